@@ -339,7 +339,21 @@ async def shutdown():
         await session_manager.shutdown()
     except Exception as e:
         print(f"⚠️  Lỗi khi cleanup: {e}")
-    
+
+    try:
+        # Dừng các process tra cứu Go-Bot (nếu pool đã được tạo)
+        lookup_pool = sys.modules.get('toolgobot.api.lookup_pool')
+        if lookup_pool is not None:
+            lookup_pool.shutdown_lookup_pool()
+    except Exception as e:
+        print(f"⚠️  Lỗi khi dừng Go-Bot lookup pool: {e}")
+
+    try:
+        from shared.redis_async import close_async_redis_pool
+        await close_async_redis_pool()
+    except Exception as e:
+        print(f"⚠️  Lỗi khi đóng Redis pool: {e}")
+
     print("✅ Shutdown hoàn tất")
 
 
@@ -4,6 +4,7 @@ import sys
 import os
 import signal
 import socket
+import secrets
 
 # Try to import psutil, fallback if not available
 try:
@@ -14,6 +15,13 @@ except ImportError:
     print("⚠️ psutil chưa được cài đặt. Chạy: pip install psutil")
     print("⚠️ Sẽ bỏ qua việc kill processes cũ tự động")
 
+# Load .env (tùy chọn) để các process con (workers, inference server) nhận cùng cấu hình
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
 processes = []
 shutdown_requested = False
 
@@ -36,7 +44,8 @@ def kill_old_processes():
         'go_soft_worker.py',
         'go_quick_worker.py',
         'go_invoice_worker.py',
-        'go_bot_worker.py'
+        'go_bot_worker.py',
+        'inference_server.py'
     ]
     
     killed_count = 0
@@ -165,14 +174,23 @@ def run():
     print("✅ Port 5000 sẵn sàng")
     
     python_cmd = "py" if sys.platform == "win32" else "python"
-    num_go_quick_workers = 10
+    num_go_quick_workers = int(os.getenv('GOQUICK_WORKER_PROCS', 10))
+    # GOQUICK_WORKER_FORK=1: 1 process go_quick_worker load model rồi tự fork num_go_quick_workers con
+    fork_go_quick_workers = os.getenv('GOQUICK_WORKER_FORK', '0') == '1' and sys.platform != "win32"
     cmds = [
         [python_cmd, "api_server.py"],
         [python_cmd, "workers/go_soft_worker.py"],
         [python_cmd, "workers/go_invoice_worker.py"],
         [python_cmd, "workers/go_bot_worker.py"],
     ]
-    for _ in range(num_go_quick_workers):
+    # Inference server (model Go-Quick dùng chung) start trước để worker/API kết nối khi load xong
+    use_inference_server = os.getenv('GOQUICK_INFERENCE_SERVER', '0') == '1'
+    if use_inference_server:
+        cmds.insert(0, [python_cmd, "tool-go-quick/inference_server.py"])
+        if not os.getenv('GOQUICK_INFERENCE_AUTHKEY'):
+            # Key ngẫu nhiên cho lần chạy này, process con (server, API, worker) kế thừa qua env
+            os.environ['GOQUICK_INFERENCE_AUTHKEY'] = secrets.token_hex(32)
+    for _ in range(1 if fork_go_quick_workers else num_go_quick_workers):
         cmds.append([python_cmd, "workers/go_quick_worker.py"])
     try:
         signal.signal(signal.SIGINT, signal_handler)
@@ -181,7 +199,9 @@ def run():
     except (ValueError, OSError):
         pass
     
-    print("🚀 Khởi động: api_server, go_soft, go_invoice, go_bot, go_quick×%d" % num_go_quick_workers)
+    print("🚀 Khởi động: %sapi_server, go_soft, go_invoice, go_bot, go_quick×%d%s" % (
+        "inference_server, " if use_inference_server else "", num_go_quick_workers,
+        " (fork sau preload)" if fork_go_quick_workers else ""))
     for cmd in cmds:
         try:
             p = subprocess.Popen(
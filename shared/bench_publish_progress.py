@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark publish_progress (events/sec) trên Redis thật
+
+So sánh:
+  - legacy:  tạo redis.Redis mới + PING + PUBLISH/RPUSH/LTRIM riêng lẻ (cách cũ)
+  - pooled:  connection pool + 1 MULTI/EXEC mỗi event
+  - batched: ProgressBatcher gom events, flush mỗi N ms
+
+Run:
+  python shared/bench_publish_progress.py --events 2000 --jobs 4 --batch-ms 20
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+
+from shared import redis_client as rc
+
+
+def legacy_publish(job_id, percent, message, data=None, **kwargs):
+    """Bản sao đường đi cũ: client mới mỗi lần, PING, 3 round trip"""
+    client = redis.Redis(host=rc.REDIS_HOST, port=rc.REDIS_PORT, db=rc.REDIS_DB,
+                         password=rc.REDIS_PASSWORD, decode_responses=False)
+    client.ping()
+    payload = rc.build_progress_payload(percent, message, data, **kwargs)
+    client.publish(f"job:{job_id}:progress", payload)
+    client.rpush(f"job:{job_id}:progress:list", payload)
+    client.ltrim(f"job:{job_id}:progress:list", -100, -1)
+    client.close()
+
+
+def run(label, publish, job_ids, n_events, after=None):
+    start = time.perf_counter()
+    for i in range(n_events):
+        job_id = job_ids[i % len(job_ids)]
+        publish(job_id, i * 100 // n_events, f"Đã xử lý {i}/{n_events}",
+                total_cccd=n_events, processed_cccd=i)
+    if after:
+        after()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {n_events:>7} events  {elapsed:8.3f}s  {n_events / elapsed:10.0f} events/s")
+    return n_events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--batch-ms', type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        rc.get_redis_client().ping()
+    except Exception as e:
+        print(f"❌ Không kết nối được Redis {rc.REDIS_HOST}:{rc.REDIS_PORT}: {e}")
+        return 1
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    job_ids = [f"{prefix}-{i}" for i in range(args.jobs)]
+    # Tắt log info của publish_progress để không đo thời gian ghi log
+    import logging
+    logging.getLogger(rc.__name__).setLevel(logging.WARNING)
+
+    legacy = run("legacy", legacy_publish, job_ids, args.events)
+    pooled = run("pooled", rc.publish_progress, job_ids, args.events)
+    rc.enable_progress_batching(args.batch_ms)
+    batched = run("batched", rc.publish_progress, job_ids, args.events, after=rc.flush_progress)
+
+    print(f"\npooled/legacy:  x{pooled / legacy:.1f}")
+    print(f"batched/legacy: x{batched / legacy:.1f}")
+
+    client = rc.get_redis_client()
+    client.delete(*[f"job:{job_id}:progress:list" for job_id in job_ids])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
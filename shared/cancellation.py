@@ -0,0 +1,223 @@
+"""
+Cancellation tokens (push-based) cho các vòng lặp nóng
+
+Mỗi process có 1 background thread PSUBSCRIBE `job:*:cancel`. Khi nhận message,
+token của job được set ngay → hot loop chỉ cần đọc 1 flag trong bộ nhớ.
+
+Các key cũ (`job:{id}:cancelled`, `job:{id}:status`) vẫn được hỗ trợ làm fallback
+cho message bị lỡ (Laravel chỉ SET key, subscriber reconnect...): token tự poll Redis
+tối đa 1 lần mỗi CANCEL_POLL_INTERVAL giây thay vì mỗi request.
+
+Nếu Redis bật `notify-keyspace-events K$`, SET `job:{id}:cancelled` từ bất kỳ client nào
+cũng đánh thức token ngay (không phải chờ hết interval).
+
+Usage:
+    token = get_cancellation_token(job_id)
+    for item in items:
+        if token.is_cancelled():
+            raise Exception("Job đã bị hủy")
+    ...
+    release_cancellation_token(job_id)
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from shared.redis_client import get_redis_client, is_job_cancelled, REDIS_DB
+
+logger = logging.getLogger(__name__)
+
+CANCEL_CHANNEL_PATTERN = 'job:*:cancel'
+CANCEL_KEYSPACE_PATTERN = f'__keyspace@{REDIS_DB}__:job:*:cancelled'
+CANCEL_POLL_INTERVAL = float(os.getenv('CANCEL_POLL_INTERVAL', 2.0))
+# Token không được dùng quá lâu (job đã xong mà quên release) sẽ bị dọn khỏi registry
+CANCEL_TOKEN_IDLE_TTL = 3600
+
+
+def cancel_channel(job_id):
+    """Pub/sub channel báo cancel của một job"""
+    return f"job:{job_id}:cancel"
+
+
+class CancellationToken:
+    """Flag cancel của một job: threading.Event + asyncio.Event cho từng event loop"""
+
+    def __init__(self, job_id, poll_interval=CANCEL_POLL_INTERVAL):
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+        self._event = threading.Event()
+        self._async_events = []
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self.last_used = time.monotonic()
+
+    def is_set(self):
+        """Chỉ đọc flag local (không chạm Redis)"""
+        return self._event.is_set()
+
+    def should_poll(self):
+        """True nếu đã đến lúc kiểm tra lại các key Redis (fallback cho message bị lỡ)"""
+        now = time.monotonic()
+        self.last_used = now
+        if now - self._last_poll >= self.poll_interval:
+            self._last_poll = now
+            return True
+        return False
+
+    def request_poll(self):
+        """Buộc lần check tiếp theo đọc Redis (sau reconnect hoặc keyspace event)"""
+        self._last_poll = 0.0
+
+    def is_cancelled(self):
+        """Flag local, fallback is_job_cancelled() theo poll_interval"""
+        if self._event.is_set():
+            return True
+        if self.should_poll() and is_job_cancelled(self.job_id):
+            self.set()
+        return self._event.is_set()
+
+    async def ais_cancelled(self):
+        """Async version của is_cancelled (fallback qua redis.asyncio)"""
+        if self._event.is_set():
+            return True
+        if self.should_poll():
+            from shared.redis_async import ais_job_cancelled
+            if await ais_job_cancelled(self.job_id):
+                self.set()
+        return self._event.is_set()
+
+    def set(self):
+        if self._event.is_set():
+            return
+        self._event.set()
+        with self._lock:
+            async_events, self._async_events = self._async_events, []
+        for loop, event in async_events:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop đã đóng
+                pass
+
+    def wait(self, timeout=None):
+        """Block thread tới khi bị cancel (hoặc timeout). Trả về True nếu đã cancel."""
+        return self._event.wait(timeout)
+
+    def async_event(self):
+        """asyncio.Event gắn với event loop hiện tại, được set khi job bị cancel"""
+        event = asyncio.Event()
+        if self._event.is_set():
+            event.set()
+            return event
+        with self._lock:
+            self._async_events.append((asyncio.get_running_loop(), event))
+        # Tránh race: set() có thể chạy giữa check và append
+        if self._event.is_set():
+            event.set()
+        return event
+
+
+class CancellationRegistry:
+    """Giữ token theo job_id và chạy 1 subscriber thread cho cả process"""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def get_token(self, job_id):
+        self._ensure_subscriber()
+        with self._lock:
+            token = self._tokens.get(job_id)
+            if token is None:
+                self._prune_idle()
+                token = CancellationToken(job_id)
+                self._tokens[job_id] = token
+            token.last_used = time.monotonic()
+            return token
+
+    def _prune_idle(self):
+        # Gọi khi đang giữ self._lock
+        cutoff = time.monotonic() - CANCEL_TOKEN_IDLE_TTL
+        for job_id in [j for j, t in self._tokens.items() if t.last_used < cutoff]:
+            del self._tokens[job_id]
+
+    def release(self, job_id):
+        with self._lock:
+            self._tokens.pop(job_id, None)
+
+    def _ensure_subscriber(self):
+        # Sau fork thread không còn tồn tại trong process con → khởi động lại
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="cancel-subscriber", daemon=True)
+            self._thread.start()
+
+    def _dispatch(self, message):
+        channel = message.get('channel')
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        if not channel:
+            return
+        keyspace = channel.startswith('__keyspace@')
+        key = channel.split('__:', 1)[1] if keyspace else channel
+        # job:{job_id}:cancel hoặc job:{job_id}:cancelled
+        job_id = key[len('job:'):key.rfind(':')]
+        with self._lock:
+            token = self._tokens.get(job_id)
+        if token is None:
+            return
+        if keyspace:
+            # Chỉ biết key bị ghi, chưa biết giá trị → để lần check tới đọc Redis
+            token.request_poll()
+        else:
+            logger.info(f"[Cancel] Job {job_id} nhận tín hiệu hủy")
+            token.set()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(CANCEL_CHANNEL_PATTERN, CANCEL_KEYSPACE_PATTERN)
+                # Có thể đã lỡ message trong lúc mất kết nối → poll lại tất cả token
+                with self._lock:
+                    tokens = list(self._tokens.values())
+                for token in tokens:
+                    token.request_poll()
+                backoff = 1
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get('type') == 'pmessage':
+                        self._dispatch(message)
+            except Exception as e:
+                logger.warning(f"[Cancel] Subscriber lỗi, thử lại sau {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+
+_registry = CancellationRegistry()
+
+
+def get_cancellation_token(job_id):
+    """Get (hoặc tạo) token cancel của job trong process hiện tại"""
+    return _registry.get_token(job_id)
+
+
+def release_cancellation_token(job_id):
+    """Bỏ token khi job kết thúc"""
+    _registry.release(job_id)
@@ -0,0 +1,343 @@
+"""
+Job queue trên Redis Streams (consumer group) cho các worker
+
+Mỗi queue (vd. 'go-soft:jobs') gồm:
+  - {queue}:stream:{lane}  : 1 stream cho mỗi priority lane (high > normal > low)
+  - {queue}:dead           : dead-letter stream (job vượt quá JOB_MAX_DELIVERIES)
+  - consumer group 'workers' trên mỗi lane stream
+
+Một message chỉ bị xóa khỏi stream sau khi worker XACK (job xử lý xong). Worker chết giữa
+chừng → message nằm trong PEL, sau JOB_VISIBILITY_TIMEOUT giây sẽ được XAUTOCLAIM cho worker khác.
+Worker còn sống thì heartbeat (XCLAIM JUSTID) để giữ lease cho job chạy lâu (crawl tới 2 giờ).
+
+Producer cũ (Laravel) vẫn LPUSH vào list {queue}: worker chuyển sang stream bằng 1 Lua script
+(RPOP + XADD atomic) nên không mất job trong lúc chuyển đổi.
+
+Yêu cầu Redis >= 6.2 (XAUTOCLAIM).
+
+Usage:
+    queue = JobQueue(QUEUE_GO_SOFT)
+    await queue.setup()
+    for message in await queue.read(count=5):
+        try:
+            await process(message.data)
+        finally:
+            await queue.ack(message)
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+
+from redis.exceptions import ResponseError
+
+from shared.redis_client import get_redis_client, JOB_TERMINAL_STATUSES
+from shared.job_store import set_job_status
+from shared.redis_async import get_async_redis_client, aget_job_status, await_job_done
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LANES = ('high', 'normal', 'low')
+DEFAULT_LANE = 'normal'
+CONSUMER_GROUP = 'workers'
+
+# Job không được heartbeat trong N giây (worker chết) sẽ được giao cho worker khác
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 300))
+# Giao quá N lần vẫn không ack → dead-letter
+JOB_MAX_DELIVERIES = int(os.getenv('JOB_MAX_DELIVERIES', 3))
+
+# RPOP list cũ + XADD vào lane stream trong 1 lệnh (không mất job nếu worker chết giữa chừng)
+_BRIDGE_SCRIPT = """
+local raw = redis.call('RPOP', KEYS[1])
+if not raw then
+    return nil
+end
+local wanted = ARGV[1]
+local ok, job = pcall(cjson.decode, raw)
+if ok and type(job) == 'table' and type(job['priority']) == 'string' then
+    wanted = job['priority']
+end
+local target = KEYS[2]
+for i = 2, #ARGV do
+    if ARGV[i] == ARGV[1] then
+        target = KEYS[i]
+    end
+end
+for i = 2, #ARGV do
+    if ARGV[i] == wanted then
+        target = KEYS[i]
+    end
+end
+redis.call('XADD', target, '*', 'data', raw)
+return 1
+"""
+
+
+def stream_key(queue, lane):
+    return f"{queue}:stream:{lane}"
+
+
+def dead_letter_key(queue):
+    return f"{queue}:dead"
+
+
+def _resolve_lane(job_data, lane=None):
+    lane = lane or (job_data.get('priority') if isinstance(job_data, dict) else None) or DEFAULT_LANE
+    if lane not in PRIORITY_LANES:
+        raise ValueError(f"Priority lane không hợp lệ: {lane} (chỉ {', '.join(PRIORITY_LANES)})")
+    return lane
+
+
+def enqueue_job(queue, job_data, lane=None):
+    """
+    Đẩy job vào stream của queue (sync, dùng cho API routes)
+
+    Args:
+        queue: tên queue, vd. 'go-bot:jobs'
+        job_data: dict job (được JSON serialize nguyên vẹn như khi LPUSH)
+        lane: 'high' | 'normal' | 'low' (mặc định lấy job_data['priority'] hoặc 'normal')
+
+    Returns:
+        Stream message ID
+    """
+    lane = _resolve_lane(job_data, lane)
+    payload = json.dumps(job_data, ensure_ascii=False)
+    return get_redis_client().xadd(stream_key(queue, lane), {'data': payload})
+
+
+async def resume_job(job_id, timeout=7200):
+    """
+    Job được giao lại trong lúc API server vẫn đang xử lý (worker trước chết khi đang chờ):
+    chỉ chờ job:{id}:done, không gửi lại request để tránh chạy trùng
+    """
+    status = await await_job_done(job_id, timeout=timeout)
+    if status is None:
+        logger.warning(f"[Job {job_id}] Resume: job chưa hoàn thành sau {timeout} giây")
+    else:
+        logger.info(f"[Job {job_id}] Resume: job kết thúc với status {status}")
+    return status
+
+
+class QueueMessage:
+    """Một job nhận từ stream (giữ message ID để ack/dead-letter)"""
+
+    def __init__(self, queue, lane, message_id, fields, deliveries=1):
+        self.queue = queue
+        self.lane = lane
+        self.id = message_id.decode('utf-8') if isinstance(message_id, bytes) else message_id
+        raw = fields.get(b'data') or fields.get('data') or b'{}'
+        self.raw = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+        self.deliveries = deliveries
+        self.data = None
+        self.error = None
+        try:
+            self.data = json.loads(self.raw)
+        except json.JSONDecodeError as e:
+            self.error = f"JSON không hợp lệ: {e}"
+
+    @property
+    def job_id(self):
+        return self.data.get('job_id') if isinstance(self.data, dict) else None
+
+    @property
+    def redelivered(self):
+        return self.deliveries > 1
+
+
+class JobQueue:
+    """Consumer phía worker của một queue (redis.asyncio, chạy trong event loop của worker)"""
+
+    def __init__(self, name, consumer=None, visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+                 max_deliveries=JOB_MAX_DELIVERIES, lanes=PRIORITY_LANES):
+        self.name = name
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.lanes = tuple(lanes)
+        self._inflight = {}
+        self._last_reclaim = 0.0
+        self._heartbeat_task = None
+        self._bridge = None
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    async def setup(self):
+        """Tạo consumer group (nếu chưa có) và bắt đầu heartbeat"""
+        client = get_async_redis_client()
+        for lane in self.lanes:
+            try:
+                await client.xgroup_create(stream_key(self.name, lane), CONSUMER_GROUP, id='0', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+        self._bridge = client.register_script(_BRIDGE_SCRIPT)
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+    async def read(self, count=1, block_ms=1000):
+        """
+        Lấy tối đa `count` job: job bị bỏ rơi (reclaim) → lane ưu tiên cao trước → block chờ job mới
+
+        Returns:
+            list[QueueMessage] (có thể rỗng nếu hết block_ms)
+        """
+        if count <= 0:
+            return []
+        await self._drain_legacy_list()
+
+        messages = await self._reclaim(count)
+        if len(messages) < count:
+            messages += await self._read_new(count - len(messages), block_ms if not messages else None)
+
+        ready = []
+        for message in messages:
+            if message.error or message.deliveries > self.max_deliveries:
+                reason = message.error or f"Giao {message.deliveries} lần không hoàn thành"
+                await self.dead_letter(message, reason)
+                continue
+            if message.redelivered and await self._is_finished(message):
+                # Worker trước đã xử lý xong nhưng chết trước khi ack
+                await self.ack(message)
+                continue
+            self._inflight[(message.lane, message.id)] = message
+            ready.append(message)
+        return ready
+
+    async def ack(self, message):
+        """Job xử lý xong (kể cả failed/cancelled): xóa khỏi PEL và stream"""
+        self._inflight.pop((message.lane, message.id), None)
+        key = stream_key(self.name, message.lane)
+        async with get_async_redis_client().pipeline(transaction=True) as pipe:
+            pipe.xack(key, CONSUMER_GROUP, message.id)
+            pipe.xdel(key, message.id)
+            await pipe.execute()
+
+    async def dead_letter(self, message, reason):
+        """Chuyển job sang {queue}:dead, ack khỏi lane stream và đánh dấu job failed"""
+        logger.error(f"[Queue {self.name}] Dead-letter job {message.job_id or message.id}: {reason}")
+        self._inflight.pop((message.lane, message.id), None)
+        key = stream_key(self.name, message.lane)
+        async with get_async_redis_client().pipeline(transaction=True) as pipe:
+            pipe.xadd(dead_letter_key(self.name), {
+                'data': message.raw,
+                'lane': message.lane,
+                'message_id': message.id,
+                'deliveries': message.deliveries,
+                'reason': reason,
+                'time': int(time.time()),
+            })
+            pipe.xack(key, CONSUMER_GROUP, message.id)
+            pipe.xdel(key, message.id)
+            await pipe.execute()
+        if message.job_id:
+            try:
+                await asyncio.to_thread(set_job_status, message.job_id, "failed", error=reason)
+            except Exception as e:
+                logger.warning(f"[Queue {self.name}] Không set được status cho job {message.job_id}: {e}")
+
+    async def _is_finished(self, message):
+        if not message.job_id:
+            return False
+        return await aget_job_status(message.job_id) in JOB_TERMINAL_STATUSES
+
+    async def _drain_legacy_list(self, limit=100):
+        """Chuyển job từ list cũ (Laravel LPUSH) sang stream"""
+        if self._bridge is None:
+            return
+        keys = [self.name] + [stream_key(self.name, lane) for lane in self.lanes]
+        for _ in range(limit):
+            moved = await self._bridge(keys=keys, args=[DEFAULT_LANE, *self.lanes])
+            if not moved:
+                return
+
+    async def _reclaim(self, count):
+        """XAUTOCLAIM message quá visibility timeout (worker giữ nó đã chết)"""
+        now = time.monotonic()
+        # Không cần quét PEL mỗi lần read
+        if now - self._last_reclaim < self.visibility_timeout / 4:
+            return []
+        self._last_reclaim = now
+
+        client = get_async_redis_client()
+        messages = []
+        for lane in self.lanes:
+            if len(messages) >= count:
+                break
+            key = stream_key(self.name, lane)
+            response = await client.xautoclaim(
+                key, CONSUMER_GROUP, self.consumer,
+                min_idle_time=self.visibility_timeout * 1000,
+                start_id='0-0', count=count - len(messages),
+            )
+            claimed = response[1] if len(response) > 1 else []
+            for message_id, fields in claimed:
+                if fields is None:
+                    # Message đã bị xóa khỏi stream nhưng còn trong PEL
+                    await client.xack(key, CONSUMER_GROUP, message_id)
+                    continue
+                deliveries = await self._delivery_count(key, message_id)
+                message = QueueMessage(self.name, lane, message_id, fields, deliveries)
+                logger.warning(f"[Queue {self.name}] Reclaim job {message.job_id} (lần giao thứ {deliveries})")
+                messages.append(message)
+        return messages
+
+    async def _delivery_count(self, key, message_id):
+        pending = await get_async_redis_client().xpending_range(
+            key, CONSUMER_GROUP, min=message_id, max=message_id, count=1
+        )
+        return pending[0]['times_delivered'] if pending else 1
+
+    async def _read_new(self, count, block_ms):
+        """XREADGROUP theo thứ tự lane: high hết job mới tới normal, low"""
+        client = get_async_redis_client()
+        messages = []
+        for lane in self.lanes:
+            if len(messages) >= count:
+                return messages
+            messages += await self._xreadgroup(client, {stream_key(self.name, lane): '>'}, count - len(messages))
+        if messages or not block_ms:
+            return messages
+        # Không lane nào có job: block trên tất cả lane cùng lúc
+        streams = {stream_key(self.name, lane): '>' for lane in self.lanes}
+        return await self._xreadgroup(client, streams, 1, block_ms)
+
+    async def _xreadgroup(self, client, streams, count, block_ms=None):
+        response = await client.xreadgroup(CONSUMER_GROUP, self.consumer, streams, count=count, block=block_ms)
+        messages = []
+        for key, entries in response or []:
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            lane = key.rsplit(':', 1)[1]
+            for message_id, fields in entries:
+                messages.append(QueueMessage(self.name, lane, message_id, fields))
+        return messages
+
+    async def _heartbeat_loop(self):
+        """Reset idle time của job đang xử lý để không bị worker khác reclaim"""
+        interval = max(self.visibility_timeout / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            by_lane = {}
+            for lane, message_id in list(self._inflight):
+                by_lane.setdefault(lane, []).append(message_id)
+            client = get_async_redis_client()
+            for lane, message_ids in by_lane.items():
+                try:
+                    await client.xclaim(
+                        stream_key(self.name, lane), CONSUMER_GROUP, self.consumer,
+                        min_idle_time=0, message_ids=message_ids, justid=True,
+                    )
+                except Exception as e:
+                    logger.warning(f"[Queue {self.name}] Heartbeat lỗi: {e}")
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Job-state store: toàn bộ field của một job trong 1 HASH `job:{id}` có TTL
+
+  - Mọi lần ghi (status/result/error/cancelled/total_cccd/start_time) là 1 HSET + EXPIRE,
+    publish_progress cũng gia hạn TTL → job còn hoạt động thì không bao giờ hết hạn.
+  - Khi job kết thúc (completed/failed/cancelled), progress list được compact còn snapshot cuối.
+  - JOB_LEGACY_KEYS=1 (mặc định): vẫn ghi song song các key cũ `job:{id}:status`, ... (cùng TTL)
+    vì Laravel còn đọc trực tiếp các key này.
+
+Maintenance (report / reclaim key không TTL, progress list chưa compact, key mồ côi):
+  Job chưa có status nhưng còn nằm trong queue (list/stream của JOB_QUEUES) hoặc có key mới được
+  ghi trong JOB_ORPHAN_MIN_AGE giây gần đây là job đang chờ worker, không bị coi là mồ côi.
+
+  python shared/job_store.py report
+  python shared/job_store.py reclaim [--delete-orphans]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from collections import Counter
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.redis_client import (
+    get_redis_client, flush_progress, queue_job_done, JOB_STATE_TTL, JOB_TERMINAL_STATUSES,
+    JOB_DONE_TTL, PROGRESS_LIST_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Field được mirror ra key cũ job:{id}:{field}
+LEGACY_FIELDS = ('status', 'result', 'error', 'cancelled', 'total_cccd', 'start_time')
+JOB_LEGACY_KEYS = os.getenv('JOB_LEGACY_KEYS', '1') != '0'
+
+# Queue của các worker: job_id còn trong queue chưa có status vì chưa được nhận
+JOB_QUEUES = [q.strip() for q in os.getenv('JOB_QUEUES', 'go-bot:jobs,go-soft:jobs,go-quick:jobs,go-invoice:jobs').split(',') if q.strip()]
+# Key job không status được ghi/gia hạn trong N giây gần đây → chưa coi là mồ côi
+JOB_ORPHAN_MIN_AGE = int(os.getenv('JOB_ORPHAN_MIN_AGE', 3600))
+
+
+def job_state_key(job_id):
+    """HASH chứa state của job"""
+    return f"job:{job_id}"
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+def queue_job_state(pipe, job_id, **fields):
+    """
+    Thêm lệnh ghi state của job vào pipeline (sync hoặc redis.asyncio đều được)
+
+    Field = None bị bỏ qua. Status cuối → push job:{id}:done + compact progress list.
+    """
+    mapping = {field: _encode(value) for field, value in fields.items() if value is not None}
+    mapping['updated_at'] = _encode(int(time.time()))
+    key = job_state_key(job_id)
+    pipe.hset(key, mapping=mapping)
+    pipe.expire(key, JOB_STATE_TTL)
+    if JOB_LEGACY_KEYS:
+        for field, value in mapping.items():
+            if field in LEGACY_FIELDS:
+                pipe.set(f"job:{job_id}:{field}", value, ex=JOB_STATE_TTL)
+
+    status = fields.get('status')
+    if status in JOB_TERMINAL_STATUSES:
+        queue_job_done(pipe, job_id, status)
+        queue_compact_progress(pipe, job_id)
+
+
+def queue_compact_progress(pipe, job_id):
+    """Chỉ giữ progress event cuối cùng (snapshot) khi job đã kết thúc"""
+    progress_list_key = f"job:{job_id}:progress:list"
+    pipe.ltrim(progress_list_key, -1, -1)
+    pipe.expire(progress_list_key, JOB_STATE_TTL)
+
+
+def set_job_state(job_id, **fields):
+    """
+    Ghi các field của job trong 1 MULTI/EXEC, vd. set_job_state(job_id, total_cccd=10)
+
+    Status cuối: flush progress đang gom (REDIS_PROGRESS_BATCH_MS > 0) trước, để progress list được
+    compact sau event cuối và không subscriber nào nhận progress sau khi đã thấy status cuối.
+    """
+    if fields.get('status') in JOB_TERMINAL_STATUSES:
+        flush_progress()
+    pipe = get_redis_client().pipeline(transaction=True)
+    queue_job_state(pipe, job_id, **fields)
+    pipe.execute()
+
+
+def set_job_status(job_id, status, error=None, result=None):
+    """
+    Set job status (kèm error/result nếu có) trong 1 MULTI/EXEC.
+    Status cuối (completed/failed/cancelled) được push vào job:{id}:done để đánh thức worker.
+
+    Args:
+        status: 'processing' | 'completed' | 'failed' | 'cancelled'
+        error: error message (str), lưu vào field error
+        result: bytes/str JSON đã serialize, lưu vào field result
+    """
+    set_job_state(job_id, result=result, error=error, status=status)
+
+
+def queue_read_cancelled_status(pipe, job_id):
+    """
+    Thêm lệnh đọc (cancelled, status) của job vào pipeline (sync hoặc redis.asyncio).
+    Kết quả 2 lệnh này đưa vào merge_cancelled_status.
+    """
+    pipe.hmget(job_state_key(job_id), 'cancelled', 'status')
+    pipe.mget(f"job:{job_id}:cancelled", f"job:{job_id}:status")
+
+
+def merge_cancelled_status(hashed, legacy):
+    """
+    (cancelled, status) dạng bytes/None theo cùng thứ tự với get_job_state: HASH trước, key cũ
+    chỉ bù field thiếu; riêng flag cancelled = '1' ở key cũ (Laravel ghi) luôn được tính
+    """
+    (h_cancelled, h_status), (cancelled, status) = hashed, legacy
+    if cancelled != b'1':
+        cancelled = h_cancelled or cancelled
+    return cancelled, h_status or status
+
+
+def read_cancelled_status(job_id, client=None):
+    """(cancelled, status) của job dạng bytes/None, 1 round trip"""
+    pipe = (client or get_redis_client()).pipeline(transaction=False)
+    queue_read_cancelled_status(pipe, job_id)
+    return merge_cancelled_status(*pipe.execute())
+
+
+def get_job_state(job_id):
+    """
+    Đọc state của job: {field: str}. Field thiếu trong HASH lấy từ key cũ
+    (job tạo trước khi có store, hoặc do Laravel ghi như cancelled flag).
+    """
+    client = get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(job_state_key(job_id))
+    pipe.mget([f"job:{job_id}:{field}" for field in LEGACY_FIELDS])
+    hashed, legacy = pipe.execute()
+
+    state = {k.decode('utf-8'): v.decode('utf-8') for k, v in hashed.items()}
+    for field, value in zip(LEGACY_FIELDS, legacy):
+        if value is not None and field not in state:
+            state[field] = value.decode('utf-8')
+    # Flag cancelled từ Laravel chỉ nằm ở key cũ
+    if legacy[LEGACY_FIELDS.index('cancelled')] == b'1':
+        state['cancelled'] = '1'
+    return state
+
+
+# ---------------------------------------------------------------------------
+# Maintenance
+# ---------------------------------------------------------------------------
+
+def _job_id_of(key):
+    """job:{id} hoặc job:{id}:suffix → (job_id, suffix)"""
+    parts = key.split(':', 2)
+    if len(parts) < 2 or parts[0] != 'job' or not parts[1]:
+        return None, None
+    return parts[1], parts[2] if len(parts) > 2 else ''
+
+
+def scan_jobs(client=None, batch=1000):
+    """SCAN job:* và gom key theo job_id: {job_id: {suffix: ttl}}"""
+    client = client or get_redis_client()
+    jobs = {}
+    keys = []
+
+    def flush():
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+        for key, ttl in zip(keys, pipe.execute()):
+            job_id, suffix = _job_id_of(key)
+            if job_id is not None:
+                jobs.setdefault(job_id, {})[suffix] = ttl
+        keys.clear()
+
+    for key in client.scan_iter(match='job:*', count=batch):
+        keys.append(key.decode('utf-8') if isinstance(key, bytes) else key)
+        if len(keys) >= batch:
+            flush()
+    if keys:
+        flush()
+    return jobs
+
+
+def processing_job_ids(client=None):
+    """job_id của các job đang 'processing' (HASH job:{id} hoặc key cũ job:{id}:status), vd. để cancel khi worker dừng"""
+    client = client or get_redis_client()
+    job_ids = set()
+    for key in client.scan_iter(match='job:*', count=1000):
+        job_id, suffix = _job_id_of(key.decode('utf-8') if isinstance(key, bytes) else key)
+        if job_id is not None and suffix in ('', 'status'):
+            job_ids.add(job_id)
+    return [job_id for job_id in sorted(job_ids) if _job_status(client, job_id) == 'processing']
+
+
+def queued_job_ids(client=None, queues=None):
+    """job_id của các job còn chờ trong queue: list cũ (Laravel LPUSH) + lane stream"""
+    from shared.job_queue import stream_key, PRIORITY_LANES
+
+    client = client or get_redis_client()
+    payloads = []
+    for queue in JOB_QUEUES if queues is None else queues:
+        if client.type(queue) == b'list':
+            payloads.extend(client.lrange(queue, 0, -1))
+        for lane in PRIORITY_LANES:
+            payloads.extend(fields.get(b'data') for _, fields in client.xrange(stream_key(queue, lane)))
+
+    job_ids = set()
+    for payload in payloads:
+        try:
+            job = json.loads(payload)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(job, dict) and job.get('job_id'):
+            job_ids.add(str(job['job_id']))
+    return job_ids
+
+
+def _is_recent(suffixes, min_age):
+    """Có key được ghi/gia hạn trong min_age giây gần đây (suy từ TTL còn lại)"""
+    for suffix, ttl in suffixes.items():
+        if suffix == 'progress:list':
+            full_ttl = PROGRESS_LIST_TTL
+        elif suffix == 'done':
+            full_ttl = JOB_DONE_TTL
+        else:
+            full_ttl = JOB_STATE_TTL
+        if ttl > 0 and full_ttl - ttl < min_age:
+            return True
+    return False
+
+
+def _job_status(client, job_id):
+    _, status = read_cancelled_status(job_id, client)
+    return status.decode('utf-8') if status else None
+
+
+def maintain(reclaim=False, delete_orphans=False, client=None, queues=None, min_age=None):
+    """
+    Kiểm tra keyspace job:*
+
+      - no_ttl:      key không có TTL (ghi trước khi có store) → EXPIRE JOB_STATE_TTL
+      - uncompacted: job đã kết thúc nhưng progress list còn > 1 event → LTRIM còn snapshot cuối
+      - orphan:      key của job không còn status (vd. progress list sót lại) → EXPIRE hoặc DEL
+      - pending:     job chưa có status nhưng còn trong queue hoặc mới ghi trong min_age giây
+                     (job đang chờ worker) → chỉ đặt TTL nếu thiếu, không bao giờ xóa
+
+    Returns:
+        Counter thống kê
+    """
+    client = client or get_redis_client()
+    min_age = JOB_ORPHAN_MIN_AGE if min_age is None else min_age
+    stats = Counter()
+    jobs = scan_jobs(client)
+    # Đọc queue sau khi SCAN: job được enqueue trong lúc SCAN vẫn được thấy
+    queued = queued_job_ids(client, queues)
+
+    for job_id, suffixes in jobs.items():
+        stats['jobs'] += 1
+        stats['keys'] += len(suffixes)
+        status = _job_status(client, job_id)
+        terminal = status in JOB_TERMINAL_STATUSES
+        orphan = status is None and job_id not in queued and not _is_recent(suffixes, min_age)
+        if orphan:
+            stats['orphan_jobs'] += 1
+            stats['orphan_keys'] += len(suffixes)
+        elif status is None:
+            stats['pending_jobs'] += 1
+        elif terminal:
+            stats['terminal_jobs'] += 1
+        else:
+            stats['active_jobs'] += 1
+
+        pipe = client.pipeline(transaction=False)
+        for suffix, ttl in suffixes.items():
+            key = f"job:{job_id}:{suffix}" if suffix else job_state_key(job_id)
+            if ttl == -1:
+                stats['no_ttl'] += 1
+            if orphan and delete_orphans:
+                pipe.delete(key)
+            elif ttl == -1:
+                pipe.expire(key, JOB_STATE_TTL)
+
+        if terminal and 'progress:list' in suffixes:
+            length = client.llen(f"job:{job_id}:progress:list")
+            if length > 1:
+                stats['uncompacted'] += 1
+                stats['compacted_events'] += length - 1
+                queue_compact_progress(pipe, job_id)
+
+        if reclaim:
+            pipe.execute()
+
+    if reclaim:
+        stats['reclaimed'] = stats['no_ttl'] + stats['uncompacted'] + (stats['orphan_keys'] if delete_orphans else 0)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['report', 'reclaim'])
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help='Xóa ngay key mồ côi thay vì chỉ đặt TTL')
+    args = parser.parse_args()
+
+    try:
+        get_redis_client().ping()
+    except Exception as e:
+        print(f"❌ Không kết nối được Redis: {e}")
+        sys.exit(1)
+
+    reclaim = args.command == 'reclaim'
+    start = time.perf_counter()
+    stats = maintain(reclaim=reclaim, delete_orphans=args.delete_orphans)
+    elapsed = time.perf_counter() - start
+
+    print(f"Jobs: {stats['jobs']} ({stats['keys']} keys) trong {elapsed:.2f}s")
+    print(f"  active:      {stats['active_jobs']}")
+    print(f"  terminal:    {stats['terminal_jobs']}")
+    print(f"  pending:     {stats['pending_jobs']}")
+    print(f"  orphan:      {stats['orphan_jobs']} ({stats['orphan_keys']} keys)")
+    print(f"  no TTL:      {stats['no_ttl']} keys")
+    print(f"  uncompacted: {stats['uncompacted']} progress lists ({stats['compacted_events']} events thừa)")
+    if reclaim:
+        print(f"✅ Đã xử lý {stats['reclaimed']} keys (TTL {JOB_STATE_TTL}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Async counterpart của shared.redis_client (redis.asyncio)
+
+Dùng trong Quart routes / async services để không block event loop khi chờ Redis.
+Payload, key và giới hạn list giữ nguyên như bản sync.
+"""
+import os
+import asyncio
+import logging
+import weakref
+
+import redis.asyncio as aioredis
+
+from shared.redis_client import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD, REDIS_MAX_CONNECTIONS,
+    PROGRESS_LIST_MAX_LEN, PROGRESS_LIST_TTL, JOB_TERMINAL_STATUSES,
+    JOB_STATE_TTL, build_progress_payload, flush_progress, job_done_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# BLPOP job:{id}:done tối đa N giây rồi đọc lại status (cho writer không push done, vd. Laravel cancel)
+JOB_DONE_CHECK_INTERVAL = int(os.getenv('JOB_DONE_CHECK_INTERVAL', 30))
+
+# Connection của redis.asyncio gắn với event loop tạo ra nó → 1 pool cho mỗi loop
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_redis_pool():
+    """Get async connection pool dùng chung cho event loop hiện tại"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = aioredis.ConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            password=REDIS_PASSWORD,
+            decode_responses=False,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            health_check_interval=30,
+        )
+        _pools[loop] = pool
+    return pool
+
+
+def get_async_redis_client():
+    """Get async Redis client instance (dùng chung pool của event loop)"""
+    return aioredis.Redis(connection_pool=get_async_redis_pool())
+
+
+async def close_async_redis_pool():
+    """Đóng pool của event loop hiện tại (gọi khi server shutdown)"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.disconnect()
+
+
+async def apublish_progress(job_id, percent, message, data=None, **kwargs):
+    """Async version của publish_progress: 1 MULTI/EXEC (publish + rpush + ltrim + expire)"""
+    try:
+        progress_bytes = build_progress_payload(percent, message, data, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ [REDIS] Cannot serialize progress for job {job_id}: {e}")
+        return
+
+    logger.info(f"📤 Publishing progress for job {job_id}: {percent}% - {message[:50]}...")
+
+    max_retries = 3
+    retry_delay = 0.5
+    progress_list_key = f"job:{job_id}:progress:list"
+
+    for attempt in range(max_retries):
+        try:
+            async with get_async_redis_client().pipeline(transaction=True) as pipe:
+                pipe.publish(f"job:{job_id}:progress", progress_bytes)
+                pipe.rpush(progress_list_key, progress_bytes)
+                pipe.ltrim(progress_list_key, -PROGRESS_LIST_MAX_LEN, -1)
+                pipe.expire(progress_list_key, PROGRESS_LIST_TTL)
+                pipe.expire(f"job:{job_id}", JOB_STATE_TTL)
+                pipe.expire(f"job:{job_id}:status", JOB_STATE_TTL)
+                await pipe.execute()
+            return
+        except Exception as e:
+            logger.error(f"❌ [REDIS] Error in apublish_progress (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(retry_delay)
+            else:
+                logger.error(f"❌ [REDIS] Failed to publish progress after {max_retries} attempts: {e}")
+
+
+async def _aget_cancelled_status(client, job_id):
+    """(cancelled, status) theo cùng thứ tự ưu tiên với job_store (HASH trước, key cũ bù field thiếu)"""
+    from shared.job_store import queue_read_cancelled_status, merge_cancelled_status
+    async with client.pipeline(transaction=False) as pipe:
+        queue_read_cancelled_status(pipe, job_id)
+        return merge_cancelled_status(*await pipe.execute())
+
+
+async def ais_job_cancelled(job_id):
+    """Check if a job has been cancelled (cancelled flag hoặc status = cancelled)"""
+    try:
+        cancelled, status = await _aget_cancelled_status(get_async_redis_client(), job_id)
+        if cancelled and cancelled.decode('utf-8').strip() == '1':
+            return True
+        return bool(status) and status.decode('utf-8').strip() == 'cancelled'
+    except Exception as e:
+        logger.error(f"Error checking cancellation for job {job_id}: {e}")
+        return False
+
+
+async def aset_status(job_id, status, error=None, result=None):
+    """
+    Set job status (kèm error/result nếu có) trong 1 round trip
+
+    Args:
+        status: 'processing' | 'completed' | 'failed' | 'cancelled'
+        error: error message (str), lưu vào field error
+        result: bytes/str JSON đã serialize, lưu vào field result
+    """
+    from shared.job_store import queue_job_state
+    if status in JOB_TERMINAL_STATUSES:
+        # Progress gửi qua publish_progress (sync, có thể đang gom batch) phải tới trước status cuối
+        await asyncio.to_thread(flush_progress)
+    async with get_async_redis_client().pipeline(transaction=True) as pipe:
+        queue_job_state(pipe, job_id, result=result, error=error, status=status)
+        await pipe.execute()
+
+
+async def aget_job_status(job_id):
+    """Đọc status của job (str hoặc None)"""
+    _, status = await _aget_cancelled_status(get_async_redis_client(), job_id)
+    return status.decode('utf-8').strip() if status else None
+
+
+async def _aget_terminal_status(client, job_id):
+    """Status cuối của job (cancelled flag tính là 'cancelled'), None nếu job chưa xong"""
+    cancelled, status = await _aget_cancelled_status(client, job_id)
+    if cancelled and cancelled.decode('utf-8').strip() == '1':
+        return 'cancelled'
+    status = status.decode('utf-8').strip() if status else None
+    return status if status in JOB_TERMINAL_STATUSES else None
+
+
+async def await_job_done(job_id, timeout=7200, check_interval=JOB_DONE_CHECK_INTERVAL):
+    """
+    Chờ job kết thúc bằng BLPOP job:{id}:done (không poll status mỗi vài giây)
+
+    Returns:
+        'completed' | 'failed' | 'cancelled', hoặc None nếu hết timeout
+    """
+    client = get_async_redis_client()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    while True:
+        # Job có thể đã xong trước khi bắt đầu chờ hoặc writer không push done
+        status = await _aget_terminal_status(client, job_id)
+        if status:
+            return status
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+
+        item = await client.blpop([job_done_key(job_id)], timeout=max(1, int(min(check_interval, remaining))))
+        if item:
+            _, status = item
+            return status.decode('utf-8')
@@ -1,152 +1,252 @@
 import redis
 import os
+import json
+import time
+import atexit
 import logging
+import threading
 
 # Redis connection
 REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+
+# Progress list: chỉ giữ 100 message cuối, tự hết hạn nếu job bị bỏ dở
+PROGRESS_LIST_MAX_LEN = 100
+PROGRESS_LIST_TTL = int(os.getenv('REDIS_PROGRESS_TTL', 86400))
+
+# Batching mode: > 0 thì gom progress events và flush mỗi N ms (0 = tắt)
+PROGRESS_BATCH_MS = int(os.getenv('REDIS_PROGRESS_BATCH_MS', 0))
+
+# Completion list job:{id}:done: API RPUSH status cuối, worker BLPOP thay vì poll status
+JOB_TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+JOB_DONE_TTL = 3600
+
+# TTL của state job (HASH job:{id} + key cũ), gia hạn mỗi lần job có hoạt động (xem shared/job_store.py)
+JOB_STATE_TTL = int(os.getenv('JOB_STATE_TTL', 86400))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_redis_pool():
+    """Get process-wide Redis connection pool (lazy init)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # redis-py tự reset pool sau fork (so sánh pid) nên an toàn cho subprocess/multiprocessing
+                _pool = redis.ConnectionPool(
+                    host=REDIS_HOST,
+                    port=REDIS_PORT,
+                    db=REDIS_DB,
+                    password=REDIS_PASSWORD,
+                    decode_responses=False,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    health_check_interval=30,
+                )
+    return _pool
+
 
 def get_redis_client():
-    """Get Redis client instance"""
-    return redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        db=REDIS_DB,
-        password=REDIS_PASSWORD,
-        decode_responses=False
-    )
+    """Get Redis client instance (dùng chung connection pool của process)"""
+    return redis.Redis(connection_pool=get_redis_pool())
 
-def publish_progress(job_id, percent, message, data=None, **kwargs):
-    import json
-    import logging
-    import time
-    
+
+# Các field frontend cần đọc trong data object
+_DATA_OBJ_KEYS = ['accumulated_total', 'accumulated_downloaded', 'accumulated_percent',
+                  'thuyet_minh_downloaded', 'thuyet_minh_total',
+                  'total_cccd', 'processed_cccd', 'total_images', 'processed_images',
+                  'total_rows', 'estimated_cccd', 'processed']
+# Các field được copy lên top level cho backward compatibility
+_TOP_LEVEL_KEYS = ['total_cccd', 'processed_cccd', 'total_images', 'processed_images',
+                   'total_rows', 'estimated_cccd', 'processed']
+_ACCUMULATED_KEYS = ['accumulated_total', 'accumulated_downloaded', 'accumulated_percent',
+                     'thuyet_minh_downloaded', 'thuyet_minh_total']
+
+
+def build_progress_payload(percent, message, data=None, **kwargs):
+    """Build JSON bytes của một progress event (format giữ nguyên cho frontend)"""
+    progress_data = {
+        'percent': percent,
+        'message': message,
+    }
+
+    # Tạo data object để frontend có thể truy cập
+    data_obj = {}
+
+    if kwargs:
+        for key, value in kwargs.items():
+            if value is not None:
+                progress_data[key] = value
+                # Thêm vào data object nếu là field frontend cần
+                if key in _DATA_OBJ_KEYS:
+                    data_obj[key] = value
+
+    if data:
+        if isinstance(data, dict):
+            # Copy tất cả fields từ data vào data_obj (bao gồm cả giá trị 0)
+            for key, value in data.items():
+                # Copy tất cả field, kể cả khi value = 0 (vì 0 là giá trị hợp lệ)
+                if value is not None or (isinstance(value, (int, float)) and value == 0):
+                    data_obj[key] = value
+                    # Cũng copy lên top level cho backward compatibility
+                    if key in _TOP_LEVEL_KEYS:
+                        progress_data[key] = value
+            # Đảm bảo các field accumulated_* và thuyet_minh_* được copy vào data_obj (kể cả khi = 0)
+            for key in _ACCUMULATED_KEYS:
+                if key in data:
+                    # Copy ngay cả khi giá trị là 0
+                    data_obj[key] = data[key]
+            progress_data['data'] = data_obj
+        else:
+            progress_data['data'] = data
+    else:
+        # Nếu không có data, vẫn tạo data object với các field từ kwargs
+        if data_obj:
+            progress_data['data'] = data_obj
+
+    return json.dumps(progress_data, ensure_ascii=False).encode('utf-8')
+
+
+def _queue_progress_commands(pipe, job_id, payloads):
+    """Thêm publish + rpush + ltrim + expire của một job vào pipeline"""
+    progress_list_key = f"job:{job_id}:progress:list"
+    for payload in payloads:
+        # Publish to pub/sub (for real-time)
+        pipe.publish(f"job:{job_id}:progress", payload)
+    # Also push to list (for polling fallback) - 1 RPUSH cho cả burst
+    pipe.rpush(progress_list_key, *payloads)
+    # Limit list size to prevent memory issues (keep last 100 messages)
+    pipe.ltrim(progress_list_key, -PROGRESS_LIST_MAX_LEN, -1)
+    pipe.expire(progress_list_key, PROGRESS_LIST_TTL)
+    # Job còn hoạt động → gia hạn state (EXPIRE trên key không tồn tại là no-op)
+    pipe.expire(f"job:{job_id}", JOB_STATE_TTL)
+    pipe.expire(f"job:{job_id}:status", JOB_STATE_TTL)
+
+
+def _send_progress(events_by_job, max_retries=3, retry_delay=0.5):
+    """
+    Gửi progress events trong 1 MULTI/EXEC (1 round trip).
+    events_by_job: {job_id: [payload_bytes, ...]} (giữ thứ tự trong từng job)
+    """
     logger = logging.getLogger(__name__)
-    
-    # ✅ Retry mechanism với timeout handling
-    max_retries = 3
-    retry_delay = 0.5  # 0.5 giây
-    
+
     for attempt in range(max_retries):
         try:
-            redis_client = get_redis_client()
-            
-            # ✅ Test connection trước khi sử dụng
-            try:
-                redis_client.ping()
-            except Exception as ping_e:
-                logger.warning(f"⚠️ [REDIS] Connection test failed (attempt {attempt + 1}/{max_retries}): {ping_e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error(f"❌ [REDIS] Cannot connect to Redis after {max_retries} attempts")
-                    return
-            
-            progress_data = {
-                'percent': percent,
-                'message': message,
-            }
-            
-            # Tạo data object để frontend có thể truy cập
-            data_obj = {}
-            
-            if kwargs:
-                for key, value in kwargs.items():
-                    if value is not None:
-                        progress_data[key] = value
-                        # Thêm vào data object nếu là field frontend cần
-                        if key in ['accumulated_total', 'accumulated_downloaded', 'accumulated_percent', 
-                                  'thuyet_minh_downloaded', 'thuyet_minh_total',
-                                  'total_cccd', 'processed_cccd', 'total_images', 'processed_images', 
-                                  'total_rows', 'estimated_cccd', 'processed']:
-                            data_obj[key] = value
-            
-            if data:
-                if isinstance(data, dict):
-                    # Copy tất cả fields từ data vào data_obj (bao gồm cả giá trị 0)
-                    for key, value in data.items():
-                        # Copy tất cả field, kể cả khi value = 0 (vì 0 là giá trị hợp lệ)
-                        if value is not None or (isinstance(value, (int, float)) and value == 0):
-                            data_obj[key] = value
-                            # Cũng copy lên top level cho backward compatibility
-                            if key in ['total_cccd', 'processed_cccd', 'total_images', 'processed_images', 
-                                      'total_rows', 'estimated_cccd', 'processed']:
-                                progress_data[key] = value
-                    # Đảm bảo các field accumulated_* và thuyet_minh_* được copy vào data_obj (kể cả khi = 0)
-                    for key in ['accumulated_total', 'accumulated_downloaded', 'accumulated_percent',
-                               'thuyet_minh_downloaded', 'thuyet_minh_total']:
-                        if key in data:
-                            # Copy ngay cả khi giá trị là 0
-                            data_obj[key] = data[key]
-                    progress_data['data'] = data_obj
-                else:
-                    progress_data['data'] = data
-            else:
-                # Nếu không có data, vẫn tạo data object với các field từ kwargs
-                if data_obj:
-                    progress_data['data'] = data_obj
-            
-            progress_json = json.dumps(progress_data, ensure_ascii=False)
-            progress_bytes = progress_json.encode('utf-8')
-            
-            processed_cccd = kwargs.get('processed_cccd') or (data.get('processed_cccd') if isinstance(data, dict) else None)
-            total_cccd = kwargs.get('total_cccd') or (data.get('total_cccd') if isinstance(data, dict) else None)
-            logger.info(f"📤 Publishing progress for job {job_id}: {percent}% - {message[:50]}...")
-            
-            # Publish to pub/sub (for real-time) với timeout
-            try:
-                redis_client.publish(f"job:{job_id}:progress", progress_bytes)
-                logger.debug(f"✅ Published to pub/sub: job:{job_id}:progress")
-            except Exception as e:
-                logger.error(f"❌ Error publishing progress to pub/sub: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error(f"❌ Failed to publish to pub/sub after {max_retries} attempts")
-            
-            # Also push to list (for polling fallback) với timeout
-            progress_list_key = f"job:{job_id}:progress:list"
-            try:
-                result = redis_client.rpush(progress_list_key, progress_bytes)
-                logger.debug(f"✅ Pushed to Redis list {progress_list_key}, new length: {result}")
-            except Exception as e:
-                logger.error(f"❌ Error pushing progress to list: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error(f"❌ Failed to push to list after {max_retries} attempts")
-            
-            # Also set job status if needed
-            try:
-                # Limit list size to prevent memory issues (keep last 100 messages)
-                redis_client.ltrim(progress_list_key, -100, -1)
-            except Exception as e:
-                logger.error(f"Error trimming progress list: {e}")
-            
-            # ✅ Nếu đến đây thì thành công, break khỏi retry loop
-            break
-            
+            pipe = get_redis_client().pipeline(transaction=True)
+            for job_id, payloads in events_by_job.items():
+                _queue_progress_commands(pipe, job_id, payloads)
+            pipe.execute()
+            return True
         except Exception as e:
             logger.error(f"❌ [REDIS] Error in publish_progress (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
-                continue
             else:
                 logger.error(f"❌ [REDIS] Failed to publish progress after {max_retries} attempts: {e}")
-                return
+    return False
+
+
+class ProgressBatcher:
+    """
+    Gom progress events trong một cửa sổ interval_ms rồi flush bằng 1 pipeline.
+    Các event của cùng job dùng chung 1 RPUSH/LTRIM/EXPIRE, PUBLISH vẫn giữ từng event
+    (subscriber SSE không bị mất message, chỉ trễ tối đa interval_ms).
+    """
+
+    def __init__(self, interval_ms=50):
+        self.interval = max(interval_ms, 1) / 1000.0
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Giữ trong suốt lúc gửi: flush() của thread khác đợi batch đang gửi dở xong rồi mới trả về
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="progress-batcher", daemon=True)
+        self._thread.start()
+
+    def add(self, job_id, payload):
+        with self._lock:
+            self._pending.setdefault(job_id, []).append(payload)
+        self._wakeup.set()
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                _send_progress(pending)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            # Đợi hết cửa sổ để gom các event tiếp theo của burst
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def enable_progress_batching(interval_ms=50):
+    """Bật batching mode cho publish_progress trong process hiện tại"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = ProgressBatcher(interval_ms)
+            atexit.register(flush_progress)
+    return _batcher
+
+
+def flush_progress():
+    """
+    Flush ngay các progress events đang chờ, kể cả batch background thread đang gửi dở.
+    job_store.set_job_state / cancel_job tự gọi trước khi ghi status cuối → không có progress cũ nào
+    tới sau "completed" và compact progress list chạy sau event cuối.
+    """
+    if _batcher is not None:
+        _batcher.flush()
+
+
+if PROGRESS_BATCH_MS > 0:
+    enable_progress_batching(PROGRESS_BATCH_MS)
+
+
+def publish_progress(job_id, percent, message, data=None, **kwargs):
+    logger = logging.getLogger(__name__)
+
+    try:
+        progress_bytes = build_progress_payload(percent, message, data, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ [REDIS] Cannot serialize progress for job {job_id}: {e}")
+        return
+
+    logger.info(f"📤 Publishing progress for job {job_id}: {percent}% - {message[:50]}...")
+
+    if _batcher is not None:
+        _batcher.add(job_id, progress_bytes)
+        return
+
+    _send_progress({job_id: [progress_bytes]})
 
 def is_job_cancelled(job_id):
     """Check if a job has been cancelled"""
     logger = logging.getLogger(__name__)
-    
+
     try:
-        redis_client = get_redis_client()
-        cancelled = redis_client.get(f"job:{job_id}:cancelled")
+        # Key cũ (Laravel set) hoặc field trong HASH job:{id}, cùng helper với job_store/redis_async
+        from shared.job_store import read_cancelled_status
+        cancelled, _ = read_cancelled_status(job_id)
         if cancelled:
             # Handle both bytes and string
             if isinstance(cancelled, bytes):
@@ -157,12 +257,28 @@ def is_job_cancelled(job_id):
         logger.error(f"Error checking cancellation for job {job_id}: {e}")
         return False
 
+def job_done_key(job_id):
+    """List nhận thông báo job kết thúc (worker BLPOP)"""
+    return f"job:{job_id}:done"
+
+
+def queue_job_done(pipe, job_id, status):
+    """Thêm RPUSH job:{id}:done vào pipeline nếu status là trạng thái cuối"""
+    if status in JOB_TERMINAL_STATUSES:
+        pipe.rpush(job_done_key(job_id), status)
+        pipe.expire(job_done_key(job_id), JOB_DONE_TTL)
+
+
 def cancel_job(job_id):
+    """Set cancelled flag + status và publish job:{id}:cancel để các process dừng ngay"""
     logger = logging.getLogger(__name__)
-    redis_client = get_redis_client()
     try:
-        redis_client.set(f"job:{job_id}:cancelled", "1")
-        redis_client.set(f"job:{job_id}:status", "cancelled")
+        from shared.job_store import queue_job_state
+        flush_progress()
+        pipe = get_redis_client().pipeline(transaction=True)
+        queue_job_state(pipe, job_id, cancelled="1", status="cancelled")
+        pipe.publish(f"job:{job_id}:cancel", "1")
+        pipe.execute()
         logger.info(f"Job {job_id} marked as cancelled")
     except Exception as e:
-        logger.error(f"Error cancelling job {job_id}: {e}")
\ No newline at end of file
+        logger.error(f"Error cancelling job {job_id}: {e}")
@@ -0,0 +1,172 @@
+"""
+Test job_store (queue_job_state, reader chung (cancelled, status), maintain) trên fakeredis
+
+Run (cần pytest + fakeredis, không cần Redis thật):
+  python -m pytest -q shared/test_job_store.py
+"""
+import os
+import sys
+import json
+import asyncio
+
+import pytest
+import redis
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared import redis_client as rc
+from shared import redis_async
+from shared import job_store
+from shared.job_queue import enqueue_job
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    pool = redis.ConnectionPool(server=server, connection_class=fakeredis.FakeRedisConnection)
+    monkeypatch.setattr(rc, '_pool', pool)
+    monkeypatch.setattr(rc, '_batcher', None)
+    monkeypatch.setattr(redis_async, 'get_async_redis_client', lambda: fakeredis.FakeAsyncRedis(server=server))
+    return redis.Redis(connection_pool=pool)
+
+
+def state_of(client, job_id):
+    return {k.decode(): v.decode() for k, v in client.hgetall(f"job:{job_id}").items()}
+
+
+def test_queue_job_state_writes_hash_and_legacy_keys(client):
+    pipe = client.pipeline(transaction=True)
+    job_store.queue_job_state(pipe, 'j1', status='processing', total_cccd=3, error=None)
+    pipe.execute()
+
+    state = state_of(client, 'j1')
+    assert state['status'] == 'processing'
+    assert state['total_cccd'] == '3'
+    assert 'error' not in state
+    assert 'updated_at' in state
+    assert client.get('job:j1:status') == b'processing'
+    assert client.get('job:j1:total_cccd') == b'3'
+    assert client.exists('job:j1:updated_at') == 0
+    assert 0 < client.ttl('job:j1') <= rc.JOB_STATE_TTL
+    assert client.lrange('job:j1:done', 0, -1) == []
+
+
+def test_queue_job_state_terminal_pushes_done_and_compacts(client):
+    for percent in (10, 50, 100):
+        rc.publish_progress('j1', percent, 'msg')
+    pipe = client.pipeline(transaction=True)
+    job_store.queue_job_state(pipe, 'j1', status='failed', error='boom')
+    pipe.execute()
+
+    assert client.lrange('job:j1:done', 0, -1) == [b'failed']
+    assert [json.loads(p)['percent'] for p in client.lrange('job:j1:progress:list', 0, -1)] == [100]
+    assert client.get('job:j1:error') == b'boom'
+
+
+def test_queue_job_state_without_legacy_keys(client, monkeypatch):
+    monkeypatch.setattr(job_store, 'JOB_LEGACY_KEYS', False)
+    job_store.set_job_state('j1', status='processing')
+    assert state_of(client, 'j1')['status'] == 'processing'
+    assert client.exists('job:j1:status') == 0
+
+
+@pytest.mark.parametrize('hashed, legacy, expected', [
+    # HASH thắng key cũ
+    ({'status': 'completed'}, {'status': 'processing'}, (None, b'completed')),
+    # Chỉ có key cũ (job tạo trước khi có store)
+    ({}, {'status': 'processing'}, (None, b'processing')),
+    # Flag cancelled của Laravel chỉ nằm ở key cũ
+    ({'status': 'processing'}, {'cancelled': '1'}, (b'1', b'processing')),
+    ({'cancelled': '0'}, {'cancelled': '1'}, (b'1', None)),
+    ({'cancelled': '1'}, {}, (b'1', None)),
+])
+def test_sync_and_async_readers_agree(client, hashed, legacy, expected):
+    if hashed:
+        client.hset('job:j1', mapping=hashed)
+    for field, value in legacy.items():
+        client.set(f'job:j1:{field}', value)
+
+    assert job_store.read_cancelled_status('j1') == expected
+    assert asyncio.run(redis_async._aget_cancelled_status(redis_async.get_async_redis_client(), 'j1')) == expected
+    status = expected[1].decode() if expected[1] else None
+    assert asyncio.run(redis_async.aget_job_status('j1')) == status
+    assert job_store.get_job_state('j1').get('status') == status
+
+
+def test_processing_job_ids_reads_hash_and_legacy_keys(client, monkeypatch):
+    monkeypatch.setattr(job_store, 'JOB_LEGACY_KEYS', False)
+    job_store.set_job_state('hashed', status='processing')
+    job_store.set_job_state('done', status='completed')
+    # Job tạo trước khi có store: chỉ có key cũ
+    client.set('job:legacy:status', b'processing')
+    client.rpush('job:other:progress:list', b'{}')
+
+    assert job_store.processing_job_ids() == ['hashed', 'legacy']
+
+
+def make_stale(client, *keys):
+    """Giả lập key được ghi từ lâu (TTL còn lại nhỏ hơn TTL gốc > JOB_ORPHAN_MIN_AGE)"""
+    for key in keys:
+        client.expire(key, 60)
+
+
+def test_maintain_deletes_stale_orphans(client):
+    rc.publish_progress('old', 10, 'msg')
+    make_stale(client, 'job:old:progress:list')
+
+    stats = job_store.maintain(reclaim=True, delete_orphans=True, queues=[])
+    assert stats['orphan_jobs'] == 1
+    assert client.exists('job:old:progress:list') == 0
+
+
+def test_maintain_keeps_recent_job_without_status(client):
+    # Job vừa được tạo (vd. total_cccd ghi trước khi worker set status)
+    job_store.set_job_state('new', total_cccd=5)
+    rc.publish_progress('new', 0, 'Đang chờ...')
+
+    stats = job_store.maintain(reclaim=True, delete_orphans=True, queues=[])
+    assert stats['orphan_jobs'] == 0
+    assert stats['pending_jobs'] == 1
+    assert client.exists('job:new', 'job:new:progress:list') == 2
+
+
+@pytest.mark.parametrize('enqueue', ['stream', 'legacy_list'])
+def test_maintain_keeps_queued_job(client, enqueue):
+    if enqueue == 'stream':
+        enqueue_job('go-soft:jobs', {'job_id': 'queued', 'priority': 'low'})
+    else:
+        client.lpush('go-soft:jobs', json.dumps({'job_id': 'queued'}))
+    # Laravel ghi key không TTL trước khi worker nhận job
+    client.set('job:queued:cancelled', '0')
+    rc.publish_progress('queued', 0, 'Đang chờ...')
+    make_stale(client, 'job:queued:progress:list')
+
+    stats = job_store.maintain(reclaim=True, delete_orphans=True, queues=['go-soft:jobs'])
+    assert stats['orphan_jobs'] == 0
+    assert stats['pending_jobs'] == 1
+    assert client.exists('job:queued:cancelled', 'job:queued:progress:list') == 2
+    # Key thiếu TTL vẫn được đặt TTL
+    assert client.ttl('job:queued:cancelled') > 0
+
+
+def test_maintain_compacts_terminal_and_sets_missing_ttl(client):
+    job_store.set_job_status('done', 'completed')
+    # Progress list ghi trước khi có store: không TTL, chưa compact
+    client.rpush('job:done:progress:list', b'{"percent": 1}', b'{"percent": 2}')
+    client.persist('job:done:status')
+
+    report = job_store.maintain(queues=[])
+    assert report['terminal_jobs'] == 1
+    assert report['uncompacted'] == 1
+    assert client.llen('job:done:progress:list') == 2
+
+    stats = job_store.maintain(reclaim=True, queues=[])
+    assert stats['no_ttl'] == 2
+    assert client.llen('job:done:progress:list') == 1
+    assert client.ttl('job:done:status') > 0
+    assert client.ttl('job:done:progress:list') > 0
@@ -0,0 +1,114 @@
+"""
+Test publish_progress / ProgressBatcher trên fakeredis
+
+Run (cần pytest + fakeredis, không cần Redis thật):
+  python -m pytest -q shared/test_redis_client.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+import pytest
+import redis
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared import redis_client as rc
+from shared import job_store
+
+
+@pytest.fixture
+def client(monkeypatch):
+    pool = redis.ConnectionPool(server=fakeredis.FakeServer(), connection_class=fakeredis.FakeRedisConnection)
+    monkeypatch.setattr(rc, '_pool', pool)
+    monkeypatch.setattr(rc, '_batcher', None)
+    return redis.Redis(connection_pool=pool)
+
+
+@pytest.fixture
+def batcher(client, monkeypatch):
+    # Cửa sổ rất dài: event chỉ được gửi khi có flush tường minh
+    b = rc.ProgressBatcher(interval_ms=60000)
+    monkeypatch.setattr(rc, '_batcher', b)
+    yield b
+    b.stop()
+
+
+def progress_list(client, job_id):
+    return [json.loads(p)['percent'] for p in client.lrange(f"job:{job_id}:progress:list", 0, -1)]
+
+
+def test_publish_progress_without_batching(client):
+    for percent in (10, 20, 30):
+        rc.publish_progress('j1', percent, 'msg', total_cccd=3)
+    assert progress_list(client, 'j1') == [10, 20, 30]
+    assert client.ttl('job:j1:progress:list') > 0
+
+
+def test_publish_progress_trims_list(client):
+    for percent in range(rc.PROGRESS_LIST_MAX_LEN + 20):
+        rc.publish_progress('j1', percent, 'msg')
+    events = progress_list(client, 'j1')
+    assert len(events) == rc.PROGRESS_LIST_MAX_LEN
+    assert events[-1] == rc.PROGRESS_LIST_MAX_LEN + 19
+
+
+def test_batcher_keeps_events_until_flush(client, batcher):
+    rc.publish_progress('j1', 10, 'a')
+    rc.publish_progress('j2', 50, 'b')
+    rc.publish_progress('j1', 20, 'c')
+    assert progress_list(client, 'j1') == []
+
+    rc.flush_progress()
+    assert progress_list(client, 'j1') == [10, 20]
+    assert progress_list(client, 'j2') == [50]
+
+
+def test_terminal_status_flushes_pending_progress_first(client, batcher):
+    for percent in (10, 60, 100):
+        rc.publish_progress('j1', percent, 'msg')
+
+    job_store.set_job_status('j1', 'completed', result='{}')
+
+    # Progress đang gom được ghi trước → compact giữ đúng event cuối, không còn gì tới sau status
+    assert progress_list(client, 'j1') == [100]
+    assert client.lrange('job:j1:done', 0, -1) == [b'completed']
+    rc.flush_progress()
+    assert progress_list(client, 'j1') == [100]
+
+
+def test_non_terminal_status_does_not_flush(client, batcher):
+    rc.publish_progress('j1', 10, 'msg')
+    job_store.set_job_state('j1', status='processing')
+    assert progress_list(client, 'j1') == []
+
+
+def test_cancel_job_flushes_pending_progress_first(client, batcher):
+    rc.publish_progress('j1', 30, 'msg')
+    rc.publish_progress('j1', 40, 'msg')
+    rc.cancel_job('j1')
+    assert progress_list(client, 'j1') == [40]
+    assert client.lrange('job:j1:done', 0, -1) == [b'cancelled']
+
+
+def test_flush_waits_for_in_flight_batch(client, batcher, monkeypatch):
+    """Batch background thread đang gửi dở khi status cuối được ghi → status phải đợi batch đó"""
+    real_send = rc._send_progress
+    sending = threading.Event()
+
+    def slow_send(events_by_job, **kwargs):
+        sending.set()
+        time.sleep(0.3)
+        return real_send(events_by_job, **kwargs)
+
+    monkeypatch.setattr(rc, '_send_progress', slow_send)
+    rc.publish_progress('j1', 10, 'msg')
+    rc.publish_progress('j1', 90, 'msg')
+    threading.Thread(target=batcher.flush).start()
+    assert sending.wait(2)
+
+    job_store.set_job_status('j1', 'completed')
+    assert progress_list(client, 'j1') == [90]
@@ -614,7 +614,9 @@ def register_routes(app, prefix):
     import sys as _sys
     import os as _os
     _sys.path.insert(0, _os.path.dirname(_os.path.dirname(_os.path.dirname(_os.path.abspath(__file__)))))
-    from shared.redis_client import get_redis_client, publish_progress
+    from shared.redis_client import publish_progress
+    from shared.job_store import set_job_status
+    from shared.cancellation import get_cancellation_token, release_cancellation_token
     
     # ✅ Import asyncio để dùng create_task
     import asyncio
@@ -649,9 +651,7 @@ def register_routes(app, prefix):
                     is_valid, error_msg = validate_date_range(start_date, end_date)
                     if not is_valid:
                         publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                        redis_client = get_redis_client()
-                        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                        redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                        set_job_status(job_id, "failed", error=error_msg)
                         return jsonify({
                             "status": "error",
                             "message": error_msg
@@ -662,7 +662,6 @@ def register_routes(app, prefix):
                     return jsonify({"status": "error", "error_code": "INVALID_AUTHORIZATION_FORMAT", "message": "Invalid Authorization format"}), 400
                 
                 headers = {"status": "success", "Authorization": auth_header}
-                redis_client = get_redis_client()
                 
                 # ✅ Định nghĩa async function xử lý trong background
                 async def process_tongquat():
@@ -673,11 +672,8 @@ def register_routes(app, prefix):
                         def progress_callback(current_step, processed, total):
                             # Check cancelled flag trong progress callback
                             try:
-                                cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                if cancelled:
-                                    cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                    if cancelled == '1':
-                                        raise Exception("Job đã bị hủy (Ctrl+C)")
+                                if get_cancellation_token(job_id).is_cancelled():
+                                    raise Exception("Job đã bị hủy (Ctrl+C)")
                             except:
                                 pass
                             
@@ -693,11 +689,8 @@ def register_routes(app, prefix):
                         }
                         
                         # Check cancelled flag trước khi bắt đầu xử lý
-                        cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                raise Exception("Job đã bị hủy (Ctrl+C)")
+                        if get_cancellation_token(job_id).is_cancelled():
+                            raise Exception("Job đã bị hủy (Ctrl+C)")
                         
                         publish_progress(job_id, 10, "Đang kết nối đến hệ thống hóa đơn...")
                         
@@ -711,8 +704,7 @@ def register_routes(app, prefix):
                                 error_msg = result
                             logger.error(f"[Job {job_id}] {error_msg}")
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}", {'type': 'error', 'error': error_msg, 'error_code': 'INVALID_RESULT_TYPE'})
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                         elif result.get('status') == 'success':
                             publish_progress(job_id, 100, "Hoàn thành!")
                             
@@ -734,15 +726,13 @@ def register_routes(app, prefix):
                                 'excel_base64': excel_base64 if not download_id else None,
                             }
                             
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+                            set_job_status(job_id, "completed", result=json.dumps(result_data, ensure_ascii=False))
                         else:
                             error_msg = result.get('message', 'Unknown error') if isinstance(result, dict) else str(result)
                             error_code = result.get('error_code', 'TONGQUAT_ERROR') if isinstance(result, dict) else 'TONGQUAT_ERROR'
                             
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}", {'type': 'error', 'error': error_msg, 'error_code': error_code})
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             
                     except Exception as e:
                         error_msg = str(e)
@@ -752,12 +742,12 @@ def register_routes(app, prefix):
                             publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
                             # ✅ Log: giữ thuật ngữ kỹ thuật
                             logger.info(f"[Job {job_id}] Job đã bị hủy (Ctrl+C hoặc client disconnect)")
-                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", "Yêu cầu đã bị hủy".encode('utf-8'))
+                            set_job_status(job_id, "cancelled", error="Yêu cầu đã bị hủy")
                         else:
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
+                    finally:
+                        release_cancellation_token(job_id)
                 
                 # ✅ Chạy xử lý trong background và trả về "accepted" ngay (giống Go Soft)
                 asyncio.create_task(process_tongquat())
@@ -791,15 +781,12 @@ def register_routes(app, prefix):
                     is_valid, error_msg = validate_date_range(start_date, end_date)
                     if not is_valid:
                         publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                        redis_client = get_redis_client()
-                        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                        redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                        set_job_status(job_id, "failed", error=error_msg)
                         return jsonify({"status": "error", "message": error_msg}), 400
                 token = auth_header.replace("Bearer ", "").strip() if auth_header else None
                 if not token:
                     return jsonify({"status": "error", "error_code": "INVALID_AUTHORIZATION_FORMAT", "message": "Invalid Authorization format"}), 400
                 headers = {"status": "success", "Authorization": auth_header}
-                redis_client = get_redis_client()
 
                 async def process_chitiet():
                     try:
@@ -808,11 +795,8 @@ def register_routes(app, prefix):
 
                         def progress_callback(current_step, processed, total):
                             try:
-                                cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                if cancelled:
-                                    cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                    if cancelled == '1':
-                                        raise Exception("Job đã bị hủy (Ctrl+C)")
+                                if get_cancellation_token(job_id).is_cancelled():
+                                    raise Exception("Job đã bị hủy (Ctrl+C)")
                             except:
                                 pass
                             percent = int((processed / total * 100)) if total > 0 else 0
@@ -825,25 +809,20 @@ def register_routes(app, prefix):
                             "end_date": end_date,
                             "progress_callback": progress_callback
                         }
-                        cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                raise Exception("Job đã bị hủy (Ctrl+C)")
+                        if get_cancellation_token(job_id).is_cancelled():
+                            raise Exception("Job đã bị hủy (Ctrl+C)")
                         publish_progress(job_id, 10, "Đang kết nối đến hệ thống hóa đơn...")
                         tongquat_result = await asyncio.to_thread(backend.call_tongquat, task)
                         if not isinstance(tongquat_result, dict):
                             error_msg = f"Unexpected result type: {type(tongquat_result).__name__}." if not isinstance(tongquat_result, str) else tongquat_result
                             logger.error(f"[Job {job_id}] {error_msg}")
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}", {'type': 'error', 'error': error_msg})
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             return
                         if tongquat_result.get("status") != "success":
                             error_msg = tongquat_result.get("message", "Tongquat failed")
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             return
                         publish_progress(job_id, 50, "Đang xuất chi tiết...")
                         chitiet_input = {**tongquat_result, "headers": headers, "progress_callback": progress_callback}
@@ -851,8 +830,7 @@ def register_routes(app, prefix):
                         if not isinstance(chitiet_result, dict):
                             error_msg = str(chitiet_result) if isinstance(chitiet_result, str) else f"Unexpected result type: {type(chitiet_result).__name__}"
                             logger.error(f"[Job {job_id}] {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             return
                         if chitiet_result.get('status') == 'success':
                             publish_progress(job_id, 100, "Hoàn thành!")
@@ -868,24 +846,22 @@ def register_routes(app, prefix):
                                 'excel_filename': excel_filename,
                                 'excel_base64': excel_base64 if not download_id else None,
                             }
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+                            set_job_status(job_id, "completed", result=json.dumps(result_data, ensure_ascii=False))
                         else:
                             error_msg = chitiet_result.get('message', 'Chi tiết extraction failed')
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                     except Exception as e:
                         error_msg = str(e)
                         if "Job đã bị hủy" in error_msg or "cancelled" in error_msg.lower():
                             publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
                             logger.info(f"[Job {job_id}] Job đã bị hủy (Ctrl+C hoặc client disconnect)")
-                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", "Yêu cầu đã bị hủy".encode('utf-8'))
+                            set_job_status(job_id, "cancelled", error="Yêu cầu đã bị hủy")
                         else:
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
+                    finally:
+                        release_cancellation_token(job_id)
 
                 asyncio.create_task(process_chitiet())
                 return jsonify({
@@ -943,7 +919,6 @@ def register_routes(app, prefix):
                     return jsonify({"status": "error", "error_code": "INVALID_AUTHORIZATION_FORMAT", "message": "Invalid Authorization format"}), 400
                 
                 headers = {"status": "success", "Authorization": auth_header}
-                redis_client = get_redis_client()
                 
                 # ✅ Định nghĩa async function xử lý trong background
                 async def process_xmlhtml():
@@ -964,11 +939,8 @@ def register_routes(app, prefix):
                         def progress_callback(current_step, processed, total):
                             # Check cancelled flag trong progress callback
                             try:
-                                cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                if cancelled:
-                                    cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                    if cancelled == '1':
-                                        raise Exception("Job đã bị hủy (Ctrl+C)")
+                                if get_cancellation_token(job_id).is_cancelled():
+                                    raise Exception("Job đã bị hủy (Ctrl+C)")
                             except:
                                 pass
                             
@@ -979,11 +951,8 @@ def register_routes(app, prefix):
                             publish_progress(job_id, percent, current_step, {'processed': processed, 'total': total})
                         
                         # Check cancelled flag trước khi bắt đầu xử lý
-                        cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                raise Exception("Job đã bị hủy (Ctrl+C)")
+                        if get_cancellation_token(job_id).is_cancelled():
+                            raise Exception("Job đã bị hủy (Ctrl+C)")
                         
                         publish_progress(job_id, 20, "Đang chuẩn bị dữ liệu...")
                         
@@ -1005,8 +974,7 @@ def register_routes(app, prefix):
                                 error_msg = xmlhtml_result
                             logger.error(f"[Job {job_id}] {error_msg}")
                             publish_progress(job_id, 0, f"Lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                         elif xmlhtml_result.get('status') == 'success':
                             publish_progress(job_id, 100, "Hoàn thành!")
                             
@@ -1048,13 +1016,11 @@ def register_routes(app, prefix):
                             }
                             
                             # ✅ Lưu vào Redis (chỉ lưu download_id, không lưu base64 lớn)
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+                            set_job_status(job_id, "completed", result=json.dumps(result_data, ensure_ascii=False))
                         else:
                             error_msg = xmlhtml_result.get('message', 'Unknown error')
                             publish_progress(job_id, 0, f"Lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             
                     except Exception as e:
                         error_msg = str(e)
@@ -1064,12 +1030,12 @@ def register_routes(app, prefix):
                             publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
                             # ✅ Log: giữ thuật ngữ kỹ thuật
                             logger.info(f"[Job {job_id}] Job đã bị hủy (Ctrl+C hoặc client disconnect)")
-                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", "Yêu cầu đã bị hủy".encode('utf-8'))
+                            set_job_status(job_id, "cancelled", error="Yêu cầu đã bị hủy")
                         else:
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
+                    finally:
+                        release_cancellation_token(job_id)
                 
                 # ✅ Chạy xử lý trong background và trả về "accepted" ngay (giống Go Soft)
                 asyncio.create_task(process_xmlhtml())
@@ -1128,7 +1094,6 @@ def register_routes(app, prefix):
                     return jsonify({"status": "error", "error_code": "INVALID_AUTHORIZATION_FORMAT", "message": "Invalid Authorization format"}), 400
                 
                 headers = {"status": "success", "Authorization": auth_header}
-                redis_client = get_redis_client()
                 
                 # ✅ Định nghĩa async function xử lý trong background
                 async def process_pdf():
@@ -1139,11 +1104,8 @@ def register_routes(app, prefix):
                         def progress_callback(current_step, processed, total):
                             # Check cancelled flag trong progress callback
                             try:
-                                cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                if cancelled:
-                                    cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                    if cancelled == '1':
-                                        raise Exception("Job đã bị hủy (Ctrl+C)")
+                                if get_cancellation_token(job_id).is_cancelled():
+                                    raise Exception("Job đã bị hủy (Ctrl+C)")
                             except:
                                 pass
                             
@@ -1154,11 +1116,8 @@ def register_routes(app, prefix):
                             publish_progress(job_id, percent, current_step, {'processed': processed, 'total': total})
                         
                         # Check cancelled flag trước khi bắt đầu xử lý
-                        cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                raise Exception("Job đã bị hủy (Ctrl+C)")
+                        if get_cancellation_token(job_id).is_cancelled():
+                            raise Exception("Job đã bị hủy (Ctrl+C)")
                         
                         publish_progress(job_id, 20, "Đang chuẩn bị dữ liệu...")
                         
@@ -1181,8 +1140,7 @@ def register_routes(app, prefix):
                                 error_msg = pdf_result
                             logger.error(f"[Job {job_id}] {error_msg}")
                             publish_progress(job_id, 0, f"Lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                         elif pdf_result.get('status') == 'success':
                             publish_progress(job_id, 100, "Hoàn thành!")
                             
@@ -1202,13 +1160,11 @@ def register_routes(app, prefix):
                                 # ✅ Backward compatibility
                                 'zip_base64': zip_base64 if not download_id else None,
                             }
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+                            set_job_status(job_id, "completed", result=json.dumps(result_data, ensure_ascii=False))
                         else:
                             error_msg = pdf_result.get('message', 'Unknown error')
                             publish_progress(job_id, 0, f"Lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
                             
                     except Exception as e:
                         error_msg = str(e)
@@ -1218,12 +1174,12 @@ def register_routes(app, prefix):
                             publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
                             # ✅ Log: giữ thuật ngữ kỹ thuật
                             logger.info(f"[Job {job_id}] Job đã bị hủy (Ctrl+C hoặc client disconnect)")
-                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", "Yêu cầu đã bị hủy".encode('utf-8'))
+                            set_job_status(job_id, "cancelled", error="Yêu cầu đã bị hủy")
                         else:
                             publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                            set_job_status(job_id, "failed", error=error_msg)
+                    finally:
+                        release_cancellation_token(job_id)
                 
                 # ✅ Chạy xử lý trong background và trả về "accepted" ngay (giống Go Soft)
                 asyncio.create_task(process_pdf())
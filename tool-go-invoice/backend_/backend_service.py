@@ -34,7 +34,7 @@ class BackendService(BaseService):
         self.job_id = job_id  # ✅ Lưu job_id để check cancelled flag
     
     def _check_cancelled(self):
-        """Check if job is cancelled from Redis"""
+        """Check if job is cancelled (token local, fallback Redis mỗi CANCEL_POLL_INTERVAL giây)"""
         if not self.job_id:
             return False
         
@@ -43,22 +43,32 @@ class BackendService(BaseService):
             import os
             import time
             sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-            from shared.redis_client import get_redis_client
+            from shared.redis_client import get_redis_client, cancel_job
+            from shared.job_store import read_cancelled_status
+            from shared.cancellation import get_cancellation_token
+            
+            # ✅ Fast path: token được set bởi pub/sub job:{id}:cancel (không chạm Redis)
+            token = get_cancellation_token(self.job_id)
+            if token.is_set():
+                return True
+            if not token.should_poll():
+                return False
             
             redis_client = get_redis_client()
             
-            # ✅ Check cancelled flag
-            cancelled = redis_client.get(f"job:{self.job_id}:cancelled")
+            # ✅ Fallback: check cancelled flag + status (HASH job:{id} + key cũ, 1 round trip)
+            cancelled, status = read_cancelled_status(self.job_id, client=redis_client)
             if cancelled:
                 cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
                 if cancelled == '1':
+                    token.set()
                     return True
             
             # ✅ Check status
-            status = redis_client.get(f"job:{self.job_id}:status")
             if status:
                 status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
                 if status == 'cancelled':
+                    token.set()
                     return True
             
             # ✅ Check nếu client đã disconnect (không poll trong 10 giây)
@@ -73,8 +83,8 @@ class BackendService(BaseService):
                     # Nếu không có poll trong 10 giây → client đã reload/đóng tab → auto cancel
                     if time_since_last_poll > 10:
                         try:
-                            redis_client.set(f"job:{self.job_id}:cancelled", "1")
-                            redis_client.set(f"job:{self.job_id}:status", "cancelled")
+                            cancel_job(self.job_id)
+                            token.set()
                             
                             # Publish progress message
                             progress_data = {
@@ -845,15 +855,14 @@ class BackendService(BaseService):
             data_crawled_detail = []  # Danh sách để lưu trữ dữ liệu JSON chi tiết
             
             total_invoices = len(datas_first["datas"])
-            for data in datas_first["datas"]:
+            # ✅ Chi tiết được lấy song song (keep-alive + rate limit theo proxy), trả về đúng thứ tự datas
+            from .detail_fetcher import DetailFetcher
+            fetcher = DetailFetcher(self.proxy_url, headers, timeout=tout, is_cancelled=self._check_cancelled)
+            for data, data_ct in zip(datas_first["datas"], fetcher.fetch_many(datas_first["datas"])):
                 # ✅ Check cancelled flag trước khi xử lý mỗi invoice
                 if self._check_cancelled():
                     raise Exception("Job đã bị hủy (Ctrl+C)")
                 
-                if data["ttxly"] == 8:
-                    spec = "sco-"
-                else:
-                    spec = ""
                 start_index+=1
                 
                 # 📊 Báo tiến trình cho mỗi hóa đơn chi tiết
@@ -865,36 +874,8 @@ class BackendService(BaseService):
                     )
                 
                 nbmst = data["nbmst"]
-                khhdon = data["khhdon"]
-                shd = data["shdon"]
-                khmshdon = data["khmshdon"]
-                f = 0
-                import random
-                while True:   
-                    f+=1
-                    try:                     
-                        res1 = self.session.get(f'https://hoadondientu.gdt.gov.vn:30000/{spec}query/invoices/detail?nbmst={nbmst}&khhdon={khhdon}&shdon={shd}&khmshdon={khmshdon}',headers=headers,verify=False,timeout =tout)
-                        if res1.status_code == 200:
-                            logger.info(f" Got invoice detail | Status: {res1.status_code} | Response size: {len(res1.content)} bytes | Attempt: {f} | | Invoice {start_index}/{total_invoices} |")
-                            break
-                        elif res1.status_code == 429:
-                            logger.warning(f" 429 Too Many Requests detected | Invoice: {nbmst}-{khmshdon}-{shd} | Rotating IP...")
-                            self._recreate_session_with_new_proxy()
-                            continue
-                    except Exception as ex:
-                        logger.error(f" Request failed,change proxy now | Invoice: {nbmst}-{khmshdon}-{shd} | Error: {str(ex)}")
-                        self._recreate_session_with_new_proxy()
-                        print("ERROR")
-                try:
-                    data_ct = res1.json()
-                    # ✅ Kiểm tra data_ct có phải là dict không
-                    if not isinstance(data_ct, dict):
-                        logger.error(f" Failed,change session,proxy now | Invoice: {nbmst} | Response không phải dict: {type(data_ct)}")
-                        self._recreate_session_with_new_proxy()
-                        continue
-                except Exception as ex:
-                    logger.error(f" Failed,change session,proxy now | Invoice: {nbmst} | Error: {str(ex)}")
-                    self._recreate_session_with_new_proxy()
+                # Response không phải JSON dict (fetcher đã đổi proxy) → bỏ qua hóa đơn như trước
+                if data_ct is None:
                     continue
 
                 headers_w = ["khmshdon"	,"khhdon"	,"shdon","ntao"	,"nky"	,"mhdon"	,"nky"	,"dvtte"	,"tgia"	,"nbten"	, "nbmst"	,"nbdchi"	,"nmten"	,"nmmst"	,"nmdchi"	,"m_VT","ten","dvtinh","sluong","dgia","stckhau","tsuat","thtien","tthue","ttcktmai"	,"tgtphi"	,"tgtttbso"	,"tthai"	,"ttxly","url","mk","ghichu","thtttoan","tchat","dgiai"]
@@ -1426,256 +1407,221 @@ class BackendService(BaseService):
     def xmlahtml(self,datas_first = {},headers: dict = {},type_export:dict = {},progress_callback=None):
         tout = 15 
         self.progress_callback = progress_callback  # Lưu callback
+        # Chỉ giữ metadata (khhdon/shdon/...) + vị trí file trong ZIP, nội dung nằm trên disk
         xml_list = []
         html_list = []
-        xml_buffer_dict = {}  
-        html_buffer_dict = {} 
         
-        i = 0
-        total_invoices = len(datas_first["datas"])
-        for data in datas_first["datas"]:
-                # ✅ Check cancelled flag trước khi xử lý mỗi invoice
-                if self._check_cancelled():
-                    raise Exception("Job đã bị hủy (Ctrl+C)")
+        # ✅ 2 ZIP riêng cho XML và HTML (cache riêng) + ZIP gộp nếu xuất cả 2, đều ghi dần xuống disk
+        import sys
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        from shared.download_service import ZipFileWriter
+        
+        want_xml = type_export.get("xml") == True
+        want_html = type_export.get("html") == True
+        xml_writer = ZipFileWriter() if want_xml else None
+        html_writer = ZipFileWriter() if want_html else None
+        combined_writer = ZipFileWriter() if want_xml and want_html else None
+        xml_names = set()
+        html_names = set()
+        
+        try:
+            i = 0
+            total_invoices = len(datas_first["datas"])
+            for data in datas_first["datas"]:
+                    # ✅ Check cancelled flag trước khi xử lý mỗi invoice
+                    if self._check_cancelled():
+                        raise Exception("Job đã bị hủy (Ctrl+C)")
                 
-                i+=1
+                    i+=1
                 
-                # ✅ Cập nhật progress cho mỗi invoice đang xử lý
-                # Hiển thị đúng message dựa trên type_export và context (PDF hay không)
-                if self.progress_callback:
-                    # ✅ Kiểm tra xem có phải đang chạy PDF không (từ raw_data trong datas_first)
-                    is_pdf_context = False
-                    if isinstance(datas_first, dict) and datas_first.get("_is_pdf_context") == True:
-                        is_pdf_context = True
+                    # ✅ Cập nhật progress cho mỗi invoice đang xử lý
+                    # Hiển thị đúng message dựa trên type_export và context (PDF hay không)
+                    if self.progress_callback:
+                        # ✅ Kiểm tra xem có phải đang chạy PDF không (từ raw_data trong datas_first)
+                        is_pdf_context = False
+                        if isinstance(datas_first, dict) and datas_first.get("_is_pdf_context") == True:
+                            is_pdf_context = True
                     
-                    if is_pdf_context and type_export.get("html") == True:
-                        # ✅ Khi chạy PDF, hiển thị message rõ ràng là đang lấy HTML để chuyển PDF
-                        step_message = f"Đang lấy HTML để chuyển PDF {i}/{total_invoices}..."
-                    elif type_export.get("xml") == True and type_export.get("html") == True:
-                        step_message = f"Đang xuất XML/HTML {i}/{total_invoices}..."
-                    elif type_export.get("xml") == True:
-                        step_message = f"Đang xuất XML {i}/{total_invoices}..."
-                    elif type_export.get("html") == True:
-                        step_message = f"Đang xuất HTML {i}/{total_invoices}..."
-                    else:
-                        step_message = f"Đang xử lý {i}/{total_invoices}..."
+                        if is_pdf_context and type_export.get("html") == True:
+                            # ✅ Khi chạy PDF, hiển thị message rõ ràng là đang lấy HTML để chuyển PDF
+                            step_message = f"Đang lấy HTML để chuyển PDF {i}/{total_invoices}..."
+                        elif type_export.get("xml") == True and type_export.get("html") == True:
+                            step_message = f"Đang xuất XML/HTML {i}/{total_invoices}..."
+                        elif type_export.get("xml") == True:
+                            step_message = f"Đang xuất XML {i}/{total_invoices}..."
+                        elif type_export.get("html") == True:
+                            step_message = f"Đang xuất HTML {i}/{total_invoices}..."
+                        else:
+                            step_message = f"Đang xử lý {i}/{total_invoices}..."
                     
-                    self.progress_callback(
-                        current_step=step_message,
-                        processed=i,
-                        total=total_invoices
-                    )
+                        self.progress_callback(
+                            current_step=step_message,
+                            processed=i,
+                            total=total_invoices
+                        )
                 
-                if data["ttxly"] == 8:
-                    spec = "sco-"
-                else:
-                    spec = ""
-                nbmst = data["nbmst"]
-                khhdon = data["khhdon"]
-                shd = data["shdon"]
-                khmshdon = data["khmshdon"]
-                time_delay = 1
-                check_timelimit = 0 
-                check_show = 1
-                while True:
-                    # ✅ Check cancelled flag trong vòng lặp retry
-                    if self._check_cancelled():
-                        raise Exception("Job đã bị hủy (Ctrl+C)")
+                    if data["ttxly"] == 8:
+                        spec = "sco-"
+                    else:
+                        spec = ""
+                    nbmst = data["nbmst"]
+                    khhdon = data["khhdon"]
+                    shd = data["shdon"]
+                    khmshdon = data["khmshdon"]
+                    time_delay = 1
+                    check_timelimit = 0 
+                    check_show = 1
+                    while True:
+                        # ✅ Check cancelled flag trong vòng lặp retry
+                        if self._check_cancelled():
+                            raise Exception("Job đã bị hủy (Ctrl+C)")
                     
-                    print(f"[{i}]")  
-                    try:    
-                        # ✅ Sử dụng _safe_get để tự động check cancelled flag
-                        response = self._safe_get(
-                            f'https://hoadondientu.gdt.gov.vn:30000/{spec}query/invoices/export-xml?nbmst={nbmst}&khhdon={khhdon}&shdon={shd}&khmshdon={khmshdon}',
-                            headers=headers,
-                            verify=False,
-                            timeout=3
-                        )
+                        print(f"[{i}]")  
+                        try:    
+                            # ✅ Sử dụng _safe_get để tự động check cancelled flag
+                            response = self._safe_get(
+                                f'https://hoadondientu.gdt.gov.vn:30000/{spec}query/invoices/export-xml?nbmst={nbmst}&khhdon={khhdon}&shdon={shd}&khmshdon={khmshdon}',
+                                headers=headers,
+                                verify=False,
+                                timeout=3
+                            )
                         
-                        logger.info(f"Processing invoice {i}/{total_invoices} - Status Code: {response.status_code} - SIZE: {len(response.content)} bytes")
-                        if response.status_code == 429:
-                            # ✅ Xử lý 429: Tạo session mới + rotate IP
-                            print(f"⚠️ 429 Too Many Requests - Creating new session with rotated IP...")
-                            self._recreate_session_with_new_proxy()
-                            
-                            # ✅ Check cancelled flag trước khi continue
-                            if self._check_cancelled():
-                                raise Exception("Job đã bị hủy (Ctrl+C)")
+                            logger.info(f"Processing invoice {i}/{total_invoices} - Status Code: {response.status_code} - SIZE: {len(response.content)} bytes")
+                            if response.status_code == 429:
+                                # ✅ Xử lý 429: Tạo session mới + rotate IP
+                                print(f"⚠️ 429 Too Many Requests - Creating new session with rotated IP...")
+                                self._recreate_session_with_new_proxy()
                             
-                            continue
-                        elif response.status_code:
-                            zip_data = io.BytesIO(response.content)
-                            zip_data.seek(0)
-                            file_header = zip_data.read(4)
-                            zip_data.seek(0)
-                            is_zip = file_header[:4] == b'PK\x03\x04'
-                            if not is_zip:
-                                check_timelimit+=1
-                                if check_timelimit %2 == 0:
-                                    time_delay+=2
-                                if time_delay > 20:
-                                    time_delay = 10
-                                print(f"Too Many Requests,Retry after {time_delay} {response.status_code} {response.text}")
-                                
-                                # ✅ Check cancelled flag trước khi retry
+                                # ✅ Check cancelled flag trước khi continue
                                 if self._check_cancelled():
                                     raise Exception("Job đã bị hủy (Ctrl+C)")
+                            
+                                continue
+                            elif response.status_code:
+                                zip_data = io.BytesIO(response.content)
+                                zip_data.seek(0)
+                                file_header = zip_data.read(4)
+                                zip_data.seek(0)
+                                is_zip = file_header[:4] == b'PK\x03\x04'
+                                if not is_zip:
+                                    check_timelimit+=1
+                                    if check_timelimit %2 == 0:
+                                        time_delay+=2
+                                    if time_delay > 20:
+                                        time_delay = 10
+                                    print(f"Too Many Requests,Retry after {time_delay} {response.status_code} {response.text}")
+                                
+                                    # ✅ Check cancelled flag trước khi retry
+                                    if self._check_cancelled():
+                                        raise Exception("Job đã bị hủy (Ctrl+C)")
                                 
-                                if response.status_code == 500:
-                                    check_show = 0
+                                    if response.status_code == 500:
+                                        check_show = 0
+                                        break
+                                else:
                                     break
-                            else:
-                                break
-                    except Exception as e:
-                        error_str = str(e)
+                        except Exception as e:
+                            error_str = str(e)
                         
-                        # ✅ Check cancelled flag ngay khi có exception (có thể là cancelled exception)
-                        if "Job đã bị hủy" in error_str or self._check_cancelled():
-                            raise Exception("Job đã bị hủy (Ctrl+C)")
+                            # ✅ Check cancelled flag ngay khi có exception (có thể là cancelled exception)
+                            if "Job đã bị hủy" in error_str or self._check_cancelled():
+                                raise Exception("Job đã bị hủy (Ctrl+C)")
                         
-                        print({"status": "error", "message": error_str})
-                        self._recreate_session_with_new_proxy()
+                            print({"status": "error", "message": error_str})
+                            self._recreate_session_with_new_proxy()
                         
-                        # ✅ Check cancelled flag sau khi recreate session
-                        if self._check_cancelled():
-                            raise Exception("Job đã bị hủy (Ctrl+C)")
+                            # ✅ Check cancelled flag sau khi recreate session
+                            if self._check_cancelled():
+                                raise Exception("Job đã bị hủy (Ctrl+C)")
                         
-                        # ✅ Check cancelled flag trước khi continue retry
-                        if self._check_cancelled():
-                            raise Exception("Job đã bị hủy (Ctrl+C)")
+                            # ✅ Check cancelled flag trước khi continue retry
+                            if self._check_cancelled():
+                                raise Exception("Job đã bị hủy (Ctrl+C)")
                         
-                        if "ReadTimeoutError" in error_str or "ConnectionError" in error_str or "Read timed out" in error_str:
-                            pass
-                if check_show == 0:
-                    print(f"Bỏ qua hóa đơn do {response.text}")
-                    continue
-                if type_export.get("xml") == True:
-                    try:
-                        with zipfile.ZipFile(zip_data, "r") as zip_file:
-                            for filename in zip_file.namelist():
-                                if filename == "invoice.xml":
-                                    file_content = zip_file.read('invoice.xml').decode('utf-8')
-                                    xml_list.append({
-                                        "khhdon": khhdon,
-                                        "shdon": shd,
-                                        "khmshdon": khmshdon,
-                                        "xml_content": file_content
-                                    })
-                                    # Lưu vào bộ đệm XML
-                                    file_name = f"{khhdon}_{shd}.xml"
-                                    xml_buffer_dict[file_name] = file_content
-                                    break
-                    except Exception as e:
-                        return {"status": "error", "message": f"❌ Lỗi khi xử lý XML: {e}"}
+                            if "ReadTimeoutError" in error_str or "ConnectionError" in error_str or "Read timed out" in error_str:
+                                pass
+                    if check_show == 0:
+                        print(f"Bỏ qua hóa đơn do {response.text}")
+                        continue
+                    if type_export.get("xml") == True:
+                        try:
+                            with zipfile.ZipFile(zip_data, "r") as zip_file:
+                                for filename in zip_file.namelist():
+                                    if filename == "invoice.xml":
+                                        file_content = zip_file.read('invoice.xml').decode('utf-8')
+                                        # Ghi thẳng vào ZIP trên disk, không giữ nội dung trong RAM
+                                        file_name = f"{khhdon}_{shd}.xml"
+                                        if file_name not in xml_names:
+                                            xml_names.add(file_name)
+                                            xml_writer.write(file_name, file_content)
+                                            if combined_writer:
+                                                combined_writer.write(f"xml/{file_name}", file_content)
+                                        xml_list.append({
+                                            "khhdon": khhdon,
+                                            "shdon": shd,
+                                            "khmshdon": khmshdon,
+                                            "filename": file_name,
+                                            "zip_path": xml_writer.file_path
+                                        })
+                                        break
+                        except Exception as e:
+                            return {"status": "error", "message": f"❌ Lỗi khi xử lý XML: {e}"}
 
-                if type_export.get("html") == True:
-                    try:
-                        with zipfile.ZipFile(zip_data, "r") as zip_file:
-                            for filename in zip_file.namelist():
-                                if filename == "invoice.html":
-                                    file_content = zip_file.read('invoice.html').decode('utf-8')
-                                    html_list.append({
-                                        "khhdon": khhdon,
-                                        "shdon": shd,
-                                        "khmshdon": khmshdon,
-                                        "xml_content": file_content
-                                    })
-                                    # Lưu vào bộ đệm HTML
-                                    file_name = f"{khhdon}_{shd}.html"
-                                    html_buffer_dict[file_name] = file_content
-                                    break
-                    except Exception as e:
-                        return {"status": "error", "message": f"❌ Lỗi khi xử lý HTML: {e}"}
-        
-        # ✅ Tạo 2 ZIP riêng biệt cho XML và HTML để cache riêng
-        xml_zip_bytes = None
-        html_zip_bytes = None
-        xml_filename = None
-        html_filename = None
-        
-        # Tạo ZIP cho XML (nếu có)
-        if type_export.get("xml") == True and len(xml_buffer_dict) > 0:
-            xml_zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(xml_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as xml_zip_archive:
-                for filename, content in xml_buffer_dict.items():
-                    xml_zip_archive.writestr(filename, content)  # Không có folder xml/ nữa
-            xml_zip_buffer.seek(0)
-            xml_zip_bytes = base64.b64encode(xml_zip_buffer.getvalue()).decode('utf-8')
-            xml_filename = "invoices_xml.zip"
-        
-        # Tạo ZIP cho HTML (nếu có)
-        if type_export.get("html") == True and len(html_buffer_dict) > 0:
-            html_zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(html_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as html_zip_archive:
-                for filename, content in html_buffer_dict.items():
-                    html_zip_archive.writestr(filename, content)  # Không có folder html/ nữa
-            html_zip_buffer.seek(0)
-            html_zip_bytes = base64.b64encode(html_zip_buffer.getvalue()).decode('utf-8')
-            html_filename = "invoices_html.zip"
-        
-        # ✅ Lưu file vào disk và tạo download_id (giống Go-Soft pattern)
-        xml_download_id = None
-        html_download_id = None
-        combined_download_id = None
+                    if type_export.get("html") == True:
+                        try:
+                            with zipfile.ZipFile(zip_data, "r") as zip_file:
+                                for filename in zip_file.namelist():
+                                    if filename == "invoice.html":
+                                        file_content = zip_file.read('invoice.html').decode('utf-8')
+                                        # Ghi thẳng vào ZIP trên disk; html2pdf đọc lại từng file qua zip_path
+                                        file_name = f"{khhdon}_{shd}.html"
+                                        if file_name not in html_names:
+                                            html_names.add(file_name)
+                                            html_writer.write(file_name, file_content)
+                                            if combined_writer:
+                                                combined_writer.write(f"html/{file_name}", file_content)
+                                        html_list.append({
+                                            "khhdon": khhdon,
+                                            "shdon": shd,
+                                            "khmshdon": khmshdon,
+                                            "filename": file_name,
+                                            "zip_path": html_writer.file_path
+                                        })
+                                        break
+                        except Exception as e:
+                            return {"status": "error", "message": f"❌ Lỗi khi xử lý HTML: {e}"}
         
-        try:
-            import sys
-            import os as os_module
-            sys.path.insert(0, os_module.path.dirname(os_module.path.dirname(os_module.path.dirname(os_module.path.abspath(__file__)))))
-            from shared.download_service import save_file_to_disk
             
-            # ✅ Lưu XML ZIP vào disk
-            if xml_zip_bytes:
-                xml_zip_bytes_data = base64.b64decode(xml_zip_bytes)
-                xml_download_id, xml_file_path = save_file_to_disk(xml_zip_bytes_data, 'zip')
-                logger.info(f"✅ Đã lưu XML ZIP file: {xml_file_path} (download_id: {xml_download_id})")
-            
-            # ✅ Lưu HTML ZIP vào disk
-            if html_zip_bytes:
-                html_zip_bytes_data = base64.b64decode(html_zip_bytes)
-                html_download_id, html_file_path = save_file_to_disk(html_zip_bytes_data, 'zip')
-                logger.info(f"✅ Đã lưu HTML ZIP file: {html_file_path} (download_id: {html_download_id})")
-            
-            # ✅ Lưu combined ZIP vào disk (nếu cả 2 đều có)
-            if xml_zip_bytes and html_zip_bytes:
-                combined_zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(combined_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as combined_zip_archive:
-                    # Thêm XML files vào folder xml/
-                    for filename, content in xml_buffer_dict.items():
-                        combined_zip_archive.writestr(f"xml/{filename}", content)
-                    # Thêm HTML files vào folder html/
-                    for filename, content in html_buffer_dict.items():
-                        combined_zip_archive.writestr(f"html/{filename}", content)
-                combined_zip_buffer.seek(0)
-                combined_zip_bytes_data = combined_zip_buffer.getvalue()
-                combined_download_id, combined_file_path = save_file_to_disk(combined_zip_bytes_data, 'zip')
-                logger.info(f"✅ Đã lưu Combined ZIP file: {combined_file_path} (download_id: {combined_download_id})")
-        except Exception as e:
-            logger.error(f"❌ Lỗi khi lưu ZIP file vào disk: {e}")
-            # Fallback: vẫn tạo base64 nếu không lưu được
+            # ✅ Hoàn tất ZIP → download_id (ZIP không có file nào thì không lưu)
+            xml_saved = xml_writer.close() if xml_writer else None
+            html_saved = html_writer.close() if html_writer else None
+            combined_saved = combined_writer.close() if combined_writer and xml_saved and html_saved else None
+        finally:
+            for writer in (xml_writer, html_writer, combined_writer):
+                if writer:
+                    writer.abort()
+        
+        xml_download_id = xml_saved[0] if xml_saved else None
+        html_download_id = html_saved[0] if html_saved else None
+        combined_download_id = combined_saved[0] if combined_saved else None
+        xml_filename = "invoices_xml.zip"
+        html_filename = "invoices_html.zip"
         
-        # ✅ Tạo response với download_id thay vì base64
         data_obj = {
-            "total_xml": len(xml_buffer_dict),
-            "total_html": len(html_buffer_dict)
+            "total_xml": len(xml_names),
+            "total_html": len(html_names)
         }
         
         # ✅ Chỉ thêm download_id nếu có data (tránh lưu empty)
         if xml_download_id:
             data_obj["xml_download_id"] = xml_download_id
             data_obj["xml_filename"] = xml_filename
-            # ✅ Backward compatibility: vẫn có base64 nếu không lưu được vào disk
-            if not xml_download_id:
-                data_obj["xml_base64"] = xml_zip_bytes
         
         if html_download_id:
             data_obj["html_download_id"] = html_download_id
             data_obj["html_filename"] = html_filename
-            # ✅ Backward compatibility: vẫn có base64 nếu không lưu được vào disk
-            if not html_download_id:
-                data_obj["html_base64"] = html_zip_bytes
         
-        # ✅ Backward compatibility: vẫn có zip_bytes và download_id nếu cả 2 đều có
+        # ✅ Backward compatibility: vẫn có download_id nếu cả 2 đều có
         if combined_download_id:
             data_obj["download_id"] = combined_download_id
             data_obj["zip_filename"] = "invoices_xmlhtml.zip"
@@ -1699,103 +1645,92 @@ class BackendService(BaseService):
     
     def html2pdf(self, html_list=[],progress_callback=None):
         try:
-            from playwright.sync_api import sync_playwright
-            import tempfile
+            from .pdf_renderer import get_pdf_renderer
             self.progress_callback = progress_callback  # Lưu callback
             
-            pdf_buffer_list = []
-            total_pdfs = len(html_list)
+            # ✅ Check cancelled flag trước khi bắt đầu
+            if self._check_cancelled():
+                raise Exception("Job đã bị hủy (Ctrl+C)")
+            
+            import sys
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+            from shared.download_service import ZipFileWriter
+            
+            # Chỉ giữ metadata; HTML được đọc dần (từ ZIP của xmlahtml qua zip_path) khi renderer cần
+            items = []
             for idx, item in enumerate(html_list, 1):
-                # ✅ Check cancelled flag trước khi xử lý mỗi PDF
-                if self._check_cancelled():
-                    raise Exception("Job đã bị hủy (Ctrl+C)")
-                
-                # 📊 Báo tiến trình cho mỗi PDF được convert
-                if self.progress_callback:
-                    self.progress_callback(
-                        current_step=f"Đang chuyển đổi sang PDF {idx}/{total_pdfs}...",
-                        processed=idx,
-                        total=total_pdfs
-                    )
-                
                 if isinstance(item, dict):
-                    khhdon = item.get('khhdon', 'unknown')
-                    shdon = item.get('shdon', 'unknown')
-                    khmshdon = item.get('khmshdon', 'unknown')
-                    xml_content = item.get('xml_content', '')
-                else:
-                    khhdon = 'unknown'
-                    shdon = idx
-                    khmshdon = 'unknown'
-                    xml_content = item
-                
-                try:
-                    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as tmp_html:
-                        tmp_html.write(xml_content)
-                        tmp_html_path = tmp_html.name
-                    
-                    with sync_playwright() as p:
-                        browser = p.chromium.launch(headless=True)
-                        page = browser.new_page()
-                        page.goto(f'file:///{os.path.abspath(tmp_html_path)}')
-                        pdf_bytes = page.pdf(format='A4', landscape=False)
-                        
-                        browser.close()
-                    os.unlink(tmp_html_path)
-                    
-                    pdf_buffer_list.append({
-                        "khhdon": khhdon,
-                        "shdon": shdon,
-                        "khmshdon": khmshdon,
+                    items.append({
+                        "khhdon": item.get('khhdon', 'unknown'),
+                        "shdon": item.get('shdon', 'unknown'),
+                        "khmshdon": item.get('khmshdon', 'unknown'),
                         "index": idx,
-                        "pdf_bytes": pdf_bytes,
-                        "filename": f"{khhdon}_{shdon}.pdf"
+                        "source": item
                     })
-                    print(f"✓ [{idx}] Converted: {khhdon}_{shdon}.pdf")
-                except Exception as e:
-                    print(f"❌ [{idx}] Error converting {khhdon}_{shdon}: {e}")
-                    continue
+                else:
+                    items.append({"khhdon": 'unknown', "shdon": idx, "khmshdon": 'unknown', "index": idx, "source": item})
             
-            # Nén tất cả PDF vào ZIP buffer (in-memory)
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for item in pdf_buffer_list:
-                    filename = item["filename"]
-                    pdf_bytes = item["pdf_bytes"]
-                    zip_file.writestr(filename, pdf_bytes)
+            def iter_html():
+                zip_files = {}
+                try:
+                    for it in items:
+                        source = it["source"]
+                        if not isinstance(source, dict):
+                            yield source
+                        elif source.get('zip_path'):
+                            zip_path = source['zip_path']
+                            if zip_path not in zip_files:
+                                zip_files[zip_path] = zipfile.ZipFile(zip_path, 'r')
+                            yield zip_files[zip_path].read(source['filename']).decode('utf-8')
+                        else:
+                            yield source.get('xml_content', '')
+                finally:
+                    for zip_file in zip_files.values():
+                        zip_file.close()
             
-            zip_buffer.seek(0)
-            zip_bytes_data = zip_buffer.getvalue()
+            total_pdfs = len(items)
+            # 1 Chromium + K page dùng chung (pdf_renderer), render song song qua page.set_content
+            renderer = get_pdf_renderer()
+            done = 0
+            # ✅ Ghi từng PDF vào ZIP trên disk ngay khi render xong (theo thứ tự hoàn thành), không giữ PDF trong RAM
+            with ZipFileWriter('zip') as pdf_writer:
+                for pos, pdf_bytes, error in renderer.render_many(iter_html(), is_cancelled=self._check_cancelled):
+                    done += 1
+                    meta = items[pos]
+                    khhdon, shdon = meta["khhdon"], meta["shdon"]
+                    
+                    # 📊 Báo tiến trình cho mỗi PDF được convert
+                    if self.progress_callback:
+                        self.progress_callback(
+                            current_step=f"Đang chuyển đổi sang PDF {done}/{total_pdfs}...",
+                            processed=done,
+                            total=total_pdfs
+                        )
+                    
+                    if error is not None:
+                        print(f"❌ [{meta['index']}] Error converting {khhdon}_{shdon}: {error}")
+                        continue
+                    pdf_writer.write(f"{khhdon}_{shdon}.pdf", pdf_bytes)
+                    print(f"✓ [{meta['index']}] Converted: {khhdon}_{shdon}.pdf")
             
-            # ✅ Lưu file vào disk và tạo download_id (giống Go-Soft pattern)
-            pdf_download_id = None
-            try:
-                import sys
-                import os as os_module
-                sys.path.insert(0, os_module.path.dirname(os_module.path.dirname(os_module.path.dirname(os_module.path.abspath(__file__)))))
-                from shared.download_service import save_file_to_disk
-                
-                pdf_download_id, pdf_file_path = save_file_to_disk(zip_bytes_data, 'zip')
-                logger.info(f"✅ Đã lưu PDF ZIP file: {pdf_file_path} (download_id: {pdf_download_id})")
-            except Exception as e:
-                logger.error(f"❌ Lỗi khi lưu PDF ZIP file vào disk: {e}")
-                # Fallback: vẫn tạo base64 nếu không lưu được
-                zip_bytes = base64.b64encode(zip_bytes_data).decode('utf-8')
+            total_pdf = pdf_writer.count
+            pdf_download_id = pdf_writer.result[0] if pdf_writer.result else None
+            if pdf_download_id:
+                logger.info(f"✅ Đã lưu PDF ZIP file: {pdf_writer.file_path} (download_id: {pdf_download_id})")
             
             response = {
                 "status": "success",
-                "message": f"Hoàn tất chuyển {len(pdf_buffer_list)}/{len(html_list)} PDF",
+                "message": f"Hoàn tất chuyển {total_pdf}/{len(html_list)} PDF",
                 "data": {
                     "filename": "invoices_pdf.zip",
-                    "total_pdf": len(pdf_buffer_list),
+                    "total_pdf": total_pdf,
                     "download_id": pdf_download_id,  # ✅ Trả về download_id thay vì zip_bytes
-                    # ✅ Backward compatibility: vẫn có zip_bytes nếu không lưu được vào disk
-                    "zip_bytes": base64.b64encode(zip_bytes_data).decode('utf-8') if pdf_download_id is None else None
+                    # ZIP luôn nằm trên disk, giữ key cho client cũ
+                    "zip_bytes": None
                 },
                 # ✅ KHÔNG trả về pdf_list nữa (quá lớn, có thể gây tràn RAM)
-                # "pdf_list": pdf_buffer_list  # ❌ Comment out để tránh tràn RAM
             }
-            print(f"✓ ZIP created with {len(pdf_buffer_list)} PDFs")
+            print(f"✓ ZIP created with {total_pdf} PDFs")
             return response
             
         except Exception as e:
@@ -0,0 +1,198 @@
+"""
+Lấy chi tiết hóa đơn (/query/invoices/detail) song song cho chitiet_
+
+Trước đây mỗi hóa đơn = 1 request tuần tự qua session `Connection: close` (mỗi lần 1 TLS handshake).
+Ở đây:
+  - ThreadPool INVOICE_DETAIL_WORKERS thread, mỗi thread 1 requests.Session keep-alive riêng
+  - Token bucket theo proxy (INVOICE_DETAIL_RATE req/s, burst INVOICE_DETAIL_BURST), dùng chung
+    giữa các job cùng proxy trong process
+  - 429 → giảm rate của bucket một nửa (tăng dần lại khi request thành công) + đổi session/IP như cũ
+  - Kết quả trả về đúng thứ tự datas để ghi vào Excel như trước
+
+Usage:
+    fetcher = DetailFetcher(proxy_url, headers, timeout=15, is_cancelled=self._check_cancelled)
+    for data, data_ct in zip(datas, fetcher.fetch_many(datas)):
+        ...
+"""
+import os
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DETAIL_URL = 'https://hoadondientu.gdt.gov.vn:30000/{spec}query/invoices/detail?nbmst={nbmst}&khhdon={khhdon}&shdon={shdon}&khmshdon={khmshdon}'
+DETAIL_WORKERS = int(os.getenv('INVOICE_DETAIL_WORKERS', 4))
+DETAIL_RATE = float(os.getenv('INVOICE_DETAIL_RATE', 4))  # request/giây cho mỗi proxy
+DETAIL_BURST = int(os.getenv('INVOICE_DETAIL_BURST', 4))
+# Rate không giảm dưới mức này dù bị 429 liên tục
+DETAIL_MIN_RATE = 0.25
+
+
+class TokenBucket:
+    """Token bucket thread-safe với rate thay đổi được (giảm khi 429, hồi dần khi OK)"""
+
+    def __init__(self, rate=DETAIL_RATE, burst=DETAIL_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, is_cancelled=None):
+        """Chờ đến khi có 1 token (thoát sớm nếu is_cancelled() True)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if is_cancelled and is_cancelled():
+                raise Exception("Job đã bị hủy (Ctrl+C)")
+            time.sleep(min(wait, 1.0))
+
+    def throttle(self):
+        """Bị 429: giảm một nửa rate và bỏ token đang có"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(DETAIL_MIN_RATE, self.rate / 2)
+            self._tokens = 0
+        logger.warning(f" Detail rate giảm còn {self.rate:.2f} req/s")
+
+    def recover(self):
+        """Request OK: tăng rate dần về mức cấu hình"""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(proxy_url):
+    """Bucket dùng chung cho 1 proxy (None = đi thẳng, không proxy)"""
+    key = proxy_url or 'direct'
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket()
+        return _buckets[key]
+
+
+class DetailFetcher:
+    """Lấy chi tiết nhiều hóa đơn song song, giữ retry + đổi proxy khi lỗi như chitiet_ cũ"""
+
+    def __init__(self, proxy_url, headers, timeout=15, workers=DETAIL_WORKERS, is_cancelled=None):
+        self.proxy_url = proxy_url
+        self.headers = headers
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.is_cancelled = is_cancelled
+        self.bucket = get_bucket(proxy_url)
+        self._local = threading.local()
+        self._closed = False
+
+    def _new_session(self):
+        # Giống _recreate_session_with_new_proxy nhưng giữ keep-alive (không "Connection: close")
+        session = requests.Session()
+        session.headers.update({
+            "User-Agent": "PostmanRuntime/7.43.4",
+            "Accept": "application/json, text/plain, */*",
+            "Accept-Language": "vi-VN,vi;q=0.9",
+        })
+        if self.proxy_url:
+            session.proxies = {
+                'http': self.proxy_url
+            }
+        self._local.session = session
+        return session
+
+    def _session(self):
+        return getattr(self._local, 'session', None) or self._new_session()
+
+    def _rotate(self):
+        """Đổi session của thread hiện tại (proxy tự đổi IP)"""
+        old = getattr(self._local, 'session', None)
+        if old is not None:
+            old.close()
+        self._new_session()
+
+    def _cancelled(self):
+        # _closed: chitiet_ đã dừng giữa chừng → thread còn lại không retry tiếp
+        return self._closed or bool(self.is_cancelled and self.is_cancelled())
+
+    def fetch(self, data):
+        """
+        Lấy chi tiết 1 hóa đơn.
+
+        Returns:
+            dict chi tiết, hoặc None nếu response không phải JSON dict (chitiet_ bỏ qua hóa đơn đó)
+        """
+        spec = "sco-" if data["ttxly"] == 8 else ""
+        nbmst, khmshdon, shd = data["nbmst"], data["khmshdon"], data["shdon"]
+        url = DETAIL_URL.format(spec=spec, nbmst=nbmst, khhdon=data["khhdon"], shdon=shd, khmshdon=khmshdon)
+        f = 0
+        while True:
+            if self._cancelled():
+                raise Exception("Job đã bị hủy (Ctrl+C)")
+            f += 1
+            self.bucket.acquire(self._cancelled)
+            try:
+                res1 = self._session().get(url, headers=self.headers, verify=False, timeout=self.timeout)
+                if res1.status_code == 200:
+                    logger.info(f" Got invoice detail | Status: {res1.status_code} | Response size: {len(res1.content)} bytes | Attempt: {f} | Invoice: {nbmst}-{khmshdon}-{shd} |")
+                    self.bucket.recover()
+                    break
+                elif res1.status_code == 429:
+                    logger.warning(f" 429 Too Many Requests detected | Invoice: {nbmst}-{khmshdon}-{shd} | Rotating IP...")
+                    self.bucket.throttle()
+                    self._rotate()
+            except Exception as ex:
+                logger.error(f" Request failed,change proxy now | Invoice: {nbmst}-{khmshdon}-{shd} | Error: {str(ex)}")
+                self._rotate()
+        try:
+            data_ct = res1.json()
+            if not isinstance(data_ct, dict):
+                logger.error(f" Failed,change session,proxy now | Invoice: {nbmst} | Response không phải dict: {type(data_ct)}")
+                self._rotate()
+                return None
+            return data_ct
+        except Exception as ex:
+            logger.error(f" Failed,change session,proxy now | Invoice: {nbmst} | Error: {str(ex)}")
+            self._rotate()
+            return None
+
+    def fetch_many(self, datas):
+        """
+        Yields:
+            chi tiết (dict hoặc None) của từng phần tử trong datas, đúng thứ tự;
+            chỉ tối đa 4*workers request được đặt trước phía sau phần tử đang chờ
+        """
+        window = self.workers * 4
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='invoice-detail')
+        pending = collections.deque()
+        source = iter(datas)
+        try:
+            for data in source:
+                pending.append(executor.submit(self.fetch, data))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            self._closed = True
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
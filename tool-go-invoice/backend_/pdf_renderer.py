@@ -0,0 +1,198 @@
+"""
+PDF renderer dùng chung: 1 Chromium + K page sống lâu cho html2pdf
+
+Trước đây mỗi hóa đơn = 1 lần sync_playwright() + chromium.launch() + ghi file HTML tạm.
+Ở đây một background thread giữ event loop riêng chạy async Playwright:
+  - browser launch 1 lần (tự launch lại nếu bị crash/disconnect)
+  - K page (INVOICE_PDF_PAGES, mặc định 4) nhận HTML qua page.set_content, render song song
+  - API sync (render / render_many) an toàn khi gọi từ nhiều thread (asyncio.to_thread của routes)
+  - render_many nhận generator và chỉ giữ tối đa 2*K HTML/PDF trong bộ nhớ
+
+Usage:
+    renderer = get_pdf_renderer()
+    for index, pdf_bytes, error in renderer.render_many(html_list):
+        ...
+"""
+import os
+import atexit
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+PDF_POOL_PAGES = int(os.getenv('INVOICE_PDF_PAGES', 4))
+PDF_RENDER_TIMEOUT = int(os.getenv('INVOICE_PDF_TIMEOUT', 60))  # giây / hóa đơn
+PDF_OPTIONS = {'format': 'A4', 'landscape': False}
+
+
+class PdfRenderer:
+    """1 browser + pool K page trên event loop riêng"""
+
+    def __init__(self, pages=PDF_POOL_PAGES):
+        self.pages = max(1, pages)
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Các object dưới đây chỉ được dùng trong event loop của renderer
+        self._playwright = None
+        self._browser = None
+        self._idle_pages = []
+        self._slots = None
+        self._browser_lock = None
+
+    # ------------------------------------------------------------------
+    # Event loop thread
+    # ------------------------------------------------------------------
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._browser_lock = asyncio.Lock()
+                self._slots = asyncio.Semaphore(self.pages)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name='pdf-renderer', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def _submit(self, coro):
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # ------------------------------------------------------------------
+    # Browser / page (chạy trong event loop)
+    # ------------------------------------------------------------------
+
+    async def _ensure_browser(self):
+        async with self._browser_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            if self._browser is not None:
+                logger.warning("Chromium bị ngắt kết nối, đang khởi động lại...")
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            # Page của browser cũ không dùng được nữa
+            self._idle_pages = []
+            logger.info(f"✅ Chromium cho PDF renderer đã sẵn sàng ({self.pages} page)")
+
+    async def _render(self, html):
+        # Semaphore giới hạn K page render cùng lúc; page rảnh được giữ lại cho lần sau
+        async with self._slots:
+            await self._ensure_browser()
+            browser = self._browser
+            page = self._idle_pages.pop() if self._idle_pages else await browser.new_page()
+            try:
+                await page.set_content(html, wait_until='load', timeout=PDF_RENDER_TIMEOUT * 1000)
+                pdf_bytes = await page.pdf(**PDF_OPTIONS)
+            except Exception:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                raise
+            # Page của browser đã bị thay (sau crash) thì bỏ
+            if browser is self._browser:
+                self._idle_pages.append(page)
+            return pdf_bytes
+
+    async def _close(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    # ------------------------------------------------------------------
+    # Sync API
+    # ------------------------------------------------------------------
+
+    def render(self, html):
+        """Render 1 HTML → PDF bytes (block)"""
+        return self._submit(self._render(html)).result(timeout=PDF_RENDER_TIMEOUT * 2)
+
+    def render_many(self, html_iter, is_cancelled=None):
+        """
+        Render nhiều HTML song song trên K page.
+
+        html_iter có thể là generator: chỉ tối đa 2*K HTML được lấy ra và giữ trong bộ nhớ cùng lúc.
+
+        Yields:
+            (index, pdf_bytes, error) theo thứ tự hoàn thành; index là vị trí trong html_iter
+        Raises:
+            Exception nếu is_cancelled() trả về True (các job chưa chạy bị hủy)
+        """
+        window = self.pages * 2
+        source = enumerate(html_iter)
+        pending = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        index, html = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[self._submit(self._render(html))] = index
+                if not pending:
+                    return
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                if is_cancelled and is_cancelled():
+                    raise Exception("Job đã bị hủy (Ctrl+C)")
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        yield index, future.result(), None
+                    except Exception as e:
+                        yield index, None, e
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """Đóng browser và dừng event loop"""
+        if self._loop is None:
+            return
+        try:
+            self._submit(self._close()).result(timeout=10)
+        except Exception as e:
+            logger.warning(f"Lỗi khi đóng PDF renderer: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_pdf_renderer():
+    """PdfRenderer dùng chung của process (lazy init)"""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = PdfRenderer()
+                atexit.register(_renderer.close)
+    return _renderer
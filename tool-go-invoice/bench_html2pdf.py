@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark html2pdf (hóa đơn/phút) trên bộ HTML hóa đơn giả lập
+
+So sánh:
+  - legacy: sync_playwright() + chromium.launch() + file HTML tạm cho MỖI hóa đơn (cách cũ)
+  - pool:   PdfRenderer (1 Chromium, K page, page.set_content) với từng giá trị K
+
+Run:
+  python bench_html2pdf.py --invoices 200 --pages 1,4,8
+  python bench_html2pdf.py --dir output/xmlhtml --legacy-invoices 20
+"""
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend_.pdf_renderer import PdfRenderer
+
+
+def make_invoice_html(index, rows=25):
+    """HTML hóa đơn giả lập: header, bảng hàng hóa, tổng tiền, CSS inline"""
+    rng = random.Random(index)
+    lines = []
+    total = 0
+    for i in range(1, rows + 1):
+        qty = rng.randint(1, 50)
+        price = rng.randint(10, 5000) * 1000
+        amount = qty * price
+        total += amount
+        lines.append(
+            f"<tr><td>{i}</td><td>Hàng hóa dịch vụ số {i} - mã {rng.randint(10000, 99999)}</td>"
+            f"<td>Cái</td><td>{qty}</td><td>{price:,}</td><td>{amount:,}</td></tr>"
+        )
+    vat = total // 10
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+body {{ font-family: 'Times New Roman', serif; font-size: 12px; margin: 24px; }}
+h1 {{ text-align: center; color: #b00; }}
+table {{ width: 100%; border-collapse: collapse; margin-top: 12px; }}
+td, th {{ border: 1px solid #333; padding: 4px; }}
+.right {{ text-align: right; }}
+</style></head><body>
+<h1>HÓA ĐƠN GIÁ TRỊ GIA TĂNG</h1>
+<p>Ký hiệu: 1C25TAA &nbsp; Số: {index:08d} &nbsp; Ngày {rng.randint(1, 28)} tháng {rng.randint(1, 12)} năm 2025</p>
+<p>Đơn vị bán hàng: CÔNG TY TNHH GIẢ LẬP {index % 97} — MST: {rng.randint(10**9, 10**10 - 1)}</p>
+<p>Đơn vị mua hàng: CÔNG TY CỔ PHẦN MẪU {index % 53} — MST: {rng.randint(10**9, 10**10 - 1)}</p>
+<table><tr><th>STT</th><th>Tên hàng hóa, dịch vụ</th><th>ĐVT</th><th>SL</th><th>Đơn giá</th><th>Thành tiền</th></tr>
+{''.join(lines)}
+<tr><td colspan="5" class="right">Cộng tiền hàng</td><td>{total:,}</td></tr>
+<tr><td colspan="5" class="right">Thuế GTGT 10%</td><td>{vat:,}</td></tr>
+<tr><td colspan="5" class="right"><b>Tổng cộng thanh toán</b></td><td><b>{total + vat:,}</b></td></tr>
+</table></body></html>"""
+
+
+def load_invoices(args):
+    if args.dir:
+        paths = sorted(glob.glob(os.path.join(args.dir, '*.html')))[:args.invoices]
+        print(f"Đọc {len(paths)} file HTML từ {args.dir}")
+    else:
+        out_dir = tempfile.mkdtemp(prefix='bench_invoices_')
+        paths = []
+        for i in range(args.invoices):
+            path = os.path.join(out_dir, f'invoice_{i:05d}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(make_invoice_html(i))
+            paths.append(path)
+        print(f"Tạo {len(paths)} file HTML giả lập trong {out_dir}")
+    htmls = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            htmls.append(f.read())
+    return htmls
+
+
+def bench_legacy(htmls):
+    """Bản sao đường đi cũ của html2pdf"""
+    from playwright.sync_api import sync_playwright
+    ok = 0
+    for html in htmls:
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as tmp:
+            tmp.write(html)
+            tmp_path = tmp.name
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=True)
+            page = browser.new_page()
+            page.goto(f'file:///{os.path.abspath(tmp_path)}')
+            page.pdf(format='A4', landscape=False)
+            browser.close()
+        os.unlink(tmp_path)
+        ok += 1
+    return ok
+
+
+def bench_pool(htmls, pages):
+    renderer = PdfRenderer(pages=pages)
+    try:
+        # Launch browser trước, chỉ đo throughput lúc đã warm (chi phí launch in riêng)
+        start = time.perf_counter()
+        renderer.render(htmls[0])
+        print(f"  warm-up (launch + 1 PDF): {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        ok = 0
+        for _, pdf_bytes, error in renderer.render_many(htmls):
+            if error is None and pdf_bytes:
+                ok += 1
+        return ok, time.perf_counter() - start
+    finally:
+        renderer.close()
+
+
+def report(name, count, ok, elapsed):
+    rate = ok / elapsed * 60 if elapsed > 0 else 0
+    print(f"{name:>10}: {ok}/{count} PDF trong {elapsed:.2f}s → {rate:,.0f} hóa đơn/phút")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invoices', type=int, default=200)
+    parser.add_argument('--dir', help='Thư mục chứa file .html thật (mặc định: tạo HTML giả lập)')
+    parser.add_argument('--pages', default='1,4,8', help='Danh sách K page cho pool, vd. 1,4,8')
+    parser.add_argument('--legacy-invoices', type=int, default=20,
+                        help='Số hóa đơn chạy theo cách cũ (chậm, 0 = bỏ qua)')
+    args = parser.parse_args()
+
+    htmls = load_invoices(args)
+    if not htmls:
+        print("Không có HTML nào để benchmark")
+        sys.exit(1)
+
+    if args.legacy_invoices > 0:
+        subset = htmls[:args.legacy_invoices]
+        start = time.perf_counter()
+        ok = bench_legacy(subset)
+        report('legacy', len(subset), ok, time.perf_counter() - start)
+
+    for pages in [int(x) for x in args.pages.split(',') if x.strip()]:
+        ok, elapsed = bench_pool(htmls, pages)
+        report(f'pool K={pages}', len(htmls), ok, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ Tương tự như Go-Soft pattern
 import os
 import uuid
 import logging
+import zipfile
 from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
@@ -47,6 +48,77 @@ def save_file_to_disk(file_bytes: bytes, file_extension: str = 'zip') -> Tuple[s
         raise
 
 
+class ZipFileWriter:
+    """
+    Ghi ZIP thẳng xuống STORAGE_DIR, mỗi lần 1 entry (không giữ cả ZIP trong RAM)
+
+    File được ghi vào `{download_id}.zip.part` và chỉ đổi tên thành `{download_id}.zip`
+    khi close() → get_file_path() không bao giờ trả về file đang ghi dở.
+
+    Usage:
+        with ZipFileWriter() as writer:
+            writer.write("a.xml", content)
+        download_id, file_path = writer.result
+    """
+
+    def __init__(self, file_extension: str = 'zip'):
+        self.download_id = str(uuid.uuid4())
+        self.file_path = os.path.join(STORAGE_DIR, f"{self.download_id}.{file_extension}")
+        self._part_path = f"{self.file_path}.part"
+        self._zip = zipfile.ZipFile(self._part_path, 'w', zipfile.ZIP_DEFLATED)
+        self.count = 0
+        self.result = None
+
+    def write(self, arcname: str, data) -> None:
+        """Nén và ghi 1 entry (str hoặc bytes) xuống disk"""
+        self._zip.writestr(arcname, data)
+        self.count += 1
+
+    def close(self) -> Optional[Tuple[str, str]]:
+        """
+        Hoàn tất ZIP.
+
+        Returns:
+            (download_id, file_path), hoặc None nếu không có entry nào (không để lại file rỗng)
+        """
+        if self._zip is None:
+            return self.result
+        self._zip.close()
+        self._zip = None
+        if self.count == 0:
+            os.remove(self._part_path)
+            return None
+        os.replace(self._part_path, self.file_path)
+        file_size = os.path.getsize(self.file_path)
+        logger.info(f"✅ Đã lưu file: {self.file_path} (download_id: {self.download_id}, {self.count} files, size: {file_size} bytes)")
+        self.result = (self.download_id, self.file_path)
+        return self.result
+
+    def abort(self) -> None:
+        """Bỏ file đang ghi dở (no-op nếu đã close)"""
+        if self._zip is None:
+            return
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+        self._zip = None
+        try:
+            os.remove(self._part_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
 def get_file_path(download_id: str, file_extension: str = 'zip') -> Optional[str]:
     """
     Lấy file path từ download_id
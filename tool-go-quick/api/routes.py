@@ -16,14 +16,21 @@ _GO_QUICK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Lazy import - chỉ import khi cần dùng
 CCCDExtractor = None
 CCCDExtractorStreaming = None
+_go_quick_main = None
+
+# 1 = load toàn bộ model + chạy inference giả ngay khi process start (API: thread nền, worker: trước khi nhận job)
+PRELOAD_ENABLED = os.getenv('GOQUICK_PRELOAD', '1') == '1'
 
 def _load_go_quick_main():
     """Load module main từ tool-go-quick (tránh import nhầm main của tool-go-invoice)."""
-    main_path = os.path.join(_GO_QUICK_DIR, "main.py")
-    spec = importlib.util.spec_from_file_location("go_quick_main", main_path)
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
+    global _go_quick_main
+    if _go_quick_main is None:
+        main_path = os.path.join(_GO_QUICK_DIR, "main.py")
+        spec = importlib.util.spec_from_file_location("go_quick_main", main_path)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        _go_quick_main = mod
+    return _go_quick_main
 
 def get_cccd_extractor():
     global CCCDExtractor, CCCDExtractorStreaming
@@ -68,24 +75,37 @@ def get_model_cache():
             logger.info("Model cache đã được load bởi thread khác, trả về")
             return _model_cache
         
-        logger.info("🔄 Đang load models lần đầu (sẽ cache để tái sử dụng)...")
-        
         # Dùng thư mục tool-go-quick (tránh nhầm với tool-go-invoice khi api_server thêm nhiều path)
         base_dir = os.path.join(_GO_QUICK_DIR, "__pycache__")
         _model_cache['base_dir'] = base_dir
-        
+
+        # GOQUICK_INFERENCE_SERVER=1: model nằm ở inference_server.py, process này chỉ giữ proxy
+        if os.getenv('GOQUICK_INFERENCE_SERVER', '0') == '1':
+            try:
+                if _GO_QUICK_DIR not in sys.path:
+                    sys.path.insert(0, _GO_QUICK_DIR)
+                from inference_server import get_inference_client
+                _model_cache.update(get_inference_client().model_cache())
+                logger.info("✅ Dùng Go-Quick inference server, không load model trong process này")
+                return _model_cache
+            except Exception as e:
+                logger.warning(f"⚠️ Không kết nối được inference server ({e}), load model trong process")
+
+        logger.info("🔄 Đang load models lần đầu (sẽ cache để tái sử dụng)...")
+
         try:
-            from ultralytics import YOLO
+            # GOQUICK_BACKEND=onnx: load best*.onnx bằng onnxruntime thay vì ultralytics
+            load_yolo = _load_go_quick_main().load_yolo
             logger.info("  ⏳ Loading YOLO model1 (best.pt)...")
-            _model_cache['yolo_model1'] = YOLO(os.path.join(base_dir, "best.pt"))
+            _model_cache['yolo_model1'] = load_yolo(base_dir, "best.pt")
             logger.info("  ✅ YOLO model1 loaded")
             
             logger.info("  ⏳ Loading YOLO model2 (best2.pt)...")
-            _model_cache['yolo_model2'] = YOLO(os.path.join(base_dir, "best2.pt"))
+            _model_cache['yolo_model2'] = load_yolo(base_dir, "best2.pt")
             logger.info("  ✅ YOLO model2 loaded")
             
             logger.info("  ⏳ Loading YOLO model3 (best3.pt)...")
-            _model_cache['yolo_model3'] = YOLO(os.path.join(base_dir, "best3.pt"))
+            _model_cache['yolo_model3'] = load_yolo(base_dir, "best3.pt")
             logger.info("  ✅ YOLO model3 loaded")
         except Exception as e:
             logger.error(f"  ❌ Lỗi load YOLO models: {e}", exc_info=True)
@@ -109,14 +129,7 @@ def get_vietocr_detector():
         
         print("  ⏳ Loading VietOCR detector...")
         try:
-            from vietocr.tool.predictor import Predictor
-            from vietocr.tool.config import Cfg
-            
-            config = Cfg.load_config_from_name('vgg_transformer')
-            config['weights'] = os.path.join(_model_cache['base_dir'], 'vgg_transformer.pth')
-            config['cnn']['pretrained'] = False
-            config['device'] = 'cpu'
-            _model_cache['vietocr_detector'] = Predictor(config)
+            _model_cache['vietocr_detector'] = _load_go_quick_main().load_ocr(_model_cache['base_dir'])
             print("  ✅ VietOCR detector loaded")
         except Exception as e:
             print(f"  ❌ Lỗi load VietOCR: {e}")
@@ -128,6 +141,53 @@ def ensure_vietocr_loaded():
     """Đảm bảo VietOCR đã được load"""
     get_vietocr_detector()
 
+# Trạng thái preload/warm-up, trả về ở /health: cold → loading → loaded → warming → ready (hoặc failed)
+_warmup_state = {
+    'status': 'cold',
+    'load_seconds': None,
+    'warmup_seconds': None,
+    'error': None,
+}
+
+def preload_models():
+    """Load YOLO + VietOCR vào model cache (chưa chạy inference)"""
+    import time
+    if _warmup_state['status'] in ('loaded', 'warming', 'ready'):
+        return _model_cache
+    _warmup_state.update(status='loading', error=None)
+    start = time.perf_counter()
+    try:
+        cache = get_model_cache()
+        if cache['yolo_model1'] is None:
+            raise RuntimeError("Không load được YOLO models")
+        if cache['vietocr_detector'] is None:
+            ensure_vietocr_loaded()
+    except Exception as e:
+        _warmup_state.update(status='failed', error=str(e))
+        raise
+    _warmup_state.update(status='loaded', load_seconds=round(time.perf_counter() - start, 2))
+    return _model_cache
+
+def warm_up_models():
+    """Preload model rồi chạy inference giả qua từng model, sau đó /health báo ready"""
+    try:
+        cache = preload_models()
+        if _warmup_state['status'] == 'ready':
+            return
+        _warmup_state.update(status='warming')
+        seconds = _load_go_quick_main().warm_up_models(cache)
+        _warmup_state.update(status='ready', warmup_seconds=round(seconds, 2))
+        print(f"✅ Go-Quick models sẵn sàng (load {_warmup_state['load_seconds']}s, warm-up {seconds:.2f}s)")
+    except Exception as e:
+        _warmup_state.update(status='failed', error=str(e))
+        print(f"❌ Lỗi warm-up Go-Quick models: {e}")
+
+def start_warm_up():
+    """warm_up_models trên thread nền (không chặn server start)"""
+    if _warmup_state['status'] != 'cold':
+        return
+    threading.Thread(target=warm_up_models, name="goquick-warmup", daemon=True).start()
+
 # Cấu hình
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'pdf', 'xlsx', 'xls', 'zip'}
@@ -229,15 +289,25 @@ def register_routes(app, prefix):
             print(f"Error reading file bytes: {e}")
             return None
     
+    if PRELOAD_ENABLED:
+        if is_async:
+            @app.before_serving
+            async def go_quick_preload():
+                start_warm_up()
+        else:
+            start_warm_up()
+
     # ==================== ROUTES ====================
     
     @app.route(f'{prefix}/health', methods=['GET'])
     async def go_quick_health_check():
-        """Health check cho tool này"""
+        """Health check cho tool này; ready = model đã load + warm-up xong"""
         return jsonify({
             "status": "success",
             "message": "ID Quick API is running",
-            "version": "1.0"
+            "version": "1.0",
+            "ready": _warmup_state['status'] == 'ready',
+            "models": dict(_warmup_state)
         })
     
     @app.route(f'{prefix}/read-quick', methods=['POST'])
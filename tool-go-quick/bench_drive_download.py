@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark tải ảnh Google Drive của process-excel với server local giả lập Drive (không cần mạng)
+
+Server giả lập /uc?export=download&id=...: trả --size KB sau --latency ms, mỗi file thứ --warning-every
+đòi confirm token qua cookie download_warning, lần gọi đầu của mỗi file thứ --flaky-every trả 503.
+
+So sánh:
+  - cũ:  tuần tự, requests.Session() mới cho mỗi file, chunk 1 KB
+  - mới: DriveDownloader (song song, keep-alive session, chunk lớn, retry/backoff)
+
+Run:
+  python bench_drive_download.py --files 100 --latency 150 --workers 1,4,8,16
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from drive_download import DriveDownloader
+
+
+def make_handler(args):
+    payload = os.urandom(args.size * 1024)
+    seen = set()
+    lock = threading.Lock()
+
+    class DriveStandIn(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            file_id = query.get("id", [""])[0]
+            number = int(file_id.rsplit("-", 1)[-1]) if file_id.rsplit("-", 1)[-1].isdigit() else 0
+            time.sleep(args.latency / 1000)
+            with lock:
+                first_call = file_id not in seen
+                seen.add(file_id)
+            if args.flaky_every and number % args.flaky_every == 0 and first_call:
+                return self._send(503, b"busy")
+            if args.warning_every and number % args.warning_every == 0 and "confirm" not in query:
+                return self._send(200, b"<html>virus scan warning</html>",
+                                  {"Set-Cookie": f"download_warning_{file_id}=tok{number}; Path=/"})
+            self._send(200, payload, {"Content-Type": "image/png"})
+
+        def _send(self, status, body, headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return DriveStandIn
+
+
+def download_legacy(base_url, file_id):
+    """Cách tải cũ của excel_to_png: Session mới mỗi file, chunk 1 KB, không retry"""
+    download_url = f"{base_url}/uc?export=download&id={file_id}"
+    with requests.Session() as session:
+        return _download_legacy(session, download_url, file_id)
+
+
+def _download_legacy(session, download_url, file_id):
+    response = session.get(download_url, stream=True)
+    if response.status_code != 200:
+        raise Exception(f"Không tải được file, status {response.status_code}")
+    for key, value in response.cookies.items():
+        if key.startswith("download_warning"):
+            response = session.get(download_url, params={"id": file_id, "confirm": value}, stream=True)
+            break
+    if response.status_code != 200:
+        raise Exception(f"Không tải được file (sau khi confirm), status {response.status_code}")
+    return b"".join(chunk for chunk in response.iter_content(1024) if chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--size', type=int, default=300, help='KB mỗi ảnh')
+    parser.add_argument('--latency', type=int, default=150, help='ms server chờ trước khi trả mỗi request')
+    parser.add_argument('--warning-every', type=int, default=10)
+    parser.add_argument('--flaky-every', type=int, default=15)
+    parser.add_argument('--workers', default='1,4,8,16', help='Danh sách số thread, vd. 1,4,8,16')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args))
+    server.handle_error = lambda *_: None  # client đóng connection giữa chừng, không in traceback
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def urls(tag):
+        # id khác nhau mỗi lần chạy để lỗi 503 giả lập xảy ra lại
+        return [(f"{i}mt.png", f"https://drive.google.com/file/d/{tag}-{i}/view") for i in range(1, args.files + 1)]
+
+    print(f"{args.files} file × {args.size} KB, latency {args.latency} ms")
+    start = time.perf_counter()
+    ok = 0
+    for _, url in urls("legacy"):
+        try:
+            download_legacy(base_url, url.split("/file/d/")[1].split("/")[0])
+            ok += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - start
+    print(f"  cũ (tuần tự):      {elapsed:7.2f}s  {ok}/{args.files} file  {args.files / elapsed:6.1f} file/s")
+
+    for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+        start = time.perf_counter()
+        with DriveDownloader(workers=workers, backoff=0.05, base_url=base_url) as downloader:
+            ok = sum(1 for _, data in downloader.iter_downloads(urls(f"w{workers}")) if data)
+        elapsed = time.perf_counter() - start
+        print(f"  mới workers={workers:<3}:  {elapsed:7.2f}s  {ok}/{args.files} file  {args.files / elapsed:6.1f} file/s")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+So sánh backend torch và onnx (GOQUICK_BACKEND) trên ảnh fixture datatest/
+
+  --check: độ chính xác — cùng ảnh qua 2 backend, so từng model
+      best.pt (pose):     keypoint 4 góc lệch tối đa bao nhiêu px
+      best2.pt (detect):  số box / class, box lệch tối đa bao nhiêu px
+      best3.pt (segment): số mask / class, bounding rect của polygon lệch tối đa bao nhiêu px
+    rồi chạy DetectWorker end-to-end (tắt result_cache) và so từng trường OCR của từng CCCD.
+    Lệch quá --tolerance px hoặc khác chữ → exit code 1.
+    Kết quả (pass/fail, lệch từng model, SHA-256 file weight) ghi vào __pycache__/onnx_parity.json:
+    GOQUICK_BACKEND=onnx chỉ load model khi file này pass với đúng bộ file hiện tại.
+  mặc định: hiệu năng — mỗi backend chạy trong 1 process riêng: thời gian load, latency trung bình mỗi lần
+    predict của từng model (batch GOQUICK_YOLO_BATCH / GOQUICK_OCR_BATCH), RSS tối đa của process.
+
+Cần file .onnx từ export_onnx.py.
+
+Run:
+  python bench_onnx.py --check
+  python bench_onnx.py --repeat 20 --threads 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import cv2
+import numpy as np
+
+_GO_QUICK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _GO_QUICK_DIR)
+
+FIXTURE_DIR = os.path.join(_GO_QUICK_DIR, 'datatest')
+BASE_DIR = os.path.join(_GO_QUICK_DIR, '__pycache__')
+YOLO_MODELS = [('yolo_model1', 'best.pt'), ('yolo_model2', 'best2.pt'), ('yolo_model3', 'best3.pt')]
+
+
+def load_fixture_images(folder):
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return [(os.path.basename(p), img) for p in paths for img in [cv2.imread(p)] if img is not None]
+
+
+def ocr_crops(images, count):
+    """Dải ngang cao 32-48 px cắt từ ảnh fixture, kích thước gần giống dòng chữ detect_lines cắt ra"""
+    from PIL import Image
+
+    crops = []
+    for i in range(count):
+        img = images[i % len(images)][1]
+        h, w = img.shape[:2]
+        top = (i * 37) % max(1, h - 48)
+        strip = img[top:top + 32 + (i % 3) * 8, w // 8: w // 8 + max(64, w // 2)]
+        crops.append(Image.fromarray(cv2.cvtColor(strip, cv2.COLOR_BGR2RGB)))
+    return crops
+
+
+def max_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024  # macOS: byte, Linux: KB
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 / 1024  # Windows
+        except Exception:
+            return None
+
+
+# ----------------------------------------------------------------------
+# Độ chính xác
+# ----------------------------------------------------------------------
+
+def _allow_unchecked_onnx():
+    """Bench/check chính là bước kiểm tra → load onnx không cần onnx_parity.json"""
+    import main
+    main._onnx_parity_ok.add(BASE_DIR)
+
+
+def _load_backend(backend):
+    import main
+    main.INFERENCE_BACKEND = backend
+    _allow_unchecked_onnx()
+    models = {key: main.load_yolo(BASE_DIR, weights) for key, weights in YOLO_MODELS}
+    models['vietocr_detector'] = main.load_ocr(BASE_DIR)
+    return models
+
+
+def _max_diff(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    if a.shape != b.shape:
+        return float('inf')
+    return float(np.abs(a - b).max()) if a.size else 0.0
+
+
+def _compare_yolo(key, ref, out):
+    """→ (mô tả lệch, lệch px lớn nhất)"""
+    ref_cls = ref.boxes.cls.cpu().numpy().astype(int).tolist()
+    out_cls = out.boxes.cls.cpu().numpy().astype(int).tolist()
+    if sorted(ref_cls) != sorted(out_cls):
+        return f"class khác: torch {ref_cls} / onnx {out_cls}", float('inf')
+    if key == 'yolo_model1':
+        diff = _max_diff(ref.keypoints.xy.cpu().numpy(), out.keypoints.xy.cpu().numpy())
+        return f"keypoint lệch {diff:.2f}px", diff
+    if key == 'yolo_model2':
+        order_ref, order_out = np.argsort(ref_cls, kind='stable'), np.argsort(out_cls, kind='stable')
+        diff = _max_diff(ref.boxes.xyxy.cpu().numpy()[order_ref], out.boxes.xyxy.cpu().numpy()[order_out])
+        return f"box lệch {diff:.2f}px", diff
+    ref_masks = [] if ref.masks is None else list(ref.masks.xy)
+    out_masks = [] if out.masks is None else list(out.masks.xy)
+    rects = lambda masks: sorted(cv2.boundingRect(np.asarray(p, dtype=np.float32)) if len(p) else (0, 0, 0, 0)
+                                 for p in masks)
+    diff = _max_diff(rects(ref_masks), rects(out_masks))
+    return f"{len(out_masks)} mask, bounding rect lệch {diff:.2f}px", diff
+
+
+def _run_end_to_end(models, folder):
+    import main
+    import result_cache
+    result_cache.RESULT_CACHE_ENABLED = False
+    return main.DetectWorker(input_path=folder, type_=1, cached_models=dict(models)).run()
+
+
+def check(args):
+    images = load_fixture_images(args.fixtures)
+    if not images:
+        raise SystemExit(f"Không có ảnh trong {args.fixtures}")
+    torch_models, onnx_models = _load_backend('torch'), _load_backend('onnx')
+    failed = False
+    details = {'fixtures': len(images)}
+
+    print(f"So sánh model trên {len(images)} ảnh ({args.fixtures}), tolerance {args.tolerance}px")
+    for key, weights in YOLO_MODELS:
+        print(f"\n{weights}")
+        worst = 0.0
+        for name, img in images:
+            ref = torch_models[key].predict(source=[img], conf=0.5, save=False, verbose=False)[0]
+            out = onnx_models[key].predict(source=[img], conf=0.5, save=False, verbose=False)[0]
+            message, diff = _compare_yolo(key, ref, out)
+            ok = diff <= args.tolerance
+            failed |= not ok
+            worst = max(worst, diff)
+            print(f"  {'✅' if ok else '❌'} {name}: {message}")
+        details[weights] = {'max_diff_px': worst if worst != float('inf') else None}
+
+    print("\nDetectWorker end-to-end (so từng trường OCR)")
+    ref, out = _run_end_to_end(torch_models, args.fixtures), _run_end_to_end(onnx_models, args.fixtures)
+    same = json.dumps(ref, ensure_ascii=False, sort_keys=True, default=str) == json.dumps(out, ensure_ascii=False, sort_keys=True, default=str)
+    details['end_to_end_identical'] = same
+    if same:
+        print("  ✅ kết quả giống hệt")
+    else:
+        failed = True
+        print("  ❌ kết quả khác:")
+        print(f"  torch: {json.dumps(ref, ensure_ascii=False, default=str)[:2000]}")
+        print(f"  onnx:  {json.dumps(out, ensure_ascii=False, default=str)[:2000]}")
+    import onnx_backend
+    path = onnx_backend.write_parity_record(BASE_DIR, not failed, args.tolerance, details)
+    print(f"\n{'✅ PASS' if not failed else '❌ FAIL'} → {path}")
+    sys.exit(1 if failed else 0)
+
+
+# ----------------------------------------------------------------------
+# Hiệu năng (mỗi backend 1 process để đo RSS riêng)
+# ----------------------------------------------------------------------
+
+def measure(args):
+    """Chạy trong process con với GOQUICK_BACKEND đã đặt; in 1 dòng JSON kết quả"""
+    import main
+
+    _allow_unchecked_onnx()
+    images = load_fixture_images(args.fixtures)
+    yolo_batch = [images[i % len(images)][1] for i in range(max(1, main.YOLO_BATCH_SIZE))]
+    crops = ocr_crops(images, max(1, main.OCR_BATCH_SIZE))
+
+    start = time.perf_counter()
+    models = {key: main.load_yolo(BASE_DIR, weights, args.threads or None) for key, weights in YOLO_MODELS}
+    models['vietocr_detector'] = main.load_ocr(BASE_DIR, args.threads or None)
+    result = {'backend': main.INFERENCE_BACKEND, 'load_s': time.perf_counter() - start}
+    result['warmup_s'] = main.warm_up_models(models)
+
+    calls = {key: (lambda m=models[key]: m.predict(source=yolo_batch, conf=0.5, save=False, verbose=False))
+             for key, _ in YOLO_MODELS}
+    calls['vietocr_detector'] = lambda: models['vietocr_detector'].predict_batch(crops)
+    for key, call in calls.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            call()
+        result[f'{key}_ms'] = (time.perf_counter() - start) / args.repeat * 1000
+    result['rss_mb'] = max_rss_mb()
+    print(json.dumps(result))
+
+
+def bench(args):
+    rows = []
+    for backend in ('torch', 'onnx'):
+        env = dict(os.environ, GOQUICK_BACKEND=backend)
+        if args.threads and backend == 'torch':
+            env['OMP_NUM_THREADS'] = str(args.threads)
+        cmd = [sys.executable, os.path.abspath(__file__), '--measure', '--repeat', str(args.repeat),
+               '--threads', str(args.threads), '--fixtures', args.fixtures]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ backend {backend} lỗi:\n{proc.stderr[-2000:]}")
+            continue
+        rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    keys = ['load_s', 'warmup_s', 'yolo_model1_ms', 'yolo_model2_ms', 'yolo_model3_ms', 'vietocr_detector_ms', 'rss_mb']
+    print(f"{'':22}" + ''.join(f"{row['backend']:>12}" for row in rows))
+    for key in keys:
+        cells = ''.join(f"{row[key]:12.1f}" if row.get(key) is not None else f"{'-':>12}" for row in rows)
+        print(f"{key:22}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='So độ chính xác onnx với torch')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='px lệch tối đa cho box/keypoint/mask')
+    parser.add_argument('--repeat', type=int, default=10, help='Số lần predict mỗi model khi đo latency')
+    parser.add_argument('--threads', type=int, default=0, help='Thread mỗi model (0 = mặc định của backend)')
+    parser.add_argument('--fixtures', default=FIXTURE_DIR)
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+    elif args.check:
+        check(args)
+    else:
+        bench(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark YOLO theo batch cho 3 stage của DetectWorker (ảnh/giây)
+
+  - detect_cccd:    best.pt  trên ảnh gốc
+  - detect_corners: best2.pt trên ảnh CCCD đã crop
+  - detect_lines:   best3.pt trên ảnh CCCD đã xoay thẳng
+
+Mặc định dùng ảnh trong datatest/ (lặp lại cho đủ --images) cho cả 3 stage;
+truyền --dir-corners / --dir-lines (vd. thư mục md1/md2 giữ lại từ 1 job) để đo sát thực tế hơn.
+
+Run:
+  python bench_yolo_batch.py --images 64 --batch 1,4,8,16
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from main import DetectWorker, load_yolo
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = [
+    ('detect_cccd', 'best.pt', 'dir_cccd'),
+    ('detect_corners', 'best2.pt', 'dir_corners'),
+    ('detect_lines', 'best3.pt', 'dir_lines'),
+]
+
+
+def load_images(folder, count):
+    paths = sorted(
+        os.path.join(folder, f) for f in os.listdir(folder)
+        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    images = [cv2.imread(p) for p in paths]
+    images = [img for img in images if img is not None]
+    if not images:
+        return []
+    return [(f"{i}.jpg", images[i % len(images)]) for i in range(count)]
+
+
+def bench_stage(worker, model, images, batch_size):
+    # Warm-up: lần predict đầu tiên khởi tạo backend/bộ nhớ, không tính vào kết quả
+    list(worker._predict_batched(model, images[:batch_size], batch_size=batch_size))
+    start = time.perf_counter()
+    done = sum(1 for _ in worker._predict_batched(model, images, batch_size=batch_size))
+    return done, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--batch', default='1,4,8,16', help='Danh sách batch size, vd. 1,4,8,16')
+    parser.add_argument('--dir-cccd', default=os.path.join(BASE_DIR, 'datatest'))
+    parser.add_argument('--dir-corners', default=os.path.join(BASE_DIR, 'datatest'))
+    parser.add_argument('--dir-lines', default=os.path.join(BASE_DIR, 'datatest'))
+    args = parser.parse_args()
+
+    worker = DetectWorker()
+    batch_sizes = [int(x) for x in args.batch.split(',') if x.strip()]
+    for stage, weights, dir_arg in STAGES:
+        images = load_images(getattr(args, dir_arg), args.images)
+        if not images:
+            print(f"{stage}: không có ảnh trong {getattr(args, dir_arg)}")
+            continue
+        model = load_yolo(worker.base_dir, weights)  # GOQUICK_BACKEND=onnx → đo onnxruntime
+        print(f"\n{stage} ({weights}, {len(images)} ảnh)")
+        for batch_size in batch_sizes:
+            done, elapsed = bench_stage(worker, model, images, batch_size)
+            rate = done / elapsed if elapsed > 0 else 0
+            print(f"  batch={batch_size:>3}: {elapsed:7.2f}s → {rate:6.1f} ảnh/giây")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Tải ảnh Google Drive (link trong file Excel process-excel) song song, dùng chung 1 keep-alive session
+
+  - GOQUICK_DRIVE_WORKERS: số file tải song song (= số connection giữ sẵn trong pool)
+  - GOQUICK_DRIVE_RETRIES / GOQUICK_DRIVE_BACKOFF: số lần thử lại khi lỗi mạng / 429 / 5xx, chờ BACKOFF × 2^lần
+    (hoặc theo Retry-After)
+  - GOQUICK_DRIVE_TIMEOUT: timeout (giây) connect/read mỗi request
+  - GOQUICK_DRIVE_CHUNK_KB: kích thước chunk đọc response
+  - GOQUICK_DRIVE_BASE_URL: host tải file (mặc định https://drive.google.com); đổi sang server local để test/bench
+
+Usage:
+    with DriveDownloader() as downloader:
+        for name, data in downloader.iter_downloads([("1mt.png", url_mt), ("1ms.png", url_ms)]):
+            ...  # data = bytes, tải lỗi → None
+"""
+import os
+import time
+import collections
+import concurrent.futures
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DRIVE_WORKERS = int(os.getenv('GOQUICK_DRIVE_WORKERS', 8))
+DRIVE_RETRIES = int(os.getenv('GOQUICK_DRIVE_RETRIES', 3))
+DRIVE_BACKOFF = float(os.getenv('GOQUICK_DRIVE_BACKOFF', 0.5))
+DRIVE_TIMEOUT = float(os.getenv('GOQUICK_DRIVE_TIMEOUT', 30))
+DRIVE_CHUNK_SIZE = int(os.getenv('GOQUICK_DRIVE_CHUNK_KB', 1024)) * 1024
+DRIVE_BASE_URL = os.getenv('GOQUICK_DRIVE_BASE_URL', 'https://drive.google.com').rstrip('/')
+
+# Retry-After (giây) lớn hơn mức này thì chỉ chờ tối đa mức này
+DRIVE_MAX_RETRY_AFTER = 30
+# Status đáng thử lại (rate limit / lỗi tạm thời phía Drive); 403/404... → lỗi luôn
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class DriveDownloadError(Exception):
+    pass
+
+
+def extract_file_id(url: str):
+    file_id = None
+    if "drive.google.com" in url:
+        if "/file/d/" in url:
+            file_id = url.split("/file/d/")[1].split("/")[0]
+        elif "id=" in url:
+            file_id = url.split("id=")[1].split("&")[0]
+        elif "/open?id=" in url:
+            file_id = url.split("/open?id=")[1].split("&")[0]
+    return file_id
+
+
+class DriveDownloader:
+    def __init__(self, workers=DRIVE_WORKERS, retries=DRIVE_RETRIES, backoff=DRIVE_BACKOFF,
+                 timeout=DRIVE_TIMEOUT, chunk_size=DRIVE_CHUNK_SIZE, base_url=DRIVE_BASE_URL):
+        self.workers = max(1, workers)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.base_url = base_url.rstrip('/')
+        # Pool đủ connection cho mọi thread → không mở TCP/TLS mới cho từng file
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def download(self, url: str) -> bytes:
+        """
+        Tải 1 file Drive → bytes, thử lại khi lỗi mạng / 429 / 5xx.
+        NẾU thất bại → raise DriveDownloadError.
+        """
+        file_id = extract_file_id(url)
+        if not file_id:
+            raise DriveDownloadError("Không thể trích xuất ID file từ URL")
+        attempt = 0
+        while True:
+            try:
+                return self._fetch(file_id)
+            except (requests.ConnectionError, requests.Timeout, _RetryableStatus) as e:
+                if attempt >= self.retries:
+                    raise DriveDownloadError(f"{e} (đã thử {attempt + 1} lần)") from e
+                delay = self.backoff * (2 ** attempt)
+                if isinstance(e, _RetryableStatus) and e.retry_after is not None:
+                    delay = min(e.retry_after, DRIVE_MAX_RETRY_AFTER)
+                attempt += 1
+                time.sleep(delay)
+
+    def _fetch(self, file_id):
+        download_url = f"{self.base_url}/uc"
+        params = {"export": "download", "id": file_id}
+        response = self._get(download_url, params)
+        # File lớn: Drive trả cookie download_warning, phải gọi lại kèm confirm token
+        token = next((value for key, value in response.cookies.items() if key.startswith("download_warning")), None)
+        if token:
+            response.close()
+            response = self._get(download_url, dict(params, confirm=token))
+        with response:
+            buf = BytesIO()
+            for chunk in response.iter_content(self.chunk_size):
+                if chunk:
+                    buf.write(chunk)
+            return buf.getvalue()
+
+    def _get(self, url, params):
+        response = self.session.get(url, params=params, stream=True, timeout=self.timeout)
+        if response.status_code == 200:
+            return response
+        response.close()
+        if response.status_code in _RETRY_STATUS:
+            raise _RetryableStatus(response.status_code, response.headers.get('Retry-After'))
+        raise DriveDownloadError(f"Không tải được file, status {response.status_code}")
+
+    def iter_downloads(self, items):
+        """
+        Tải song song tối đa self.workers file, chỉ tải trước tối đa 2 × workers file so với chỗ đang đọc
+        → RAM không phụ thuộc số dòng Excel, tải mạng chồng lên xử lý phía sau.
+        Pool được đóng hẳn trước khi generator trả về, kể cả khi bên đọc dừng giữa chừng.
+
+        Args:
+            items: iterable (key, url)
+        Yields:
+            (key, bytes) theo đúng thứ tự items; tải lỗi → (key, None)
+        """
+        window = self.workers * 2
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="goquick-drive") as executor:
+            try:
+                for key, url in items:
+                    pending.append((key, executor.submit(self.download, url)))
+                    if len(pending) >= window:
+                        yield _download_result(*pending.popleft())
+                while pending:
+                    yield _download_result(*pending.popleft())
+            finally:
+                # Dừng giữa chừng (job bị hủy) → bỏ file chưa tải, with chỉ chờ file đang tải
+                for _, future in pending:
+                    future.cancel()
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Không tải được file, status {status_code}")
+        try:
+            self.retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            self.retry_after = None
+
+
+def _download_result(key, future):
+    try:
+        return key, future.result()
+    except Exception as e:
+        print(f"Lỗi tải {key}: {e}")
+        return key, None
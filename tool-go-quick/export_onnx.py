@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Export 4 model của go-quick sang ONNX cho GOQUICK_BACKEND=onnx (onnx_backend.py)
+
+  - best.pt / best2.pt / best3.pt → best*.onnx (ultralytics export, batch + kích thước ảnh dynamic)
+  - vgg_transformer.pth → vgg_transformer_cnn.onnx, vgg_transformer_encoder.onnx, vgg_transformer_decoder.onnx
+    + vgg_transformer_onnx.json (vocab, config dataset); decoder tách riêng để chạy greedy decode từng bước như VietOCR
+
+File ghi cạnh file weight (tool-go-quick/__pycache__). Sau khi export chạy bench_onnx.py --check để so kết quả với PyTorch.
+
+Run:
+  python tool-go-quick/export_onnx.py [--opset 17] [--only yolo|ocr]
+"""
+import os
+import sys
+import json
+import argparse
+
+_GO_QUICK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _GO_QUICK_DIR)
+
+# Export luôn đọc từ weight PyTorch, kể cả khi .env đặt GOQUICK_BACKEND=onnx
+os.environ['GOQUICK_BACKEND'] = 'torch'
+
+import onnx_backend
+from main import _ensure_torch_loaded, load_ocr
+
+BASE_DIR = os.path.join(_GO_QUICK_DIR, "__pycache__")
+# Giống vietocr.tool.translate.translate
+OCR_MAX_SEQ_LENGTH = 128
+
+
+def export_yolo(opset):
+    from ultralytics import YOLO
+
+    for weights, onnx_name in onnx_backend.YOLO_ONNX.items():
+        path = YOLO(os.path.join(BASE_DIR, weights)).export(format='onnx', imgsz=640, dynamic=True, opset=opset)
+        target = os.path.join(BASE_DIR, onnx_name)
+        if os.path.abspath(path) != target:
+            os.replace(path, target)
+        print(f"✅ {weights} → {target}")
+
+
+def export_ocr(opset):
+    torch = _ensure_torch_loaded()
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, src):
+            return self.transformer.forward_encoder(src)
+
+    class Decoder(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, tgt, memory):
+            return self.transformer.forward_decoder(tgt, memory)[0]
+
+    predictor = load_ocr(BASE_DIR)
+    model = predictor.model.eval()
+    dataset = predictor.config['dataset']
+    prefix = os.path.join(BASE_DIR, onnx_backend.OCR_ONNX_PREFIX)
+
+    img = torch.rand(2, 3, dataset['image_height'], 160)
+    tgt = torch.ones(3, 2, dtype=torch.long)
+    with torch.no_grad():
+        src = model.cnn(img)
+        memory = model.transformer.forward_encoder(src)
+        torch.onnx.export(model.cnn, (img,), f"{prefix}_cnn.onnx", opset_version=opset,
+                          input_names=['img'], output_names=['src'],
+                          dynamic_axes={'img': {0: 'batch', 3: 'width'}, 'src': {0: 'seq', 1: 'batch'}})
+        torch.onnx.export(Encoder(model.transformer), (src,), f"{prefix}_encoder.onnx", opset_version=opset,
+                          input_names=['src'], output_names=['memory'],
+                          dynamic_axes={'src': {0: 'seq', 1: 'batch'}, 'memory': {0: 'seq', 1: 'batch'}})
+        torch.onnx.export(Decoder(model.transformer), (tgt, memory), f"{prefix}_decoder.onnx", opset_version=opset,
+                          input_names=['tgt', 'memory'], output_names=['output'],
+                          dynamic_axes={'tgt': {0: 'steps', 1: 'batch'}, 'memory': {0: 'seq', 1: 'batch'},
+                                        'output': {0: 'batch', 1: 'steps'}})
+
+    meta = {'vocab': predictor.config['vocab'], 'dataset': dict(dataset), 'max_seq_length': OCR_MAX_SEQ_LENGTH}
+    with open(f"{prefix}_onnx.json", 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"✅ vgg_transformer.pth → {prefix}_{{cnn,encoder,decoder}}.onnx")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--only', choices=['yolo', 'ocr'])
+    args = parser.parse_args()
+
+    if args.only != 'ocr':
+        export_yolo(args.opset)
+    if args.only != 'yolo':
+        export_ocr(args.opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Inference server cho Go-Quick: N process giữ YOLO (best/best2/best3.pt) + VietOCR, dùng chung
+cho Quart routes và go_quick_worker
+
+Trước đây mỗi process (api_server + 10 go_quick_worker) load 1 bộ model riêng, và tối đa 10 job
+trong 1 worker cùng gọi predict trên 1 bộ model qua run_in_executor (tranh GIL, model không thread-safe).
+Ở đây:
+  - GOQUICK_INFERENCE_PROCS process inference (spawn), mỗi process 1 bộ model + torch threads riêng
+  - Client nối qua Unix socket quyền 0600 (Windows: named pipe local), request = 1 lần predict.
+    Kết nối bắt buộc có GOQUICK_INFERENCE_AUTHKEY (message là pickle → lộ key = chạy được code
+    tùy ý trong server): thiếu key thì server/client không start, run_all.py tự sinh key ngẫu nhiên
+    cho mọi process con nếu chưa set
+  - Request vào 1 queue giới hạn GOQUICK_INFERENCE_QUEUE: đầy thì server ngừng đọc socket của client
+    → client bị chặn ở predict (back-pressure) thay vì dồn ảnh vào RAM
+  - Mỗi process gom các request cùng model (từ nhiều job khác nhau) trong GOQUICK_INFERENCE_BATCH_WAIT_MS
+    thành 1 lần predict (tối đa GOQUICK_INFERENCE_BATCH ảnh)
+  - Kết quả YOLO trả về dạng rút gọn (boxes/keypoints trên CPU, mask đã đổi sang polygon) đủ cho DetectWorker
+  - Process inference chết giữa chừng → request nó đang chạy nhận lỗi ngay; server chết (mất kết nối)
+    → mọi request đang chờ của client lỗi ngay, không đợi GOQUICK_INFERENCE_TIMEOUT
+
+Run:
+  python tool-go-quick/inference_server.py     (run_all.py tự start khi GOQUICK_INFERENCE_SERVER=1)
+
+Client (api.routes.get_model_cache tự dùng khi GOQUICK_INFERENCE_SERVER=1):
+  cache = get_inference_client().model_cache()
+  cache['yolo_model1'].predict(source=[img], conf=0.5, save=False)
+  cache['vietocr_detector'].predict_batch([pil_img, ...])
+"""
+import os
+import re
+import sys
+import stat
+import time
+import queue
+import socket
+import tempfile
+import logging
+import itertools
+import threading
+import concurrent.futures
+import multiprocessing
+from multiprocessing.connection import Listener, Client, wait as wait_any
+
+logger = logging.getLogger(__name__)
+
+_GO_QUICK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _default_address():
+    if sys.platform == 'win32':
+        return r'\\.\pipe\go-quick-inference'
+    return os.path.join(tempfile.gettempdir(), f'go-quick-inference-{os.getuid()}.sock')
+
+
+# Đường dẫn Unix socket (Windows: named pipe); dạng host:port = TCP, chỉ dùng khi bắt buộc
+INFERENCE_ADDRESS = os.getenv('GOQUICK_INFERENCE_ADDRESS') or _default_address()
+INFERENCE_AUTHKEY = os.getenv('GOQUICK_INFERENCE_AUTHKEY', '').encode()
+INFERENCE_PROCS = int(os.getenv('GOQUICK_INFERENCE_PROCS', max(1, (os.cpu_count() or 2) // 2)))
+INFERENCE_QUEUE = int(os.getenv('GOQUICK_INFERENCE_QUEUE', INFERENCE_PROCS * 8))
+INFERENCE_BATCH = int(os.getenv('GOQUICK_INFERENCE_BATCH', 16))  # ảnh tối đa / lần predict
+INFERENCE_BATCH_WAIT = float(os.getenv('GOQUICK_INFERENCE_BATCH_WAIT_MS', 5)) / 1000
+INFERENCE_TIMEOUT = int(os.getenv('GOQUICK_INFERENCE_TIMEOUT', 300))  # giây / request
+# Client chờ server sẵn sàng (server load model xong mới mở socket)
+INFERENCE_CONNECT_WAIT = int(os.getenv('GOQUICK_INFERENCE_CONNECT_WAIT', 120))
+# Đã kết nối rồi mà mất kết nối (server chết) → chỉ thử kết nối lại trong N giây rồi báo lỗi
+INFERENCE_RECONNECT_WAIT = int(os.getenv('GOQUICK_INFERENCE_RECONNECT_WAIT', 5))
+
+YOLO_WEIGHTS = {
+    'yolo_model1': 'best.pt',
+    'yolo_model2': 'best2.pt',
+    'yolo_model3': 'best3.pt',
+}
+OCR_MODEL = 'vietocr_detector'
+
+
+def _parse_address(address):
+    """host:port → (host, port) cho TCP, còn lại là đường dẫn Unix socket / named pipe"""
+    if re.fullmatch(r'[^/\\]*:\d+', address):
+        host, _, port = address.rpartition(':')
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+def _format_address(address):
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else address
+
+
+def _require_authkey(authkey):
+    if not authkey:
+        raise RuntimeError("Chưa set GOQUICK_INFERENCE_AUTHKEY (chạy qua run_all.py để tự sinh key, "
+                           "hoặc set cùng 1 giá trị ngẫu nhiên cho server và mọi worker)")
+    return authkey
+
+
+# ----------------------------------------------------------------------
+# Kết quả YOLO rút gọn (pickle qua socket)
+# ----------------------------------------------------------------------
+
+class MaskPolygons:
+    """Thay cho ultralytics Masks: chỉ giữ polygon (.xy) thay vì mask full-size"""
+
+    def __init__(self, xy):
+        self.xy = xy
+
+    def __len__(self):
+        return len(self.xy)
+
+
+class InferenceResult:
+    """Phần của ultralytics Results mà DetectWorker dùng: boxes, keypoints, masks"""
+
+    def __init__(self, boxes=None, keypoints=None, masks=None):
+        self.boxes = boxes
+        self.keypoints = keypoints
+        self.masks = masks
+
+    @classmethod
+    def from_result(cls, r):
+        r = r.cpu()
+        masks = MaskPolygons(list(r.masks.xy)) if r.masks is not None else None
+        return cls(boxes=r.boxes, keypoints=r.keypoints, masks=masks)
+
+
+# ----------------------------------------------------------------------
+# Process inference
+# ----------------------------------------------------------------------
+
+def _load_models():
+    """Load YOLO + VietOCR cho 1 process inference (đã warm-up)"""
+    if _GO_QUICK_DIR not in sys.path:
+        sys.path.insert(0, _GO_QUICK_DIR)
+    from main import INFERENCE_BACKEND, _ensure_torch_loaded, load_yolo, load_ocr, warm_up_models
+    threads = int(os.getenv('GOQUICK_INFERENCE_THREADS', max(1, (os.cpu_count() or 2) // INFERENCE_PROCS)))
+    if INFERENCE_BACKEND == 'torch':
+        _ensure_torch_loaded().set_num_threads(threads)
+        threads = None
+
+    base_dir = os.path.join(_GO_QUICK_DIR, "__pycache__")
+    # onnx: số thread chia theo process truyền thẳng vào session onnxruntime
+    models = {key: load_yolo(base_dir, weights, threads) for key, weights in YOLO_WEIGHTS.items()}
+    models[OCR_MODEL] = load_ocr(base_dir, threads)
+    seconds = warm_up_models(models)
+    logger.info(f"Inference process warm-up {seconds:.2f}s")
+    return models
+
+
+def _model_info(models):
+    """Thông tin client cần để giả lập model: names của YOLO, config dataset của VietOCR"""
+    info = {key: {'names': dict(models[key].names)} for key in YOLO_WEIGHTS}
+    info[OCR_MODEL] = {'config': {'dataset': dict(models[OCR_MODEL].config['dataset'])}}
+    return info
+
+
+def _run_batch(models, batch):
+    """batch: list (conn_id, req_id, model_key, items, options) cùng model → list (conn_id, req_id, ok, payload)"""
+    model_key, options = batch[0][2], batch[0][4]
+    items = [item for req in batch for item in req[3]]
+    try:
+        if model_key == OCR_MODEL:
+            outputs = models[OCR_MODEL].predict_batch(items)
+        else:
+            results = models[model_key].predict(source=items, save=False, **options)
+            outputs = [InferenceResult.from_result(r) for r in results]
+    except Exception as e:
+        if len(batch) == 1:
+            return [(batch[0][0], batch[0][1], False, str(e))]
+        # Lỗi cả batch gộp → chạy lại từng request để chỉ request lỗi nhận lỗi
+        replies = []
+        for req in batch:
+            replies.extend(_run_batch(models, [req]))
+        return replies
+    replies = []
+    start = 0
+    for conn_id, req_id, _, req_items, _ in batch:
+        replies.append((conn_id, req_id, True, outputs[start:start + len(req_items)]))
+        start += len(req_items)
+    return replies
+
+
+def _worker_main(index, requests, conn, load_models=_load_models):
+    """
+    Vòng lặp của 1 process inference: lấy request, gom thêm request cùng model, predict, trả kết quả
+
+    Mọi message về server đi qua pipe riêng của process (send đồng bộ, không qua feeder thread):
+    process chết thì server đọc được tới đúng message cuối rồi EOF.
+    """
+    logging.basicConfig(level=logging.INFO)
+    try:
+        models = load_models()
+    except Exception as e:
+        conn.send(('failed', index, str(e)))
+        return
+    conn.send(('ready', index, _model_info(models)))
+
+    held = None
+    stopping = False
+    while not stopping:
+        req = held if held is not None else requests.get()
+        held = None
+        if req is None:
+            return
+        batch = [req]
+        count = len(req[3])
+        deadline = time.monotonic() + INFERENCE_BATCH_WAIT
+        while count < INFERENCE_BATCH:
+            try:
+                nxt = requests.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if nxt is None:
+                stopping = True
+                break
+            if nxt[2] != req[2] or nxt[4] != req[4]:
+                # Khác model/options → để dành cho vòng sau
+                held = nxt
+                break
+            batch.append(nxt)
+            count += len(nxt[3])
+        # Server giữ danh sách request đang chạy của process này để báo lỗi ngay nếu process chết
+        conn.send(('start', index, [(r[0], r[1]) for r in batch]))
+        for reply in _run_batch(models, batch):
+            conn.send(reply)
+        conn.send(('idle', index, None))
+
+
+class InferenceServer:
+    """Listener local socket + N process inference"""
+
+    def __init__(self, address=INFERENCE_ADDRESS, authkey=INFERENCE_AUTHKEY, procs=INFERENCE_PROCS,
+                 queue_size=INFERENCE_QUEUE, load_models=_load_models):
+        self.address = _parse_address(address)
+        self.authkey = _require_authkey(authkey)
+        self.load_models = load_models
+        self.procs = max(1, procs)
+        self.queue_size = max(1, queue_size)
+        self._ctx = multiprocessing.get_context('spawn')
+        self.requests = self._ctx.Queue(maxsize=self.queue_size)
+        self.workers = {}
+        self.model_info = None
+        self._pipes = {}  # index process → đầu đọc pipe kết quả (chỉ thread dispatch đụng sau khi ready)
+        self._inflight = {}  # index process → [(conn_id, req_id)] của batch đang chạy
+        self._conns = {}  # conn_id → (conn, send_lock)
+        self._conns_lock = threading.Lock()
+        self._conn_ids = itertools.count(1)
+        self._listener = None
+        self._stopped = threading.Event()
+
+    def _start_worker(self, index):
+        reader, writer = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(target=_worker_main, args=(index, self.requests, writer, self.load_models),
+                                 name=f'go-quick-inference-{index}', daemon=True)
+        proc.start()
+        # Chỉ process con giữ đầu ghi → process chết là reader nhận EOF
+        writer.close()
+        self.workers[index] = proc
+        self._pipes[index] = reader
+        return proc
+
+    def _wait_ready(self):
+        """Chờ mọi process load model xong; trả về model_info"""
+        ready = 0
+        info = None
+        while ready < self.procs:
+            for index, reader in list(self._pipes.items()):
+                if not reader.poll(0.1):
+                    continue
+                try:
+                    message = reader.recv()
+                except EOFError:
+                    message = ('failed', index, f"exit {self.workers[index].exitcode}")
+                if message[0] == 'ready':
+                    ready += 1
+                    info = message[2]
+                    logger.info(f"✅ Inference process {index} sẵn sàng ({ready}/{self.procs})")
+                elif message[0] == 'failed':
+                    raise RuntimeError(f"Inference process {index} không load được model: {message[2]}")
+        return info
+
+    def _reply(self, conn_id, req_id, ok, payload):
+        with self._conns_lock:
+            entry = self._conns.get(conn_id)
+        if entry is None:
+            return  # Client đã ngắt kết nối
+        conn, send_lock = entry
+        try:
+            with send_lock:
+                conn.send((req_id, ok, payload))
+        except Exception as e:
+            logger.warning(f"Không gửi được kết quả cho client {conn_id}: {e}")
+
+    def _worker_died(self, index):
+        """Process inference chết (OOM, crash) → báo lỗi ngay request nó đang chạy và start lại"""
+        proc = self.workers[index]
+        proc.join(timeout=5)
+        self._pipes.pop(index).close()
+        for conn_id, req_id in self._inflight.pop(index, []):
+            self._reply(conn_id, req_id, False, f"Inference process {index} đã dừng giữa chừng (exit {proc.exitcode})")
+        if not self._stopped.is_set():
+            logger.warning(f"⚠️ Inference process {index} đã dừng (exit {proc.exitcode}), đang start lại...")
+            self._start_worker(index)
+
+    def _dispatch(self):
+        """Trả kết quả từ các process về đúng client"""
+        while not self._stopped.is_set():
+            readers = {reader: index for index, reader in self._pipes.items()}
+            for reader in wait_any(list(readers), timeout=1):
+                index = readers[reader]
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    self._worker_died(index)
+                    continue
+                kind = message[0]
+                if kind in ('ready', 'failed'):
+                    # Process được start lại sau khi chết
+                    logger.info(f"Inference process {index}: {kind}")
+                elif kind == 'start':
+                    self._inflight[index] = message[2]
+                elif kind == 'idle':
+                    self._inflight.pop(index, None)
+                else:
+                    self._reply(*message)
+
+    def _listen(self):
+        """Mở listener; Unix socket được tạo với quyền 0600 (chỉ user chạy server kết nối được)"""
+        if isinstance(self.address, tuple):
+            logger.warning("⚠️ Inference server nghe trên TCP: mọi user trên máy có authkey đều kết nối được")
+            return Listener(self.address, authkey=self.authkey)
+        if sys.platform == 'win32':
+            return Listener(self.address, family='AF_PIPE', authkey=self.authkey)
+        try:
+            # Socket cũ còn sót (server trước bị kill) → xóa; chỉ xóa nếu đúng là socket
+            if stat.S_ISSOCK(os.lstat(self.address).st_mode):
+                os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+        old_umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.address, 0o600)
+        return listener
+
+    def _serve_client(self, conn_id, conn):
+        try:
+            conn.send(('hello', self.model_info))
+            while not self._stopped.is_set():
+                req_id, model_key, items, options = conn.recv()
+                # Queue đầy → block ở đây, không đọc thêm request của client này (back-pressure)
+                self.requests.put((conn_id, req_id, model_key, items, options or {}))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.warning(f"Client {conn_id} lỗi: {e}")
+        finally:
+            with self._conns_lock:
+                self._conns.pop(conn_id, None)
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def serve_forever(self):
+        logger.info(f"🔄 Đang start {self.procs} inference process...")
+        for index in range(self.procs):
+            self._start_worker(index)
+        self.model_info = self._wait_ready()
+        threading.Thread(target=self._dispatch, name='inference-dispatch', daemon=True).start()
+
+        listener = self._listener = self._listen()
+        logger.info(f"✅ Go-Quick inference server: {_format_address(self.address)} | "
+                    f"{self.procs} process, queue {self.queue_size}, batch {INFERENCE_BATCH}")
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    if self._stopped.is_set():
+                        break
+                    # Sai authkey cũng rơi vào đây (AuthenticationError)
+                    logger.warning(f"Lỗi accept client: {e}")
+                    continue
+                conn_id = next(self._conn_ids)
+                with self._conns_lock:
+                    self._conns[conn_id] = (conn, threading.Lock())
+                threading.Thread(target=self._serve_client, args=(conn_id, conn),
+                                 name=f'inference-client-{conn_id}', daemon=True).start()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+        # Ngắt kết nối client (shutdown đánh thức cả thread đang recv) → client báo lỗi ngay request đang chờ
+        with self._conns_lock:
+            conns, self._conns = list(self._conns.values()), {}
+        for conn, _ in conns:
+            try:
+                with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        for _ in self.workers:
+            try:
+                self.requests.put(None, timeout=1)
+            except Exception:
+                pass
+        for proc in self.workers.values():
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+
+
+# ----------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------
+
+class InferenceClient:
+    """1 kết nối tới inference server, dùng chung cho mọi thread/job trong process"""
+
+    def __init__(self, address=INFERENCE_ADDRESS, authkey=INFERENCE_AUTHKEY, timeout=INFERENCE_TIMEOUT):
+        self.address = _parse_address(address)
+        self.authkey = _require_authkey(authkey)
+        self.timeout = timeout
+        self.model_info = None
+        self._conn = None
+        self._connected_once = False
+        self._lock = threading.Lock()  # connect + send
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def connect(self, wait=INFERENCE_CONNECT_WAIT):
+        """Kết nối (chờ tối đa wait giây nếu server đang load model; kết nối lại sau khi mất thì chờ ngắn)"""
+        with self._lock:
+            if self._conn is not None:
+                return
+            if self._connected_once:
+                wait = min(wait, INFERENCE_RECONNECT_WAIT)
+            deadline = time.monotonic() + wait
+            while True:
+                try:
+                    conn = Client(self.address, authkey=self.authkey)
+                    break
+                except (ConnectionRefusedError, FileNotFoundError, OSError):
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(1)
+            _, self.model_info = conn.recv()
+            self._conn = conn
+            self._connected_once = True
+            threading.Thread(target=self._read, args=(conn,), name='inference-client-reader', daemon=True).start()
+            logger.info(f"✅ Đã kết nối inference server {_format_address(self.address)}")
+
+    def _read(self, conn):
+        try:
+            while True:
+                req_id, ok, payload = conn.recv()
+                with self._pending_lock:
+                    future = self._pending.pop(req_id, None)
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(Exception(f"Inference server: {payload}"))
+        except (EOFError, OSError) as e:
+            logger.warning(f"⚠️ Mất kết nối inference server: {e}")
+        finally:
+            with self._lock:
+                if self._conn is conn:
+                    self._conn = None
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(Exception("Mất kết nối inference server"))
+
+    def call(self, model_key, items, options=None):
+        """Gửi 1 request predict (block tới khi có kết quả) → list output theo thứ tự items"""
+        items = list(items)
+        if not items:
+            return []
+        self.connect()
+        req_id = next(self._ids)
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            self._pending[req_id] = future
+        try:
+            with self._lock:
+                if self._conn is None:
+                    raise Exception("Mất kết nối inference server")
+                self._conn.send((req_id, model_key, items, options))
+            return future.result(timeout=self.timeout)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
+
+    def model_cache(self):
+        """Dict cùng format với api.routes._model_cache, model là proxy gọi qua server"""
+        self.connect()
+        cache = {key: RemoteYOLO(self, key, self.model_info[key]['names']) for key in YOLO_WEIGHTS}
+        cache[OCR_MODEL] = RemoteOCR(self, self.model_info[OCR_MODEL]['config'])
+        return cache
+
+
+class RemoteYOLO:
+    """Thay cho ultralytics YOLO trong DetectWorker: predict(source=[ảnh...]) → InferenceResult"""
+
+    def __init__(self, client, key, names):
+        self.client = client
+        self.key = key
+        self.names = names
+
+    def predict(self, source, conf=0.5, save=False, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        return self.client.call(self.key, images, {'conf': conf})
+
+
+class RemoteOCR:
+    """Thay cho VietOCR Predictor: predict / predict_batch trên ảnh PIL"""
+
+    def __init__(self, client, config):
+        self.client = client
+        self.config = config
+
+    def predict_batch(self, images):
+        return self.client.call(OCR_MODEL, images)
+
+    def predict(self, image):
+        return self.client.call(OCR_MODEL, [image])[0]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """InferenceClient dùng chung của process (lazy init)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient()
+    return _client
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    server = InferenceServer()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    # Chạy qua module "inference_server" (không phải __main__) để InferenceResult/_worker_main
+    # được pickle với đúng tên module mà process con và client import được
+    if _GO_QUICK_DIR not in sys.path:
+        sys.path.insert(0, _GO_QUICK_DIR)
+    import inference_server
+    inference_server.main()
@@ -1,5 +1,4 @@
 import sys
-from ultralytics import YOLO
 import cv2
 import numpy as np
 import os
@@ -12,12 +11,25 @@ from PIL import Image
 from io import BytesIO
 import zipfile
 import base64
-import requests
 from requests import get
 import subprocess
 import sys
 import uuid
+import queue
 import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Module cùng thư mục import được cả khi main.py được load bằng importlib (api.routes)
+_GO_QUICK_DIR = os.path.dirname(os.path.abspath(__file__))
+if _GO_QUICK_DIR not in sys.path:
+    sys.path.insert(0, _GO_QUICK_DIR)
+import pdf_pages
+import drive_download
+import result_cache
+import onnx_backend
 
 # Lazy-load torch (Windows DLL safety: prevent loading until needed)
 _torch_loaded = False
@@ -35,9 +47,92 @@ def _ensure_torch_loaded():
         return torch
     return __import__('torch')
 
+# torch = ultralytics YOLO + VietOCR Predictor (file .pt/.pth);
+# onnx = onnxruntime với file .onnx tạo bằng export_onnx.py (không import torch, xem onnx_backend.py)
+INFERENCE_BACKEND = os.getenv('GOQUICK_BACKEND', 'torch').lower()
+# Thư mục weight đã qua onnx_backend.require_parity (bench_onnx.py --check pass với đúng file hiện tại)
+_onnx_parity_ok = set()
+
+
+def _require_onnx_parity(base_dir):
+    if base_dir not in _onnx_parity_ok:
+        onnx_backend.require_parity(base_dir)
+        _onnx_parity_ok.add(base_dir)
+
+
+def load_yolo(base_dir, weights, threads=None):
+    """Load 1 model YOLO theo GOQUICK_BACKEND; weights là tên file .pt (best.pt / best2.pt / best3.pt)"""
+    if INFERENCE_BACKEND == 'onnx':
+        _require_onnx_parity(base_dir)
+        return onnx_backend.OnnxYOLO(os.path.join(base_dir, onnx_backend.YOLO_ONNX[weights]), threads)
+    _ensure_torch_loaded()
+    from ultralytics import YOLO
+    return YOLO(os.path.join(base_dir, weights))
+
+
+def load_ocr(base_dir, threads=None):
+    """Load VietOCR (vgg_transformer) theo GOQUICK_BACKEND"""
+    if INFERENCE_BACKEND == 'onnx':
+        _require_onnx_parity(base_dir)
+        return onnx_backend.OnnxOCR(base_dir, threads)
+    _ensure_torch_loaded()
+    from vietocr.tool.predictor import Predictor
+    from vietocr.tool.config import Cfg
+
+    config = Cfg.load_config_from_name('vgg_transformer')
+    config['weights'] = os.path.join(base_dir, 'vgg_transformer.pth')
+    config['cnn']['pretrained'] = False
+    config['device'] = 'cpu'
+    return Predictor(config)
+
 # vietocr must be in requirements.txt - do not auto-install at module level
 # (REMOVED: auto pip-install that could cause subprocess DLL conflicts)
 
+# Số ảnh mỗi lần gọi YOLO predict (CPU-only: 4; GPU có thể tăng 8-16)
+YOLO_BATCH_SIZE = int(os.getenv('GOQUICK_YOLO_BATCH', 4))
+# Số crop mỗi lần VietOCR predict_batch
+OCR_BATCH_SIZE = int(os.getenv('GOQUICK_OCR_BATCH', 16))
+# 1 = ghi ảnh từng stage (md1..md4, temp_rs) ra work_dir và giữ lại sau khi chạy để debug;
+# mặc định DetectWorker.run chuyển ảnh/OCR giữa các stage trong RAM
+DEBUG_DUMP = os.getenv('GOQUICK_DEBUG_DUMP', '0') == '1'
+# 1 = DetectWorker.run chạy 4 stage chồng lên nhau theo từng ảnh (run_pipeline);
+# 0 = chạy tuần tự từng stage trên toàn bộ ảnh như cũ
+PIPELINE_ENABLED = os.getenv('GOQUICK_PIPELINE', '1') == '1'
+# Số ảnh tối đa chờ giữa 2 stage liền nhau của pipeline (giới hạn RAM)
+PIPELINE_QUEUE_SIZE = int(os.getenv('GOQUICK_PIPELINE_QUEUE', 8))
+# Đánh dấu hết input trong queue của pipeline
+_PIPELINE_END = object()
+_cache_bypass_warned = False
+
+def _warn_result_cache_bypassed():
+    """result_cache chỉ được tra/lưu trong run_pipeline: GOQUICK_PIPELINE=0 thì cảnh báo (1 lần) là cache không dùng"""
+    global _cache_bypass_warned
+    if result_cache.RESULT_CACHE_ENABLED and not _cache_bypass_warned:
+        _cache_bypass_warned = True
+        logger.warning("⚠️ GOQUICK_RESULT_CACHE=1 nhưng GOQUICK_PIPELINE=0: chạy tuần tự không dùng result cache")
+
+def warm_up_models(models):
+    """
+    Chạy 1 lần inference giả qua từng model (3 YOLO với batch GOQUICK_YOLO_BATCH ảnh đen,
+    VietOCR với GOQUICK_OCR_BATCH crop trắng) để khởi tạo kernel/bộ nhớ trước job đầu tiên.
+
+    Args:
+        models: dict cùng format api.routes._model_cache (yolo_model1..3, vietocr_detector)
+    Returns:
+        số giây warm-up
+    """
+    start = time.perf_counter()
+    image = np.zeros((640, 640, 3), dtype=np.uint8)
+    for key in ('yolo_model1', 'yolo_model2', 'yolo_model3'):
+        model = models.get(key)
+        if model is not None:
+            model.predict(source=[image] * max(1, YOLO_BATCH_SIZE), conf=0.5, save=False, verbose=False)
+    detector = models.get('vietocr_detector')
+    if detector is not None:
+        crop = Image.new('RGB', (128, 32), (255, 255, 255))
+        detector.predict_batch([crop] * max(1, OCR_BATCH_SIZE))
+    return time.perf_counter() - start
+
 def count_files( folderPath):
         """ Đếm số file trong thư mục """
         return len([f for f in os.listdir(folderPath) if os.path.isfile(os.path.join(folderPath, f))])
@@ -45,7 +140,8 @@ import shutil
 
 class DetectWorker():
     def __init__(self,input_path:str = None,type_:int = 0, cached_models=None, job_id=None, total_cccd=0):
-        _ensure_torch_loaded()  # Lazy-load torch DLL on first use (Windows DLL safety)
+        if INFERENCE_BACKEND == 'torch':
+            _ensure_torch_loaded()  # Lazy-load torch DLL on first use (Windows DLL safety)
         super().__init__()
         self.path_img = input_path
         self.path_rs = None
@@ -66,25 +162,29 @@ class DetectWorker():
         # Tạo unique session ID cho mỗi request để tránh conflict khi chạy đồng thời
         self.session_id = str(uuid.uuid4())[:8]
         self.work_dir = os.path.join(self.base_dir, f"work_{self.session_id}")
+        # Output từng stage giữ trong RAM: {stage: {tên file: ảnh BGR}} (md1 → md2 → md3)
+        self.stage_images = {'md1': {}, 'md2': {}, 'md3': {}}
+        # [(tên crop, text)] của OCR, collect_cus_info dùng trực tiếp thay vì đọc ocr_results.txt
+        self.ocr_data = None
         
-        # Import is_job_cancelled function
-        self.is_job_cancelled_func = None
+        # Cancellation token: flag local do pub/sub set, fallback Redis theo chu kỳ
+        self.cancel_token = None
         if self.job_id:
             try:
                 import sys
                 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
                 if project_root not in sys.path:
                     sys.path.insert(0, project_root)
-                from shared.redis_client import is_job_cancelled
-                self.is_job_cancelled_func = is_job_cancelled
+                from shared.cancellation import get_cancellation_token
+                self.cancel_token = get_cancellation_token(self.job_id)
             except Exception as e:
                 pass
     
     def check_cancellation(self):
         """Check if job has been cancelled. Raise exception if cancelled."""
-        if self.job_id and self.is_job_cancelled_func:
+        if self.job_id and self.cancel_token:
             try:
-                if self.is_job_cancelled_func(self.job_id):
+                if self.cancel_token.is_cancelled():
                     raise Exception("Job đã bị hủy")
             except Exception as e:
                 if "đã bị hủy" in str(e):
@@ -92,13 +192,354 @@ class DetectWorker():
                 # Ignore other errors (Redis connection issues, etc.)
                 pass
         
-    def init_temp_dirs(self):
+    def _iter_image_files(self, img_paths):
+        """Đọc lần lượt ảnh trên disk → (path, ảnh BGR)"""
+        for img_path in img_paths:
+            yield img_path, cv2.imread(img_path)
+
+    def _predict_batched(self, model, images, batch_size=None):
+        """
+        Chạy YOLO theo batch (list ảnh numpy) thay vì gọi predict cho từng file.
+
+        Args:
+            images: iterable (key, ảnh BGR); chỉ batch_size ảnh được giữ trong bộ nhớ cùng lúc
+            batch_size: mặc định YOLO_BATCH_SIZE (GOQUICK_YOLO_BATCH)
+        Yields:
+            (key, ảnh BGR, result) đúng thứ tự images; ảnh không đọc được bị bỏ qua
+        """
+        batch_size = max(1, batch_size or YOLO_BATCH_SIZE)
+        batch = []
+        for key, img in images:
+            if img is None:
+                print(f"⚠️ Không đọc được ảnh: {key}")
+                continue
+            batch.append((key, img))
+            if len(batch) >= batch_size:
+                yield from self._predict_batch(model, batch)
+                batch = []
+        if batch:
+            yield from self._predict_batch(model, batch)
+
+    def _predict_batch(self, model, batch):
+        results = model.predict(source=[img for _, img in batch], conf=0.5, save=False)
+        for (key, img), r in zip(batch, results):
+            yield key, img, r
+
+    def _ocr_batched(self, detector, images, batch_size=None):
+        """
+        OCR nhiều crop bằng VietOCR predict_batch.
+
+        Crop được sắp theo chiều rộng sau resize (VietOCR chỉ gom được các ảnh cùng chiều rộng
+        vào 1 tensor) rồi chia batch, nên mỗi batch gần như là 1 lần forward.
+
+        Args:
+            images: list đường dẫn ảnh, PIL Image hoặc ảnh BGR (numpy, output trong RAM của detect_lines)
+            batch_size: mặc định OCR_BATCH_SIZE (GOQUICK_OCR_BATCH)
+        Yields:
+            (index, text) theo từng batch xong; index là vị trí trong images
+        """
+        from PIL import Image
+
+        batch_size = max(1, batch_size or OCR_BATCH_SIZE)
+        dataset = detector.config['dataset']
+
+        def open_image(src):
+            if isinstance(src, str):
+                return Image.open(src)
+            if isinstance(src, np.ndarray):
+                return Image.fromarray(cv2.cvtColor(src, cv2.COLOR_BGR2RGB))
+            return src
+
+        def image_size(src):
+            if isinstance(src, np.ndarray):
+                return src.shape[1], src.shape[0]
+            if isinstance(src, str):
+                with Image.open(src) as img:
+                    return img.size
+            return src.size
+
+        def ocr_width(src):
+            w, h = image_size(src)
+            return onnx_backend.ocr_resize(w, h, dataset['image_height'], dataset['image_min_width'], dataset['image_max_width'])[0]
+
+        order = sorted(range(len(images)), key=lambda idx: ocr_width(images[idx]))
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            batch = [open_image(images[idx]) for idx in indexes]
+            try:
+                texts = detector.predict_batch(batch)
+            except Exception as e:
+                # Lỗi cả batch → OCR lại từng crop để chỉ mất crop lỗi
+                print(f"⚠️ OCR batch lỗi ({e}), chạy lại từng ảnh")
+                texts = []
+                for idx, img in zip(indexes, batch):
+                    try:
+                        texts.append(detector.predict(img))
+                    except Exception as ex:
+                        print(f"Error processing OCR for {images[idx]}: {ex}")
+                        texts.append("")
+            for idx, img, text in zip(indexes, batch, texts):
+                if img is not images[idx]:
+                    img.close()
+                yield idx, text.strip()
+
+    def _put_image(self, stage, name, img):
+        """Lưu output của 1 stage vào RAM (ghi thêm ra work_dir nếu GOQUICK_DEBUG_DUMP=1)"""
+        if img is None or img.size == 0:
+            return
+        self.stage_images[stage][name] = img
+        if DEBUG_DUMP:
+            folder = {'md1': self.work_md1, 'md2': self.work_md2, 'md3': self.work_md3}[stage]
+            cv2.imwrite(os.path.join(folder, name), img)
+
+    def _take_images(self, stage):
+        """Lấy (và giải phóng) toàn bộ ảnh của 1 stage → list (tên file, ảnh BGR)"""
+        images = list(self.stage_images[stage].items())
+        self.stage_images[stage] = {}
+        return images
+
+    def _dump_debug(self, path, img):
+        """Ảnh chỉ dùng để xem lại (boxed_*, temp_rs) → chỉ ghi khi GOQUICK_DEBUG_DUMP=1"""
+        if DEBUG_DUMP:
+            cv2.imwrite(path, img)
+
+    @staticmethod
+    def _split_cccd_name(file_name):
+        """'1mt.jpg' → ('1', 'mt'); tên không có mt/ms → (tên, 'unknown')"""
+        file_name_no_ext = os.path.splitext(os.path.basename(file_name))[0]
+        if file_name_no_ext.lower().endswith('mt'):
+            return file_name_no_ext[:-2], 'mt'
+        if file_name_no_ext.lower().endswith('ms'):
+            return file_name_no_ext[:-2], 'ms'
+        return file_name_no_ext, 'unknown'
+
+    @staticmethod
+    def _order_points(pts):
+        rect = np.zeros((4, 2), dtype="float32")
+
+        s = pts.sum(axis=1)
+        diff = np.diff(pts, axis=1)
+
+        rect[0] = pts[np.argmin(s)]     # top-left
+        rect[2] = pts[np.argmax(s)]     # bottom-right
+        rect[1] = pts[np.argmin(diff)]  # top-right
+        rect[3] = pts[np.argmax(diff)]  # bottom-left
+
+        return rect
+
+    def _crop_card(self, file_name, image_bgr, r):
+        """
+        Stage 1 cho 1 ảnh: cắt + nắn phẳng CCCD theo 4 keypoint của best.pt.
+
+        Returns:
+            (ảnh cho md1, đạt): (None, False) nếu không thấy đủ 4 góc;
+            ảnh gốc có chữ "Không đạt" + False nếu độ tin cậy < 75%
+        """
+        if len(r.keypoints) == 0:
+            return None, False
+        kpts = r.keypoints.xy[0].cpu().numpy()  # (4, 2)
+        if kpts.shape[0] != 4:
+            return None, False
+
+        # ==== TÍNH ĐỘ CHÍNH XÁC ====
+        conf = r.keypoints.conf[0].cpu().numpy()
+        avg_conf = np.mean(conf) * 100  # %
+
+        if avg_conf < 75:
+            # VẼ CHỮ GIỮA ẢNH: "Không đạt"
+            h, w = image_bgr.shape[:2]
+            text = f"Không đạt ({avg_conf:.1f}%)"
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            scale = 1.2
+            thickness = 3
+            text_size = cv2.getTextSize(text, font, scale, thickness)[0]
+            text_x = (w - text_size[0]) // 2
+            text_y = (h + text_size[1]) // 2
+            cv2.putText(image_bgr, text, (text_x, text_y), font, scale, (0, 0, 255), thickness)
+            return image_bgr, False
+
+        # ==== Tiếp tục xử lý ảnh đạt yêu cầu ====
+        pts = kpts.astype(np.float32)
+        ordered_pts = self._order_points(pts)
+
+        # Vẽ khung và độ chính xác lên ảnh
+        text = f"Conf: {avg_conf:.1f}%"
+        text_org = (int(ordered_pts[0][0]), int(ordered_pts[0][1]) - 10)
+        cv2.putText(image_bgr, text, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+        (tl, tr, br, bl) = ordered_pts
+        widthA = np.linalg.norm(br - bl)
+        widthB = np.linalg.norm(tr - tl)
+        maxWidth = int(max(widthA, widthB))
+        heightA = np.linalg.norm(tr - br)
+        heightB = np.linalg.norm(tl - bl)
+        maxHeight = int(max(heightA, heightB))
+
+        dst = np.array([
+            [0, 0],
+            [maxWidth - 1, 0],
+            [maxWidth - 1, maxHeight - 1],
+            [0, maxHeight - 1]
+        ], dtype="float32")
+        M = cv2.getPerspectiveTransform(ordered_pts, dst)
+        warped = cv2.warpPerspective(image_bgr, M, (maxWidth, maxHeight))
+        cv2.polylines(image_bgr, [ordered_pts.astype(np.int32)], isClosed=True, color=(0, 255, 0), thickness=2)
+
+        self._dump_debug(os.path.join(self.work_dir, "md1", f"boxed_{file_name}.jpg"), image_bgr)
+        return warped, True
+
+    def _align_card(self, img, r):
+        """Stage 2 cho 1 ảnh: xoay CCCD nằm ngang theo quoc_huy→qr hoặc chip→m_red (best2.pt)"""
+        centers = {}
+        for box in r.boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
+            cls = int(box.cls[0].cpu().item())
+            name = self.model2.names[cls]
+            cx = int((x1 + x2) / 2)
+            cy = int((y1 + y2) / 2)
+            centers[name] = (cx, cy)
+
+        if 'quoc_huy' in centers and 'qr' in centers:
+            ptA, ptB = centers['quoc_huy'], centers['qr']
+        elif 'chip' in centers and 'm_red' in centers:
+            ptA, ptB = centers['chip'], centers['m_red']
+        else:
+            return img  # Giữ nguyên gốc
+
+        dx, dy = ptB[0] - ptA[0], ptB[1] - ptA[1]
+        angle = math.degrees(math.atan2(dy, dx))
+        rotate_angle = -angle   # CHUẨN: Luôn lấy -angle để vector nằm ngang
+        if abs(rotate_angle) < 10:
+            return img  # Giữ nguyên gốc
+        h, w = img.shape[:2]
+        center_img = (w // 2, h // 2)
+        M = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
+
+        cos = abs(M[0, 0])
+        sin = abs(M[0, 1])
+        new_w = int(h * sin + w * cos)
+        new_h = int(h * cos + w * sin)
+        M[0, 2] += (new_w / 2) - center_img[0]
+        M[1, 2] += (new_h / 2) - center_img[1]
+        def transform(pt):
+            x, y = pt
+            new_x = M[0,0]*x + M[0,1]*y + M[0,2]
+            new_y = M[1,0]*x + M[1,1]*y + M[1,2]
+            return (new_x, new_y)
+
+        ptA_new = transform(ptA)
+        ptB_new = transform(ptB)
+
+        # Nếu vector AB sau xoay mà B bên trái A → thêm 180°
+        if ptB_new[0] < ptA_new[0]:
+            rotate_angle += 180
+
+        # Tính lại ma trận FINAL duy nhất
+        M_final = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
+        cos = abs(M_final[0, 0])
+        sin = abs(M_final[0, 1])
+        new_w = int(h * sin + w * cos)
+        new_h = int(h * cos + w * sin)
+        M_final[0, 2] += (new_w / 2) - center_img[0]
+        M_final[1, 2] += (new_h / 2) - center_img[1]
+
+        return cv2.warpAffine(
+            img,
+            M_final,
+            (new_w, new_h),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(255, 255, 255)
+        )
+
+    def _crop_fields(self, img_name, image_bgr, r):
+        """
+        Stage 3 cho 1 ảnh: cắt từng field (id, name, sn, ...) theo mask của best3.pt.
+
+        Returns:
+            list (tên crop "{tên ảnh}-{field}.jpg", ảnh crop); [] nếu không có mask
+        """
+        crops = []
+        if r.masks is None or len(r.masks.xy) == 0:
+            return crops
+
+        image_clean = image_bgr.copy()
+        file_name = os.path.splitext(os.path.basename(img_name))[0]
+        for j, polygon in enumerate(r.masks.xy):
+            points = polygon.astype(int)
+            if points.shape[0] < 4:
+                continue
+            pts = points.reshape((-1, 1, 2))
+            cv2.polylines(image_bgr, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
+            class_id = int(r.boxes.cls[j]) if r.boxes is not None else 0
+            conf = float(r.boxes.conf[j]) if r.boxes is not None else 0.0
+            class_name = self.model3.names[class_id] if hasattr(self.model3, 'names') else str(class_id)
+            label_text = f"{class_name} {conf:.2f}"
+
+            # Vẽ label trên ảnh đã vẽ
+            x, y = points[0]
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            font_scale = 0.5
+            thickness = 1
+            text_size, _ = cv2.getTextSize(label_text, font, font_scale, thickness)
+            text_w, text_h = text_size
+
+            cv2.rectangle(image_bgr, (x, y - text_h - 4), (x + text_w, y), (0, 255, 0), -1)
+            cv2.putText(image_bgr, label_text, (x, y - 2), font, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+            # === CROP đúng từ ảnh gốc ===
+            mask = np.zeros(image_clean.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [pts], 255)
+
+            masked = cv2.bitwise_and(image_clean, image_clean, mask=mask)
+
+            x, y, w, h = cv2.boundingRect(pts)
+            crop = masked[y:y+h, x:x+w]
+            if crop.size == 0:
+                continue
+
+            # === Tên file crop: tên gốc + tên label ===
+            crops.append((f"{file_name.replace('.jpg','')}-{class_name}.jpg", crop))
+        original_ext = os.path.splitext(os.path.basename(img_name))[1] or '.jpg'
+        boxed_name = os.path.join(self.work_dir, "md3", "detected_results", f"boxed_{file_name}{original_ext}")
+        self._dump_debug(boxed_name, image_bgr)
+        return crops
+
+    def _get_ocr_detector(self):
+        """VietOCR Predictor: lấy từ model cache, chưa có thì load (và lưu lại vào cache)"""
+        if self.vietocr_detector is not None:
+            return self.vietocr_detector
+        if self.cached_models and self.cached_models.get('vietocr_detector'):
+            self.vietocr_detector = self.cached_models['vietocr_detector']
+            return self.vietocr_detector
+
+        detector = load_ocr(self.base_dir)
+        if self.cached_models:
+            self.cached_models['vietocr_detector'] = detector
+        self.vietocr_detector = detector
+        return detector
+
+    @staticmethod
+    def _normalize_ocr_text(text):
+        """Dòng nơi cấp OCR lỗi vặt → chuẩn hóa về tên cơ quan đầy đủ"""
+        text_ki = [
+            "CỤC", "TRƯỞNG", "CỤC", "CẢNH", "SÁT",
+            "QUẢN", "LÝ", "HÀNH", "CHÍNH", "VỀ",
+            "TRẬT", "TỰ", "XÃ", "HỘI"
+        ]
+        if len(text) > 14 and text.isupper() and any(word in text for word in text_ki):
+            return "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
+        return text
+
+    def init_temp_dirs(self, create=True):
         """Create temporary directories với unique session ID"""
         self.work_md1 = os.path.join(self.work_dir, "md1", "cropped_results")
         self.work_md2 = os.path.join(self.work_dir, "md2", "detect_results")
         self.work_md3 = os.path.join(self.work_dir, "md3", "detected_results", "crops")
         self.work_md4 = os.path.join(self.work_dir, "md4")
         self.work_temp_rs = os.path.join(self.work_dir, "temp_rs")
+        if not create:
+            return
         
         os.makedirs(self.work_md1, exist_ok=True)
         os.makedirs(self.work_md2, exist_ok=True)
@@ -116,7 +557,8 @@ class DetectWorker():
     
     def run(self):
         try:
-            self.init_temp_dirs()
+            # Pipeline chạy trong RAM, chỉ tạo thư mục khi cần dump debug
+            self.init_temp_dirs(create=DEBUG_DUMP)
             
             if self.type_ == 1:
                 if self.cached_models:
@@ -126,11 +568,27 @@ class DetectWorker():
                     self.vietocr_detector = self.cached_models.get('vietocr_detector')
                 
                 if self.model1 is None:
-                    self.model1 = YOLO(os.path.join(self.base_dir, "best.pt"))
+                    self.model1 = load_yolo(self.base_dir, "best.pt")
                 if self.model2 is None:
-                    self.model2 = YOLO(os.path.join(self.base_dir, "best2.pt"))
+                    self.model2 = load_yolo(self.base_dir, "best2.pt")
                 if self.model3 is None:
-                    self.model3 = YOLO(os.path.join(self.base_dir, "best3.pt"))
+                    self.model3 = load_yolo(self.base_dir, "best3.pt")
+                
+                if PIPELINE_ENABLED:
+                    return self.run_pipeline()
+                _warn_result_cache_bypassed()
+                
+                # Chạy tuần tự chỉ nhận zip/thư mục ảnh → PDF/Excel phải đổi sang zip PNG trước
+                if pdf_pages.is_pdf(self.path_img):
+                    converted = self.pdf_to_png(self.path_img)
+                    if converted.get("status") != "success":
+                        return converted
+                    self.path_img = base64.b64decode(converted["zip_base64"])
+                elif self._as_excel_bytes(self.path_img) is not None:
+                    converted = self.excel_to_png(self.path_img)
+                    if converted.get("status") != "success":
+                        return converted
+                    self.path_img = base64.b64decode(converted["zip_base64"])
                 
                 self.detect_cccd()
                 self.detect_corners()
@@ -144,7 +602,10 @@ class DetectWorker():
                 results = self.excel_to_png(self.path_img)
                 return results
         finally:
-            self.cleanup_temp_dirs()
+            if not DEBUG_DUMP:
+                self.cleanup_temp_dirs()
+            else:
+                print(f"🐞 GOQUICK_DEBUG_DUMP=1: giữ lại {self.work_dir}")
             try:
                 import gc
                 if not self.cached_models:
@@ -160,6 +621,296 @@ class DetectWorker():
                     pass
             except:
                 pass
+    # ------------------------------------------------------------------
+    # Pipeline: detect cccd → corners → lines → OCR chồng lên nhau theo từng ảnh
+    # ------------------------------------------------------------------
+
+    def _open_input_images(self):
+        """
+        Returns:
+            (danh sách tên ảnh, hàm tên ảnh → generator (tên, ảnh BGR)) cho input PDF, Excel link Drive,
+            zip (bytes/base64) hoặc thư mục. PDF được render thẳng ra numpy từng trang (không qua PNG/ZIP),
+            ảnh Drive được tải song song và decode ngay khi tải xong (không qua ZIP)
+        """
+        if pdf_pages.is_pdf(self.path_img):
+            pdf_bytes = base64.b64decode(self.path_img) if isinstance(self.path_img, str) else bytes(self.path_img)
+            return pdf_pages.page_names(pdf_bytes), lambda names: pdf_pages.iter_pdf_pages(pdf_bytes, names)
+        excel_bytes = self._as_excel_bytes(self.path_img)
+        if excel_bytes is not None:
+            return self._open_excel_images(excel_bytes)
+        if isinstance(self.path_img, bytes) or (isinstance(self.path_img, str) and self.path_img.startswith('UEsDB')):  # base64 zip detection
+            zip_bytes = base64.b64decode(self.path_img) if isinstance(self.path_img, str) else self.path_img
+            zf = zipfile.ZipFile(BytesIO(zip_bytes), "r")
+            img_files = [f for f in zf.namelist() if f.lower().endswith(('.jpg', '.png', '.jpeg'))]
+
+            def read_images(names):
+                with zf:
+                    for f in names:
+                        yield f, cv2.imdecode(np.frombuffer(zf.read(f), np.uint8), cv2.IMREAD_COLOR)
+            return img_files, read_images
+        img_files = [os.path.join(self.path_img, f)
+                     for f in os.listdir(self.path_img)
+                     if f.lower().endswith(('.jpg', '.png', '.jpeg'))]
+        return img_files, self._iter_image_files
+
+    @staticmethod
+    def _pipeline_put(q, item, stop):
+        """put có kiểm tra stop: queue đầy mà pipeline đã dừng thì bỏ item (False)"""
+        while True:
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                if stop.is_set():
+                    return False
+
+    @staticmethod
+    def _pipeline_get(q, stop):
+        """get có kiểm tra stop: pipeline đã dừng mà queue rỗng → _PIPELINE_END"""
+        while True:
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                if stop.is_set():
+                    return _PIPELINE_END
+
+    def _pipeline_take(self, inbox, stop, limit):
+        """
+        Lấy 1 item (chờ) + các item đang có sẵn trong inbox, tối đa limit, không đợi cho đủ.
+
+        Returns:
+            (list item, đã gặp _PIPELINE_END)
+        """
+        item = self._pipeline_get(inbox, stop)
+        if item is _PIPELINE_END:
+            return [], True
+        batch = [item]
+        while len(batch) < limit:
+            try:
+                item = inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is _PIPELINE_END:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _pipeline_thread(self, name, target, outbox, stop, errors, *args):
+        """Chạy 1 stage trên thread riêng; lỗi → dừng cả pipeline, luôn báo _PIPELINE_END cho stage sau"""
+        def run():
+            try:
+                target(*args, outbox, stop)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                errors.append(e)
+                stop.set()
+            finally:
+                self._pipeline_put(outbox, _PIPELINE_END, stop)
+        thread = threading.Thread(target=run, name=f"goquick-{name}-{self.session_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def _pipeline_read(self, images, outbox, stop):
+        """
+        Stage 0: đọc/decode ảnh input → (tên, ảnh BGR | None).
+
+        Ảnh đã có trong result_cache: rows vào self._cached_rows, chỉ chuyển (tên, None) qua các stage YOLO;
+        ảnh chưa có: giữ digest trong self._image_digests để stage OCR lưu kết quả vào cache
+        """
+        for name, img in images:
+            if img is not None and result_cache.RESULT_CACHE_ENABLED:
+                digest = result_cache.image_digest(img)
+                rows = result_cache.get(digest)
+                if rows is not None:
+                    self._cached_rows[name] = rows
+                    img = None
+                else:
+                    self._image_digests[name] = digest
+            if stop.is_set() or not self._pipeline_put(outbox, (name, img), stop):
+                return
+
+    def _pipeline_yolo(self, model, process, inbox, outbox, stop):
+        """
+        Stage YOLO: gom ảnh đang chờ trong inbox thành batch (≤ YOLO_BATCH_SIZE) → predict →
+        process(tên, ảnh, result) → outbox.
+
+        Ảnh đã bị loại ở stage trước (None) vẫn được chuyển tiếp để stage OCR biết ảnh đó đã xong.
+        """
+        ended = False
+        while not ended and not stop.is_set():
+            batch, ended = self._pipeline_take(inbox, stop, max(1, YOLO_BATCH_SIZE))
+            outputs = [None] * len(batch)
+            ready = [(i, img) for i, (_, img) in enumerate(batch) if img is not None]
+            if ready:
+                for i, img, r in self._predict_batch(model, ready):
+                    outputs[i] = process(batch[i][0], img, r)
+            for (name, _), output in zip(batch, outputs):
+                if not self._pipeline_put(outbox, (name, output), stop):
+                    return
+
+    def _pipeline_cache_rows(self, batch, image_rows):
+        """
+        Stage OCR: ảnh trúng cache → image_rows lấy từ cache (gắn lại tên ảnh hiện tại vào tên crop);
+        ảnh vừa OCR xong → lưu [(field, text)] vào result_cache (trừ [] khi không tìm thấy CCCD)
+        """
+        for img_file, _ in batch:
+            goc_name = os.path.splitext(os.path.basename(img_file))[0]
+            if img_file in self._cached_rows:
+                image_rows[img_file] = [(f"{goc_name}-{field}", text) for field, text in self._cached_rows[img_file]]
+            elif img_file in self._image_digests:
+                rows = [(crop_name[len(goc_name) + 1:], text) for crop_name, text in image_rows.get(img_file, [])]
+                result_cache.put(self._image_digests[img_file], rows)
+
+    def run_pipeline(self, progress_callback=None):
+        """
+        Chạy 4 stage dưới dạng pipeline: mỗi stage 1 thread, nối bằng queue giới hạn
+        PIPELINE_QUEUE_SIZE ảnh, nên ảnh đầu đã tới OCR khi ảnh sau còn đang detect.
+        YOLO/VietOCR (torch) và OpenCV nhả GIL khi tính nên các thread chạy song song thực sự.
+        Ảnh đã OCR trước đó (result_cache, theo nội dung ảnh) bỏ qua YOLO/OCR, lấy luôn kết quả cũ.
+
+        Mỗi CCCD (đủ mt + ms) OCR xong → publish progress kèm customer của CCCD đó
+        (và gọi progress_callback(processed_cccd, total_cccd, customers) nếu có),
+        kết quả cuối giống detect_cccd → detect_corners → detect_lines → collect_cus_info.
+        """
+        print("1-4.Pipeline detect cccd → corners → lines → OCR")
+        try:
+            img_files, read_images = self._open_input_images()
+        except Exception as e:
+            # Input hỏng (Excel thiếu cột, PDF/zip lỗi...) → trả message cho client như khi chạy tuần tự
+            logger.error(f"❌ Không đọc được input: {e}")
+            return {"status": "error", "message": str(e)}
+
+        # Gom ảnh theo CCCD (mt/ms liền nhau) để CCCD đầu tiên xong sớm nhất,
+        # vẫn giữ thứ tự CCCD theo lần xuất hiện đầu tiên như khi chạy tuần tự
+        card_images = {}  # {base_name: [tên ảnh]}
+        for img_file in img_files:
+            base_name, _ = self._split_cccd_name(img_file)
+            card_images.setdefault(base_name, []).append(img_file)
+        img_files = [img_file for names in card_images.values() for img_file in names]
+
+        self.total_cccd = len(card_images)
+        if self.total_cccd == 0:
+            print("Không có ảnh nào.")
+            return self._build_customers([])
+
+        publish_progress_func = None
+        if self.job_id:
+            try:
+                import sys
+                project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                if project_root not in sys.path:
+                    sys.path.insert(0, project_root)
+                from shared.redis_client import publish_progress
+                from shared.job_store import set_job_state
+
+                set_job_state(self.job_id, total_cccd=self.total_cccd)
+                publish_progress(self.job_id, 0, f"Bắt đầu xử lý... (0/{self.total_cccd} CCCD - 0%)",
+                                 total_cccd=self.total_cccd, processed_cccd=0)
+                publish_progress_func = publish_progress
+            except Exception as e:
+                print(f"⚠️ Không thể import publish_progress: {e}")
+
+        def crop_card(img_file, img, r):
+            file_name = os.path.splitext(os.path.basename(img_file))[0]
+            card, _ = self._crop_card(file_name, img, r)
+            if card is not None and card.size > 0:
+                self._dump_debug(os.path.join(self.work_md1, f"{file_name}.jpg"), card)
+                return card
+            return None
+
+        def align_card(img_file, img, r):
+            rotated = self._align_card(img, r)
+            file_name = os.path.splitext(os.path.basename(img_file))[0]
+            self._dump_debug(os.path.join(self.work_md2, f"{file_name}.jpg"), rotated)
+            return rotated
+
+        def crop_fields(img_file, img, r):
+            crops = self._crop_fields(img_file, img, r)
+            for crop_name, crop in crops:
+                self._dump_debug(os.path.join(self.work_md3, crop_name), crop)
+            return crops
+
+        detector = self._get_ocr_detector()
+        self._cached_rows = {}  # {tên ảnh: [(field, text)]} lấy từ result_cache
+        self._image_digests = {}  # {tên ảnh: digest} của ảnh chưa có trong cache
+        stop = threading.Event()
+        errors = []
+        q_images, q_cards, q_aligned, q_fields = (queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE)) for _ in range(4))
+        threads = [
+            self._pipeline_thread('read', self._pipeline_read, q_images, stop, errors, read_images(img_files)),
+            self._pipeline_thread('cccd', self._pipeline_yolo, q_cards, stop, errors, self.model1, crop_card, q_images),
+            self._pipeline_thread('corners', self._pipeline_yolo, q_aligned, stop, errors, self.model2, align_card, q_cards),
+            self._pipeline_thread('lines', self._pipeline_yolo, q_fields, stop, errors, self.model3, crop_fields, q_aligned),
+        ]
+
+        # Stage OCR chạy trên thread gọi run(): gom crop của các ảnh đang chờ → predict_batch
+        image_rows = {}  # {tên ảnh: [(tên crop, text)]}
+        pending = {base_name: len(names) for base_name, names in card_images.items()}
+        processed_cccd = 0
+        try:
+            ended = False
+            while not ended:
+                batch, ended = self._pipeline_take(q_fields, stop, max(1, OCR_BATCH_SIZE))
+                if not batch:
+                    continue
+                try:
+                    self.check_cancellation()
+                except Exception as e:
+                    if "đã bị hủy" in str(e):
+                        print(f"⚠️ Job {self.job_id} đã bị hủy, dừng xử lý")
+                        break
+                    raise
+
+                crops = [(img_file, crop_name, crop) for img_file, fields in batch for crop_name, crop in (fields or [])]
+                texts = [""] * len(crops)
+                for idx, text in self._ocr_batched(detector, [crop for _, _, crop in crops]):
+                    texts[idx] = text
+                for (img_file, crop_name, _), text in zip(crops, texts):
+                    image_rows.setdefault(img_file, []).append((os.path.splitext(crop_name)[0], self._normalize_ocr_text(text)))
+                self._pipeline_cache_rows(batch, image_rows)
+
+                for img_file, _ in batch:
+                    base_name, _ = self._split_cccd_name(img_file)
+                    pending[base_name] -= 1
+                    if pending[base_name] > 0:
+                        continue
+                    processed_cccd += 1
+                    percent = min(99, int(processed_cccd * 99 / self.total_cccd))
+                    if publish_progress_func or progress_callback:
+                        rows = [row for name in card_images[base_name] for row in image_rows.get(name, [])]
+                        card_customers = [c for c in self._parse_customers(rows) if any(c.values())]
+                    if publish_progress_func:
+                        message = f"Đang xử lý CCCD... ({processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
+                        publish_progress_func(self.job_id, percent, message, data={"customer": card_customers},
+                                              total_cccd=self.total_cccd, processed_cccd=processed_cccd)
+                    if progress_callback:
+                        progress_callback(processed_cccd, self.total_cccd, card_customers)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=30)
+        if errors:
+            raise errors[0]
+        if self._cached_rows:
+            print(f"♻️ {len(self._cached_rows)}/{len(img_files)} ảnh lấy kết quả từ result cache")
+
+        ocr_data = [row for img_file in img_files for row in image_rows.get(img_file, [])]
+        self.ocr_data = ocr_data
+        if DEBUG_DUMP:
+            with open(os.path.join(self.work_md4, 'ocr_results.txt'), 'w', encoding='utf-8') as f_out:
+                for crop_name, text in ocr_data:
+                    f_out.write(f"{crop_name}.jpg\t{text}\n")
+            for img_file in img_files:
+                goc_name = os.path.splitext(os.path.basename(img_file))[0]
+                infos = []
+                for crop_name, text in image_rows.get(img_file, []):
+                    label = crop_name.split('-')[1]
+                    infos.append((label, "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI" if label == "noi_cap" else text))
+                if infos:
+                    self._draw_ocr_result(goc_name, infos, self.work_md2, self.work_temp_rs)
+        return self.collect_cus_info()
+
     def pdf_to_png(self, pdf_bytes_input):
         """
         Convert PDF bytes to PNG images
@@ -175,31 +926,19 @@ class DetectWorker():
             else:
                 pdf_bytes = pdf_bytes_input
             
-            # Read PDF from bytes
-            pdf_stream = BytesIO(pdf_bytes)
-            doc = fitz.open(stream=pdf_stream, filetype="pdf")
             output_zip = BytesIO()
             total_images = 0
             
             with zipfile.ZipFile(output_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf_out:
-                for i, page in enumerate(doc):
-                    try:
-                        pix = page.get_pixmap()
-                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                        
-                        pair_num = (i // 2) + 1
-                        side = "mt" if i % 2 == 0 else "ms"
-                        img_name = f"{pair_num}{side}.png"
-                        
-                        img_buf = BytesIO()
-                        img.save(img_buf, format="PNG")
-                        img_buf.seek(0)
-                        
-                        zf_out.writestr(img_name, img_buf.getvalue())
-                        total_images += 1
-                    except Exception as e:
-                        print(f"Lỗi xử lý trang {i}: {e}")
+                for img_name, img in pdf_pages.iter_pdf_pages(pdf_bytes, pdf_pages.page_names(pdf_bytes)):
+                    if img is None:
                         continue
+                    ok, buf = cv2.imencode(".png", img)
+                    if not ok:
+                        print(f"Lỗi encode {img_name}")
+                        continue
+                    zf_out.writestr(img_name, buf.tobytes())
+                    total_images += 1
             
             output_zip.seek(0)
             result_bytes = output_zip.getvalue()
@@ -222,13 +961,36 @@ class DetectWorker():
                 "status": "error",
                 "message": f"Lỗi khi xử lý PDF bytes: {e}"
             }
-    def excel_to_png(self, excel_bytes_input):
+    @staticmethod
+    def _as_excel_bytes(data):
+        """bytes file Excel (xlsx/xls) nếu input (bytes/base64) là Excel, ngược lại None"""
+        if isinstance(data, str):
+            # base64 của "PK" (xlsx) / OLE2 (xls); chuỗi khác (vd. đường dẫn thư mục) không phải Excel
+            if not data.startswith(('UEsDB', '0M8R4')):
+                return None
+            try:
+                raw = base64.b64decode(data)
+            except Exception:
+                return None
+        elif isinstance(data, (bytes, bytearray)):
+            raw = bytes(data)
+        else:
+            return None
+        if raw[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1':  # xls (OLE2)
+            return raw
+        if raw[:2] != b'PK':
+            return None
+        try:
+            with zipfile.ZipFile(BytesIO(raw)) as zf:
+                return raw if 'xl/workbook.xml' in zf.namelist() else None
+        except zipfile.BadZipFile:
+            return None
+
+    @staticmethod
+    def _read_excel_rows(excel_bytes_input):
         """
-        Download images from Excel bytes (Google Drive URLs)
-        Args:
-            excel_bytes_input: bytes hoặc str base64 của file Excel
-        Returns:
-            dict: status, message, total_rows, total_images, zip_base64
+        Đọc 3 cột đầu (file_name, mt_url, ms_url) của file Excel, bỏ các hàng trắng.
+        NẾU lỗi → raise ValueError(message trả về cho client).
         """
         try:
             # Convert base64 string to bytes if needed
@@ -236,23 +998,16 @@ class DetectWorker():
                 excel_bytes = base64.b64decode(excel_bytes_input)
             else:
                 excel_bytes = excel_bytes_input
-            
+
             # Read Excel from bytes
             excel_stream = BytesIO(excel_bytes)
             df = pd.read_excel(excel_stream, header=0)  # hàng đầu là header
         except Exception as e:
-            return {
-                "status": "error",
-                "message": f"Lỗi đọc file Excel bytes: {e}"
-            }
+            raise ValueError(f"Lỗi đọc file Excel bytes: {e}")
 
         if df.shape[1] < 3:
-            return {
-                "status": "error",
-                "message": "File Excel cần ít nhất 3 cột: file_name, mt_url, ms_url."
-            }
+            raise ValueError("File Excel cần ít nhất 3 cột: file_name, mt_url, ms_url.")
 
-        # Lấy 3 cột đầu, bỏ các hàng trắng
         df_sub = df.iloc[:, :3].fillna("")
         lines_excel = []
         for _, row in df_sub.iterrows():
@@ -263,82 +1018,62 @@ class DetectWorker():
                 lines_excel.append((file_name, mt_url, ms_url))
 
         if not lines_excel:
+            raise ValueError("Không có dữ liệu hợp lệ trong file Excel.")
+        return lines_excel
+
+    @staticmethod
+    def _excel_row_images(file_name, mt_url, ms_url):
+        """1 dòng Excel → [(tên ảnh, url)]: '{file_name}mt.png' / '{file_name}ms.png'; dòng không có tên → []"""
+        file_name = file_name.strip()
+        if not file_name:
+            return []
+        return [(f"{file_name}{side}.png", url) for side, url in (("mt", mt_url), ("ms", ms_url)) if url]
+
+    def _open_excel_images(self, excel_bytes):
+        """_open_input_images cho Excel: ảnh Drive tải song song (DriveDownloader) → decode → pipeline"""
+        lines_excel = self._read_excel_rows(excel_bytes)
+        items = [item for line in lines_excel for item in self._excel_row_images(*line)]
+
+        def read_images(names):
+            urls = dict(items)
+            with drive_download.DriveDownloader() as downloader:
+                for name, data in downloader.iter_downloads((name, urls[name]) for name in names):
+                    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+                    if data and img is None:
+                        print(f"Lỗi decode ảnh {name}")
+                    yield name, img
+        return [name for name, _ in items], read_images
+
+    def excel_to_png(self, excel_bytes_input):
+        """
+        Download images from Excel bytes (Google Drive URLs)
+        Args:
+            excel_bytes_input: bytes hoặc str base64 của file Excel
+        Returns:
+            dict: status, message, total_rows, total_images, zip_base64
+        """
+        try:
+            lines_excel = self._read_excel_rows(excel_bytes_input)
+        except ValueError as e:
             return {
                 "status": "error",
-                "message": "Không có dữ liệu hợp lệ trong file Excel."
+                "message": str(e)
             }
 
-        # --- Hàm phụ xử lý Google Drive URL ---
-        def extract_file_id(url: str):
-            file_id = None
-            if "drive.google.com" in url:
-                if "/file/d/" in url:
-                    file_id = url.split("/file/d/")[1].split("/")[0]
-                elif "id=" in url:
-                    file_id = url.split("id=")[1].split("&")[0]
-                elif "/open?id=" in url:
-                    file_id = url.split("/open?id=")[1].split("&")[0]
-            return file_id
-
-        def download_from_drive(url: str) -> bytes:
-            """
-            Tải file từ Google Drive, trả về bytes.
-            NẾU thất bại → raise Exception.
-            """
-            file_id = extract_file_id(url)
-            if not file_id:
-                raise Exception("Không thể trích xuất ID file từ URL")
-            download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-            session = requests.Session()
-            response = session.get(download_url, stream=True)
-            if response.status_code != 200:
-                raise Exception(f"Không tải được file, status {response.status_code}")
-            # xử lý token confirm nếu có
-            for key, value in response.cookies.items():
-                if key.startswith("download_warning"):
-                    token = value
-                    params = {"id": file_id, "confirm": token}
-                    response = session.get(download_url, params=params, stream=True)
-                    break
-            if response.status_code != 200:
-                raise Exception(f"Không tải được file (sau khi confirm), status {response.status_code}")
-
-            buf = BytesIO()
-            for chunk in response.iter_content(1024):
-                if chunk:
-                    buf.write(chunk)
-            return buf.getvalue()
         mem_zip = BytesIO()
         total_images = 0
 
         try:
-            count_lines = len(lines_excel)
-            with zipfile.ZipFile(mem_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                for index,(file_name, mt_url, ms_url) in enumerate(lines_excel,start=1):
-                    file_name = file_name.strip()
-                    if not file_name:
-                        continue
-                    print(f"[{index}|{count_lines}]Xử lý: {file_name}")
-                    # tải mặt trước
-                    if mt_url:
-                        try:
-                            mt_bytes = download_from_drive(mt_url)
-                            mt_name = f"{file_name}mt.png"
-                            zf.writestr(mt_name, mt_bytes)
-                            total_images += 1
-                        except Exception as e:
-                            # log lỗi, nhưng không dừng toàn bộ
-                            print(f"Lỗi tải mặt trước {file_name}: {e}")
-
-                    # tải mặt sau
-                    if ms_url:
-                        try:
-                            ms_bytes = download_from_drive(ms_url)
-                            ms_name = f"{file_name}ms.png"
-                            zf.writestr(ms_name, ms_bytes)
-                            total_images += 1
-                        except Exception as e:
-                            print(f"Lỗi tải mặt sau {file_name}: {e}")
+            items = [item for line in lines_excel for item in self._excel_row_images(*line)]
+            count_images = len(items)
+            with zipfile.ZipFile(mem_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf, \
+                    drive_download.DriveDownloader() as downloader:
+                for index, (img_name, img_bytes) in enumerate(downloader.iter_downloads(items), start=1):
+                    print(f"[{index}|{count_images}]Tải: {img_name}")
+                    # ảnh lỗi đã được log, không dừng toàn bộ
+                    if img_bytes is not None:
+                        zf.writestr(img_name, img_bytes)
+                        total_images += 1
 
             mem_zip.seek(0)
             zip_bytes = mem_zip.getvalue()
@@ -505,18 +1240,6 @@ class DetectWorker():
         return info_list
     def detect_cccd(self):
         print("1.Detect cccd")
-        def order_points(pts):
-            rect = np.zeros((4, 2), dtype="float32")
-
-            s = pts.sum(axis=1)
-            diff = np.diff(pts, axis=1)
-
-            rect[0] = pts[np.argmin(s)]     # top-left
-            rect[2] = pts[np.argmax(s)]     # bottom-right
-            rect[1] = pts[np.argmin(diff)]  # top-right
-            rect[3] = pts[np.argmax(diff)]  # bottom-left
-
-            return rect
         
         # Handle bytes input (zip or raw bytes with images)
         if isinstance(self.path_img, bytes) or (isinstance(self.path_img, str) and self.path_img.startswith('UEsDB')):  # base64 zip detection
@@ -567,17 +1290,10 @@ class DetectWorker():
                             if project_root not in sys.path:
                                 sys.path.insert(0, project_root)
                             from shared.redis_client import publish_progress
+                            from shared.job_store import set_job_state
                             
                             # Lưu vào Redis
-                            import redis
-                            redis_client = redis.Redis(
-                                host=os.getenv('REDIS_HOST', '127.0.0.1'),
-                                port=int(os.getenv('REDIS_PORT', 6379)),
-                                db=int(os.getenv('REDIS_DB', 0)),
-                                password=os.getenv('REDIS_PASSWORD', None),
-                                decode_responses=False
-                            )
-                            redis_client.set(f"job:{self.job_id}:total_cccd", str(self.total_cccd))
+                            set_job_state(self.job_id, total_cccd=self.total_cccd)
                             
                             # Publish progress với format 0/total_cccd và 0%
                             publish_progress(self.job_id, 0, f"Bắt đầu xử lý... (0/{self.total_cccd} CCCD - 0%)", 
@@ -604,7 +1320,8 @@ class DetectWorker():
                         except Exception as e:
                             pass
                     
-                    for i, img_file in enumerate(img_files):
+                    zip_images = ((f, cv2.imdecode(np.frombuffer(zf.read(f), np.uint8), cv2.IMREAD_COLOR)) for f in img_files)
+                    for i, (img_file, img_array, r) in enumerate(self._predict_batched(self.model1, zip_images)):
                         # Check cancellation trước khi xử lý mỗi ảnh
                         try:
                             self.check_cancellation()
@@ -613,68 +1330,13 @@ class DetectWorker():
                                 return
                             raise
                         
-                        img_data = zf.read(img_file)
-                        img_stream = BytesIO(img_data)
-                        img_array = cv2.imdecode(np.frombuffer(img_stream.getvalue(), np.uint8), cv2.IMREAD_COLOR)
-                        
-                        results = self.model1.predict(source=img_array, conf=0.5, save=False)
-                        r = results[0]
-                        
-                        if len(r.keypoints) == 0:
-                            continue
-                        
                         file_name = os.path.splitext(os.path.basename(img_file))[0]
-                        image_bgr = img_array
-                        kpts = r.keypoints.xy[0].cpu().numpy()
-                        
-                        if kpts.shape[0] != 4:
-                            continue
-                        
-                        # Rest of detection logic...
-                        conf = r.keypoints.conf[0].cpu().numpy()
-                        avg_conf = np.mean(conf) * 100
-                        
-                        if avg_conf < 75:
-                            h, w = image_bgr.shape[:2]
-                            text = f"Không đạt ({avg_conf:.1f}%)"
-                            font = cv2.FONT_HERSHEY_SIMPLEX
-                            scale = 1.2
-                            thickness = 3
-                            text_size = cv2.getTextSize(text, font, scale, thickness)[0]
-                            text_x = (w - text_size[0]) // 2
-                            text_y = (h + text_size[1]) // 2
-                            cv2.putText(image_bgr, text, (text_x, text_y), font, scale, (0, 0, 255), thickness)
-                            cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), image_bgr)
+                        card, ok = self._crop_card(file_name, img_array, r)
+                        if card is not None:
+                            self._put_image('md1', f"{file_name}.jpg", card)
+                        if not ok:
                             continue
                         
-                        pts = kpts.astype(np.float32)
-                        ordered_pts = order_points(pts)
-                        
-                        text = f"Conf: {avg_conf:.1f}%"
-                        text_org = (int(ordered_pts[0][0]), int(ordered_pts[0][1]) - 10)
-                        cv2.putText(image_bgr, text, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                        
-                        (tl, tr, br, bl) = ordered_pts
-                        widthA = np.linalg.norm(br - bl)
-                        widthB = np.linalg.norm(tr - tl)
-                        maxWidth = int(max(widthA, widthB))
-                        heightA = np.linalg.norm(tr - br)
-                        heightB = np.linalg.norm(tl - bl)
-                        maxHeight = int(max(heightA, heightB))
-                        
-                        dst = np.array([
-                            [0, 0],
-                            [maxWidth - 1, 0],
-                            [maxWidth - 1, maxHeight - 1],
-                            [0, maxHeight - 1]
-                        ], dtype="float32")
-                        M = cv2.getPerspectiveTransform(ordered_pts, dst)
-                        warped = cv2.warpPerspective(image_bgr, M, (maxWidth, maxHeight))
-                        cv2.polylines(image_bgr, [ordered_pts.astype(np.int32)], isClosed=True, color=(0, 255, 0), thickness=2)
-                        
-                        cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), warped)
-                        cv2.imwrite(os.path.join(self.work_dir, "md1", f"boxed_{file_name}.jpg"), image_bgr)
-                        
                         # Track CCCD đã xử lý (extract base_name)
                         file_name_no_ext = os.path.splitext(os.path.basename(img_file))[0]
                         if file_name_no_ext.lower().endswith('mt'):
@@ -738,17 +1400,10 @@ class DetectWorker():
                     if project_root not in sys.path:
                         sys.path.insert(0, project_root)
                     from shared.redis_client import publish_progress
+                    from shared.job_store import set_job_state
                     
                     # Lưu vào Redis
-                    import redis
-                    redis_client = redis.Redis(
-                        host=os.getenv('REDIS_HOST', '127.0.0.1'),
-                        port=int(os.getenv('REDIS_PORT', 6379)),
-                        db=int(os.getenv('REDIS_DB', 0)),
-                        password=os.getenv('REDIS_PASSWORD', None),
-                        decode_responses=False
-                    )
-                    redis_client.set(f"job:{self.job_id}:total_cccd", str(self.total_cccd))
+                    set_job_state(self.job_id, total_cccd=self.total_cccd)
                     
                             # Publish progress với format 0/total_cccd và 0%
                     publish_progress(self.job_id, 0, f"Bắt đầu xử lý... (0/{self.total_cccd} CCCD - 0%)", 
@@ -775,7 +1430,7 @@ class DetectWorker():
                 except Exception as e:
                     pass
             
-            for i, img_path in enumerate(img_files):
+            for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model1, self._iter_image_files(img_files))):
                 # Check cancellation trước khi xử lý mỗi ảnh
                 try:
                     self.check_cancellation()
@@ -784,66 +1439,12 @@ class DetectWorker():
                         return
                     raise
                 
-                results = self.model1.predict(source=img_path, conf=0.5, save=False)
-                r = results[0]
-                if len(r.keypoints) == 0:
+                file_name = os.path.splitext(os.path.basename(img_path))[0]
+                card, ok = self._crop_card(file_name, img_array, r)
+                if card is not None:
+                    self._put_image('md1', f"{file_name}.jpg", card)
+                if not ok:
                     continue
-                image_bgr = cv2.imread(r.path)
-                file_name = os.path.basename(r.path)
-                file_name = os.path.splitext(file_name)[0] 
-                kpts = r.keypoints.xy[0].cpu().numpy()  # (4, 2)
-                if kpts.shape[0] != 4:
-                    continue  
-
-                # ==== TÍNH ĐỘ CHÍNH XÁC ====
-                conf = r.keypoints.conf[0].cpu().numpy()
-                avg_conf = np.mean(conf) * 100  # %
-
-                if avg_conf < 75:
-                    # VẼ CHỮ GIỮA ẢNH: "Không đạt"
-                    h, w = image_bgr.shape[:2]
-                    text = f"Không đạt ({avg_conf:.1f}%)"
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    scale = 1.2
-                    thickness = 3
-                    text_size = cv2.getTextSize(text, font, scale, thickness)[0]
-                    text_x = (w - text_size[0]) // 2
-                    text_y = (h + text_size[1]) // 2
-                    cv2.putText(image_bgr, text, (text_x, text_y), font, scale, (0, 0, 255), thickness)
-
-                    # Lưu ảnh không đạt
-                    cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), image_bgr)
-                    continue
-
-                # ==== Tiếp tục xử lý ảnh đạt yêu cầu ====
-                pts = kpts.astype(np.float32)
-                ordered_pts = order_points(pts)
-
-                # Vẽ khung và độ chính xác lên ảnh
-                text = f"Conf: {avg_conf:.1f}%"
-                text_org = (int(ordered_pts[0][0]), int(ordered_pts[0][1]) - 10)
-                cv2.putText(image_bgr, text, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-                (tl, tr, br, bl) = ordered_pts
-                widthA = np.linalg.norm(br - bl)
-                widthB = np.linalg.norm(tr - tl)
-                maxWidth = int(max(widthA, widthB))
-                heightA = np.linalg.norm(tr - br)
-                heightB = np.linalg.norm(tl - bl)
-                maxHeight = int(max(heightA, heightB))
-
-                dst = np.array([
-                    [0, 0],
-                    [maxWidth - 1, 0],
-                    [maxWidth - 1, maxHeight - 1],
-                    [0, maxHeight - 1]
-                ], dtype="float32")
-                M = cv2.getPerspectiveTransform(ordered_pts, dst)
-                warped = cv2.warpPerspective(image_bgr, M, (maxWidth, maxHeight))
-                cv2.polylines(image_bgr, [ordered_pts.astype(np.int32)], isClosed=True, color=(0, 255, 0), thickness=2)
-
-                cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), warped)
-                cv2.imwrite(os.path.join(self.work_dir, "md1", f"boxed_{file_name}.jpg"), image_bgr)
                 
                 # Track CCCD đã xử lý (extract base_name)
                 file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
@@ -868,18 +1469,70 @@ class DetectWorker():
                     publish_progress_func(self.job_id, percent, message, 
                                        total_cccd=self.total_cccd, processed_cccd=processed_cccd)
 
+    def _draw_ocr_result(self, goc_name, infos, goc_folder, results_folder):
+        """Vẽ text OCR lên ảnh gốc + ghi file txt vào temp_rs (chỉ dùng khi GOQUICK_DEBUG_DUMP=1)"""
+        from PIL import Image, ImageDraw, ImageFont
+
+        img_path = os.path.join(goc_folder, f"{goc_name}.jpg")
+        if not os.path.exists(img_path):
+            return
+
+        # Dùng OpenCV để vẽ nền mờ
+        image_cv = cv2.imread(img_path)
+        h, w = image_cv.shape[:2]
+
+        box_w = int(w)
+        box_h = int(h)
+        box_x = 10
+        box_y = 10
+
+        overlay = image_cv.copy()
+        cv2.rectangle(overlay, (box_x, box_y), (box_x + box_w, box_y + box_h), (255, 255, 255), -1)
+        alpha = 0.3
+        image_cv = cv2.addWeighted(overlay, alpha, image_cv, 1 - alpha, 0)
+
+        # Convert BGR OpenCV => RGB PIL
+        image_pil = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
+        image_pil = Image.fromarray(image_pil)
+
+        draw = ImageDraw.Draw(image_pil)
+
+        # === Load font Tiếng Việt ===
+        # ⚠️ Đường dẫn font Unicode, ví dụ Arial Unicode MS hoặc Roboto
+        font_path = os.path.join(self.base_dir, "arial.ttf")  # Bạn thay đường dẫn đúng của bạn!
+        font_size = max(20, int(h * 0.02))  # Auto scale size
+
+        try:
+            font = ImageFont.truetype(font_path, font_size)
+        except:
+            font = ImageFont.load_default()
+
+        # Vẽ text từng dòng
+        y0 = box_y + 20
+        dy = int(font_size * 1.5)
+        for label, text in infos:
+            
+            line = f"{label}: {text}"
+            draw.text((box_x + 10, y0), line, font=font, fill=(0, 0, 0))
+            y0 += dy
+
+        # Convert lại về BGR OpenCV
+        image_result = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
+
+        # Lưu ảnh kết quả
+        result_img = os.path.join(results_folder, f"{goc_name}.jpg")
+        cv2.imwrite(result_img, image_result)
+        # Lưu file txt kèm
+        result_txt = os.path.join(results_folder, f"{goc_name}.txt")
+        with open(result_txt, 'w', encoding='utf-8') as f:
+            for label, text in infos:
+                f.write(f"{label}: {text}\n")
+
     def detect_lines(self):
         print("3.Detect lines")
-        import cv2
-        import numpy as np
-        import os
-        import math
-        folder = self.work_md2
-        img_files = [
-            os.path.join(folder, f)
-            for f in os.listdir(folder)
-            if f.lower().endswith(('.jpg', '.png', '.jpeg'))
-        ]
+        img_files = self._take_images('md2')
+        # Tên ảnh đã xoay thẳng: công đoạn 3.3 chỉ ghi kết quả cho các ảnh này
+        goc_names = {os.path.splitext(name)[0] for name, _ in img_files}
 
         total = len(img_files)
         if total == 0:
@@ -913,7 +1566,7 @@ class DetectWorker():
             except Exception as e:
                 print(f"⚠️ Không thể import publish_progress: {e}")
 
-        for i, img_path in enumerate(img_files):
+        for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model3, img_files)):
             # Check cancellation trước khi xử lý mỗi ảnh
             try:
                 self.check_cancellation()
@@ -923,80 +1576,11 @@ class DetectWorker():
                     return
                 raise
             
-            results = self.model3.predict(source=img_path, conf=0.5, save=False)
-            r = results[0]
-            if r.masks is None or len(r.masks.xy) == 0:
-                # Track CCCD đã xử lý (kể cả khi skip)
-                file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
-                if file_name_no_ext.lower().endswith('mt'):
-                    base_name = file_name_no_ext[:-2]
-                elif file_name_no_ext.lower().endswith('ms'):
-                    base_name = file_name_no_ext[:-2]
-                else:
-                    base_name = file_name_no_ext
-                
-                processed_cccd_set.add(base_name)
-                processed_cccd = len(processed_cccd_set)
-                
-                # Tính % cho công đoạn 3.1: sub_stage1_base + (processed_cccd × sub_stage1_percent_per_cccd)
-                # Đảm bảo mỗi CCCD có percent khác nhau: dùng processed_cccd làm phần thập phân nhỏ
-                base_percent = sub_stage1_base + (processed_cccd * sub_stage1_percent_per_cccd)
-                # Thêm offset nhỏ dựa trên processed_cccd để đảm bảo mỗi CCCD có percent khác nhau
-                percent = base_percent + (processed_cccd * 0.5)  # 0.5% per CCCD để đảm bảo khác nhau
-                if percent > 66 + sub_stage_range_1_2:
-                    percent = 66 + sub_stage_range_1_2  # 82%
-                percent = round(percent)  # Round về số nguyên gần nhất
-                
-                # Publish progress cho công đoạn 3.1
-                if publish_progress_func and self.job_id and self.total_cccd > 0:
-                    message = f"Đang detect lines (crop)... ({processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
-                    publish_progress_func(self.job_id, percent, message, 
-                                       total_cccd=self.total_cccd, processed_cccd=processed_cccd)
-                continue
+            crops = self._crop_fields(img_path, img_array, r)
+            for crop_name, crop in crops:
+                self._put_image('md3', crop_name, crop)
 
-            image_bgr = cv2.imread(r.path)
-            image_clean = image_bgr.copy()
-            file_name = os.path.basename(r.path)
-            file_name = os.path.splitext(file_name)[0] 
-            for j, polygon in enumerate(r.masks.xy):
-                points = polygon.astype(int)
-                if points.shape[0] < 4:
-                    continue
-                pts = points.reshape((-1, 1, 2))
-                cv2.polylines(image_bgr, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
-                class_id = int(r.boxes.cls[j]) if r.boxes is not None else 0
-                conf = float(r.boxes.conf[j]) if r.boxes is not None else 0.0
-                class_name = self.model3.names[class_id] if hasattr(self.model3, 'names') else str(class_id)
-                label_text = f"{class_name} {conf:.2f}"
-
-                # Vẽ label trên ảnh đã vẽ
-                x, y = points[0]
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.5
-                thickness = 1
-                text_size, _ = cv2.getTextSize(label_text, font, font_scale, thickness)
-                text_w, text_h = text_size
-
-                cv2.rectangle(image_bgr, (x, y - text_h - 4), (x + text_w, y), (0, 255, 0), -1)
-                cv2.putText(image_bgr, label_text, (x, y - 2), font, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
-
-                # === CROP đúng từ ảnh gốc ===
-                mask = np.zeros(image_clean.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask, [pts], 255)
-
-                masked = cv2.bitwise_and(image_clean, image_clean, mask=mask)
-
-                x, y, w, h = cv2.boundingRect(pts)
-                crop = masked[y:y+h, x:x+w]
-
-                # === Tên file crop: tên gốc + tên label ===
-                crop_name = os.path.join(self.work_md3, f"{file_name.replace('.jpg','')}-{class_name}.jpg")
-                cv2.imwrite(crop_name, crop)
-            original_ext = os.path.splitext(os.path.basename(r.path))[1] or '.jpg'
-            boxed_name = os.path.join(self.work_dir, "md3", "detected_results", f"boxed_{file_name}{original_ext}")
-            cv2.imwrite(boxed_name, image_bgr)
-            
-            # Track CCCD đã xử lý (extract base_name)
+            # Track CCCD đã xử lý (kể cả ảnh không có field nào)
             file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
             if file_name_no_ext.lower().endswith('mt'):
                 base_name = file_name_no_ext[:-2]
@@ -1023,36 +1607,17 @@ class DetectWorker():
                 message = f"Đang detect lines (crop)... ({processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
                 publish_progress_func(self.job_id, percent, message, 
                                    total_cccd=self.total_cccd, processed_cccd=processed_cccd)
-        import os
-        from PIL import Image, ImageDraw, ImageFont
-        from vietocr.tool.predictor import Predictor
-        from vietocr.tool.config import Cfg
-        import cv2
-        import numpy as np
+        detector = self._get_ocr_detector()
 
-        if self.vietocr_detector is not None:
-            detector = self.vietocr_detector
-        elif self.cached_models and self.cached_models.get('vietocr_detector'):
-            detector = self.cached_models['vietocr_detector']
-            self.vietocr_detector = detector
-        else:
-            config = Cfg.load_config_from_name('vgg_transformer')
-            config['weights'] = os.path.join(self.base_dir, 'vgg_transformer.pth')
-            config['cnn']['pretrained'] = False
-            config['device'] = 'cpu'
-            detector = Predictor(config)
-            if self.cached_models:
-                self.cached_models['vietocr_detector'] = detector
-
-        crop_folder = self.work_md3
         goc_folder = self.work_md2
         results_folder = self.work_temp_rs
 
         ocr_result_file = os.path.join(self.work_md4, 'ocr_results.txt')
         ocr_data = []
         
-        # Đếm tổng số crop files để tính progress
-        crop_files = [f for f in os.listdir(crop_folder) if f.lower().endswith('.jpg')]
+        # Đếm tổng số crop để tính progress
+        crops = self._take_images('md3')
+        crop_files = [name for name, _ in crops]
         total_crops = len(crop_files)
         
         # Công đoạn 3.2: OCR từng field (82% → 98%)
@@ -1063,80 +1628,77 @@ class DetectWorker():
         ocr_cccd_tracker = {}  # {base_name: {'mt': set(), 'ms': set()}}
         ocr_cccd_set = set()  # Track CCCD đã OCR xong (cả mt và ms)
         
-        with open(ocr_result_file, 'w', encoding='utf-8') as f_out:
-            i = 0
-            for file_name in os.listdir(crop_folder):
-                # Check cancellation trước khi OCR mỗi file
-                try:
-                    self.check_cancellation()
-                except Exception as e:
-                    if "đã bị hủy" in str(e):
-                        return
-                    raise
+        # ✅ OCR theo batch (gom crop cùng chiều rộng), kết quả ghi lại đúng thứ tự crop_files
+        texts = [""] * total_crops
+        for idx, text in self._ocr_batched(detector, [img for _, img in crops]):
+            # Check cancellation sau mỗi crop OCR xong
+            try:
+                self.check_cancellation()
+            except Exception as e:
+                if "đã bị hủy" in str(e):
+                    return
+                raise
+            
+            texts[idx] = text
+            file_name_no_ext = os.path.splitext(crop_files[idx])[0]
+            
+            # Track OCR progress: Extract base_name từ crop file name
+            # Ví dụ: "1mt-id.jpg" → base_name = "1", field = "id"
+            parts = file_name_no_ext.split('-')
+            if len(parts) >= 2:
+                goc_name = parts[0]  # "1mt" hoặc "1ms"
+                # Bỏ phần mt/ms để lấy base_name
+                if goc_name.lower().endswith('mt'):
+                    base_name = goc_name[:-2]
+                    side = 'mt'
+                elif goc_name.lower().endswith('ms'):
+                    base_name = goc_name[:-2]
+                    side = 'ms'
+                else:
+                    base_name = goc_name
+                    side = 'unknown'
+                
+                if base_name not in ocr_cccd_tracker:
+                    ocr_cccd_tracker[base_name] = {'mt': set(), 'ms': set()}
                 
-                i+=1
-                if file_name.lower().endswith('.jpg'):
-                    img_path = os.path.join(crop_folder, file_name)
-                    img = Image.open(img_path)
-                    text = detector.predict(img).strip()
-                    text_ki = [
-                        "CỤC", "TRƯỞNG", "CỤC", "CẢNH", "SÁT",
-                        "QUẢN", "LÝ", "HÀNH", "CHÍNH", "VỀ",
-                        "TRẬT", "TỰ", "XÃ", "HỘI"
-                    ]
-
-                    if len(text) > 14 and text.isupper() and any(word in text for word in text_ki):
-                        text = "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
-                    f_out.write(f"{file_name}\t{text}\n")
-                    file_name_no_ext = os.path.splitext(file_name)[0]
-                    ocr_data.append((file_name_no_ext, text))
+                # Track field theo mt/ms
+                ocr_cccd_tracker[base_name][side].add(parts[1] if len(parts) > 1 else 'unknown')
+                
+                # Kiểm tra xem CCCD này đã OCR xong chưa (có ít nhất 1 field từ mt hoặc ms)
+                # Nếu đã có field từ cả mt và ms (hoặc chỉ có 1 trong 2 nếu thiếu), coi như đã OCR xong
+                has_mt = len(ocr_cccd_tracker[base_name]['mt']) > 0
+                has_ms = len(ocr_cccd_tracker[base_name]['ms']) > 0
+                
+                # Chỉ publish khi OCR xong 1 CCCD (có ít nhất 1 field từ mt hoặc ms)
+                # Và chỉ publish 1 lần cho mỗi CCCD
+                if (has_mt or has_ms) and base_name not in ocr_cccd_set:
+                    ocr_cccd_set.add(base_name)
+                    ocr_processed_cccd = len(ocr_cccd_set)
                     
-                    # Track OCR progress: Extract base_name từ crop file name
-                    # Ví dụ: "1mt-id.jpg" → base_name = "1", field = "id"
-                    parts = file_name_no_ext.split('-')
-                    if len(parts) >= 2:
-                        goc_name = parts[0]  # "1mt" hoặc "1ms"
-                        # Bỏ phần mt/ms để lấy base_name
-                        if goc_name.lower().endswith('mt'):
-                            base_name = goc_name[:-2]
-                            side = 'mt'
-                        elif goc_name.lower().endswith('ms'):
-                            base_name = goc_name[:-2]
-                            side = 'ms'
-                        else:
-                            base_name = goc_name
-                            side = 'unknown'
-                        
-                        if base_name not in ocr_cccd_tracker:
-                            ocr_cccd_tracker[base_name] = {'mt': set(), 'ms': set()}
-                        
-                        # Track field theo mt/ms
-                        ocr_cccd_tracker[base_name][side].add(parts[1] if len(parts) > 1 else 'unknown')
-                        
-                        # Kiểm tra xem CCCD này đã OCR xong chưa (có ít nhất 1 field từ mt hoặc ms)
-                        # Nếu đã có field từ cả mt và ms (hoặc chỉ có 1 trong 2 nếu thiếu), coi như đã OCR xong
-                        has_mt = len(ocr_cccd_tracker[base_name]['mt']) > 0
-                        has_ms = len(ocr_cccd_tracker[base_name]['ms']) > 0
-                        
-                        # Chỉ publish khi OCR xong 1 CCCD (có ít nhất 1 field từ mt hoặc ms)
-                        # Và chỉ publish 1 lần cho mỗi CCCD
-                        if (has_mt or has_ms) and base_name not in ocr_cccd_set:
-                            ocr_cccd_set.add(base_name)
-                            ocr_processed_cccd = len(ocr_cccd_set)
-                            
-                            # Tính % cho công đoạn 3.2: sub_stage2_base + (ocr_processed_cccd × sub_stage2_percent_per_cccd)
-                            # Đảm bảo mỗi CCCD có percent khác nhau
-                            base_percent = sub_stage2_base + (ocr_processed_cccd * sub_stage2_percent_per_cccd)
-                            percent = base_percent + (ocr_processed_cccd * 0.5)  # 0.5% per CCCD để đảm bảo khác nhau
-                            if percent > 66 + (sub_stage_range_1_2 * 2):
-                                percent = 66 + (sub_stage_range_1_2 * 2)  # 98%
-                            percent = round(percent)  # Round về số nguyên gần nhất
-                            
-                            # Publish progress cho công đoạn 3.2
-                            if publish_progress_func and self.job_id and self.total_cccd > 0:
-                                message = f"Đang detect lines (OCR)... ({ocr_processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
-                                publish_progress_func(self.job_id, percent, message, 
-                                                   total_cccd=self.total_cccd, processed_cccd=ocr_processed_cccd)
+                    # Tính % cho công đoạn 3.2: sub_stage2_base + (ocr_processed_cccd × sub_stage2_percent_per_cccd)
+                    # Đảm bảo mỗi CCCD có percent khác nhau
+                    base_percent = sub_stage2_base + (ocr_processed_cccd * sub_stage2_percent_per_cccd)
+                    percent = base_percent + (ocr_processed_cccd * 0.5)  # 0.5% per CCCD để đảm bảo khác nhau
+                    if percent > 66 + (sub_stage_range_1_2 * 2):
+                        percent = 66 + (sub_stage_range_1_2 * 2)  # 98%
+                    percent = round(percent)  # Round về số nguyên gần nhất
+                    
+                    # Publish progress cho công đoạn 3.2
+                    if publish_progress_func and self.job_id and self.total_cccd > 0:
+                        message = f"Đang detect lines (OCR)... ({ocr_processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
+                        publish_progress_func(self.job_id, percent, message, 
+                                           total_cccd=self.total_cccd, processed_cccd=ocr_processed_cccd)
+
+        for file_name, text in zip(crop_files, texts):
+            text = self._normalize_ocr_text(text)
+            file_name_no_ext = os.path.splitext(file_name)[0]
+            ocr_data.append((file_name_no_ext, text))
+        # collect_cus_info đọc thẳng từ RAM; file txt chỉ còn để debug
+        self.ocr_data = ocr_data
+        if DEBUG_DUMP:
+            with open(ocr_result_file, 'w', encoding='utf-8') as f_out:
+                for crop_name, text in ocr_data:
+                    f_out.write(f"{crop_name}.jpg\t{text}\n")
 
         goc_dict = {}
         for crop_name, text in ocr_data:
@@ -1172,60 +1734,11 @@ class DetectWorker():
                     return
                 raise
             
-            img_path = os.path.join(goc_folder, f"{goc_name}.jpg")
-            if not os.path.exists(img_path):
+            if goc_name not in goc_names:
                 continue
-
-            # Dùng OpenCV để vẽ nền mờ
-            image_cv = cv2.imread(img_path)
-            h, w = image_cv.shape[:2]
-
-            box_w = int(w)
-            box_h = int(h)
-            box_x = 10
-            box_y = 10
-
-            overlay = image_cv.copy()
-            cv2.rectangle(overlay, (box_x, box_y), (box_x + box_w, box_y + box_h), (255, 255, 255), -1)
-            alpha = 0.3
-            image_cv = cv2.addWeighted(overlay, alpha, image_cv, 1 - alpha, 0)
-
-            # Convert BGR OpenCV => RGB PIL
-            image_pil = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
-            image_pil = Image.fromarray(image_pil)
-
-            draw = ImageDraw.Draw(image_pil)
-
-            # === Load font Tiếng Việt ===
-            # ⚠️ Đường dẫn font Unicode, ví dụ Arial Unicode MS hoặc Roboto
-            font_path = os.path.join(self.base_dir, "arial.ttf")  # Bạn thay đường dẫn đúng của bạn!
-            font_size = max(20, int(h * 0.02))  # Auto scale size
-
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-            except:
-                font = ImageFont.load_default()
-
-            # Vẽ text từng dòng
-            y0 = box_y + 20
-            dy = int(font_size * 1.5)
-            for label, text in infos:
-                
-                line = f"{label}: {text}"
-                draw.text((box_x + 10, y0), line, font=font, fill=(0, 0, 0))
-                y0 += dy
-
-            # Convert lại về BGR OpenCV
-            image_result = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-
-            # Lưu ảnh kết quả
-            result_img = os.path.join(results_folder, f"{goc_name}.jpg")
-            cv2.imwrite(result_img, image_result)
-            # Lưu file txt kèm
-            result_txt = os.path.join(results_folder, f"{goc_name}.txt")
-            with open(result_txt, 'w', encoding='utf-8') as f:
-                for label, text in infos:
-                    f.write(f"{label}: {text}\n")
+            # Ảnh kết quả có vẽ text + file txt chỉ để xem lại khi debug
+            if DEBUG_DUMP:
+                self._draw_ocr_result(goc_name, infos, goc_folder, results_folder)
             
             # Track CCCD đã vẽ text và lưu file xong (extract base_name)
             if goc_name.lower().endswith('mt'):
@@ -1272,6 +1785,10 @@ class DetectWorker():
         """Parse OCR results từ goc_dict thành customer objects"""
         print("4.Collect customer info")
         
+        # OCR results có sẵn trong RAM (detect_lines) → không cần đọc lại file
+        if self.ocr_data is not None:
+            return self._build_customers(self.ocr_data)
+        
         # Đọc OCR results từ file
         ocr_result_file = os.path.join(self.work_md4, 'ocr_results.txt')
         if not os.path.exists(ocr_result_file):
@@ -1304,8 +1821,12 @@ class DetectWorker():
                 "total_cccd": 0
             }
         
+        return self._build_customers(ocr_data)
+
+    def _build_customers(self, ocr_data):
+        """[(tên crop, text)] → customer objects"""
         if not ocr_data:
-            print(f"⚠️ Không có OCR data trong file: {ocr_result_file}")
+            print("⚠️ Không có OCR data")
             return {
                 "status": "error",
                 "message": "Không có dữ liệu OCR",
@@ -1315,6 +1836,29 @@ class DetectWorker():
         
         print(f"📊 Đã đọc {len(ocr_data)} OCR records")
         
+        customers = self._parse_customers(ocr_data)
+        
+        print(f"📊 Đã parse {len(customers)} customer objects")
+        
+        # Filter out empty customers (không có id_card hoặc name)
+        customers_filtered = [c for c in customers if c.get("id_card") or c.get("name")]
+        
+        print(f"📊 Sau filter: {len(customers_filtered)} customers (có id_card hoặc name)")
+        
+        if len(customers_filtered) == 0 and len(customers) > 0:
+            # Nếu filter quá strict, thử lấy tất cả customers có ít nhất 1 field
+            customers_filtered = [c for c in customers if any(c.values())]
+            print(f"📊 Sau filter lenient: {len(customers_filtered)} customers (có ít nhất 1 field)")
+        
+        return {
+            "status": "success",
+            "message": f"Đã xử lý {len(customers_filtered)} CCCD",
+            "customer": customers_filtered,
+            "total_cccd": len(customers_filtered)
+        }
+
+    def _parse_customers(self, ocr_data):
+        """[(tên crop, text)] → list customer (mỗi base_name 1 customer, theo thứ tự xuất hiện)"""
         # Build goc_dict từ OCR data
         goc_dict = {}
         for crop_name, text in ocr_data:
@@ -1330,10 +1874,7 @@ class DetectWorker():
                 text = "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
             goc_dict[goc_name].append((label, text))
         
-        print(f"📊 Đã build goc_dict với {len(goc_dict)} goc_name")
-        
         # Parse thành customer objects
-        customers = []
         cccd_dict = {}  # {base_name: customer_dict}
         
         for goc_name, infos in goc_dict.items():
@@ -1395,36 +1936,11 @@ class DetectWorker():
                     customer["issue_place"] = text
                     customer["place_created"] = text  # Alias cho frontend
         
-        # Convert dict thành list
-        customers = list(cccd_dict.values())
-        
-        print(f"📊 Đã parse {len(customers)} customer objects từ {len(cccd_dict)} base_name")
-        
-        # Filter out empty customers (không có id_card hoặc name)
-        customers_filtered = [c for c in customers if c.get("id_card") or c.get("name")]
-        
-        print(f"📊 Sau filter: {len(customers_filtered)} customers (có id_card hoặc name)")
-        
-        if len(customers_filtered) == 0 and len(customers) > 0:
-            # Nếu filter quá strict, thử lấy tất cả customers có ít nhất 1 field
-            customers_filtered = [c for c in customers if any(c.values())]
-            print(f"📊 Sau filter lenient: {len(customers_filtered)} customers (có ít nhất 1 field)")
-        
-        return {
-            "status": "success",
-            "message": f"Đã xử lý {len(customers_filtered)} CCCD",
-            "customer": customers_filtered,
-            "total_cccd": len(customers_filtered)
-        }
+        return list(cccd_dict.values())
 
     def detect_corners(self):
         print("2.Detect corners")
-        folder = self.work_md1
-        img_files = [
-            os.path.join(folder, f)
-            for f in os.listdir(folder)
-            if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-        ]
+        img_files = self._take_images('md1')
         total = len(img_files)
         if total == 0:
             print("❌ Không tìm thấy ảnh!")
@@ -1449,7 +1965,7 @@ class DetectWorker():
             except Exception as e:
                 print(f"⚠️ Không thể import publish_progress: {e}")
         
-        for i, img_path in enumerate(img_files):
+        for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model2, img_files)):
             # Check cancellation trước khi xử lý mỗi ảnh
             try:
                 self.check_cancellation()
@@ -1459,119 +1975,8 @@ class DetectWorker():
                     return
                 raise
             
-            results = self.model2.predict(source=img_path, conf=0.5, save=False)
-            r = results[0]
-            img = cv2.imread(r.path)
-            file_name = os.path.basename(r.path)  
-            file_name = os.path.splitext(file_name)[0] 
-            centers = {}
-            for box in r.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-                cls = int(box.cls[0].cpu().item())
-                name = self.model2.names[cls]
-                cx = int((x1 + x2) / 2)
-                cy = int((y1 + y2) / 2)
-                centers[name] = (cx, cy)
-
-            if 'quoc_huy' in centers and 'qr' in centers:
-                ptA, ptB = centers['quoc_huy'], centers['qr']
-            elif 'chip' in centers and 'm_red' in centers:
-                ptA, ptB = centers['chip'], centers['m_red']
-            else:
-                cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), img)  # Lưu nguyên gốc
-                # Track CCCD đã xử lý (kể cả khi skip)
-                file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
-                if file_name_no_ext.lower().endswith('mt'):
-                    base_name = file_name_no_ext[:-2]
-                elif file_name_no_ext.lower().endswith('ms'):
-                    base_name = file_name_no_ext[:-2]
-                else:
-                    base_name = file_name_no_ext
-                
-                processed_cccd_set.add(base_name)
-                processed_cccd = len(processed_cccd_set)
-                
-                # Tính % = base_percent + (processed_cccd × percent_per_cccd)
-                percent = int(base_percent + (processed_cccd * percent_per_cccd))
-                if percent > 66:
-                    percent = 66
-                
-                # Publish progress
-                if publish_progress_func and self.job_id and self.total_cccd > 0:
-                    message = f"Đang detect corners... ({processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
-                    publish_progress_func(self.job_id, percent, message, 
-                                       total_cccd=self.total_cccd, processed_cccd=processed_cccd)
-                continue
-
-            dx, dy = ptB[0] - ptA[0], ptB[1] - ptA[1]
-            angle = math.degrees(math.atan2(dy, dx))
-            rotate_angle = -angle   # CHUẨN: Luôn lấy -angle để vector nằm ngang
-            if abs(rotate_angle) < 10:
-                cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), img)  # Lưu nguyên gốc
-                # Track CCCD đã xử lý (kể cả khi skip)
-                file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
-                if file_name_no_ext.lower().endswith('mt'):
-                    base_name = file_name_no_ext[:-2]
-                elif file_name_no_ext.lower().endswith('ms'):
-                    base_name = file_name_no_ext[:-2]
-                else:
-                    base_name = file_name_no_ext
-                
-                processed_cccd_set.add(base_name)
-                processed_cccd = len(processed_cccd_set)
-                
-                # Tính % = base_percent + (processed_cccd × percent_per_cccd)
-                percent = int(base_percent + (processed_cccd * percent_per_cccd))
-                if percent > 66:
-                    percent = 66
-                
-                # Publish progress
-                if publish_progress_func and self.job_id and self.total_cccd > 0:
-                    message = f"Đang detect corners... ({processed_cccd}/{self.total_cccd} CCCD - {percent}%)"
-                    publish_progress_func(self.job_id, percent, message, 
-                                       total_cccd=self.total_cccd, processed_cccd=processed_cccd)
-                continue
-            h, w = img.shape[:2]
-            center_img = (w // 2, h // 2)
-            M = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
-
-            cos = abs(M[0, 0])
-            sin = abs(M[0, 1])
-            new_w = int(h * sin + w * cos)
-            new_h = int(h * cos + w * sin)
-            M[0, 2] += (new_w / 2) - center_img[0]
-            M[1, 2] += (new_h / 2) - center_img[1]
-            def transform(pt):
-                x, y = pt
-                new_x = M[0,0]*x + M[0,1]*y + M[0,2]
-                new_y = M[1,0]*x + M[1,1]*y + M[1,2]
-                return (new_x, new_y)
-
-            ptA_new = transform(ptA)
-            ptB_new = transform(ptB)
-
-            # Nếu vector AB sau xoay mà B bên trái A → thêm 180°
-            if ptB_new[0] < ptA_new[0]:
-                rotate_angle += 180
-
-            # Tính lại ma trận FINAL duy nhất
-            M_final = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
-            cos = abs(M_final[0, 0])
-            sin = abs(M_final[0, 1])
-            new_w = int(h * sin + w * cos)
-            new_h = int(h * cos + w * sin)
-            M_final[0, 2] += (new_w / 2) - center_img[0]
-            M_final[1, 2] += (new_h / 2) - center_img[1]
-
-            rotated = cv2.warpAffine(
-                img,
-                M_final,
-                (new_w, new_h),
-                flags=cv2.INTER_LINEAR,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(255, 255, 255)
-            )
-            cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), rotated)
+            file_name = os.path.splitext(os.path.basename(img_path))[0]
+            self._put_image('md2', f"{file_name}.jpg", self._align_card(img_array, r))
             
             # Track CCCD đã xử lý (extract base_name)
             file_name_no_ext = os.path.splitext(os.path.basename(img_path))[0]
@@ -1587,8 +1992,8 @@ class DetectWorker():
             
             # Tính % = base_percent + (processed_cccd × percent_per_cccd)
             percent = int(base_percent + (processed_cccd * percent_per_cccd))
-            if percent > 50:
-                percent = 50
+            if percent > 66:
+                percent = 66
             
             # Publish progress
             if publish_progress_func and self.job_id and self.total_cccd > 0:
@@ -1619,7 +2024,7 @@ class DetectWorkerStreaming(DetectWorker):
     def run_streaming(self):
         """Run with streaming progress - returns generator"""
         try:
-            self.init_temp_dirs()
+            self.init_temp_dirs(create=DEBUG_DUMP)
             
             if self.type_ == 1:
                 if self.cached_models:
@@ -1629,14 +2034,20 @@ class DetectWorkerStreaming(DetectWorker):
                     self.vietocr_detector = self.cached_models.get('vietocr_detector')
                 
                 if self.model1 is None:
-                    self.model1 = YOLO(os.path.join(self.base_dir, "best.pt"))
+                    self.model1 = load_yolo(self.base_dir, "best.pt")
                 if self.model2 is None:
-                    self.model2 = YOLO(os.path.join(self.base_dir, "best2.pt"))
+                    self.model2 = load_yolo(self.base_dir, "best2.pt")
                 if self.model3 is None:
-                    self.model3 = YOLO(os.path.join(self.base_dir, "best3.pt"))
+                    self.model3 = load_yolo(self.base_dir, "best3.pt")
                 
                 # Process with progress events
                 try:
+                    if PIPELINE_ENABLED:
+                        for event in self._run_pipeline_streaming():
+                            yield event
+                        return
+                    _warn_result_cache_bypassed()
+
                     for event in self.detect_cccd_streaming():
                         yield event
                     
@@ -1727,20 +2138,70 @@ class DetectWorkerStreaming(DetectWorker):
         finally:
             self.cleanup_temp_dirs()
     
+    def _run_pipeline_streaming(self):
+        """
+        run_pipeline (kèm result_cache) trên thread riêng, mỗi CCCD xong → 1 progress event;
+        client đóng generator → pipeline dừng ở batch OCR kế tiếp
+        """
+        events = queue.Queue()
+        closed = threading.Event()
+        outcome = {}
+
+        def on_card(processed_cccd, total_cccd, customers):
+            if closed.is_set():
+                raise Exception("Job đã bị hủy (client ngắt kết nối)")
+            events.put({
+                "type": "progress",
+                "step": "pipeline",
+                "message": f"Đã xử lý {processed_cccd}/{total_cccd} CCCD",
+                "percent": self.base_percent + int(processed_cccd * 95 / max(1, total_cccd)),
+                "processed_cccd": processed_cccd,
+                "total_cccd": total_cccd,
+                "data": {"customer": customers}
+            })
+
+        def work():
+            try:
+                outcome["data"] = self.run_pipeline(progress_callback=on_card)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                events.put(_PIPELINE_END)
+
+        thread = threading.Thread(target=work, name=f"goquick-stream-{self.session_id}", daemon=True)
+        thread.start()
+        try:
+            while True:
+                event = events.get()
+                if event is _PIPELINE_END:
+                    break
+                yield event
+        finally:
+            closed.set()
+            thread.join(timeout=30)
+        if "error" in outcome:
+            raise outcome["error"]
+        data = outcome["data"]
+        if isinstance(data, dict) and data.get("status") == "error":
+            # Input hỏng (link Drive / PDF / Excel lỗi): run_pipeline trả message thay vì raise
+            yield {
+                "type": "error",
+                "percent": 100,
+                "message": f"Lỗi xử lý: {data.get('message')}",
+                "data": None
+            }
+            return
+        yield {
+            "type": "complete",
+            "percent": 100,
+            "message": "Hoàn thành trích xuất CCCD",
+            "data": data
+        }
+
     def detect_cccd_streaming(self):
         """Detect CCCD với streaming progress"""
         print("1.Detect cccd (streaming)")
         
-        def order_points(pts):
-            rect = np.zeros((4, 2), dtype="float32")
-            s = pts.sum(axis=1)
-            diff = np.diff(pts, axis=1)
-            rect[0] = pts[np.argmin(s)]
-            rect[2] = pts[np.argmax(s)]
-            rect[1] = pts[np.argmin(diff)]
-            rect[3] = pts[np.argmax(diff)]
-            return rect
-        
         # Count total images first
         total_images = 0
         processed_images = 0
@@ -1778,15 +2239,9 @@ class DetectWorkerStreaming(DetectWorker):
                 input_zip = BytesIO(zip_bytes)  # Reset stream
                 
                 with zipfile.ZipFile(input_zip, "r") as zf:
-                    for i, img_file in enumerate(img_files):
+                    zip_images = ((f, cv2.imdecode(np.frombuffer(zf.read(f), np.uint8), cv2.IMREAD_COLOR)) for f in img_files)
+                    for i, (img_file, img_array, r) in enumerate(self._predict_batched(self.model1, zip_images)):
                         try:
-                            img_data = zf.read(img_file)
-                            img_stream = BytesIO(img_data)
-                            img_array = cv2.imdecode(np.frombuffer(img_stream.getvalue(), np.uint8), cv2.IMREAD_COLOR)
-                            
-                            results = self.model1.predict(source=img_array, conf=0.5, save=False)
-                            r = results[0]
-                            
                             if len(r.keypoints) == 0:
                                 processed_images += 1
                                 progress_pct = self.base_percent + 10 + int((processed_images / total_images) * 20)
@@ -1801,56 +2256,12 @@ class DetectWorkerStreaming(DetectWorker):
                                 continue
                             
                             file_name = os.path.splitext(os.path.basename(img_file))[0]
-                            image_bgr = img_array
-                            kpts = r.keypoints.xy[0].cpu().numpy()
-                            
-                            if kpts.shape[0] != 4:
+                            card, ok = self._crop_card(file_name, img_array, r)
+                            if card is not None:
+                                self._put_image('md1', f"{file_name}.jpg", card)
+                            if not ok:
                                 continue
                             
-                            conf = r.keypoints.conf[0].cpu().numpy()
-                            avg_conf = np.mean(conf) * 100
-                            
-                            if avg_conf < 75:
-                                h, w = image_bgr.shape[:2]
-                                text = f"Không đạt ({avg_conf:.1f}%)"
-                                font = cv2.FONT_HERSHEY_SIMPLEX
-                                scale = 1.2
-                                thickness = 3
-                                text_size = cv2.getTextSize(text, font, scale, thickness)[0]
-                                text_x = (w - text_size[0]) // 2
-                                text_y = (h + text_size[1]) // 2
-                                cv2.putText(image_bgr, text, (text_x, text_y), font, scale, (0, 0, 255), thickness)
-                                cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), image_bgr)
-                                continue
-                            
-                            pts = kpts.astype(np.float32)
-                            ordered_pts = order_points(pts)
-                            
-                            text = f"Conf: {avg_conf:.1f}%"
-                            text_org = (int(ordered_pts[0][0]), int(ordered_pts[0][1]) - 10)
-                            cv2.putText(image_bgr, text, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                            
-                            (tl, tr, br, bl) = ordered_pts
-                            widthA = np.linalg.norm(br - bl)
-                            widthB = np.linalg.norm(tr - tl)
-                            maxWidth = int(max(widthA, widthB))
-                            heightA = np.linalg.norm(tr - br)
-                            heightB = np.linalg.norm(tl - bl)
-                            maxHeight = int(max(heightA, heightB))
-                            
-                            dst = np.array([
-                                [0, 0],
-                                [maxWidth - 1, 0],
-                                [maxWidth - 1, maxHeight - 1],
-                                [0, maxHeight - 1]
-                            ], dtype="float32")
-                            M = cv2.getPerspectiveTransform(ordered_pts, dst)
-                            warped = cv2.warpPerspective(image_bgr, M, (maxWidth, maxHeight))
-                            cv2.polylines(image_bgr, [ordered_pts.astype(np.int32)], isClosed=True, color=(0, 255, 0), thickness=2)
-                            
-                            cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), warped)
-                            cv2.imwrite(os.path.join(self.work_dir, "md1", f"boxed_{file_name}.jpg"), image_bgr)
-                            
                             processed_images += 1
                             
                             progress_percent = self.base_percent + 10 + int((processed_images / total_images) * 20)
@@ -1895,64 +2306,17 @@ class DetectWorkerStreaming(DetectWorker):
                 "processed": 0
             }
             
-            for i, img_path in enumerate(img_files):
-                results = self.model1.predict(source=img_path, conf=0.5, save=False)
-                r = results[0]
+            for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model1, self._iter_image_files(img_files))):
                 if len(r.keypoints) == 0:
                     processed_images += 1
                     continue
-                image_bgr = cv2.imread(r.path)
-                file_name = os.path.basename(r.path)
-                file_name = os.path.splitext(file_name)[0]
-                kpts = r.keypoints.xy[0].cpu().numpy()
-                if kpts.shape[0] != 4:
+                file_name = os.path.splitext(os.path.basename(img_path))[0]
+                card, ok = self._crop_card(file_name, img_array, r)
+                if card is not None:
+                    self._put_image('md1', f"{file_name}.jpg", card)
+                if not ok:
                     processed_images += 1
                     continue
-
-                conf = r.keypoints.conf[0].cpu().numpy()
-                avg_conf = np.mean(conf) * 100
-
-                if avg_conf < 75:
-                    h, w = image_bgr.shape[:2]
-                    text = f"Không đạt ({avg_conf:.1f}%)"
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    scale = 1.2
-                    thickness = 3
-                    text_size = cv2.getTextSize(text, font, scale, thickness)[0]
-                    text_x = (w - text_size[0]) // 2
-                    text_y = (h + text_size[1]) // 2
-                    cv2.putText(image_bgr, text, (text_x, text_y), font, scale, (0, 0, 255), thickness)
-                    cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), image_bgr)
-                    processed_images += 1
-                    continue
-
-                pts = kpts.astype(np.float32)
-                ordered_pts = order_points(pts)
-
-                text = f"Conf: {avg_conf:.1f}%"
-                text_org = (int(ordered_pts[0][0]), int(ordered_pts[0][1]) - 10)
-                cv2.putText(image_bgr, text, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-                (tl, tr, br, bl) = ordered_pts
-                widthA = np.linalg.norm(br - bl)
-                widthB = np.linalg.norm(tr - tl)
-                maxWidth = int(max(widthA, widthB))
-                heightA = np.linalg.norm(tr - br)
-                heightB = np.linalg.norm(tl - bl)
-                maxHeight = int(max(heightA, heightB))
-
-                dst = np.array([
-                    [0, 0],
-                    [maxWidth - 1, 0],
-                    [maxWidth - 1, maxHeight - 1],
-                    [0, maxHeight - 1]
-                ], dtype="float32")
-                M = cv2.getPerspectiveTransform(ordered_pts, dst)
-                warped = cv2.warpPerspective(image_bgr, M, (maxWidth, maxHeight))
-                cv2.polylines(image_bgr, [ordered_pts.astype(np.int32)], isClosed=True, color=(0, 255, 0), thickness=2)
-
-                cv2.imwrite(os.path.join(self.work_md1, f"{file_name}.jpg"), warped)
-                cv2.imwrite(os.path.join(self.work_dir, "md1", f"boxed_{file_name}.jpg"), image_bgr)
                 
                 processed_images += 1
                 
@@ -1968,12 +2332,7 @@ class DetectWorkerStreaming(DetectWorker):
     
     def detect_corners_streaming(self):
         """Detect corners với streaming progress"""
-        folder = self.work_md1
-        img_files = [
-            os.path.join(folder, f)
-            for f in os.listdir(folder)
-            if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-        ]
+        img_files = self._take_images('md1')
         total = len(img_files)
         if total == 0:
             yield {"type": "warning", "message": "Không có ảnh CCCD để căn chỉnh"}
@@ -1988,97 +2347,9 @@ class DetectWorkerStreaming(DetectWorker):
             "processed": 0
         }
         
-        for i, img_path in enumerate(img_files):
-            results = self.model2.predict(source=img_path, conf=0.5, save=False)
-            r = results[0]
-            img = cv2.imread(r.path)
-            file_name = os.path.basename(r.path)
-            file_name = os.path.splitext(file_name)[0]
-            centers = {}
-            for box in r.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-                cls = int(box.cls[0].cpu().item())
-                name = self.model2.names[cls]
-                cx = int((x1 + x2) / 2)
-                cy = int((y1 + y2) / 2)
-                centers[name] = (cx, cy)
-
-            if 'quoc_huy' in centers and 'qr' in centers:
-                ptA, ptB = centers['quoc_huy'], centers['qr']
-            elif 'chip' in centers and 'm_red' in centers:
-                ptA, ptB = centers['chip'], centers['m_red']
-            else:
-                cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), img)
-                # Yield progress ngay cả khi skip
-                progress_percent = self.base_percent + 35 + int(((i + 1) / total) * 15)
-                yield {
-                    "type": "progress",
-                    "step": "detect_corners",
-                    "message": f"Đang căn chỉnh {i + 1}/{total} ảnh",
-                    "percent": progress_percent,
-                    "processed": i + 1,
-                    "total": total
-                }
-                continue
-
-            dx, dy = ptB[0] - ptA[0], ptB[1] - ptA[1]
-            angle = math.degrees(math.atan2(dy, dx))
-            rotate_angle = -angle
-            
-            if abs(rotate_angle) < 10:
-                cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), img)
-                # Yield progress ngay cả khi skip
-                progress_percent = self.base_percent + 35 + int(((i + 1) / total) * 15)
-                yield {
-                    "type": "progress",
-                    "step": "detect_corners",
-                    "message": f"Đang căn chỉnh {i + 1}/{total} ảnh",
-                    "percent": progress_percent,
-                    "processed": i + 1,
-                    "total": total
-                }
-                continue
-                
-            h, w = img.shape[:2]
-            center_img = (w // 2, h // 2)
-            M = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
-
-            cos = abs(M[0, 0])
-            sin = abs(M[0, 1])
-            new_w = int(h * sin + w * cos)
-            new_h = int(h * cos + w * sin)
-            M[0, 2] += (new_w / 2) - center_img[0]
-            M[1, 2] += (new_h / 2) - center_img[1]
-            
-            def transform(pt):
-                x, y = pt
-                new_x = M[0,0]*x + M[0,1]*y + M[0,2]
-                new_y = M[1,0]*x + M[1,1]*y + M[1,2]
-                return (new_x, new_y)
-
-            ptA_new = transform(ptA)
-            ptB_new = transform(ptB)
-
-            if ptB_new[0] < ptA_new[0]:
-                rotate_angle += 180
-
-            M_final = cv2.getRotationMatrix2D(center_img, rotate_angle, 1.0)
-            cos = abs(M_final[0, 0])
-            sin = abs(M_final[0, 1])
-            new_w = int(h * sin + w * cos)
-            new_h = int(h * cos + w * sin)
-            M_final[0, 2] += (new_w / 2) - center_img[0]
-            M_final[1, 2] += (new_h / 2) - center_img[1]
-
-            rotated = cv2.warpAffine(
-                img,
-                M_final,
-                (new_w, new_h),
-                flags=cv2.INTER_LINEAR,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(255, 255, 255)
-            )
-            cv2.imwrite(os.path.join(self.work_md2, f"{file_name}.jpg"), rotated)
+        for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model2, img_files)):
+            file_name = os.path.splitext(os.path.basename(img_path))[0]
+            self._put_image('md2', f"{file_name}.jpg", self._align_card(img_array, r))
             
             progress_percent = self.base_percent + 35 + int(((i + 1) / total) * 15)
             yield {
@@ -2092,12 +2363,7 @@ class DetectWorkerStreaming(DetectWorker):
     
     def detect_lines_streaming(self):
         """Detect lines và OCR với streaming progress"""
-        folder = self.work_md2
-        img_files = [
-            os.path.join(folder, f)
-            for f in os.listdir(folder)
-            if f.lower().endswith(('.jpg', '.png', '.jpeg'))
-        ]
+        img_files = self._take_images('md2')
 
         total = len(img_files)
         if total == 0:
@@ -2113,10 +2379,7 @@ class DetectWorkerStreaming(DetectWorker):
             "processed": 0
         }
 
-        for i, img_path in enumerate(img_files):
-            results = self.model3.predict(source=img_path, conf=0.5, save=False)
-            r = results[0]
-            
+        for i, (img_path, img_array, r) in enumerate(self._predict_batched(self.model3, img_files)):
             # Yield progress sau mỗi ảnh để giữ connection sống
             progress_percent = self.base_percent + 55 + int(((i + 1) / total) * 15)
             yield {
@@ -2128,49 +2391,8 @@ class DetectWorkerStreaming(DetectWorker):
                 "total": total
             }
             
-            if r.masks is None or len(r.masks.xy) == 0:
-                continue
-
-            image_bgr = cv2.imread(r.path)
-            image_clean = image_bgr.copy()
-            file_name = os.path.basename(r.path)
-            file_name = os.path.splitext(file_name)[0]
-            
-            for j, polygon in enumerate(r.masks.xy):
-                points = polygon.astype(int)
-                if points.shape[0] < 4:
-                    continue
-                pts = points.reshape((-1, 1, 2))
-                cv2.polylines(image_bgr, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
-                class_id = int(r.boxes.cls[j]) if r.boxes is not None else 0
-                conf = float(r.boxes.conf[j]) if r.boxes is not None else 0.0
-                class_name = self.model3.names[class_id] if hasattr(self.model3, 'names') else str(class_id)
-                label_text = f"{class_name} {conf:.2f}"
-
-                x, y = points[0]
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.5
-                thickness = 1
-                text_size, _ = cv2.getTextSize(label_text, font, font_scale, thickness)
-                text_w, text_h = text_size
-
-                cv2.rectangle(image_bgr, (x, y - text_h - 4), (x + text_w, y), (0, 255, 0), -1)
-                cv2.putText(image_bgr, label_text, (x, y - 2), font, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
-
-                mask = np.zeros(image_clean.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask, [pts], 255)
-
-                masked = cv2.bitwise_and(image_clean, image_clean, mask=mask)
-
-                x, y, w, h = cv2.boundingRect(pts)
-                crop = masked[y:y+h, x:x+w]
-
-                crop_name = os.path.join(self.work_md3, f"{file_name.replace('.jpg','')}-{class_name}.jpg")
-                cv2.imwrite(crop_name, crop)
-            
-            original_ext = os.path.splitext(os.path.basename(r.path))[1] or '.jpg'
-            boxed_name = os.path.join(self.work_dir, "md3", "detected_results", f"boxed_{file_name}{original_ext}")
-            cv2.imwrite(boxed_name, image_bgr)
+            for crop_name, crop in self._crop_fields(img_path, img_array, r):
+                self._put_image('md3', crop_name, crop)
         
         # OCR phase
         yield {
@@ -2180,129 +2402,63 @@ class DetectWorkerStreaming(DetectWorker):
             "percent": self.base_percent + 75
         }
         
-        from PIL import Image, ImageDraw, ImageFont
-        from vietocr.tool.predictor import Predictor
-        from vietocr.tool.config import Cfg
+        detector = self._get_ocr_detector()
 
-        if self.vietocr_detector is not None:
-            detector = self.vietocr_detector
-        elif self.cached_models and self.cached_models.get('vietocr_detector'):
-            detector = self.cached_models['vietocr_detector']
-            self.vietocr_detector = detector
-        else:
-            config = Cfg.load_config_from_name('vgg_transformer')
-            config['weights'] = os.path.join(self.base_dir, 'vgg_transformer.pth')
-            config['cnn']['pretrained'] = False
-            config['device'] = 'cpu'
-            detector = Predictor(config)
-            if self.cached_models:
-                self.cached_models['vietocr_detector'] = detector
-
-        crop_folder = self.work_md3
         goc_folder = self.work_md2
         results_folder = self.work_temp_rs
 
         ocr_result_file = os.path.join(self.work_md4, 'ocr_results.txt')
         ocr_data = []
         
-        crop_files = [f for f in os.listdir(crop_folder) if f.lower().endswith('.jpg')]
+        crops = self._take_images('md3')
+        crop_files = [name for name, _ in crops]
         total_crops = len(crop_files)
         
-        with open(ocr_result_file, 'w', encoding='utf-8') as f_out:
-            for i, file_name in enumerate(crop_files):
-                try:
-                    img_path = os.path.join(crop_folder, file_name)
-                    img = Image.open(img_path)
-                    text = detector.predict(img).strip()
-                    text_ki = [
-                        "CỤC", "TRƯỞNG", "CỤC", "CẢNH", "SÁT",
-                        "QUẢN", "LÝ", "HÀNH", "CHÍNH", "VỀ",
-                        "TRẬT", "TỰ", "XÃ", "HỘI"
-                    ]
-
-                    if len(text) > 14 and text.isupper() and any(word in text for word in text_ki):
-                        text = "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
-                    f_out.write(f"{file_name}\t{text}\n")
-                    file_name_no_ext = os.path.splitext(file_name)[0]
-                    ocr_data.append((file_name_no_ext, text))
-                except Exception as e:
-                    print(f"Error processing OCR for {file_name}: {e}")
-                    file_name_no_ext = os.path.splitext(file_name)[0]
-                    ocr_data.append((file_name_no_ext, ""))
-                
-                # Yield progress sau mỗi crop để giữ connection sống
-                progress_percent = self.base_percent + 75 + int(((i + 1) / max(1, total_crops)) * 15)
-                yield {
-                    "type": "progress",
-                    "step": "ocr",
-                    "message": f"Đang OCR: {i + 1}/{total_crops} vùng",
-                    "percent": min(progress_percent, self.base_percent + 90),
-                    "processed": i + 1,
-                    "total": total_crops
-                }
-
-        # Build results
-        goc_dict = {}
-        for crop_name, text in ocr_data:
-            parts = crop_name.replace('.jpg', '').split('-')
-            goc_name = parts[0]
-            try:
-                label = parts[1]
-            except:
-                label = parts[2] if len(parts) > 2 else 'unknown'
-            if goc_name not in goc_dict:
-                goc_dict[goc_name] = []
-            if label == "noi_cap":
-                text = "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
-            goc_dict[goc_name].append((label, text))
-        
-        for goc_name, infos in goc_dict.items():
-            img_path = os.path.join(goc_folder, f"{goc_name}.jpg")
-            if not os.path.exists(img_path):
-                continue
-
-            image_cv = cv2.imread(img_path)
-            h, w = image_cv.shape[:2]
-
-            box_w = int(w)
-            box_h = int(h)
-            box_x = 10
-            box_y = 10
-
-            overlay = image_cv.copy()
-            cv2.rectangle(overlay, (box_x, box_y), (box_x + box_w, box_y + box_h), (255, 255, 255), -1)
-            alpha = 0.3
-            image_cv = cv2.addWeighted(overlay, alpha, image_cv, 1 - alpha, 0)
-
-            image_pil = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
-            image_pil = Image.fromarray(image_pil)
-
-            draw = ImageDraw.Draw(image_pil)
-
-            font_path = os.path.join(self.base_dir, "arial.ttf")
-            font_size = max(20, int(h * 0.02))
-
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-            except:
-                font = ImageFont.load_default()
-
-            y0 = box_y + 20
-            dy = int(font_size * 1.5)
-            for label, text in infos:
-                line = f"{label}: {text}"
-                draw.text((box_x + 10, y0), line, font=font, fill=(0, 0, 0))
-                y0 += dy
-
-            image_result = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
+        # ✅ OCR theo batch (gom crop cùng chiều rộng), kết quả ghi lại đúng thứ tự crop_files
+        texts = [""] * total_crops
+        for i, (idx, text) in enumerate(self._ocr_batched(detector, [img for _, img in crops])):
+            texts[idx] = text
+            
+            # Yield progress sau mỗi crop để giữ connection sống
+            progress_percent = self.base_percent + 75 + int(((i + 1) / max(1, total_crops)) * 15)
+            yield {
+                "type": "progress",
+                "step": "ocr",
+                "message": f"Đang OCR: {i + 1}/{total_crops} vùng",
+                "percent": min(progress_percent, self.base_percent + 90),
+                "processed": i + 1,
+                "total": total_crops
+            }
 
-            result_img = os.path.join(results_folder, f"{goc_name}.jpg")
-            cv2.imwrite(result_img, image_result)
+        for file_name, text in zip(crop_files, texts):
+            text = self._normalize_ocr_text(text)
+            file_name_no_ext = os.path.splitext(file_name)[0]
+            ocr_data.append((file_name_no_ext, text))
+        # collect_cus_info đọc thẳng từ RAM; file txt chỉ còn để debug
+        self.ocr_data = ocr_data
+        if DEBUG_DUMP:
+            with open(ocr_result_file, 'w', encoding='utf-8') as f_out:
+                for crop_name, text in ocr_data:
+                    f_out.write(f"{crop_name}.jpg\t{text}\n")
+
+        # Ảnh kết quả có vẽ text + file txt chỉ để xem lại khi debug
+        if DEBUG_DUMP:
+            goc_dict = {}
+            for crop_name, text in ocr_data:
+                parts = crop_name.replace('.jpg', '').split('-')
+                goc_name = parts[0]
+                try:
+                    label = parts[1]
+                except:
+                    label = parts[2] if len(parts) > 2 else 'unknown'
+                if goc_name not in goc_dict:
+                    goc_dict[goc_name] = []
+                if label == "noi_cap":
+                    text = "CỤC TRƯỞNG CỤC CẢNH SÁT QUẢN LÝ HÀNH CHÍNH VỀ TRẬT TỰ XÃ HỘI"
+                goc_dict[goc_name].append((label, text))
             
-            result_txt = os.path.join(results_folder, f"{goc_name}.txt")
-            with open(result_txt, 'w', encoding='utf-8') as f:
-                for label, text in infos:
-                    f.write(f"{label}: {text}\n")
+            for goc_name, infos in goc_dict.items():
+                self._draw_ocr_result(goc_name, infos, goc_folder, results_folder)
         
         yield {
             "type": "progress",
@@ -2313,82 +2469,18 @@ class DetectWorkerStreaming(DetectWorker):
     
     def excel_to_png_streaming(self, excel_bytes_input):
         """
-        Download images from Excel bytes với streaming progress
+        Download images from Excel bytes với streaming progress.
+        Ảnh của các dòng sau được tải song song (DriveDownloader) trong khi dòng hiện tại đang detect
         """
         try:
-            if isinstance(excel_bytes_input, str):
-                excel_bytes = base64.b64decode(excel_bytes_input)
-            else:
-                excel_bytes = excel_bytes_input
-            
-            excel_stream = BytesIO(excel_bytes)
-            df = pd.read_excel(excel_stream, header=0)
-        except Exception as e:
+            lines_excel = self._read_excel_rows(excel_bytes_input)
+        except ValueError as e:
             yield {
                 "type": "error",
-                "message": f"Lỗi đọc file Excel bytes: {e}"
+                "message": str(e)
             }
             return
 
-        if df.shape[1] < 3:
-            yield {
-                "type": "error",
-                "message": "File Excel cần ít nhất 3 cột: file_name, mt_url, ms_url."
-            }
-            return
-
-        df_sub = df.iloc[:, :3].fillna("")
-        lines_excel = []
-        for _, row in df_sub.iterrows():
-            file_name = str(row.iloc[0]).strip()
-            mt_url = str(row.iloc[1]).strip()
-            ms_url = str(row.iloc[2]).strip()
-            if any([file_name, mt_url, ms_url]):
-                lines_excel.append((file_name, mt_url, ms_url))
-
-        if not lines_excel:
-            yield {
-                "type": "error",
-                "message": "Không có dữ liệu hợp lệ trong file Excel."
-            }
-            return
-
-        def extract_file_id(url: str):
-            file_id = None
-            if "drive.google.com" in url:
-                if "/file/d/" in url:
-                    file_id = url.split("/file/d/")[1].split("/")[0]
-                elif "id=" in url:
-                    file_id = url.split("id=")[1].split("&")[0]
-                elif "/open?id=" in url:
-                    file_id = url.split("/open?id=")[1].split("&")[0]
-            return file_id
-
-        def download_from_drive(url: str) -> bytes:
-            import requests
-            file_id = extract_file_id(url)
-            if not file_id:
-                raise Exception("Không thể trích xuất ID file từ URL")
-            download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-            session = requests.Session()
-            response = session.get(download_url, stream=True)
-            if response.status_code != 200:
-                raise Exception(f"Không tải được file, status {response.status_code}")
-            for key, value in response.cookies.items():
-                if key.startswith("download_warning"):
-                    token = value
-                    params = {"id": file_id, "confirm": token}
-                    response = session.get(download_url, params=params, stream=True)
-                    break
-            if response.status_code != 200:
-                raise Exception(f"Không tải được file (sau khi confirm), status {response.status_code}")
-
-            buf = BytesIO()
-            for chunk in response.iter_content(1024):
-                if chunk:
-                    buf.write(chunk)
-            return buf.getvalue()
-        
         total_rows = len(lines_excel)
         # Tính total_cccd từ số dòng Excel (mỗi dòng = 1 CCCD = 2 ảnh)
         total_cccd = total_rows
@@ -2406,43 +2498,31 @@ class DetectWorkerStreaming(DetectWorker):
             "processed_cccd": 0
         }
         
-        mem_zip = BytesIO()
         total_images = 0
 
         # Xử lý từng cặp ảnh ngay sau khi download
         processed_cccd = 0
         all_results = {"customer": []}
         
+        downloader = drive_download.DriveDownloader()
+        row_items = [self._excel_row_images(*line) for line in lines_excel]
+        downloads = downloader.iter_downloads(item for items in row_items for item in items)
         try:
             # Xử lý từng cặp ảnh (mt + ms)
-            for index, (file_name, mt_url, ms_url) in enumerate(lines_excel, start=1):
-                file_name = file_name.strip()
-                if not file_name:
+            for index, ((file_name, mt_url, ms_url), items) in enumerate(zip(lines_excel, row_items), start=1):
+                if not items:
                     continue
                 
                 # Tạo ZIP tạm cho cặp ảnh này
                 pair_zip = BytesIO()
                 pair_images = []
                 
-                # Tải mặt trước
-                if mt_url:
-                    try:
-                        mt_bytes = download_from_drive(mt_url)
-                        mt_name = f"{file_name}mt.png"
-                        pair_images.append((mt_name, mt_bytes))
+                # Lấy mặt trước/mặt sau đã tải (tải lỗi → đã log, bỏ qua)
+                for _ in items:
+                    img_name, img_bytes = next(downloads)
+                    if img_bytes is not None:
+                        pair_images.append((img_name, img_bytes))
                         total_images += 1
-                    except Exception as e:
-                        print(f"Lỗi tải mặt trước {file_name}: {e}")
-
-                # Tải mặt sau
-                if ms_url:
-                    try:
-                        ms_bytes = download_from_drive(ms_url)
-                        ms_name = f"{file_name}ms.png"
-                        pair_images.append((ms_name, ms_bytes))
-                        total_images += 1
-                    except Exception as e:
-                        print(f"Lỗi tải mặt sau {file_name}: {e}")
                 
                 # Nếu có ít nhất 1 ảnh, xử lý ngay (detect CCCD)
                 if pair_images:
@@ -2462,7 +2542,7 @@ class DetectWorkerStreaming(DetectWorker):
                             cached_models=self.cached_models,
                             base_percent=5 + int((index / total_rows) * 90)  # Progress từ 5% đến 95%
                         )
-                        pair_worker.init_temp_dirs()
+                        pair_worker.init_temp_dirs(create=DEBUG_DUMP)
                         
                         # Xử lý cặp ảnh này
                         pair_result = None
@@ -2541,6 +2621,9 @@ class DetectWorkerStreaming(DetectWorker):
                 "type": "error",
                 "message": f"Lỗi trong quá trình xử lý Excel → ảnh: {e}"
             }
+        finally:
+            downloads.close()
+            downloader.close()
     
     def pdf_to_png_streaming(self, pdf_bytes_input):
         """
@@ -2639,7 +2722,7 @@ class DetectWorkerStreaming(DetectWorker):
                                 cached_models=self.cached_models,
                                 base_percent=5 + int((pair_index / total_cccd) * 90)  # Progress từ 5% đến 95%
                             )
-                            pair_worker.init_temp_dirs()
+                            pair_worker.init_temp_dirs(create=DEBUG_DUMP)
                             
                             # Xử lý cặp ảnh này
                             pair_result = None
@@ -2741,7 +2824,16 @@ class CCCDExtractorStreaming():
         inp_path = data_inp.get("inp_path")
         job_id = data_inp.get("job_id")
         total_cccd = data_inp.get("total_cccd", 0)
-        results = DetectWorker(input_path=inp_path, type_=func_type, cached_models=self.cached_models, job_id=job_id, total_cccd=total_cccd).run()
+        try:
+            results = DetectWorker(input_path=inp_path, type_=func_type, cached_models=self.cached_models, job_id=job_id, total_cccd=total_cccd).run()
+        finally:
+            if job_id:
+                # Token cancel do DetectWorker tạo chỉ sống trong job này
+                try:
+                    from shared.cancellation import release_cancellation_token
+                    release_cancellation_token(job_id)
+                except Exception:
+                    pass
         return results
     
     def handle_task_streaming(self, data_inp: dict, base_percent: int = 0):
@@ -2769,7 +2861,7 @@ class CCCDExtractorStreaming():
             cached_models=self.cached_models,
             base_percent=0
         )
-        worker.init_temp_dirs()
+        worker.init_temp_dirs(create=DEBUG_DUMP)
         
         try:
             for event in worker.excel_to_png_streaming(inp_path):
@@ -2787,7 +2879,7 @@ class CCCDExtractorStreaming():
             cached_models=self.cached_models,
             base_percent=0
         )
-        worker.init_temp_dirs()
+        worker.init_temp_dirs(create=DEBUG_DUMP)
         
         try:
             for event in worker.pdf_to_png_streaming(inp_path):
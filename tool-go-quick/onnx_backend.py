@@ -0,0 +1,405 @@
+"""
+Backend onnxruntime cho 3 model YOLO (best*.onnx) và VietOCR (vgg_transformer_*.onnx) của go-quick
+
+File .onnx tạo bằng export_onnx.py. OnnxYOLO.predict / OnnxOCR.predict_batch trả kết quả cùng dạng
+ultralytics Results / VietOCR Predictor (phần DetectWorker dùng) nên main.py không phải đổi code xử lý;
+pre/post-process (letterbox, NMS, mask → polygon, greedy decode) viết lại bằng numpy giống ultralytics 8.3 / VietOCR,
+không import torch.
+  - GOQUICK_ORT_THREADS: intra-op thread mỗi session (0 = onnxruntime tự chọn theo số core)
+  - GOQUICK_ORT_PROVIDERS: execution provider, vd. "CUDAExecutionProvider,CPUExecutionProvider"
+
+Kiểm tra sai khác so với PyTorch + so sánh latency/RSS: bench_onnx.py
+Backend onnx chỉ load được khi bench_onnx.py --check đã pass với đúng bộ file weight hiện tại
+(onnx_parity.json cạnh file weight, ghi SHA-256 của file .pt/.pth/.onnx): export lại hoặc thay weight → chạy lại --check.
+  - GOQUICK_ONNX_SKIP_PARITY=1: bỏ qua kiểm tra này (chỉ dùng khi debug, log cảnh báo)
+"""
+import os
+import ast
+import json
+import math
+import time
+import hashlib
+import logging
+
+import cv2
+import numpy as np
+
+ORT_THREADS = int(os.getenv('GOQUICK_ORT_THREADS', 0))
+ORT_PROVIDERS = [p.strip() for p in os.getenv('GOQUICK_ORT_PROVIDERS', 'CPUExecutionProvider').split(',') if p.strip()]
+
+ONNX_SKIP_PARITY = os.getenv('GOQUICK_ONNX_SKIP_PARITY', '0') == '1'
+
+logger = logging.getLogger(__name__)
+
+# Tên file .onnx theo file weight PyTorch
+YOLO_ONNX = {'best.pt': 'best.onnx', 'best2.pt': 'best2.onnx', 'best3.pt': 'best3.onnx'}
+OCR_ONNX_PREFIX = 'vgg_transformer'  # vgg_transformer_{cnn,encoder,decoder}.onnx + vgg_transformer_onnx.json
+OCR_ONNX_FILES = tuple(f"{OCR_ONNX_PREFIX}_{part}" for part in ('cnn.onnx', 'encoder.onnx', 'decoder.onnx', 'onnx.json'))
+# Kết quả bench_onnx.py --check, ghi cạnh file weight
+PARITY_FILE = 'onnx_parity.json'
+
+# Mặc định predict của ultralytics
+_IOU_THRESHOLD = 0.7
+_MAX_DET = 300
+_MAX_NMS = 30000
+_MAX_WH = 7680  # offset box theo class để NMS từng class trong 1 lần
+
+
+# ----------------------------------------------------------------------
+# Parity với PyTorch (bench_onnx.py --check)
+# ----------------------------------------------------------------------
+
+class OnnxParityError(RuntimeError):
+    """Chưa có kết quả bench_onnx.py --check pass cho bộ file weight hiện tại"""
+    pass
+
+
+def model_fingerprint(model_dir):
+    """{tên file: SHA-256} của weight PyTorch + file ONNX export từ đó; file thiếu → None"""
+    names = list(YOLO_ONNX) + list(YOLO_ONNX.values()) + ['vgg_transformer.pth'] + list(OCR_ONNX_FILES)
+    fingerprint = {}
+    for name in names:
+        h = hashlib.sha256()
+        try:
+            with open(os.path.join(model_dir, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            fingerprint[name] = h.hexdigest()
+        except OSError:
+            fingerprint[name] = None
+    return fingerprint
+
+
+def write_parity_record(model_dir, passed, tolerance, details):
+    """Ghi kết quả --check (pass/fail, tolerance, lệch từng model) kèm fingerprint của file weight"""
+    record = {
+        'passed': bool(passed),
+        'checked_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'tolerance_px': tolerance,
+        'files': model_fingerprint(model_dir),
+        'details': details,
+    }
+    path = os.path.join(model_dir, PARITY_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def require_parity(model_dir):
+    """
+    Raise OnnxParityError nếu bench_onnx.py --check chưa pass với đúng các file weight/ONNX đang có trong model_dir.
+    GOQUICK_ONNX_SKIP_PARITY=1 → chỉ log cảnh báo.
+    """
+    try:
+        with open(os.path.join(model_dir, PARITY_FILE), encoding='utf-8') as f:
+            record = json.load(f)
+        if not record.get('passed'):
+            problem = f"lần --check gần nhất ({record.get('checked_at')}) không pass"
+        elif record.get('files') != model_fingerprint(model_dir):
+            problem = f"file weight/ONNX đã đổi sau lần --check ({record.get('checked_at')})"
+        else:
+            return
+    except (OSError, ValueError):
+        problem = f"chưa có {PARITY_FILE}"
+    message = f"GOQUICK_BACKEND=onnx: {problem}; chạy python tool-go-quick/bench_onnx.py --check"
+    if ONNX_SKIP_PARITY:
+        logger.warning(f"⚠️ {message} (bỏ qua do GOQUICK_ONNX_SKIP_PARITY=1)")
+        return
+    raise OnnxParityError(message)
+
+
+def create_session(path, threads=None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    threads = ORT_THREADS if threads is None else threads
+    if threads > 0:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=options, providers=ORT_PROVIDERS)
+
+
+# ----------------------------------------------------------------------
+# Kết quả YOLO dạng ultralytics Results (phần DetectWorker dùng)
+# ----------------------------------------------------------------------
+
+class _Array(np.ndarray):
+    """ndarray có .cpu() / .numpy() như torch.Tensor"""
+
+    def __getitem__(self, item):
+        # box.cls[0].cpu().item(): lấy 1 phần tử vẫn phải là _Array (0-d) như tensor, không phải numpy scalar
+        out = super().__getitem__(item)
+        return out if isinstance(out, np.ndarray) else np.asarray(out).view(_Array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.view(np.ndarray)
+
+
+def _array(data, dtype=np.float32):
+    return np.asarray(data, dtype=dtype).view(_Array)
+
+
+class OnnxBoxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = _array(xyxy)
+        self.conf = _array(conf)
+        self.cls = _array(cls)
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield OnnxBoxes(self.xyxy[i:i + 1], self.conf[i:i + 1], self.cls[i:i + 1])
+
+
+class OnnxKeypoints:
+    def __init__(self, xy, conf):
+        self.xy = _array(xy)
+        self.conf = _array(conf)
+
+    def __len__(self):
+        return len(self.xy)
+
+
+class OnnxMasks:
+    """Chỉ giữ polygon (.xy, toạ độ ảnh gốc) như Masks.xy của ultralytics"""
+
+    def __init__(self, xy):
+        self.xy = xy
+
+    def __len__(self):
+        return len(self.xy)
+
+
+class OnnxResult:
+    def __init__(self, boxes, keypoints=None, masks=None):
+        self.boxes = boxes
+        self.keypoints = keypoints
+        self.masks = masks
+
+    def cpu(self):
+        return self
+
+
+# ----------------------------------------------------------------------
+# YOLO
+# ----------------------------------------------------------------------
+
+def _letterbox(img, new_shape, auto=False, stride=32):
+    """
+    ultralytics LetterBox(center=True): resize giữ tỉ lệ + pad 114.
+    auto=True: chỉ pad tới bội của stride (ảnh chữ nhật) như ultralytics khi cả batch cùng kích thước
+    """
+    h, w = img.shape[:2]
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    new_unpad = int(round(w * r)), int(round(h * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = dw % stride, dh % stride
+    dw, dh = dw / 2, dh / 2
+    if (w, h) != new_unpad:
+        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+
+def _scale_coords(input_shape, coords, orig_shape):
+    """Toạ độ trên ảnh letterbox → ảnh gốc (ultralytics scale_boxes / scale_coords), coords[..., :2k] dạng x, y xen kẽ"""
+    gain = min(input_shape[0] / orig_shape[0], input_shape[1] / orig_shape[1])
+    pad_x = round((input_shape[1] - orig_shape[1] * gain) / 2 - 0.1)
+    pad_y = round((input_shape[0] - orig_shape[0] * gain) / 2 - 0.1)
+    coords = coords.copy()
+    coords[..., 0::2] = ((coords[..., 0::2] - pad_x) / gain).clip(0, orig_shape[1])
+    coords[..., 1::2] = ((coords[..., 1::2] - pad_y) / gain).clip(0, orig_shape[0])
+    return coords
+
+
+def _nms(boxes, scores, iou_threshold):
+    """Greedy NMS (như torchvision.ops.nms), trả index theo score giảm dần"""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = (xx2 - xx1).clip(0) * (yy2 - yy1).clip(0)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-7)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def _non_max_suppression(pred, nc, conf, iou=_IOU_THRESHOLD):
+    """
+    pred: (4 + nc + extra, anchors) của 1 ảnh → (n, 6 + extra): x1, y1, x2, y2, conf, cls, extra...
+    (extra = hệ số mask hoặc keypoints), sắp theo conf giảm dần như ultralytics non_max_suppression
+    """
+    x = pred.T
+    scores = x[:, 4:4 + nc]
+    cls = scores.argmax(1)
+    best = scores[np.arange(len(x)), cls]
+    keep = best > conf
+    x, cls, best = x[keep], cls[keep], best[keep]
+    if not len(x):
+        return np.zeros((0, 6 + pred.shape[0] - 4 - nc), dtype=np.float32)
+    order = best.argsort()[::-1][:_MAX_NMS]
+    x, cls, best = x[order], cls[order], best[order]
+    xy, wh = x[:, :2], x[:, 2:4]
+    boxes = np.concatenate([xy - wh / 2, xy + wh / 2], 1)
+    keep = _nms(boxes + cls[:, None] * _MAX_WH, best, iou)[:_MAX_DET]
+    return np.concatenate([boxes[keep], best[keep, None], cls[keep, None].astype(np.float32), x[keep, 4 + nc:]], 1)
+
+
+def _process_masks(protos, coefs, boxes, input_shape):
+    """ultralytics process_mask (upsample): mask logit → crop theo box → resize về ảnh input → > 0"""
+    c, mh, mw = protos.shape
+    masks = (coefs @ protos.reshape(c, -1)).reshape(-1, mh, mw)
+    scaled = boxes * np.array([mw / input_shape[1], mh / input_shape[0]] * 2, dtype=np.float32)
+    cols = np.arange(mw, dtype=np.float32)[None, None, :]
+    rows = np.arange(mh, dtype=np.float32)[None, :, None]
+    x1, y1, x2, y2 = (scaled[:, i, None, None] for i in range(4))
+    masks = masks * ((cols >= x1) & (cols < x2) & (rows >= y1) & (rows < y2))
+    return np.stack([cv2.resize(m, (input_shape[1], input_shape[0]), interpolation=cv2.INTER_LINEAR) > 0
+                     for m in masks]) if len(masks) else np.zeros((0,) + tuple(input_shape), dtype=bool)
+
+
+def _mask_polygons(masks, input_shape, orig_shape):
+    """ultralytics masks2segments(strategy="all") + scale_coords → list polygon (k, 2) trên ảnh gốc"""
+    polygons = []
+    for mask in masks:
+        contours = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        if contours:
+            segment = np.concatenate([c.reshape(-1, 2) for c in contours]).astype(np.float32)
+        else:
+            segment = np.zeros((0, 2), dtype=np.float32)
+        polygons.append(_scale_coords(input_shape, segment, orig_shape))
+    return polygons
+
+
+class OnnxYOLO:
+    """Thay cho ultralytics YOLO (task detect / pose / segment) khi GOQUICK_BACKEND=onnx"""
+
+    def __init__(self, path, threads=None):
+        self.session = create_session(path, threads)
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.task = meta.get('task', 'detect')
+        self.names = ast.literal_eval(meta['names'])
+        imgsz = ast.literal_eval(meta.get('imgsz', '[640, 640]'))
+        self.imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        self.kpt_shape = tuple(ast.literal_eval(meta['kpt_shape'])) if 'kpt_shape' in meta else None
+        self.stride = int(meta.get('stride', 32))
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Export dynamic=True: nhận được ảnh chữ nhật (pad tới bội stride) giống model .pt
+        self.dynamic = not all(isinstance(d, int) for d in model_input.shape[2:])
+
+    def predict(self, source, conf=0.25, save=False, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        if not images:
+            return []
+        auto = self.dynamic and len({img.shape for img in images}) == 1
+        batch = np.stack([_letterbox(img, self.imgsz, auto, self.stride)[..., ::-1].transpose(2, 0, 1) for img in images])
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+        outputs = self.session.run(None, {self.input_name: batch})
+        input_shape = batch.shape[2:]
+        return [self._postprocess(outputs, i, input_shape, img.shape[:2], conf) for i, img in enumerate(images)]
+
+    def _postprocess(self, outputs, index, input_shape, orig_shape, conf):
+        det = _non_max_suppression(outputs[0][index], len(self.names), conf)
+        boxes = OnnxBoxes(_scale_coords(input_shape, det[:, :4], orig_shape), det[:, 4], det[:, 5])
+        if self.task == 'pose':
+            nk, ndim = self.kpt_shape
+            kpts = det[:, 6:].reshape(len(det), nk, ndim)
+            xy = _scale_coords(input_shape, kpts[..., :2].reshape(len(det), -1), orig_shape).reshape(len(det), nk, 2)
+            kpt_conf = kpts[..., 2] if ndim == 3 else np.ones((len(det), nk), dtype=np.float32)
+            return OnnxResult(boxes, keypoints=OnnxKeypoints(xy, kpt_conf))
+        if self.task == 'segment':
+            if not len(det):
+                return OnnxResult(boxes, masks=None)
+            masks = _process_masks(outputs[1][index], det[:, 6:], det[:, :4], input_shape)
+            return OnnxResult(boxes, masks=OnnxMasks(_mask_polygons(masks, input_shape, orig_shape)))
+        return OnnxResult(boxes)
+
+
+# ----------------------------------------------------------------------
+# VietOCR (vgg_transformer: CNN → Transformer encoder → decoder greedy)
+# ----------------------------------------------------------------------
+
+def ocr_resize(w, h, expected_height, image_min_width, image_max_width):
+    """vietocr.tool.translate.resize: chiều rộng sau resize (làm tròn lên bội 10, kẹp trong [min, max])"""
+    new_w = int(expected_height * float(w) / float(h))
+    new_w = math.ceil(new_w / 10) * 10
+    new_w = max(new_w, image_min_width)
+    new_w = min(new_w, image_max_width)
+    return new_w, expected_height
+
+
+class OnnxOCR:
+    """Thay cho VietOCR Predictor (predict / predict_batch trên ảnh PIL) khi GOQUICK_BACKEND=onnx"""
+
+    PAD, SOS, EOS, MASK = 0, 1, 2, 3
+
+    def __init__(self, model_dir, threads=None):
+        prefix = os.path.join(model_dir, OCR_ONNX_PREFIX)
+        with open(f"{prefix}_onnx.json", encoding='utf-8') as f:
+            meta = json.load(f)
+        self.config = {'dataset': meta['dataset'], 'vocab': meta['vocab']}
+        self.max_seq_length = meta.get('max_seq_length', 128)
+        # vietocr Vocab: 0-3 là token đặc biệt, ký tự bắt đầu từ 4
+        self.i2c = {i + 4: c for i, c in enumerate(meta['vocab'])}
+        self.i2c.update({self.PAD: '<pad>', self.SOS: '<sos>', self.EOS: '<eos>', self.MASK: '*'})
+        self.cnn = create_session(f"{prefix}_cnn.onnx", threads)
+        self.encoder = create_session(f"{prefix}_encoder.onnx", threads)
+        self.decoder = create_session(f"{prefix}_decoder.onnx", threads)
+
+    def _preprocess(self, image):
+        """vietocr.tool.translate.process_input: RGB, resize cao image_height (LANCZOS), CHW / 255"""
+        from PIL import Image
+
+        dataset = self.config['dataset']
+        img = image.convert('RGB')
+        new_w, new_h = ocr_resize(*img.size, dataset['image_height'], dataset['image_min_width'], dataset['image_max_width'])
+        img = img.resize((new_w, new_h), Image.LANCZOS)
+        return np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+
+    def _translate(self, batch):
+        """vietocr.tool.translate.translate (greedy): lặp decoder tới khi mọi dòng gặp EOS hoặc max_seq_length"""
+        src = self.cnn.run(None, {'img': batch})[0]
+        memory = self.encoder.run(None, {'src': src})[0]
+        tokens = [[self.SOS] * len(batch)]
+        steps = 0
+        while steps <= self.max_seq_length and not np.any(np.asarray(tokens).T == self.EOS, axis=1).all():
+            output = self.decoder.run(None, {'tgt': np.asarray(tokens, dtype=np.int64), 'memory': memory})[0]
+            tokens.append(output[:, -1].argmax(-1).tolist())
+            steps += 1
+        return np.asarray(tokens).T.tolist()
+
+    def _decode(self, ids):
+        first = 1 if self.SOS in ids else 0
+        last = ids.index(self.EOS) if self.EOS in ids else None
+        return ''.join(self.i2c[i] for i in ids[first:last])
+
+    def predict_batch(self, images):
+        buckets = {}
+        for i, image in enumerate(images):
+            img = self._preprocess(image)
+            buckets.setdefault(img.shape[-1], []).append((i, img))
+        texts = [''] * len(images)
+        for items in buckets.values():
+            batch = np.ascontiguousarray(np.stack([img for _, img in items]))
+            for (i, _), ids in zip(items, self._translate(batch)):
+                texts[i] = self._decode(ids)
+        return texts
+
+    def predict(self, image):
+        return self.predict_batch([image])[0]
@@ -0,0 +1,110 @@
+"""
+Render trang PDF → ảnh BGR (numpy) cho DetectWorker, không qua PNG/ZIP/base64
+
+Trang i → ảnh "{i//2 + 1}{mt|ms}.png" (trang chẵn mặt trước, trang lẻ mặt sau) giống pdf_to_png.
+  - GOQUICK_PDF_DPI: DPI render (0 = mặc định PyMuPDF 72 dpi như trước)
+  - GOQUICK_PDF_RENDER_PROCS: > 1 thì render song song bằng process pool (PyMuPDF không thread-safe),
+    mỗi process mở PDF 1 lần; chỉ tối đa 2 × số process trang được render trước → RAM không phụ thuộc số trang.
+    Process con tạo bằng spawn (không fork từ process đang có thread torch/Redis), pool được đóng hẳn
+    trước khi iter_pdf_pages trả về
+
+Module riêng (không nằm trong main.py) để process con import được theo tên khi main được load bằng importlib.
+
+Usage:
+    names = page_names(pdf_bytes)
+    for name, img in iter_pdf_pages(pdf_bytes, names):
+        ...
+"""
+import os
+import collections
+import multiprocessing
+import concurrent.futures
+
+import cv2
+import fitz
+import numpy as np
+
+PDF_DPI = int(os.getenv('GOQUICK_PDF_DPI', 0))
+PDF_RENDER_PROCS = int(os.getenv('GOQUICK_PDF_RENDER_PROCS', 1))
+
+# PDF đã mở trong process render (process pool)
+_doc = None
+
+
+def is_pdf(data):
+    """bytes PDF hoặc base64 của PDF ("%PDF" → "JVBER")"""
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data[:4]) == b'%PDF'
+    return isinstance(data, str) and data.startswith('JVBER')
+
+
+def page_name(index):
+    pair_num = (index // 2) + 1
+    side = "mt" if index % 2 == 0 else "ms"
+    return f"{pair_num}{side}.png"
+
+
+def page_names(pdf_bytes):
+    """Tên ảnh của mọi trang (chỉ đọc số trang, không render)"""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [page_name(i) for i in range(doc.page_count)]
+
+
+def render_page(doc, index, dpi=PDF_DPI):
+    """Render 1 trang → ảnh BGR"""
+    pix = doc[index].get_pixmap(dpi=dpi) if dpi else doc[index].get_pixmap()
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+    if pix.n == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+
+def _init_worker(pdf_bytes):
+    global _doc
+    _doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _render_in_worker(index, dpi):
+    return render_page(_doc, index, dpi)
+
+
+def iter_pdf_pages(pdf_bytes, names, dpi=PDF_DPI, procs=PDF_RENDER_PROCS):
+    """
+    Yields:
+        (tên ảnh, ảnh BGR) theo thứ tự trang; trang lỗi → (tên ảnh, None)
+    """
+    if procs <= 1:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for index, name in enumerate(names):
+                try:
+                    yield name, render_page(doc, index, dpi)
+                except Exception as e:
+                    print(f"Lỗi xử lý trang {index}: {e}")
+                    yield name, None
+        return
+
+    window = procs * 2
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=procs, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker, initargs=(pdf_bytes,)) as executor:
+        try:
+            for index, name in enumerate(names):
+                pending.append((name, executor.submit(_render_in_worker, index, dpi)))
+                if len(pending) >= window:
+                    yield _page_result(*pending.popleft())
+            while pending:
+                yield _page_result(*pending.popleft())
+        finally:
+            # Dừng giữa chừng (job bị hủy) → bỏ trang chưa render, with chỉ chờ trang đang render
+            for _, future in pending:
+                future.cancel()
+
+
+def _page_result(name, future):
+    try:
+        return name, future.result()
+    except Exception as e:
+        print(f"Lỗi xử lý trang {name}: {e}")
+        return name, None
@@ -0,0 +1,158 @@
+"""
+Cache kết quả OCR của từng ảnh CCCD theo nội dung ảnh (content-addressed), lưu trong Redis
+
+Key = SHA-256 của pixel ảnh (đã decode, nên cùng 1 ảnh gửi lại qua zip / Excel / PDF đều trúng) + version model.
+Value = các dòng OCR của ảnh đó [(field, text)] → DetectWorker ghép lại customer như khi chạy model.
+Value là thông tin CCCD (PII) dạng plain text trong Redis nên cache tắt mặc định, bật thì giữ ngắn hạn.
+Ảnh không tìm thấy CCCD (rows rỗng) không được cache.
+Cache chỉ được tra/lưu trong DetectWorker.run_pipeline (cả bản streaming): GOQUICK_PIPELINE=0 (chạy tuần tự
+từng stage) không dùng cache, DetectWorker log cảnh báo 1 lần.
+  - GOQUICK_RESULT_CACHE: 1 = bật, 0 = tắt (mặc định)
+  - GOQUICK_RESULT_CACHE_MAX: số ảnh tối đa giữ trong cache, vượt thì bỏ ảnh lâu không dùng nhất (LRU)
+  - GOQUICK_RESULT_CACHE_TTL: giây kể từ lúc OCR, hết hạn dù có được dùng lại hay không
+  - GOQUICK_MODEL_VERSION: version model trong key; để trống = tự tính từ GOQUICK_BACKEND + file weight (tên, size, mtime)
+    → thay best*.pt / vgg_transformer.pth / file .onnx hoặc đổi backend là cache cũ không còn được dùng
+
+Redis không kết nối được → coi như miss (không chặn việc xử lý), thử lại sau REDIS_RETRY_SECONDS.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+RESULT_CACHE_ENABLED = os.getenv('GOQUICK_RESULT_CACHE', '0') == '1'
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('GOQUICK_RESULT_CACHE_MAX', 50000))
+RESULT_CACHE_TTL = int(os.getenv('GOQUICK_RESULT_CACHE_TTL', 3600))
+MODEL_VERSION = os.getenv('GOQUICK_MODEL_VERSION', '')
+
+# Tăng khi đổi cách crop/OCR/normalize ra rows → cache cũ không còn khớp
+CACHE_SCHEMA = 1
+REDIS_RETRY_SECONDS = 60
+
+_KEY_PREFIX = 'goquick:ocr'
+_LRU_KEY = f'{_KEY_PREFIX}:lru'  # ZSET key → lần dùng cuối
+_MODEL_FILES = {
+    'torch': ('best.pt', 'best2.pt', 'best3.pt', 'vgg_transformer.pth'),
+    'onnx': ('best.onnx', 'best2.onnx', 'best3.onnx', 'vgg_transformer_cnn.onnx',
+             'vgg_transformer_encoder.onnx', 'vgg_transformer_decoder.onnx'),
+}
+_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+_version = None
+_redis = None
+_redis_failed_at = 0.0
+_lock = threading.Lock()
+
+
+def image_digest(img):
+    """SHA-256 của ảnh BGR (numpy), gồm cả shape để 2 ảnh khác kích thước không trùng"""
+    h = hashlib.sha256()
+    h.update(f"{img.shape}|{img.dtype}".encode())
+    h.update(memoryview(img if img.flags['C_CONTIGUOUS'] else img.copy()).cast('B'))
+    return h.hexdigest()
+
+
+def model_version():
+    global _version
+    if _version is None:
+        if MODEL_VERSION:
+            _version = MODEL_VERSION
+        else:
+            backend = os.getenv('GOQUICK_BACKEND', 'torch').lower()
+            h = hashlib.sha256(f"{CACHE_SCHEMA}|{backend}".encode())
+            for name in _MODEL_FILES.get(backend, ()):
+                try:
+                    st = os.stat(os.path.join(_MODEL_DIR, name))
+                    h.update(f"{name}|{st.st_size}|{st.st_mtime_ns}".encode())
+                except OSError:
+                    h.update(f"{name}|missing".encode())
+            _version = h.hexdigest()[:16]
+    return _version
+
+
+def _get_redis():
+    """Redis client dùng chung của project (shared.redis_client); lỗi gần đây → None"""
+    global _redis, _redis_failed_at
+    if _redis is not None:
+        return _redis
+    if time.time() - _redis_failed_at < REDIS_RETRY_SECONDS:
+        return None
+    with _lock:
+        if _redis is None:
+            try:
+                project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                if project_root not in sys.path:
+                    sys.path.insert(0, project_root)
+                from shared.redis_client import get_redis_client
+                client = get_redis_client()
+                client.ping()
+                _redis = client
+            except Exception as e:
+                print(f"⚠️ Result cache tắt tạm thời, không kết nối được Redis: {e}")
+                _redis_failed_at = time.time()
+    return _redis
+
+
+def _failed(e):
+    global _redis, _redis_failed_at
+    print(f"⚠️ Lỗi result cache: {e}")
+    _redis = None
+    _redis_failed_at = time.time()
+
+
+def _key(digest):
+    return f"{_KEY_PREFIX}:{model_version()}:{digest}"
+
+
+def get(digest):
+    """
+    Returns:
+        [(field, text)] đã cache của ảnh; miss / cache tắt / Redis lỗi → None
+    """
+    if not RESULT_CACHE_ENABLED:
+        return None
+    client = _get_redis()
+    if client is None:
+        return None
+    key = _key(digest)
+    try:
+        raw = client.get(key)
+        if raw is None:
+            return None
+        # Chỉ cập nhật LRU, không gia hạn TTL: PII không sống quá RESULT_CACHE_TTL kể từ lúc OCR
+        client.zadd(_LRU_KEY, {key: time.time()})
+        return [tuple(row) for row in json.loads(raw)]
+    except Exception as e:
+        _failed(e)
+        return None
+
+
+def put(digest, rows):
+    """
+    Lưu [(field, text)] của ảnh, rồi bỏ các ảnh lâu không dùng nhất nếu vượt RESULT_CACHE_MAX_ENTRIES.
+    rows rỗng (không tìm thấy CCCD, có thể do lỗi tạm thời) không lưu → lần sau ảnh được chạy lại model.
+    """
+    if not RESULT_CACHE_ENABLED or not rows:
+        return
+    client = _get_redis()
+    if client is None:
+        return
+    key = _key(digest)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.set(key, json.dumps(rows, ensure_ascii=False), ex=RESULT_CACHE_TTL)
+        now = time.time()
+        pipe.zadd(_LRU_KEY, {key: now})
+        # Key đã hết TTL thì bỏ khỏi LRU luôn
+        pipe.zremrangebyscore(_LRU_KEY, 0, now - RESULT_CACHE_TTL)
+        pipe.zcard(_LRU_KEY)
+        size = pipe.execute()[-1]
+        overflow = size - RESULT_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [member for member, _ in client.zpopmin(_LRU_KEY, overflow)]
+            if evicted:
+                client.delete(*evicted)
+    except Exception as e:
+        _failed(e)
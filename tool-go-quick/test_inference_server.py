@@ -0,0 +1,120 @@
+"""
+Test inference_server: client ↔ server qua Unix socket với model giả (không cần torch/weights)
+
+Run:
+  python -m pytest -q tool-go-quick/test_inference_server.py
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import inference_server as inf
+
+AUTHKEY = b'test-inference-key'
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='Unix socket')
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.boxes = value
+        self.keypoints = None
+        self.masks = None
+
+    def cpu(self):
+        return self
+
+
+class FakeYOLO:
+    names = {0: 'card'}
+
+    def predict(self, source, save=False, conf=0.5):
+        outputs = []
+        for item in source:
+            if item == 'crash':
+                os._exit(1)
+            if item == 'slow':
+                time.sleep(5)
+            outputs.append(FakeResult(f"{item}@{conf}"))
+        return outputs
+
+
+class FakeOCR:
+    config = {'dataset': {'image_height': 32}}
+
+    def predict_batch(self, images):
+        return [str(image).upper() for image in images]
+
+
+def load_fake_models():
+    models = {key: FakeYOLO() for key in inf.YOLO_WEIGHTS}
+    models[inf.OCR_MODEL] = FakeOCR()
+    return models
+
+
+@pytest.fixture
+def server(tmp_path):
+    address = str(tmp_path / 'inference.sock')
+    srv = inf.InferenceServer(address=address, authkey=AUTHKEY, procs=1, load_models=load_fake_models)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 60
+    while not os.path.exists(address):
+        assert time.monotonic() < deadline, 'server không start'
+        time.sleep(0.1)
+    yield srv
+    srv.stop()
+
+
+def test_round_trip(server):
+    client = inf.InferenceClient(address=server.address, authkey=AUTHKEY, timeout=30)
+    cache = client.model_cache()
+
+    results = cache['yolo_model1'].predict(source=['a', 'b'], conf=0.7)
+    assert [r.boxes for r in results] == ['a@0.7', 'b@0.7']
+    assert cache['yolo_model2'].names == {0: 'card'}
+    assert cache[inf.OCR_MODEL].predict_batch(['x', 'y']) == ['X', 'Y']
+    assert cache[inf.OCR_MODEL].config['dataset']['image_height'] == 32
+
+
+def test_socket_is_private(server):
+    assert os.stat(server.address).st_mode & 0o777 == 0o600
+
+
+def test_wrong_authkey_is_rejected(server):
+    client = inf.InferenceClient(address=server.address, authkey=b'wrong', timeout=30)
+    with pytest.raises(multiprocessing.AuthenticationError):
+        client.connect(wait=5)
+    # Server vẫn phục vụ client đúng key
+    ok = inf.InferenceClient(address=server.address, authkey=AUTHKEY, timeout=30)
+    assert ok.call(inf.OCR_MODEL, ['z']) == ['Z']
+
+
+def test_missing_authkey_refuses_to_start(tmp_path):
+    with pytest.raises(RuntimeError, match='GOQUICK_INFERENCE_AUTHKEY'):
+        inf.InferenceServer(address=str(tmp_path / 's.sock'), authkey=b'')
+    with pytest.raises(RuntimeError, match='GOQUICK_INFERENCE_AUTHKEY'):
+        inf.InferenceClient(address=str(tmp_path / 's.sock'), authkey=b'')
+
+
+def test_dead_inference_process_fails_fast(server):
+    client = inf.InferenceClient(address=server.address, authkey=AUTHKEY, timeout=60)
+    start = time.monotonic()
+    with pytest.raises(Exception, match='đã dừng'):
+        client.call('yolo_model1', ['crash'])
+    assert time.monotonic() - start < 10
+
+
+def test_server_stop_fails_pending_requests_fast(server):
+    client = inf.InferenceClient(address=server.address, authkey=AUTHKEY, timeout=60)
+    client.connect()
+    threading.Timer(0.5, server.stop).start()
+    start = time.monotonic()
+    with pytest.raises(Exception, match='Mất kết nối'):
+        client.call('yolo_model1', ['slow'])
+    assert time.monotonic() - start < 10
@@ -0,0 +1,98 @@
+"""
+Test phần numpy của onnx_backend không cần weight / onnxruntime: ocr_resize, letterbox + scale ngược,
+kiểm tra onnx_parity.json (kết quả bench_onnx.py --check)
+
+Run:
+  python -m pytest -q tool-go-quick/test_onnx_backend.py
+"""
+import os
+import sys
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import onnx_backend as ob
+
+
+@pytest.mark.parametrize('w, h, expected', [
+    (100, 32, 100),   # đã là bội 10
+    (105, 32, 110),   # làm tròn lên bội 10
+    (99, 40, 80),     # int(79.2) = 79 → 80
+    (10, 64, 32),     # kẹp image_min_width
+    (5000, 32, 512),  # kẹp image_max_width
+])
+def test_ocr_resize(w, h, expected):
+    assert ob.ocr_resize(w, h, 32, 32, 512) == (expected, 32)
+
+
+@pytest.mark.parametrize('shape, auto, out_shape, top', [
+    ((480, 640), False, (640, 640), 80),   # pad đủ ô vuông
+    ((480, 640), True, (480, 640), 0),     # 160 % 32 = 0 → không pad
+    ((301, 500), True, (416, 640), 15),    # 255 % 32 = 31 → pad 15 trên / 16 dưới
+    ((640, 320), False, (640, 640), 0),    # ảnh dọc: pad trái/phải
+])
+def test_letterbox_shape_and_padding(shape, auto, out_shape, top):
+    img = np.full(shape + (3,), 200, dtype=np.uint8)
+    out = ob._letterbox(img, (640, 640), auto=auto)
+    assert out.shape == out_shape + (3,)
+    assert out.dtype == np.uint8
+    if top:
+        assert (out[top - 1] == 114).all()
+        assert (out[top] == 200).all()
+    assert out[out_shape[0] // 2, out_shape[1] // 2].tolist() == [200, 200, 200]
+
+
+@pytest.mark.parametrize('shape, auto', [((480, 640), False), ((301, 500), True), ((640, 320), False)])
+def test_scale_coords_inverts_letterbox(shape, auto):
+    h, w = shape
+    out_shape = ob._letterbox(np.zeros(shape + (3,), dtype=np.uint8), (640, 640), auto=auto).shape[:2]
+    gain = min(out_shape[0] / h, out_shape[1] / w)
+    pad_x, pad_y = (out_shape[1] - w * gain) / 2, (out_shape[0] - h * gain) / 2
+    points = np.array([[0, 0, w, h], [w / 4, h / 3, w / 2, h / 2]], dtype=np.float32)
+    boxed = points.copy()
+    boxed[:, 0::2] = boxed[:, 0::2] * gain + pad_x
+    boxed[:, 1::2] = boxed[:, 1::2] * gain + pad_y
+    assert np.abs(ob._scale_coords(out_shape, boxed, shape) - points).max() < 1.0
+
+
+def _model_dir(tmp_path):
+    for name in list(ob.YOLO_ONNX) + list(ob.YOLO_ONNX.values()) + ['vgg_transformer.pth'] + list(ob.OCR_ONNX_FILES):
+        (tmp_path / name).write_bytes(name.encode())
+    return str(tmp_path)
+
+
+def test_require_parity_without_record(tmp_path):
+    with pytest.raises(ob.OnnxParityError, match=ob.PARITY_FILE):
+        ob.require_parity(_model_dir(tmp_path))
+
+
+def test_require_parity_passed_record(tmp_path):
+    model_dir = _model_dir(tmp_path)
+    ob.write_parity_record(model_dir, True, 2.0, {'fixtures': 4})
+    ob.require_parity(model_dir)
+    assert json.loads((tmp_path / ob.PARITY_FILE).read_text(encoding='utf-8'))['details'] == {'fixtures': 4}
+
+
+def test_require_parity_failed_record(tmp_path):
+    model_dir = _model_dir(tmp_path)
+    ob.write_parity_record(model_dir, False, 2.0, {})
+    with pytest.raises(ob.OnnxParityError, match='không pass'):
+        ob.require_parity(model_dir)
+
+
+def test_require_parity_rejects_reexported_model(tmp_path):
+    model_dir = _model_dir(tmp_path)
+    ob.write_parity_record(model_dir, True, 2.0, {})
+    (tmp_path / 'best2.onnx').write_bytes(b're-exported')
+    with pytest.raises(ob.OnnxParityError, match='đã đổi'):
+        ob.require_parity(model_dir)
+
+
+def test_require_parity_skip(tmp_path, monkeypatch):
+    monkeypatch.setattr(ob, 'ONNX_SKIP_PARITY', True)
+    ob.require_parity(_model_dir(tmp_path))
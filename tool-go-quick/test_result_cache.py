@@ -0,0 +1,110 @@
+"""
+Test result_cache (hit, TTL không gia hạn, bỏ qua rows rỗng, tắt mặc định) trên fakeredis
+
+Run (cần pytest + fakeredis, không cần Redis thật / torch / weights):
+  python -m pytest -q tool-go-quick/test_result_cache.py
+"""
+import os
+import sys
+import time
+import importlib
+
+import pytest
+import redis
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import result_cache
+
+DIGEST = 'a' * 64
+ROWS = [('id', '001099012345'), ('name', 'NGUYỄN VĂN A')]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = redis.Redis(connection_pool=redis.ConnectionPool(
+        server=fakeredis.FakeServer(), connection_class=fakeredis.FakeRedisConnection))
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_ENABLED', True)
+    monkeypatch.setattr(result_cache, 'MODEL_VERSION', 'test')
+    monkeypatch.setattr(result_cache, '_version', None)
+    monkeypatch.setattr(result_cache, '_redis', client)
+    return client
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('GOQUICK_RESULT_CACHE', raising=False)
+    try:
+        assert importlib.reload(result_cache).RESULT_CACHE_ENABLED is False
+    finally:
+        importlib.reload(result_cache)
+
+
+def test_disabled_cache_never_touches_redis(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_ENABLED', False)
+    result_cache.put(DIGEST, ROWS)
+    assert client.keys('*') == []
+    assert result_cache.get(DIGEST) is None
+
+
+def test_put_then_get_hits(client):
+    assert result_cache.get(DIGEST) is None
+    result_cache.put(DIGEST, ROWS)
+    assert result_cache.get(DIGEST) == ROWS
+    assert result_cache.get('b' * 64) is None
+
+
+def test_empty_rows_are_not_cached(client):
+    result_cache.put(DIGEST, [])
+    assert client.keys('*') == []
+    assert result_cache.get(DIGEST) is None
+
+
+def test_hit_does_not_extend_ttl(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_TTL', 100)
+    result_cache.put(DIGEST, ROWS)
+    key = result_cache._key(DIGEST)
+    client.expire(key, 5)
+
+    assert result_cache.get(DIGEST) == ROWS
+    assert client.ttl(key) <= 5
+
+
+def test_entry_expires_after_ttl(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_TTL', 1)
+    result_cache.put(DIGEST, ROWS)
+    assert result_cache.get(DIGEST) == ROWS
+    time.sleep(1.1)
+    assert result_cache.get(DIGEST) is None
+
+
+def test_lru_eviction(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_MAX_ENTRIES', 2)
+    result_cache.put('1' * 64, ROWS)
+    result_cache.put('2' * 64, ROWS)
+    # Dùng lại ảnh 1 → ảnh 2 thành ảnh lâu không dùng nhất
+    result_cache.get('1' * 64)
+    result_cache.put('3' * 64, ROWS)
+
+    assert result_cache.get('1' * 64) == ROWS
+    assert result_cache.get('2' * 64) is None
+    assert result_cache.get('3' * 64) == ROWS
+
+
+def test_model_version_is_part_of_key(client, monkeypatch):
+    result_cache.put(DIGEST, ROWS)
+    monkeypatch.setattr(result_cache, 'MODEL_VERSION', 'other')
+    monkeypatch.setattr(result_cache, '_version', None)
+    assert result_cache.get(DIGEST) is None
+
+
+def test_image_digest_depends_on_pixels_and_shape():
+    np = pytest.importorskip('numpy')
+    img = np.zeros((4, 6, 3), dtype=np.uint8)
+    assert result_cache.image_digest(img) == result_cache.image_digest(img.copy())
+    # Ảnh không C-contiguous (slice) cho cùng digest với bản copy
+    assert result_cache.image_digest(np.zeros((4, 12, 3), dtype=np.uint8)[:, ::2]) == result_cache.image_digest(img)
+    assert result_cache.image_digest(img.reshape(6, 4, 3)) != result_cache.image_digest(img)
+    other = img.copy()
+    other[0, 0, 0] = 1
+    assert result_cache.image_digest(other) != result_cache.image_digest(img)
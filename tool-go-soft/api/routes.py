@@ -411,7 +411,8 @@ def register_routes(app, prefix):
             "session_id": "...",
             "tokhai_type": "842" hoặc "01/GTGT" hoặc "00" (Tất cả) hoặc null,
             "start_date": "01/01/2023",
-            "end_date": "31/12/2023"
+            "end_date": "31/12/2023",
+            "parallel_ranges": 3  # Optional - crawl song song N khoảng ~1 năm trên N page clone cookies (mặc định GOSOFT_CRAWL_PARALLEL_RANGES)
         }
         Returns: { "status": "accepted", "job_id": "..." }
         
@@ -421,7 +422,8 @@ def register_routes(app, prefix):
         try:
             from quart import request
             import asyncio
-            from shared.redis_client import publish_progress
+            from shared.redis_async import apublish_progress, ais_job_cancelled, aset_status
+            from shared.cancellation import release_cancellation_token
             
             data = await request.get_json()
             job_id = data.get("job_id")
@@ -429,6 +431,7 @@ def register_routes(app, prefix):
             tokhai_type = data.get("tokhai_type")  # Có thể là None, "00", hoặc giá trị cụ thể
             start_date = data.get("start_date")
             end_date = data.get("end_date")
+            parallel_ranges = data.get("parallel_ranges")  # Optional - số khoảng thời gian crawl song song
             
             if not all([job_id, session_id, start_date, end_date]):
                 return jsonify({
@@ -457,32 +460,27 @@ def register_routes(app, prefix):
                     accumulated_total = 0
                     accumulated_downloaded = 0
                     
-                    async for event in tc.crawl_tokhai(session_id, tokhai_type, start_date, end_date, job_id=job_id):
+                    async for event in tc.crawl_tokhai(session_id, tokhai_type, start_date, end_date, job_id=job_id, parallel_ranges=parallel_ranges):
                         # ✅ Check cancelled trước khi xử lý event tiếp theo
-                        from shared.redis_client import get_redis_client
-                        check_redis = get_redis_client()
-                        cancelled = check_redis.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
-                                check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                publish_progress(job_id, 0, "Job đã bị hủy")
-                                break
+                        if await ais_job_cancelled(job_id):
+                            logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
+                            await apublish_progress(job_id, 0, "Job đã bị hủy")
+                            await aset_status(job_id, "cancelled")
+                            break
                         
                         event_type = event.get('type', 'unknown')
                         
                         # ✅ Nếu event là error với JOB_CANCELLED, dừng ngay
                         if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
                             logger.info(f"[API] Job {job_id} đã bị cancel từ crawler")
-                            check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            publish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await apublish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await aset_status(job_id, "cancelled")
                             break
                         
                         if event_type == 'progress':
                             percent = event.get('percent', 0)
                             message = event.get('message', 'Đang xử lý...')
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'info':
                             message = event.get('message', '')
@@ -490,7 +488,7 @@ def register_routes(app, prefix):
                             percent = event.get('accumulated_percent', event.get('percent', 0))
                             if isinstance(percent, float):
                                 percent = int(percent)
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'special_items':
                             # ✅ Forward accumulated_percent và các field khác từ event để không reset về 0%
@@ -498,12 +496,12 @@ def register_routes(app, prefix):
                             if isinstance(percent, float):
                                 percent = int(percent)
                             message = event.get('message', '')
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'download_start':
                             total = event.get('accumulated_total', event.get('total', 0))
                             accumulated_total = total
-                            publish_progress(job_id, 0, f"Bắt đầu tải {total} file...", event)
+                            await apublish_progress(job_id, 0, f"Bắt đầu tải {total} file...", event)
                             
                         elif event_type == 'download_progress':
                             current = event.get('accumulated_downloaded', event.get('current', 0))
@@ -535,7 +533,7 @@ def register_routes(app, prefix):
                             # LOG: Kiểm tra event trước khi publish
                             logger.info(f"[API] download_progress event before publish: accumulated_percent={event.get('accumulated_percent')}, accumulated_total={event.get('accumulated_total')}, accumulated_downloaded={event.get('accumulated_downloaded')}, thuyet_minh_downloaded={event.get('thuyet_minh_downloaded')}, thuyet_minh_total={event.get('thuyet_minh_total')}")
                             
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'item':
                             results.append(event.get('data'))
@@ -550,9 +548,6 @@ def register_routes(app, prefix):
                             total_count = total_from_event
                             
                             # Publish complete event
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            
                             result_data = {
                                 'total': total_count,  # ✅ Số file đã tải (tờ khai + tờ thuyết minh)
                                 'zip_filename': zip_filename,
@@ -566,29 +561,24 @@ def register_routes(app, prefix):
                                 'special_items_count': event.get('special_items_count'),
                                 'message': event.get('message')
                             }
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
-                            
-                            publish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await apublish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await aset_status(job_id, "completed", result=json.dumps(result_data))
                             logger.info(f"[API] Job {job_id} completed: {total_count} file (tokhai: {event.get('tokhai_downloaded', 0)}, thuyet_minh: {event.get('thuyet_minh_downloaded', 0)}), download_id: {download_id}")
                             
                         elif event_type == 'error':
                             error_msg = event.get('error', 'Lỗi không xác định')
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                            publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await aset_status(job_id, "failed", error=error_msg)
                             logger.error(f"[API] Job {job_id} error: {error_msg}")
                             
                 except Exception as e:
                     error_msg = str(e)
                     logger.error(f"[API] Error in crawl_and_publish for job {job_id}: {error_msg}")
-                    from shared.redis_client import get_redis_client
-                    redis_client = get_redis_client()
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                    publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await aset_status(job_id, "failed", error=error_msg)
+                finally:
+                    # Token cancel của job chỉ dùng trong task này
+                    release_cancellation_token(job_id)
             
             # Chạy crawl trong background
             asyncio.create_task(crawl_and_publish())
@@ -614,7 +604,8 @@ def register_routes(app, prefix):
             "job_id": "...",  # Job ID để publish events
             "session_id": "...",
             "start_date": "01/01/2023",
-            "end_date": "31/12/2023"
+            "end_date": "31/12/2023",
+            "parallel_ranges": 3  # Optional - như /crawl/tokhai
         }
         Returns: { "status": "accepted", "job_id": "..." }
         
@@ -623,13 +614,15 @@ def register_routes(app, prefix):
         try:
             from quart import request
             import asyncio
-            from shared.redis_client import publish_progress
+            from shared.redis_async import apublish_progress, ais_job_cancelled, aset_status
+            from shared.cancellation import release_cancellation_token
             
             data = await request.get_json()
             job_id = data.get("job_id")
             session_id = data.get("session_id")
             start_date = data.get("start_date")
             end_date = data.get("end_date")
+            parallel_ranges = data.get("parallel_ranges")  # Optional - số khoảng thời gian crawl song song
             
             # ✅ job_id là required (giống tờ khai)
             if not all([job_id, session_id, start_date, end_date]):
@@ -656,26 +649,21 @@ def register_routes(app, prefix):
                     accumulated_total = 0
                     accumulated_downloaded = 0
                     
-                    async for event in tc.crawl_thongbao(session_id, start_date, end_date, job_id=job_id):
+                    async for event in tc.crawl_thongbao(session_id, start_date, end_date, job_id=job_id, parallel_ranges=parallel_ranges):
                         # ✅ Check cancelled trước khi xử lý event tiếp theo (giống tờ khai)
-                        from shared.redis_client import get_redis_client
-                        check_redis = get_redis_client()
-                        cancelled = check_redis.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
-                                check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                publish_progress(job_id, 0, "Job đã bị hủy")
-                                break
+                        if await ais_job_cancelled(job_id):
+                            logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
+                            await apublish_progress(job_id, 0, "Job đã bị hủy")
+                            await aset_status(job_id, "cancelled")
+                            break
                         
                         event_type = event.get('type', 'unknown')
                         
                         # ✅ Nếu event là error với JOB_CANCELLED, dừng ngay
                         if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
                             logger.info(f"[API] Job {job_id} đã bị cancel từ crawler")
-                            check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            publish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await apublish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await aset_status(job_id, "cancelled")
                             break
                         
                         if event_type == 'progress':
@@ -683,13 +671,13 @@ def register_routes(app, prefix):
                             accumulated_percent = event.get('accumulated_percent', percent)
                             message = event.get('message', 'Đang xử lý...')
                             logger.debug(f"📤 [ROUTES] [THONGBAO] Publish progress: {percent}% (accumulated: {accumulated_percent}%)")
-                            publish_progress(job_id, accumulated_percent if accumulated_percent is not None else percent, message, event)
+                            await apublish_progress(job_id, accumulated_percent if accumulated_percent is not None else percent, message, event)
                             
                         elif event_type == 'info':
                             message = event.get('message', '')
                             accumulated_percent = event.get('accumulated_percent')
                             logger.debug(f"📤 [ROUTES] [THONGBAO] Publish info: {message}")
-                            publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, message, event)
+                            await apublish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, message, event)
                             
                         elif event_type == 'download_start':
                             total = event.get('accumulated_total', event.get('total', 0))
@@ -699,7 +687,7 @@ def register_routes(app, prefix):
                             total_ranges = event.get('total_ranges', '?')
                             date_range = event.get('date_range', '?')
                             logger.debug(f"📤 [ROUTES] [THONGBAO] Publish download_start: Range {range_index}/{total_ranges} ({date_range}), Total: {total}")
-                            publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, f"Bắt đầu tải {total} file...", event)
+                            await apublish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, f"Bắt đầu tải {total} file...", event)
                             
                         elif event_type == 'download_progress':
                             current = event.get('accumulated_downloaded', event.get('current', 0))
@@ -709,7 +697,7 @@ def register_routes(app, prefix):
                             accumulated_percent = event.get('accumulated_percent')
                             percent = accumulated_percent if accumulated_percent is not None else (int((current / total) * 100) if total > 0 else 0)
                             logger.debug(f"📤 [ROUTES] [THONGBAO] Publish download_progress: {current}/{total} files, Accumulated %: {accumulated_percent}%")
-                            publish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
+                            await apublish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
                             
                         elif event_type == 'item':
                             results.append(event.get('data'))
@@ -724,36 +712,28 @@ def register_routes(app, prefix):
                             else:
                                 total_count = total_from_event
                             
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            
                             result_data = {
                                 'total': total_count,
                                 'zip_filename': zip_filename,
                                 'has_zip': False,
                                 'download_id': download_id
                             }
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
-                            
-                            publish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await apublish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await aset_status(job_id, "completed", result=json.dumps(result_data))
                             
                         elif event_type == 'error':
                             error_msg = event.get('error', 'Lỗi không xác định')
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                            publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await aset_status(job_id, "failed", error=error_msg)
                             
                 except Exception as e:
                     error_msg = str(e)
                     logger.error(f"[API] Lỗi trong quá trình crawl thông báo cho job {job_id}: {error_msg}")
-                    from shared.redis_client import get_redis_client
-                    redis_client = get_redis_client()
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                    publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await aset_status(job_id, "failed", error=error_msg)
+                finally:
+                    # Token cancel của job chỉ dùng trong task này
+                    release_cancellation_token(job_id)
             
             asyncio.create_task(crawl_and_publish())
             
@@ -780,19 +760,22 @@ def register_routes(app, prefix):
             "job_id": "...",  # Optional - nếu có thì dùng queue mode
             "session_id": "...",
             "start_date": "01/01/2023",
-            "end_date": "31/12/2023"
+            "end_date": "31/12/2023",
+            "parallel_ranges": 3  # Optional - như /crawl/tokhai
         }
         """
         try:
             from quart import request, Response
             import asyncio
-            from shared.redis_client import publish_progress
+            from shared.redis_async import apublish_progress, ais_job_cancelled, aset_status
+            from shared.cancellation import release_cancellation_token
             
             data = await request.get_json()
             job_id = data.get("job_id")
             session_id = data.get("session_id")
             start_date = data.get("start_date")
             end_date = data.get("end_date")
+            parallel_ranges = data.get("parallel_ranges")  # Optional - số khoảng thời gian crawl song song
             
             # Validate required fields (job_id is optional)
             if not all([session_id, start_date, end_date]):
@@ -826,7 +809,7 @@ def register_routes(app, prefix):
                 tc = get_tax_crawler()
 
                 async def generate():
-                    async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date, job_id=None):
+                    async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date, job_id=None, parallel_ranges=parallel_ranges):
                         yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
 
                 return Response(
@@ -850,26 +833,21 @@ def register_routes(app, prefix):
                     accumulated_total = 0
                     accumulated_downloaded = 0
                     
-                    async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date):
+                    async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date, parallel_ranges=parallel_ranges):
                         # ✅ Check cancelled trước khi xử lý event tiếp theo
-                        from shared.redis_client import get_redis_client
-                        check_redis = get_redis_client()
-                        cancelled = check_redis.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
-                                check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                publish_progress(job_id, 0, "Job đã bị hủy")
-                                break
+                        if await ais_job_cancelled(job_id):
+                            logger.info(f"[API] Job {job_id} đã bị cancel, dừng crawl")
+                            await apublish_progress(job_id, 0, "Job đã bị hủy")
+                            await aset_status(job_id, "cancelled")
+                            break
                         
                         event_type = event.get('type', 'unknown')
                         
                         # ✅ Nếu event là error với JOB_CANCELLED, dừng ngay
                         if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
                             logger.info(f"[API] Job {job_id} đã bị cancel từ crawler")
-                            check_redis.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                            publish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await apublish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await aset_status(job_id, "cancelled")
                             break
                         
                         if event_type == 'progress':
@@ -878,7 +856,7 @@ def register_routes(app, prefix):
                             if isinstance(percent, float):
                                 percent = int(percent)
                             message = event.get('message', 'Đang xử lý...')
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'info':
                             message = event.get('message', '')
@@ -886,12 +864,12 @@ def register_routes(app, prefix):
                             percent = event.get('accumulated_percent', event.get('percent', 0))
                             if isinstance(percent, float):
                                 percent = int(percent)
-                            publish_progress(job_id, percent, message, event)
+                            await apublish_progress(job_id, percent, message, event)
                             
                         elif event_type == 'download_start':
                             total = event.get('accumulated_total', event.get('total', 0))
                             accumulated_total = total
-                            publish_progress(job_id, 0, f"Bắt đầu tải {total} file...", event)
+                            await apublish_progress(job_id, 0, f"Bắt đầu tải {total} file...", event)
                             
                         elif event_type == 'download_progress':
                             current = event.get('accumulated_downloaded', event.get('current', 0))
@@ -899,7 +877,7 @@ def register_routes(app, prefix):
                             accumulated_total = total
                             accumulated_downloaded = current
                             percent = int((current / total) * 100) if total > 0 else 0
-                            publish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
+                            await apublish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
                             
                         elif event_type == 'item':
                             results.append(event.get('data'))
@@ -914,36 +892,28 @@ def register_routes(app, prefix):
                             else:
                                 total_count = total_from_event
                             
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            
                             result_data = {
                                 'total': total_count,
                                 'zip_filename': zip_filename,
                                 'has_zip': False,
                                 'download_id': download_id
                             }
-                            redis_client.set(f"job:{job_id}:result", json.dumps(result_data).encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
-                            
-                            publish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await apublish_progress(job_id, 100, "Hoàn thành crawl", event)
+                            await aset_status(job_id, "completed", result=json.dumps(result_data))
                             
                         elif event_type == 'error':
                             error_msg = event.get('error', 'Lỗi không xác định')
-                            from shared.redis_client import get_redis_client
-                            redis_client = get_redis_client()
-                            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                            publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                            await aset_status(job_id, "failed", error=error_msg)
 
                 except Exception as e:
                     error_msg = str(e)
                     logger.error(f"[API] Lỗi trong quá trình crawl giấy nộp tiền cho job {job_id}: {error_msg}")
-                    from shared.redis_client import get_redis_client
-                    redis_client = get_redis_client()
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                    publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await aset_status(job_id, "failed", error=error_msg)
+                finally:
+                    # Token cancel của job chỉ dùng trong task này
+                    release_cancellation_token(job_id)
 
             asyncio.create_task(crawl_and_publish())
             
@@ -1563,7 +1533,24 @@ def register_routes(app, prefix):
                 "message": str(e)
             }), 500
     
-    # ==================== BATCH CRAWL (Queue Mode - Redis Polling) ====================
+    @app.route(f'{prefix}/debug/wait-stats', methods=['GET'])
+    async def debug_wait_stats():
+        """
+        Thời gian đợi điều hướng trang thuế theo từng bước (services/waits.py), bước tốn nhiều nhất trước
+        Query: reset=1 → xóa thống kê sau khi trả về
+        """
+        from quart import request
+        from services import waits
+        
+        stats = waits.wait_stats()
+        if request.args.get("reset") == "1":
+            waits.reset_wait_stats()
+        return jsonify({
+            "status": "success",
+            "stats": stats
+        })
+    
+        # ==================== BATCH CRAWL (Queue Mode - Redis Polling) ====================
     
     @app.route(f'{prefix}/crawl/batch/queue', methods=['POST'])
     async def batch_crawl_queue():
@@ -1584,7 +1571,8 @@ def register_routes(app, prefix):
         try:
             from quart import request
             import asyncio
-            from shared.redis_client import publish_progress, get_redis_client
+            from shared.redis_async import apublish_progress, ais_job_cancelled, aset_status
+            from shared.cancellation import release_cancellation_token
             
             data = await request.get_json()
             job_id = data.get("job_id")
@@ -1617,338 +1605,127 @@ def register_routes(app, prefix):
             
             async def crawl_and_publish():
                 try:
-                    redis_client = get_redis_client()
                     tc = get_tax_crawler()
                     batch_results = {}
                     total_types = len(crawl_types)
+                    type_labels = {
+                        'tokhai': 'Tờ khai',
+                        'thongbao': 'Thông báo',
+                        'giaynoptien': 'Giấy nộp tiền'
+                    }
+                    # Track accumulated values cho từng loại crawl (các loại chạy song song)
+                    type_accumulated_total = {crawl_type: 0 for crawl_type in crawl_types}
+                    type_accumulated_downloaded = {crawl_type: 0 for crawl_type in crawl_types}
+                    merged_download_id = None
+                    merged_zip_filename = None
                     
-                    publish_progress(job_id, 0, f"Bắt đầu crawl {total_types} loại...", {
+                    await apublish_progress(job_id, 0, f"Bắt đầu crawl {total_types} loại...", {
                         'type': 'batch_start',
                         'total_types': total_types
                     })
                     
-                    for type_index, crawl_type in enumerate(crawl_types, 1):
-                        type_label = {
-                            'tokhai': 'Tờ khai',
-                            'thongbao': 'Thông báo',
-                            'giaynoptien': 'Giấy nộp tiền'
-                        }.get(crawl_type, crawl_type)
+                    # Các loại chạy song song trong tc.crawl_batch, event nào cũng có crawl_type; % job = batch_percent (trung bình các loại)
+                    async for event in tc.crawl_batch(session_id, start_date, end_date, crawl_types, tokhai_type, job_id=job_id):
+                        if await ais_job_cancelled(job_id):
+                            logger.info(f"[API] Job {job_id} đã bị cancel trong batch crawl")
+                            await apublish_progress(job_id, 0, "Job đã bị hủy")
+                            await aset_status(job_id, "cancelled")
+                            return
                         
-                        cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                        if cancelled:
-                            cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                            if cancelled == '1':
-                                logger.info(f"[API] Job {job_id} đã bị cancel trong batch crawl")
-                                redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                publish_progress(job_id, 0, "Job đã bị hủy")
-                                return
+                        event_type = event.get('type', 'unknown')
+                        crawl_type = event.get('crawl_type') or event.get('current_type')
+                        type_label = type_labels.get(crawl_type, crawl_type)
+                        batch_percent = event.get('batch_percent', 0)
                         
-                        # Publish batch_progress event
-                        publish_progress(job_id, int((type_index - 1) / total_types * 100), f"Đang crawl {type_label} ({type_index}/{total_types})...", {
-                            'type': 'batch_progress',
-                            'current_type': crawl_type,
-                            'type_index': type_index,
-                            'total_types': total_types
-                        })
+                        if event_type == 'type_error' and event.get('error_code') == 'JOB_CANCELLED':
+                            logger.info(f"[API] Job {job_id} đã bị cancel từ crawler {crawl_type}")
+                            await apublish_progress(job_id, 0, "Job đã bị hủy", event)
+                            await aset_status(job_id, "cancelled")
+                            return
                         
-                        try:
-                            # Track accumulated values cho từng loại crawl
-                            type_accumulated_total = 0
-                            type_accumulated_downloaded = 0
+                        if event_type == 'batch_progress':
+                            await apublish_progress(job_id, batch_percent, f"Đang crawl {type_label} ({event.get('type_index')}/{total_types})...", {
+                                'type': 'batch_progress',
+                                'current_type': crawl_type,
+                                'type_index': event.get('type_index'),
+                                'total_types': total_types
+                            })
+                        
+                        elif event_type == 'progress':
+                            await apublish_progress(job_id, batch_percent, event.get('message', 'Đang xử lý...'), event)
+                            
+                        elif event_type == 'info':
+                            await apublish_progress(job_id, batch_percent, event.get('message', ''), event)
+                            
+                        elif event_type == 'download_start':
+                            total = event.get('accumulated_total', event.get('total', 0))
+                            type_accumulated_total[crawl_type] = total
+                            await apublish_progress(job_id, batch_percent, f"Bắt đầu tải {total} file...", event)
+                            
+                        elif event_type == 'download_progress':
+                            current = event.get('accumulated_downloaded', event.get('current', 0))
+                            total = event.get('accumulated_total', event.get('total', 0))
+                            type_accumulated_total[crawl_type] = total
+                            type_accumulated_downloaded[crawl_type] = current
+                            accumulated_percent = event.get('accumulated_percent')
+                            event['accumulated_percent'] = accumulated_percent if accumulated_percent is not None else (int((current / total) * 100) if total > 0 else 0)
+                            event['accumulated_total'] = total
+                            event['accumulated_downloaded'] = current
+                            await apublish_progress(job_id, batch_percent, f"Đã tải {current}/{total} file", event)
+                            
+                        elif event_type == 'type_complete':
+                            result = event.get('result') or {}
+                            # Chỉ lưu metadata, KHÔNG lưu results array
+                            batch_results[crawl_type] = {
+                                'total': type_accumulated_total[crawl_type] or result.get('total', 0),
+                                'download_id': result.get('download_id'),
+                                'zip_filename': result.get('zip_filename')
+                            }
                             
-                            # gọi method crawl tương ứng cho từng loại
-                            if crawl_type == 'tokhai':
-                                async for event in tc.crawl_tokhai(session_id, tokhai_type, start_date, end_date, job_id=job_id):
-                                    # Check cancelled
-                                    cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                    if cancelled:
-                                        cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                        if cancelled == '1':
-                                            logger.info(f"[API] Job {job_id} đã bị cancel trong crawl {crawl_type}")
-                                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                            publish_progress(job_id, 0, "Job đã bị hủy")
-                                            return
-                                    
-                                    event_type = event.get('type', 'unknown')
-                                    
-                                    if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
-                                        logger.info(f"[API] Job {job_id} đã bị cancel từ crawler {crawl_type}")
-                                        redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                        publish_progress(job_id, 0, "Job đã bị hủy", event)
-                                        return
-                                    
-                                    # Forward events với crawl_type (giống single crawl)
-                                    if event_type == 'progress':
-                                        percent = event.get('accumulated_percent', event.get('percent', 0))
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else percent
-                                        message = event.get('message', 'Đang xử lý...')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else percent, message, event)
-                                        
-                                    elif event_type == 'info':
-                                        message = event.get('message', '')
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, message, event)
-                                        
-                                    elif event_type == 'download_start':
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        accumulated_percent = event.get('accumulated_percent', 0)
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, f"Bắt đầu tải {total} file...", event)
-                                        
-                                    elif event_type == 'download_progress':
-                                        current = event.get('accumulated_downloaded', event.get('current', 0))
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        type_accumulated_downloaded = current
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else (int((current / total) * 100) if total > 0 else 0)
-                                        event['accumulated_percent'] = percent
-                                        event['accumulated_total'] = type_accumulated_total
-                                        event['accumulated_downloaded'] = type_accumulated_downloaded
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
-                                        
-                                    elif event_type == 'item':
-                                        # BỎ: Không lưu item vào results array
-                                        pass
-                                        
-                                    elif event_type == 'complete':
-                                        total_from_event = event.get('total', 0)
-                                        type_download_id = event.get('download_id')
-                                        type_zip_filename = event.get('zip_filename')
-                                        
-                                        if type_accumulated_total > 0:
-                                            type_total = type_accumulated_total
-                                        else:
-                                            type_total = total_from_event
-                                        
-                                        # Chỉ lưu metadata, KHÔNG lưu results array
-                                        batch_results[crawl_type] = {
-                                            'total': type_total,
-                                            'download_id': type_download_id,
-                                            'zip_filename': type_zip_filename
-                                        }
-                                        
-                                        publish_progress(job_id, int(type_index / total_types * 100), f"Hoàn thành {type_label} ({type_index}/{total_types})", {
-                                            'type': 'type_complete',
-                                            'crawl_type': crawl_type,
-                                            'result': batch_results[crawl_type]
-                                        })
-                                        
-                                    elif event_type == 'error':
-                                        error_msg = event.get('error', 'Lỗi không xác định')
-                                        event['crawl_type'] = crawl_type
-                                        logger.error(f"[API] Job {job_id} error in {crawl_type}: {error_msg}")
-                                        publish_progress(job_id, 0, f"Lỗi: {error_msg}", event)
-                                        
-                            elif crawl_type == 'thongbao':
-                                # Tương tự như tokhai
-                                type_accumulated_total = 0
-                                type_accumulated_downloaded = 0
-                                
-                                async for event in tc.crawl_thongbao(session_id, start_date, end_date, job_id=job_id):
-                                    cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                    if cancelled:
-                                        cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                        if cancelled == '1':
-                                            logger.info(f"[API] Job {job_id} đã bị cancel trong crawl {crawl_type}")
-                                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                            publish_progress(job_id, 0, "Job đã bị hủy")
-                                            return
-                                    
-                                    event_type = event.get('type', 'unknown')
-                                    
-                                    if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
-                                        logger.info(f"[API] Job {job_id} đã bị cancel từ crawler {crawl_type}")
-                                        redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                        publish_progress(job_id, 0, "Job đã bị hủy", event)
-                                        return
-                                    
-                                    if event_type == 'progress':
-                                        percent = event.get('accumulated_percent', event.get('percent', 0))
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else percent
-                                        message = event.get('message', 'Đang xử lý...')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else percent, message, event)
-                                        
-                                    elif event_type == 'info':
-                                        message = event.get('message', '')
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, message, event)
-                                        
-                                    elif event_type == 'download_start':
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        accumulated_percent = event.get('accumulated_percent', 0)
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, f"Bắt đầu tải {total} file...", event)
-                                        
-                                    elif event_type == 'download_progress':
-                                        current = event.get('accumulated_downloaded', event.get('current', 0))
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        type_accumulated_downloaded = current
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else (int((current / total) * 100) if total > 0 else 0)
-                                        event['accumulated_percent'] = percent
-                                        event['accumulated_total'] = type_accumulated_total
-                                        event['accumulated_downloaded'] = type_accumulated_downloaded
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
-                                        
-                                    elif event_type == 'item':
-                                        pass
-                                        
-                                    elif event_type == 'complete':
-                                        total_from_event = event.get('total', 0)
-                                        type_download_id = event.get('download_id')
-                                        type_zip_filename = event.get('zip_filename')
-                                        
-                                        if type_accumulated_total > 0:
-                                            type_total = type_accumulated_total
-                                        else:
-                                            type_total = total_from_event
-                                        
-                                        batch_results[crawl_type] = {
-                                            'total': type_total,
-                                            'download_id': type_download_id,
-                                            'zip_filename': type_zip_filename
-                                        }
-                                        
-                                        publish_progress(job_id, int(type_index / total_types * 100), f"Hoàn thành {type_label} ({type_index}/{total_types})", {
-                                            'type': 'type_complete',
-                                            'crawl_type': crawl_type,
-                                            'result': batch_results[crawl_type]
-                                        })
-                                        
-                                    elif event_type == 'error':
-                                        error_msg = event.get('error', 'Lỗi không xác định')
-                                        event['crawl_type'] = crawl_type
-                                        logger.error(f"[API] Job {job_id} error in {crawl_type}: {error_msg}")
-                                        publish_progress(job_id, 0, f"Lỗi: {error_msg}", event)
-                                        
-                            elif crawl_type == 'giaynoptien':
-                                # ✅ Tương tự như tokhai
-                                type_accumulated_total = 0
-                                type_accumulated_downloaded = 0
-                                
-                                async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date, job_id=job_id):
-                                    cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                                    if cancelled:
-                                        cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                                        if cancelled == '1':
-                                            logger.info(f"[API] Job {job_id} đã bị cancel trong crawl {crawl_type}")
-                                            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                            publish_progress(job_id, 0, "Job đã bị hủy")
-                                            return
-                                    
-                                    event_type = event.get('type', 'unknown')
-                                    
-                                    if event_type == 'error' and event.get('error_code') == 'JOB_CANCELLED':
-                                        logger.info(f"[API] Job {job_id} đã bị cancel từ crawler {crawl_type}")
-                                        redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                                        publish_progress(job_id, 0, "Job đã bị hủy", event)
-                                        return
-                                    
-                                    if event_type == 'progress':
-                                        percent = event.get('accumulated_percent', event.get('percent', 0))
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else percent
-                                        message = event.get('message', 'Đang xử lý...')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else percent, message, event)
-                                        
-                                    elif event_type == 'info':
-                                        message = event.get('message', '')
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, message, event)
-                                        
-                                    elif event_type == 'download_start':
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        accumulated_percent = event.get('accumulated_percent', 0)
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, accumulated_percent if accumulated_percent is not None else 0, f"Bắt đầu tải {total} file...", event)
-                                        
-                                    elif event_type == 'download_progress':
-                                        current = event.get('accumulated_downloaded', event.get('current', 0))
-                                        total = event.get('accumulated_total', event.get('total', 0))
-                                        type_accumulated_total = total
-                                        type_accumulated_downloaded = current
-                                        accumulated_percent = event.get('accumulated_percent')
-                                        percent = accumulated_percent if accumulated_percent is not None else (int((current / total) * 100) if total > 0 else 0)
-                                        event['accumulated_percent'] = percent
-                                        event['accumulated_total'] = type_accumulated_total
-                                        event['accumulated_downloaded'] = type_accumulated_downloaded
-                                        event['crawl_type'] = crawl_type
-                                        publish_progress(job_id, percent, f"Đã tải {current}/{total} file", event)
-                                        
-                                    elif event_type == 'item':
-                                        pass
-                                        
-                                    elif event_type == 'complete':
-                                        total_from_event = event.get('total', 0)
-                                        type_download_id = event.get('download_id')
-                                        type_zip_filename = event.get('zip_filename')
-                                        
-                                        if type_accumulated_total > 0:
-                                            type_total = type_accumulated_total
-                                        else:
-                                            type_total = total_from_event
-                                        
-                                        batch_results[crawl_type] = {
-                                            'total': type_total,
-                                            'download_id': type_download_id,
-                                            'zip_filename': type_zip_filename
-                                        }
-                                        
-                                        publish_progress(job_id, int(type_index / total_types * 100), f"Hoàn thành {type_label} ({type_index}/{total_types})", {
-                                            'type': 'type_complete',
-                                            'crawl_type': crawl_type,
-                                            'result': batch_results[crawl_type]
-                                        })
-                                        
-                                    elif event_type == 'error':
-                                        error_msg = event.get('error', 'Lỗi không xác định')
-                                        event['crawl_type'] = crawl_type
-                                        logger.error(f"[API] Job {job_id} error in {crawl_type}: {error_msg}")
-                                        publish_progress(job_id, 0, f"Lỗi: {error_msg}", event)
-                                        
-                        except Exception as e:
-                            logger.error(f"Error crawling {crawl_type} in batch: {e}")
-                            publish_progress(job_id, 0, f"Lỗi khi crawl {type_label}: {str(e)}", {
-                                'type': 'type_error',
+                            await apublish_progress(job_id, batch_percent, f"Hoàn thành {type_label} ({len(batch_results)}/{total_types})", {
+                                'type': 'type_complete',
                                 'crawl_type': crawl_type,
-                                'error': str(e)
+                                'result': batch_results[crawl_type]
                             })
+                            
+                        elif event_type == 'type_error':
+                            error_msg = event.get('error') or 'Lỗi không xác định'
+                            logger.error(f"[API] Job {job_id} error in {crawl_type}: {error_msg}")
+                            await apublish_progress(job_id, batch_percent, f"Lỗi khi crawl {type_label}: {error_msg}", event)
+                        
+                        elif event_type == 'batch_complete':
+                            merged_download_id = event.get('download_id')
+                            merged_zip_filename = event.get('zip_filename')
+                        
+                        elif event_type == 'error':
+                            error_msg = event.get('error', 'Lỗi không xác định')
+                            await apublish_progress(job_id, 0, f"Lỗi: {error_msg}", event)
+                            await aset_status(job_id, "failed", error=error_msg)
+                            return
                     
                     # Publish batch_complete event
                     result_data = {
                         'batch_results': batch_results,
-                        'total_files': sum(r.get('total', 0) for r in batch_results.values())
+                        'total_files': sum(r.get('total', 0) for r in batch_results.values()),
+                        'download_id': merged_download_id,
+                        'zip_filename': merged_zip_filename
                     }
-                    redis_client.set(f"job:{job_id}:result", json.dumps(result_data).encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
-                    
-                    publish_progress(job_id, 100, "Hoàn thành batch crawl", {
+                    await apublish_progress(job_id, 100, "Hoàn thành batch crawl", {
                         'type': 'batch_complete',
-                        'batch_results': batch_results
+                        'batch_results': batch_results,
+                        'download_id': merged_download_id,
+                        'zip_filename': merged_zip_filename
                     })
+                    await aset_status(job_id, "completed", result=json.dumps(result_data))
                     
                 except Exception as e:
                     error_msg = str(e)
                     logger.error(f"[API] Lỗi trong quá trình batch crawl cho job {job_id}: {error_msg}")
-                    redis_client = get_redis_client()
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
-                    publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await apublish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                    await aset_status(job_id, "failed", error=error_msg)
+                finally:
+                    # Token cancel của job chỉ dùng trong task này
+                    release_cancellation_token(job_id)
             
             asyncio.create_task(crawl_and_publish())
             
@@ -2016,50 +1793,9 @@ def register_routes(app, prefix):
             tc = get_tax_crawler()
             
             async def generate():
-                # ✅ Batch crawl: chạy từng loại tuần tự và forward events
-                total_types = len(crawl_types)
-                
-                # Emit batch_start event
-                yield f"data: {json.dumps({'type': 'batch_start', 'total_types': total_types}, ensure_ascii=False)}\n\n"
-                
-                batch_results = {}
-                
-                for type_index, crawl_type in enumerate(crawl_types, 1):
-                    type_label = {
-                        'tokhai': 'Tờ khai',
-                        'thongbao': 'Thông báo',
-                        'giaynoptien': 'Giấy nộp tiền'
-                    }.get(crawl_type, crawl_type)
-                    
-                    # Emit batch_progress event
-                    yield f"data: {json.dumps({'type': 'batch_progress', 'current_type': crawl_type, 'type_index': type_index, 'total_types': total_types}, ensure_ascii=False)}\n\n"
-                    
-                    try:
-                        # ✅ Gọi method crawl tương ứng cho từng loại
-                        if crawl_type == 'tokhai':
-                            async for event in tc.crawl_tokhai(session_id, tokhai_type, start_date, end_date, job_id=None):
-                                # Forward event với thêm crawl_type
-                                event['crawl_type'] = crawl_type
-                                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-                        elif crawl_type == 'thongbao':
-                            async for event in tc.crawl_thongbao(session_id, start_date, end_date, job_id=None):
-                                event['crawl_type'] = crawl_type
-                                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-                                
-                        elif crawl_type == 'giaynoptien':
-                            async for event in tc.crawl_giay_nop_tien(session_id, start_date, end_date, job_id=None):
-                                event['crawl_type'] = crawl_type
-                                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-                                
-                        # Emit type_complete event
-                        yield f"data: {json.dumps({'type': 'type_complete', 'crawl_type': crawl_type, 'result': batch_results.get(crawl_type, {})}, ensure_ascii=False)}\n\n"
-                        
-                    except Exception as e:
-                        logger.error(f"Error crawling {crawl_type}: {e}")
-                        yield f"data: {json.dumps({'type': 'type_error', 'crawl_type': crawl_type, 'error': str(e)}, ensure_ascii=False)}\n\n"
-                
-                # Emit batch_complete event
-                yield f"data: {json.dumps({'type': 'batch_complete', 'batch_results': batch_results}, ensure_ascii=False)}\n\n"
+                # ✅ Batch crawl: các loại chạy song song trong tc.crawl_batch, forward events (đã có crawl_type)
+                async for event in tc.crawl_batch(session_id, start_date, end_date, crawl_types, tokhai_type):
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
             
             return Response(
                 generate(),
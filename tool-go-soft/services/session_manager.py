@@ -2,11 +2,9 @@ import os
 import uuid
 import asyncio
 import logging
-import re
 import base64
 import tempfile
 import shutil
-import json
 from typing import Dict, Optional, Any
 from datetime import datetime, timedelta
 from dataclasses import dataclass, field
@@ -31,6 +29,7 @@ class SessionData:
     cookies: Dict[str, str] = field(default_factory=dict)
     jsessionid: Optional[str] = None  # JSESSIONID sau khi login thành công (để check session validity)
     download_path: Optional[str] = None  # Folder để lưu file download
+    owns_context: bool = True  # False = page phụ trên context của session khác (clone_session share_context) → đóng page, giữ context
     
     def update_activity(self):
         self.last_active = datetime.now()
@@ -117,29 +116,13 @@ class SessionManager:
         download_path = tempfile.mkdtemp(prefix=f"taxcrawl_{session_id[:8]}_")
         
         # Mỗi session có context riêng (isolated cookies, storage)
-        context = await self._browser.new_context(
-            ignore_https_errors=True,
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            accept_downloads=True
-        )
+        context = await self._new_context()
         
         # Set download behavior - files sẽ được download vào folder này
         # Lưu download_path vào session để dùng sau
         
-        # Enable request/response tracking
-        await context.route("**/*", lambda route: route.continue_())
-        
         page = await context.new_page()
         
-        # Lấy context ID để match chính xác (Playwright context có thể có ID)
-        # Nếu không có ID, dùng index trong browser.contexts
-        try:
-            context_index = len(self._browser.contexts) - 1  # Index của context mới tạo
-            context_id = str(context_index)  # Dùng index làm ID
-        except:
-            context_id = None
-        
         session_data = SessionData(
             session_id=session_id,
             browser=self._browser,
@@ -153,6 +136,57 @@ class SessionManager:
         logger.info(f"Created new session: {session_id}")
         return session_id
     
+    async def _new_context(self) -> BrowserContext:
+        context = await self._browser.new_context(
+            ignore_https_errors=True,
+            viewport={'width': 1920, 'height': 1080},
+            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            accept_downloads=True
+        )
+        
+        # Enable request/response tracking
+        await context.route("**/*", lambda route: route.continue_())
+        return context
+    
+    async def clone_session(self, session_id: str, share_context: bool = False) -> Optional[str]:
+        """
+        Tạo session phụ dùng chung đăng nhập với session_id, đóng bằng close_session như session thường
+          - share_context=False: context + page mới trên cùng browser, copy cookies (crawl song song nhiều khoảng thời gian)
+          - share_context=True: chỉ mở page mới trên context của session gốc, cookies luôn đồng bộ (crawl_batch)
+        Returns: session_id mới, None nếu session gốc không tồn tại / chưa đăng nhập
+        """
+        source = self.get_session(session_id)
+        if not source or not source.is_logged_in:
+            return None
+        
+        await self._ensure_browser()
+        clone_id = str(uuid.uuid4())
+        download_path = tempfile.mkdtemp(prefix=f"taxcrawl_{clone_id[:8]}_")
+        
+        if share_context:
+            context = source.context
+        else:
+            context = await self._new_context()
+            await context.add_cookies(await source.context.cookies())
+        page = await context.new_page()
+        
+        self._sessions[clone_id] = SessionData(
+            session_id=clone_id,
+            browser=self._browser,
+            context=context,
+            page=page,
+            username=source.username,
+            is_logged_in=True,
+            dse_session_id=source.dse_session_id,
+            cookies=dict(source.cookies),
+            jsessionid=source.jsessionid,
+            download_path=download_path,
+            owns_context=not share_context
+        )
+        
+        logger.info(f"Cloned session {session_id} → {clone_id}")
+        return clone_id
+    
     def get_session(self, session_id: str) -> Optional[SessionData]:
         """Lấy session data theo ID"""
         session = self._sessions.get(session_id)
@@ -167,11 +201,11 @@ class SessionManager:
         if session:
             try:
                 await session.page.close()
-                await session.context.close()
+                if session.owns_context:
+                    await session.context.close()
                 
                 # Cleanup download folder
                 if session.download_path and os.path.exists(session.download_path):
-                    import shutil
                     shutil.rmtree(session.download_path, ignore_errors=True)
                     
                 logger.info(f"Closed session: {session_id}")
@@ -24,6 +24,7 @@ from openpyxl.utils import get_column_letter
 from openpyxl.styles.numbers import FORMAT_NUMBER_COMMA_SEPARATED1
 
 from .session_manager import SessionManager, SessionData
+from . import waits
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,6 +47,31 @@ TOKHAI_TYPES = {
 
 # Base URL
 BASE_URL = "https://thuedientu.gdt.gov.vn"
+# Trang dichvucong có hàm connectSSO mở các chức năng tra cứu của thuedientu trong iframe
+DICH_VU_KHAC_URL = "https://dichvucong.gdt.gov.vn/tthc/dich-vu-khac"
+
+# Số file tờ khai tải song song (httpx) trong 1 trang kết quả
+TOKHAI_DOWNLOAD_CONCURRENCY = int(os.getenv('GOSOFT_TOKHAI_DOWNLOAD_CONCURRENCY', 6))
+# Số lần tối đa lấy lại params dse_* từ frame cho 1 trang khi server báo params hết hạn
+TOKHAI_MAX_PARAMS_REFRESH = int(os.getenv('GOSOFT_TOKHAI_MAX_PARAMS_REFRESH', 2))
+# Số file thông báo / giấy nộp tiền tải song song (httpx) trong 1 trang kết quả
+DIRECT_DOWNLOAD_CONCURRENCY = int(os.getenv('GOSOFT_DIRECT_DOWNLOAD_CONCURRENCY', 6))
+# crawl_batch: tổng số file tải cùng lúc (httpx) của mọi loại đang chạy song song trên cùng 1 tài khoản
+BATCH_DOWNLOAD_CONCURRENCY = int(os.getenv('GOSOFT_BATCH_DOWNLOAD_CONCURRENCY', 8))
+# Số khoảng thời gian (_get_date_ranges) crawl song song, mỗi khoảng 1 page trên context clone cookies từ session
+# đăng nhập; 1 = tuần tự trên session.page. Job truyền parallel_ranges để ghi đè, tối đa CRAWL_MAX_PARALLEL_RANGES
+CRAWL_PARALLEL_RANGES = int(os.getenv('GOSOFT_CRAWL_PARALLEL_RANGES', 1))
+CRAWL_MAX_PARALLEL_RANGES = int(os.getenv('GOSOFT_CRAWL_MAX_PARALLEL_RANGES', 4))
+# Field đếm trong event progress của từng khoảng → cộng dồn khi gộp các khoảng crawl song song
+_RANGE_COUNTER_FIELDS = ("accumulated_total", "accumulated_downloaded", "thuyet_minh_downloaded", "thuyet_minh_total")
+# Link "Tải về" dạng javascript:downloadGNT(123) / onclick="taiVe('abc')" → (tên hàm, tham số)
+_JS_DOWNLOAD_CALL_RE = re.compile(r"(\w+)\(\s*['\"]?([\w.\-]+)['\"]?\s*\)")
+# Giữ chỗ tham số trong URL mẫu
+_URL_TEMPLATE_ARG = "{arg}"
+
+
+class TokhaiParamsExpired(Exception):
+    """Params dse_* của trang kết quả không còn hợp lệ (server trả HTML / 401 / 403 / timeout.jsp) → cần lấy lại từ frame"""
 
 
 class TaxCrawlerService:
@@ -55,6 +81,10 @@ class TaxCrawlerService:
         self.session_manager = session_manager
         os.makedirs(self.ZIP_STORAGE_DIR, exist_ok=True)
         self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        # session_id → {tên hàm JS của link "Tải về": URL mẫu} (xem _iter_direct_downloads)
+        self._download_url_templates: Dict[str, Dict[str, str]] = {}
+        # session_id → semaphore dùng chung thay cho giới hạn riêng từng trang khi crawl_batch chạy nhiều loại song song
+        self._download_pools: Dict[str, asyncio.Semaphore] = {}
     
     async def _get_http_client(self, session_id: str) -> Optional[httpx.AsyncClient]:
         """
@@ -89,33 +119,17 @@ class TaxCrawlerService:
         if session_id in self._http_clients:
             await self._http_clients[session_id].aclose()
             del self._http_clients[session_id]
+        self._download_url_templates.pop(session_id, None)
     
     async def _check_cancelled(self, job_id: str) -> bool:
         """
-        Kiểm tra xem job có bị cancel không
+        Kiểm tra xem job có bị cancel không (token push-based, fallback async Redis theo chu kỳ)
         
         Returns:
             True nếu job bị cancel, False nếu không
         """
-        try:
-            from shared.redis_client import get_redis_client
-            redis_client = get_redis_client()
-            cancelled = redis_client.get(f"job:{job_id}:cancelled")
-            if cancelled:
-                cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                if cancelled == '1':
-                    return True
-            
-            # Check status
-            status = redis_client.get(f"job:{job_id}:status")
-            if status:
-                status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                if status == 'cancelled':
-                    return True
-            return False
-        except Exception as e:
-            logger.warning(f"Error checking cancelled flag: {e}")
-            return False
+        from shared.cancellation import get_cancellation_token
+        return await get_cancellation_token(job_id).ais_cancelled()
     
     async def _check_session_timeout(self, page) -> bool:
         """
@@ -214,210 +228,77 @@ class TaxCrawlerService:
         
         return name_tk
     
-    async def _navigate_to_tokhai_page(self, page, dse_session_id: str) -> bool:
-        success = False
-        frame = None
+    async def _open_sso_frame(self, page, sso_code: str, ready_selector: str, label: str,
+                              url_contains=('thuedientu.gdt.gov.vn',)):
+        """
+        Mở chức năng sso_code của thuedientu.gdt.gov.vn trong iframe SSO của trang dich-vu-khac,
+        mỗi bước đợi theo điều kiện (services/waits.py) thay cho sleep cố định:
+        1. Navigate đến /tthc/dich-vu-khac nếu page chưa ở đó → đợi hàm connectSSO có trên trang
+        2. Gọi connectSSO(sso_code, '', '', '') → đợi frame navigate tới URL chứa mọi chuỗi trong url_contains
+        3. Đợi ready_selector (form tra cứu) hiện trong frame
         
+        Returns: frame, None nếu không mở được
+        """
+        # QUAN TRỌNG: Page mới có thể chưa có URL hoặc đang ở homelogin → navigate đúng URL
+        if '/tthc/dich-vu-khac' not in page.url:
+            logger.info(f"Navigating to /tthc/dich-vu-khac for {label}...")
+            await page.goto(DICH_VU_KHAC_URL, wait_until='domcontentloaded', timeout=30000)
+        else:
+            logger.info("Already on /tthc/dich-vu-khac page")
+        
+        if not await waits.wait_until(lambda: page.evaluate("typeof connectSSO === 'function'"),
+                                      f"{label}.connect_sso_ready", timeout=15000):
+            logger.error(f"connectSSO function not found on {page.url}")
+            return None
+        
+        logger.info(f"Calling connectSSO('{sso_code}', '', '', '') via JavaScript...")
+        frame = await waits.wait_for_event(
+            page, 'framenavigated',
+            lambda: page.evaluate(f"async () => {{ await connectSSO('{sso_code}', '', '', ''); }}"),
+            lambda f: all(part in f.url for part in url_contains),
+            f"{label}.sso_frame", timeout=20000
+        )
+        if not frame:
+            # Iframe đã mở sẵn từ trước (connectSSO không navigate lại) → tìm trong page.frames
+            frame = await waits.wait_for_frame(page, f"{label}.sso_frame_lookup", url_contains, timeout=5000)
+        if not frame:
+            logger.error(f"Iframe not found after calling connectSSO('{sso_code}')")
+            return None
+        logger.info(f"Found frame: {frame.url[:100]}...")
+        
+        if await waits.wait_for_selector(frame, ready_selector, f"{label}.form", timeout=25000):
+            return frame
+        # Redirect SSO có thể thay iframe → tìm lại frame 1 lần
+        logger.warning(f"Frame found but {ready_selector} not found, looking up frame again")
+        frame = await waits.wait_for_frame(page, f"{label}.sso_frame_lookup", url_contains, timeout=5000)
+        if frame and await waits.wait_for_selector(frame, ready_selector, f"{label}.form_retry", timeout=10000):
+            return frame
+        logger.error(f"Still cannot find {ready_selector} in SSO iframe")
+        return None
+    
+    async def _navigate_to_tokhai_page(self, page, dse_session_id: str) -> bool:
         try:
-            # Bước 1: Navigate đến trang dich-vu-khac
-            # QUAN TRỌNG: Page mới cần navigate đến đúng URL, không dùng current_url
-            # Vì page mới có thể chưa có URL hoặc URL không đúng
-            logger.info("Navigating to /tthc/dich-vu-khac...")
-            try:
-                # Đảm bảo navigate đến đúng URL (không phải homelogin)
-                target_url = 'https://dichvucong.gdt.gov.vn/tthc/dich-vu-khac'
-                current_url = page.url
-                
-                # Nếu đang ở homelogin hoặc URL khác, navigate lại
-                if '/tthc/dich-vu-khac' not in current_url:
-                    await page.goto(target_url, wait_until='domcontentloaded', timeout=30000)
-                    await asyncio.sleep(2)
-                    logger.info(f"Successfully navigated to dich-vu-khac, current URL: {page.url}")
-                else:
-                    logger.info(f"Already on dich-vu-khac page: {current_url}")
-            except Exception as nav_err:
-                logger.error(f"Error navigating to dich-vu-khac: {nav_err}")
-                return False
-            
-            # Bước 2: Gọi trực tiếp hàm JavaScript connectSSO('360103', '', '', '')
-            logger.info("Calling connectSSO('360103', '', '', '') via JavaScript...")
-            
-            try:
-                # Gọi hàm connectSSO trực tiếp bằng JavaScript
-                await page.evaluate("""
-                    async () => {
-                        // Kiểm tra xem hàm connectSSO có tồn tại không
-                        if (typeof connectSSO === 'function') {
-                            await connectSSO('360103', '', '', '');
-                            return { success: true, message: 'connectSSO called' };
-                        } else {
-                            return { success: false, message: 'connectSSO function not found' };
-                        }
-                    }
-                """)
-                logger.info("connectSSO('360103', '', '', '') called successfully")
-                # Đợi AJAX hoàn tất và iframe được set src
-                await asyncio.sleep(3)
-            except Exception as e:
-                logger.error(f"Error calling connectSSO: {e}")
-                return False
-            
-            # Bước 3: Đợi iframe load với src từ thuedientu.gdt.gov.vn
-            logger.info("Waiting for iframe to load with thuedientu.gdt.gov.vn...")
-            
-            # Tìm iframe trong #iframeRenderSSO
-            max_wait = 20  # Đợi tối đa 10 giây (20 * 0.5)
-            for i in range(max_wait):
-                try:
-                    # Tìm iframe trong modal #iframeRenderSSO
-                    iframe_elem = page.locator('#iframeRenderSSO iframe').first
-                    if await iframe_elem.count() > 0:
-                        # Lấy src của iframe
-                        iframe_src = await iframe_elem.get_attribute('src')
-                        if iframe_src and 'thuedientu.gdt.gov.vn' in iframe_src:
-                            logger.info(f"Found iframe with src: {iframe_src[:100]}...")
-                            
-                            # Tìm frame từ page.frames
-                            frames = page.frames
-                            for f in frames:
-                                if 'thuedientu.gdt.gov.vn' in f.url:
-                                    frame = f
-                                    logger.info(f"Found frame: {frame.url[:100]}...")
-                                    break
-                            
-                            if frame:
-                                break
-                except Exception as e:
-                    logger.debug(f"Waiting for iframe (attempt {i + 1}/{max_wait}): {e}")
-                
-                await asyncio.sleep(0.5)
-            
-            # Bước 4: Switch vào iframe và đợi #maTKhai xuất hiện
-            if frame:
-                try:
-                    logger.info("Waiting for #maTKhai in iframe...")
-                    await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                    await asyncio.sleep(1)
-                    await frame.wait_for_selector('#maTKhai', timeout=15000)
-                    success = True
-                    logger.info("Tra cuu tokhai page loaded successfully via SSO iframe")
-                except Exception as e:
-                    logger.warning(f"Frame found but #maTKhai not found: {e}")
-                    # Thử đợi thêm một chút
-                    try:
-                        await asyncio.sleep(2)
-                        await frame.wait_for_selector('#maTKhai', timeout=10000)
-                        success = True
-                        logger.info("Tra cuu tokhai page loaded after additional wait")
-                    except:
-                        logger.error("Still cannot find #maTKhai after additional wait")
-            else:
-                logger.error("Iframe not found after clicking connectSSO link")
-            
-            return success
-            
+            frame = await self._open_sso_frame(page, '360103', '#maTKhai', 'tokhai')
         except Exception as e:
             logger.error(f"Error navigating to tokhai page: {e}")
             return False
+        if frame:
+            logger.info("Tra cuu tokhai page loaded successfully via SSO iframe")
+        return frame is not None
     
     async def _navigate_to_tokhai_search(self, session: SessionData) -> bool:
         return await self._navigate_to_tokhai_page(session.page, session.dse_session_id)
     
     async def _navigate_to_thongbao_page(self, page, dse_session_id: str) -> bool:
-        success = False
-        frame = None
-        
         try:
-            # Bước 1: Navigate đến trang dich-vu-khac
-            current_url = page.url
-            if '/tthc/dich-vu-khac' not in current_url:
-                logger.info("Navigating to /tthc/dich-vu-khac for thongbao...")
-                await page.goto('https://dichvucong.gdt.gov.vn/tthc/dich-vu-khac', wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(2)
-            else:
-                logger.info("Already on /tthc/dich-vu-khac page")
-            
-            # Bước 2: Gọi trực tiếp hàm JavaScript connectSSO('360102', '', '', '')
-            logger.info("Calling connectSSO('360102', '', '', '') via JavaScript...")
-            
-            try:
-                # Gọi hàm connectSSO trực tiếp bằng JavaScript
-                await page.evaluate("""
-                    async () => {
-                        // Kiểm tra xem hàm connectSSO có tồn tại không
-                        if (typeof connectSSO === 'function') {
-                            await connectSSO('360102', '', '', '');
-                            return { success: true, message: 'connectSSO called' };
-                        } else {
-                            return { success: false, message: 'connectSSO function not found' };
-                        }
-                    }
-                """)
-                logger.info("connectSSO('360102', '', '', '') called successfully")
-                # Đợi AJAX hoàn tất và iframe được set src
-                await asyncio.sleep(3)
-            except Exception as e:
-                logger.error(f"Error calling connectSSO for thongbao: {e}")
-                return False
-            
-            # Bước 3: Đợi iframe load với src từ thuedientu.gdt.gov.vn
-            logger.info("Waiting for iframe to load with thuedientu.gdt.gov.vn for thongbao...")
-            
-            # Tìm iframe trong #iframeRenderSSO
-            max_wait = 20  # Đợi tối đa 10 giây (20 * 0.5)
-            for i in range(max_wait):
-                try:
-                    # Tìm iframe trong modal #iframeRenderSSO
-                    iframe_elem = page.locator('#iframeRenderSSO iframe').first
-                    if await iframe_elem.count() > 0:
-                        # Lấy src của iframe
-                        iframe_src = await iframe_elem.get_attribute('src')
-                        if iframe_src and 'thuedientu.gdt.gov.vn' in iframe_src:
-                            logger.info(f"Found iframe with src: {iframe_src[:100]}...")
-                            
-                            # Tìm frame từ page.frames
-                            frames = page.frames
-                            for f in frames:
-                                if 'thuedientu.gdt.gov.vn' in f.url:
-                                    frame = f
-                                    logger.info(f"Found frame: {frame.url[:100]}...")
-                                    break
-                            
-                            if frame:
-                                break
-                except Exception as e:
-                    logger.debug(f"Waiting for iframe (attempt {i + 1}/{max_wait}): {e}")
-                
-                await asyncio.sleep(0.5)
-            
-            # Bước 4: Switch vào iframe và đợi form thông báo xuất hiện
-            if frame:
-                try:
-                    logger.info("Waiting for thong bao form in iframe...")
-                    await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                    await asyncio.sleep(1)
-                    # Đợi form thông báo load - kiểm tra input qryFromDate
-                    await frame.wait_for_selector('#qryFromDate', timeout=15000)
-                    success = True
-                    logger.info("Tra cuu thong bao page loaded successfully via SSO iframe")
-                except Exception as e:
-                    logger.warning(f"Frame found but form not found: {e}")
-                    # Thử đợi thêm một chút
-                    try:
-                        await asyncio.sleep(2)
-                        await frame.wait_for_selector('#qryFromDate', timeout=10000)
-                        success = True
-                        logger.info("Tra cuu thong bao page loaded after additional wait")
-                    except:
-                        logger.error("Still cannot find form after additional wait")
-            else:
-                logger.error("Iframe not found after calling connectSSO for thongbao")
-            
-            return success
-            
+            # Form thông báo load xong khi có input qryFromDate
+            frame = await self._open_sso_frame(page, '360102', '#qryFromDate', 'thongbao')
         except Exception as e:
             logger.error(f"Error navigating to thongbao page: {e}")
             return False
+        if frame:
+            logger.info("Tra cuu thong bao page loaded successfully via SSO iframe")
+        return frame is not None
     
     async def _navigate_to_giaynoptien_page(self, page, dse_session_id: str) -> bool:
         """
@@ -427,105 +308,326 @@ class TaxCrawlerService:
         Flow:
         1. Navigate đến /tthc/dich-vu-khac
         2. Gọi connectSSO('330410', '', '', '')
-        3. Đợi iframe load với src từ thuedientu.gdt.gov.vn
-        4. Switch vào iframe và đợi form giấy nộp tiền xuất hiện
+        3. Đợi iframe load với src từ thuedientu.gdt.gov.vn (URL chứa etaxnnt)
+        4. Đợi form giấy nộp tiền xuất hiện trong iframe
         
         Returns: True nếu thành công
         """
-        success = False
-        frame = None
+        try:
+            frame = await self._open_sso_frame(
+                page, '330410', 'input[name="ngay_lap_tu_ngay"], #ngay_lap_tu_ngay', 'giaynoptien',
+                url_contains=('thuedientu.gdt.gov.vn', 'etaxnnt')
+            )
+        except Exception as e:
+            logger.error(f"Error navigating to giaynoptien page: {e}")
+            return False
+        if frame:
+            logger.info("Tra cuu giay nop tien page loaded successfully via SSO iframe")
+        return frame is not None
+    
+    def _resolve_parallel_ranges(self, parallel_ranges: Optional[int], start_date: str, end_date: str) -> int:
+        """Số khoảng crawl song song thực tế: parallel_ranges của job (None → CRAWL_PARALLEL_RANGES), không quá số khoảng"""
+        try:
+            requested = CRAWL_PARALLEL_RANGES if parallel_ranges is None else int(parallel_ranges)
+        except (TypeError, ValueError):
+            requested = CRAWL_PARALLEL_RANGES
+        requested = max(1, min(requested, CRAWL_MAX_PARALLEL_RANGES))
+        if requested == 1:
+            return 1
+        return min(requested, len(self._get_date_ranges(start_date, end_date)))
+    
+    @staticmethod
+    def _tokhai_completion_message(tokhai_downloaded: int, tokhai_total: int, thuyet_minh_downloaded: int,
+                                   thuyet_minh_total: int, special_items_count: int) -> str:
+        message = f"Hoàn thành! Đã tải {tokhai_downloaded}/{tokhai_total} tờ khai"
+        if thuyet_minh_total > 0:
+            message += f" - {thuyet_minh_downloaded}/{thuyet_minh_total} tờ thuyết minh"
+        if special_items_count > 0:
+            message += f". Có {special_items_count} tờ khai đặc biệt không tải được"
+        return message
+    
+    @staticmethod
+    def _zip_data_events(download_id: str, zip_base64: str, zip_filename: str):
+        """Event gửi ZIP base64 sau complete: 1 zip_data, hoặc nhiều zip_chunk 5MB nếu ZIP lớn"""
+        chunk_size = 5 * 1024 * 1024
+        if len(zip_base64) > chunk_size:
+            logger.info(f"Zip base64 is large ({len(zip_base64)/1024/1024:.2f} MB), sending in chunks")
+            for i in range(0, len(zip_base64), chunk_size):
+                yield {
+                    "type": "zip_chunk",
+                    "download_id": download_id,
+                    "chunk_index": i // chunk_size,
+                    "chunk_data": zip_base64[i:i+chunk_size],
+                    "is_last": (i + chunk_size) >= len(zip_base64)
+                }
+        else:
+            yield {
+                "type": "zip_data",
+                "download_id": download_id,
+                "zip_base64": zip_base64,
+                "zip_filename": zip_filename
+            }
+    
+    @staticmethod
+    def _merge_range_progress(event: Dict[str, Any], range_idx: int, range_states: List[Dict[str, Any]],
+                              range_weights: List[float]) -> Dict[str, Any]:
+        """
+        Đổi accumulated_* trong event của 1 khoảng (crawl riêng, chỉ tính trong khoảng đó) thành tích lũy trên tất cả khoảng
+        accumulated_percent = tổng % từng khoảng × trọng số số ngày (như range_percentages khi crawl tuần tự)
+        """
+        state = range_states[range_idx]
+        fields = [key for key in _RANGE_COUNTER_FIELDS + ("accumulated_percent",) if key in event]
+        if not fields:
+            return event
         
+        merged = dict(event)
+        for key in fields:
+            state[key] = event[key]
+        for key in _RANGE_COUNTER_FIELDS:
+            if key in event:
+                merged[key] = sum(s.get(key) or 0 for s in range_states)
+        if "accumulated_percent" in event:
+            percent = int(round(min(100.0, sum(w * (s.get("accumulated_percent") or 0)
+                                               for w, s in zip(range_weights, range_states)))))
+            # "percent" của progress tờ khai / thông báo là % tổng; download_progress thông báo là % trong khoảng → giữ nguyên
+            if event.get("percent") == event["accumulated_percent"]:
+                merged["percent"] = percent
+            merged["accumulated_percent"] = percent
+        if "range_index" in event:
+            merged["range_index"] = range_idx + 1
+            merged["total_ranges"] = len(range_states)
+        return merged
+    
+    def _copy_zip_entries(self, zf: zipfile.ZipFile, download_id: str, file_names: set, prefix: str = "") -> List[Dict[str, Any]]:
+        """
+        Chép các file trong ZIP_STORAGE_DIR/{download_id}.zip vào zf (tên thêm prefix), bỏ file đã có trong file_names
+        Returns: [{"name", "size"}] các file đã chép
+        """
+        files_info = []
         try:
-            # Bước 1: Navigate đến trang dich-vu-khac
-            current_url = page.url
-            if '/tthc/dich-vu-khac' not in current_url:
-                logger.info("Navigating to /tthc/dich-vu-khac for giaynoptien...")
-                await page.goto('https://dichvucong.gdt.gov.vn/tthc/dich-vu-khac', wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(2)
-            else:
-                logger.info("Already on /tthc/dich-vu-khac page")
+            with zipfile.ZipFile(os.path.join(self.ZIP_STORAGE_DIR, f"{download_id}.zip")) as src:
+                for info in src.infolist():
+                    name = f"{prefix}{info.filename}"
+                    if name in file_names:
+                        continue
+                    file_names.add(name)
+                    zf.writestr(name, src.read(info), compress_type=zipfile.ZIP_DEFLATED)
+                    files_info.append({"name": name, "size": info.file_size})
+        except (OSError, zipfile.BadZipFile) as e:
+            logger.warning(f"⚠️ Không đọc được ZIP {download_id}: {e}")
+        return files_info
+    
+    async def _merge_range_completes(self, session_id: str, completes: List[Dict[str, Any]],
+                                     date_ranges: List[List[str]], start_date: str, end_date: str) -> tuple:
+        """
+        Gộp complete của từng khoảng (theo thứ tự khoảng) thành 1 complete như khi crawl tuần tự:
+        số → cộng, list (results, files, special_items) → nối, còn lại lấy của khoảng đầu;
+        ZIP từng khoảng gộp thành 1 ZIP mới (download_id mới), ZIP con bị xóa
+        Returns: (complete, zip_base64 của ZIP gộp hoặc None)
+        """
+        merged: Dict[str, Any] = {}
+        for complete in completes:
+            for key, value in complete.items():
+                if key not in merged:
+                    merged[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    merged[key] = (merged[key] or []) + value
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    merged[key] = (merged[key] or 0) + value
+        
+        download_id = None
+        zip_base64 = None
+        files_info = []
+        sub_download_ids = [c["download_id"] for c in completes if c.get("download_id")]
+        if sub_download_ids:
+            download_id = str(uuid.uuid4())
+            zip_file_path = os.path.join(self.ZIP_STORAGE_DIR, f"{download_id}.zip")
+            file_names = set()
+            with zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for sub_id in sub_download_ids:
+                    files_info += self._copy_zip_entries(zf, sub_id, file_names)
+                    try:
+                        os.remove(os.path.join(self.ZIP_STORAGE_DIR, f"{sub_id}.zip"))
+                    except OSError:
+                        pass
+            total_size = sum(f["size"] for f in files_info)
             
-            # Bước 2: Gọi trực tiếp hàm JavaScript connectSSO('330410', '', '', '')
-            logger.info("Calling connectSSO('330410', '', '', '') via JavaScript...")
+            with open(zip_file_path, 'rb') as f:
+                zip_base64 = base64.b64encode(f.read()).decode('utf-8')
             
             try:
-                # Gọi hàm connectSSO trực tiếp bằng JavaScript
-                await page.evaluate("""
-                    async () => {
-                        // Kiểm tra xem hàm connectSSO có tồn tại không
-                        if (typeof connectSSO === 'function') {
-                            await connectSSO('330410', '', '', '');
-                            return { success: true, message: 'connectSSO called' };
-                        } else {
-                            return { success: false, message: 'connectSSO function not found' };
-                        }
-                    }
-                """)
-                logger.info("connectSSO('330410', '', '', '') called successfully")
-                # Đợi AJAX hoàn tất và iframe được set src
-                await asyncio.sleep(3)
-            except Exception as e:
-                logger.error(f"Error calling connectSSO for giaynoptien: {e}")
-                return False
-            
-            # Bước 3: Đợi iframe load với src từ thuedientu.gdt.gov.vn
-            logger.info("Waiting for iframe to load with thuedientu.gdt.gov.vn for giaynoptien...")
-            
-            # Tìm frame trực tiếp từ page.frames (đáng tin cậy hơn)
-            max_wait = 30  # Đợi tối đa 15 giây (30 * 0.5)
-            frame = None
-            for i in range(max_wait):
+                from shared.redis_async import get_async_redis_client
+                redis_key = f"session:{session_id}:download_id"
+                await get_async_redis_client().setex(redis_key, 3600, download_id.encode('utf-8'))
+            except Exception as redis_err:
+                logger.warning(f"⚠️ Không thể lưu download_id vào Redis: {redis_err}")
+            
+            merged["files_count"] = len(files_info)
+            merged["total_size"] = total_size
+            if "files" in merged:
+                merged["files"] = files_info
+        
+        # Tên ZIP theo cả kỳ thay vì khoảng đầu: tokhai_TAT_CA_01012020_16122020.zip → ..._01012020_31122023.zip
+        first_range = f"{date_ranges[0][0].replace('/', '')}_{date_ranges[0][1].replace('/', '')}"
+        if merged.get("zip_filename"):
+            merged["zip_filename"] = merged["zip_filename"].replace(
+                first_range, f"{start_date.replace('/', '')}_{end_date.replace('/', '')}")
+        merged["download_id"] = download_id
+        if "has_zip" in merged:
+            merged["has_zip"] = download_id is not None
+        if "zip_base64" in merged:
+            merged["zip_base64"] = zip_base64
+        if "tokhai_total" in merged:
+            merged["message"] = self._tokhai_completion_message(
+                merged.get("tokhai_downloaded", 0), merged["tokhai_total"], merged.get("thuyet_minh_downloaded", 0),
+                merged.get("thuyet_minh_total", 0), merged.get("special_items_count", 0))
+        if "special_items" in merged and not merged["special_items"]:
+            merged["special_items"] = None
+        return merged, zip_base64
+    
+    async def _crawl_ranges_parallel(self, crawl_range, session_id: str, start_date: str, end_date: str,
+                                     parallel: int) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Crawl các khoảng _get_date_ranges song song trên `parallel` page: session gốc + (parallel - 1) session clone cookies
+        crawl_range(session_id, start, end) → async generator event của 1 khoảng (crawl_* với parallel_ranges=1)
+        
+        Event gộp về 1 luồng như khi crawl tuần tự:
+          - item của khoảng sau giữ lại tới khi các khoảng trước xong → thứ tự kết quả giống tuần tự
+          - accumulated_* / percent tính lại trên tất cả khoảng
+          - complete + ZIP của từng khoảng gộp thành 1 complete + 1 ZIP
+        Khoảng nào trả error (kể cả JOB_CANCELLED / SESSION_EXPIRED) → dừng các khoảng còn lại, trả error đó
+        """
+        date_ranges = self._get_date_ranges(start_date, end_date)
+        range_days = [self._calculate_days_between(s, e) for s, e in date_ranges]
+        total_days = sum(range_days)
+        range_weights = [days / total_days if total_days > 0 else 1 / len(date_ranges) for days in range_days]
+        
+        clone_ids = []
+        tasks = []
+        try:
+            for _ in range(parallel - 1):
                 try:
-                    # Tìm frame từ page.frames trực tiếp
-                    frames = page.frames
-                    for f in frames:
-                        if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
-                            frame = f
-                            logger.info(f"Found frame: {frame.url[:100]}...")
-                            break
-                    
-                    if frame:
-                        # Kiểm tra xem frame đã load chưa
-                        try:
-                            await frame.wait_for_load_state('domcontentloaded', timeout=2000)
-                            break
-                        except:
-                            # Frame chưa load xong, tiếp tục đợi
-                            frame = None
-                            pass
+                    clone_id = await self.session_manager.clone_session(session_id)
                 except Exception as e:
-                    logger.debug(f"Waiting for frame (attempt {i + 1}/{max_wait}): {e}")
-                
-                await asyncio.sleep(0.5)
+                    logger.warning(f"⚠️ Không tạo được session phụ để crawl song song: {e}")
+                    break
+                if not clone_id:
+                    break
+                clone_ids.append(clone_id)
+            worker_session_ids = [session_id] + clone_ids
             
-            # Bước 4: Switch vào iframe và đợi form giấy nộp tiền xuất hiện
-            if frame:
-                try:
-                    logger.info("Waiting for giay nop tien form in iframe...")
-                    await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                    await asyncio.sleep(1)
-                    # Đợi form giấy nộp tiền load
-                    await frame.wait_for_selector('input[name="ngay_lap_tu_ngay"], #ngay_lap_tu_ngay', timeout=15000)
-                    success = True
-                    logger.info("Tra cuu giay nop tien page loaded successfully via SSO iframe")
-                except Exception as e:
-                    logger.warning(f"Frame found but form not found: {e}")
-                    # Thử đợi thêm một chút
+            logger.info(f"Crawl {len(date_ranges)} khoảng song song trên {len(worker_session_ids)} page (session {session_id})")
+            yield {"type": "info", "message": f"Bắt đầu crawl {len(date_ranges)} khoảng thời gian trên {len(worker_session_ids)} phiên song song..."}
+            
+            # (range_idx, event); event None = khoảng đó đã xong
+            events: asyncio.Queue = asyncio.Queue()
+            pending = list(range(len(date_ranges)))
+            
+            async def run_worker(worker_session_id: str):
+                while pending:
+                    range_idx = pending.pop(0)
+                    range_start, range_end = date_ranges[range_idx]
                     try:
-                        await asyncio.sleep(2)
-                        await frame.wait_for_selector('input[name="ngay_lap_tu_ngay"], #ngay_lap_tu_ngay', timeout=10000)
-                        success = True
-                        logger.info("Tra cuu giay nop tien page loaded after additional wait")
-                    except:
-                        logger.error("Still cannot find form after additional wait")
-            else:
-                logger.error("Iframe not found after calling connectSSO for giaynoptien")
+                        async for event in crawl_range(worker_session_id, range_start, range_end):
+                            await events.put((range_idx, event))
+                    except Exception as e:
+                        logger.error(f"Error crawling date range {date_ranges[range_idx]}: {e}")
+                        await events.put((range_idx, {"type": "error", "error": f"Lỗi xử lý khoảng {date_ranges[range_idx]}: {e}", "error_code": "CRAWL_ERROR"}))
+                    await events.put((range_idx, None))
             
-            return success
+            tasks = [asyncio.create_task(run_worker(sid)) for sid in worker_session_ids]
             
-        except Exception as e:
-            logger.error(f"Error navigating to giaynoptien page: {e}")
-            return False
+            range_states: List[Dict[str, Any]] = [{} for _ in date_ranges]
+            held_items: List[List[Dict[str, Any]]] = [[] for _ in date_ranges]
+            range_done = [False] * len(date_ranges)
+            completes: List[Optional[Dict[str, Any]]] = [None] * len(date_ranges)
+            head = 0  # khoảng đầu tiên chưa xong: item của khoảng này trả ngay, khoảng sau giữ lại
+            
+            while head < len(date_ranges):
+                range_idx, event = await events.get()
+                
+                if event is None:
+                    range_done[range_idx] = True
+                    range_states[range_idx]["accumulated_percent"] = 100
+                    while head < len(date_ranges) and range_done[head]:
+                        head += 1
+                        if head < len(date_ranges):
+                            for item in held_items[head]:
+                                yield item
+                            held_items[head] = []
+                    continue
+                
+                event_type = event.get("type")
+                if event_type == "error":
+                    # ZIP của các khoảng đã xong không còn dùng tới
+                    for complete in completes:
+                        if complete and complete.get("download_id"):
+                            try:
+                                os.remove(os.path.join(self.ZIP_STORAGE_DIR, f"{complete['download_id']}.zip"))
+                            except OSError:
+                                pass
+                    yield event
+                    return
+                if event_type == "complete":
+                    completes[range_idx] = event
+                    continue
+                if event_type in ("zip_data", "zip_chunk"):
+                    # ZIP của khoảng đã nằm trong ZIP_STORAGE_DIR, gộp lại ở cuối
+                    continue
+                
+                event = self._merge_range_progress(event, range_idx, range_states, range_weights)
+                if event_type == "item" and range_idx > head:
+                    held_items[range_idx].append(event)
+                else:
+                    yield event
+            
+            completes = [c for c in completes if c]
+            if not completes:
+                yield {"type": "error", "error": "Không có khoảng thời gian nào crawl xong", "error_code": "CRAWL_ERROR"}
+                return
+            
+            complete, zip_base64 = await self._merge_range_completes(session_id, completes, date_ranges, start_date, end_date)
+            logger.info(f"✅ Gộp {len(completes)} khoảng: {complete.get('files_count', 0)} file (download_id: {complete['download_id']})")
+            yield complete
+            if complete["download_id"] and zip_base64 and "zip_base64" not in complete:
+                for event in self._zip_data_events(complete["download_id"], zip_base64, complete.get("zip_filename")):
+                    yield event
+        
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for clone_id in clone_ids:
+                await self.close_http_client(clone_id)
+                await self.session_manager.close_session(clone_id)
+    
+    @staticmethod
+    def _is_portal_response(response) -> bool:
+        """Response trang / AJAX của thuedientu (bỏ qua ảnh, css, js) → dấu hiệu server đã trả kết quả tra cứu"""
+        return 'thuedientu.gdt.gov.vn' in response.url and response.request.resource_type in ('document', 'xhr', 'fetch')
+    
+    async def _submit_search(self, page, frame, search_btn, label: str):
+        """
+        Click "Tra cứu" rồi đợi server trả kết quả thay cho sleep cố định:
+        response trang / AJAX của thuedientu → frame hết request (networkidle)
+        Returns: frame kết quả (iframe có thể reload khi submit → tìm lại trong page.frames)
+        """
+        await waits.wait_for_response(page, search_btn.click, self._is_portal_response, f"{label}.search_response")
+        for f in page.frames:
+            if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
+                frame = f
+                break
+        await waits.wait_for_load(frame, f"{label}.search_networkidle", timeout=5000)
+        return frame
+    
+    @staticmethod
+    async def _first_row_id(rows, exclude: Optional[str] = None, col: int = 1) -> Optional[str]:
+        """Mã giao dịch (td thứ col) của dòng đầu table kết quả; None nếu chưa có hoặc vẫn bằng exclude (trang cũ)"""
+        cols = rows.first.locator('td')
+        if await cols.count() <= col:
+            return None
+        row_id = ((await cols.nth(col).text_content()) or '').strip()
+        return row_id if row_id and row_id != exclude else None
     
     async def crawl_tokhai_info(
         self,
@@ -594,7 +696,7 @@ class TaxCrawlerService:
                 yield {"type": "error", "error": f"Không tìm thấy loại tờ khai: {tokhai_type}", "error_code": "INVALID_TOKHAI_TYPE"}
                 return
             
-            await asyncio.sleep(0.5)
+            await waits.wait_for_load(frame, "tokhai_info.select_type", timeout=3000)
             
             # Chia khoảng thời gian
             date_ranges = self._get_date_ranges(start_date, end_date)
@@ -625,9 +727,7 @@ class TaxCrawlerService:
                     
                     # Click Tra cứu
                     search_btn = frame.locator('input[value="Tra cứu"]')
-                    await search_btn.click()
-                    
-                    await asyncio.sleep(2)
+                    frame = await self._submit_search(page, frame, search_btn, "tokhai_info")
                     
                     # Xử lý pagination
                     check_pages = True
@@ -737,8 +837,11 @@ class TaxCrawlerService:
                         try:
                             next_btn = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                             if await next_btn.count() > 0:
+                                page_before = await self._extract_pagination_info(frame)
                                 await next_btn.click()
-                                await asyncio.sleep(1)
+                                if page_before:
+                                    await self._wait_for_pagination(frame, "tokhai_info.next_page", after_page=page_before["current_page"])
+                                await waits.wait_for_load(frame, "tokhai_info.page_networkidle", timeout=5000)
                             else:
                                 check_pages = False
                         except:
@@ -766,6 +869,7 @@ class TaxCrawlerService:
         start_date: str,
         end_date: str,
         job_id: Optional[str] = None,  # ✅ Thêm job_id để check cancelled
+        parallel_ranges: Optional[int] = None,  # Số khoảng thời gian crawl song song (None → CRAWL_PARALLEL_RANGES)
     ) -> AsyncGenerator[Dict[str, Any], None]:
         session = self.session_manager.get_session(session_id)
         if not session:
@@ -776,6 +880,13 @@ class TaxCrawlerService:
             yield {"type": "error", "error": "Chưa đăng nhập. Vui lòng đăng nhập lại.", "error_code": "NOT_LOGGED_IN"}
             return
         
+        parallel = self._resolve_parallel_ranges(parallel_ranges, start_date, end_date)
+        if parallel > 1:
+            crawl_range = lambda sid, range_start, range_end: self.crawl_tokhai(sid, tokhai_type, range_start, range_end, job_id=job_id, parallel_ranges=1)
+            async for event in self._crawl_ranges_parallel(crawl_range, session_id, start_date, end_date, parallel):
+                yield event
+            return
+        
         page = session.page
         
         # ✅ FIX: Tạo temp directory trong source code thay vì system temp
@@ -816,11 +927,7 @@ class TaxCrawlerService:
                 yield {"type": "error", "error": "Không tìm thấy iframe sau khi navigate. Vui lòng thử lại.", "error_code": "NAVIGATION_ERROR"}
                 return
             
-            try:
-                await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                await asyncio.sleep(1)
-                await frame.wait_for_selector('#maTKhai', timeout=15000)
-            except Exception as e:
+            if not await waits.wait_for_selector(frame, '#maTKhai', "tokhai.form", timeout=15000):
                 yield {"type": "error", "error": "Không tìm thấy form tra cứu. Vui lòng thử lại.", "error_code": "NAVIGATION_ERROR"}
                 return
             
@@ -861,7 +968,7 @@ class TaxCrawlerService:
                 yield {"type": "error", "error": f"Không tìm thấy loại tờ khai: {tokhai_type}. Hãy dùng value như '842', '00' (Tất cả), hoặc text như '01/GTGT'", "error_code": "INVALID_TOKHAI_TYPE"}
                 return
             
-            await asyncio.sleep(0.5)
+            await waits.wait_for_load(frame, "tokhai.select_type", timeout=3000)
             
             date_ranges = self._get_date_ranges(start_date, end_date)
             
@@ -925,28 +1032,11 @@ class TaxCrawlerService:
                     
                     # Click button Tra cứu
                     search_btn = frame.locator('input[value="Tra cứu"]')
-                    await search_btn.click()
-                    
-                    await asyncio.sleep(1)
-                    
-                    try:
-                        frames = page.frames
-                        for f in frames:
-                            if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
-                                frame = f
-                                break
-                    except Exception as refind_frame_e:
-                        pass
-                    
-                    try:
-                        await frame.wait_for_load_state('networkidle', timeout=5000)
-                    except Exception as frame_load_e:
-                        pass
+                    frame = await self._submit_search(page, frame, search_btn, "tokhai")
                     
                     try:
                         table_body = frame.locator('#allResultTableBody, table.md_list2 tbody, table#data_content_onday tbody').first
                         await table_body.wait_for(timeout=10000, state='visible')
-                        await asyncio.sleep(1.5)
                     except Exception as e:
                         pass
                         accumulated_percent_so_far = min(100.0, accumulated_percent_so_far)
@@ -962,8 +1052,6 @@ class TaxCrawlerService:
                         }
                         continue
                     
-                    await asyncio.sleep(1)
-                    
                     pagination_info = await self._extract_pagination_info(frame)
                     if not pagination_info:
                         rows = table_body.locator('tr')
@@ -1025,6 +1113,7 @@ class TaxCrawlerService:
                                 next_btn = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                 next_btn_count = await next_btn.count()
                                 if next_btn_count > 0:
+                                    page_before = await self._extract_pagination_info(frame)
                                     await asyncio.wait_for(next_btn.click(), timeout=10.0)
                                 else:
                                     break
@@ -1034,9 +1123,9 @@ class TaxCrawlerService:
                                 break
                                 break
                             
-                            logger.info(f"⏳ [TOKHAI] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num - 1}: Đợi 2 giây sau khi click...")
-                            await asyncio.sleep(2)
-                            logger.info(f"✅ [TOKHAI] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num - 1}: Đã đợi xong 2 giây, bắt đầu đợi table load...")
+                            # Đợi #currAcc rời trang vừa xử lý thay cho sleep cố định
+                            if page_before and not await self._wait_for_pagination(frame, "tokhai.next_page", after_page=page_before["current_page"], timeout=15000):
+                                logger.warning(f"⚠️ [TOKHAI] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num - 1}: #currAcc vẫn báo trang {page_before['current_page']} sau khi click next")
                             
                             try:
                                 frames = page.frames
@@ -1055,12 +1144,7 @@ class TaxCrawlerService:
                                 timeout=20.0
                             )
                             
-                            try:
-                                await frame.wait_for_load_state('networkidle', timeout=5000)
-                            except Exception as frame_load_e:
-                                pass
-                            
-                            await asyncio.sleep(1.5)
+                            await waits.wait_for_load(frame, "tokhai.page_networkidle", timeout=5000)
                             
                             if page_num > 1:
                                 try:
@@ -1081,24 +1165,15 @@ class TaxCrawlerService:
                                     
                                     if previous_first_row_id and first_row_id:
                                         if previous_first_row_id == first_row_id:
-                                            await asyncio.sleep(2)
-                                            first_row_id_after_wait = None
-                                            if row_count_check > 0:
-                                                try:
-                                                    first_row_after = rows_check.first
-                                                    first_cols_after = first_row_after.locator('td')
-                                                    col_count_after = await first_cols_after.count()
-                                                    if col_count_after > 1:
-                                                        first_row_id_after_wait = await first_cols_after.nth(1).text_content()
-                                                        first_row_id_after_wait = first_row_id_after_wait.strip() if first_row_id_after_wait else None
-                                                except Exception as get_id_e2:
-                                                    logger.debug(f"⚠️ [TOKHAI] [{range_idx + 1}/{len(date_ranges)}] Không thể lấy mã giao dịch sau khi đợi: {get_id_e2}")
-                                            
-                                            if first_row_id_after_wait and previous_first_row_id == first_row_id_after_wait:
+                                            # Table chưa render trang mới → đợi mã giao dịch dòng đầu đổi
+                                            first_row_id_after_wait = await waits.wait_until(
+                                                lambda: self._first_row_id(rows_check, exclude=previous_first_row_id),
+                                                "tokhai.first_row_changed", timeout=5000
+                                            )
+                                            if not first_row_id_after_wait:
                                                 logger.error(f"❌ [TOKHAI] [{range_idx + 1}/{len(date_ranges)}] Table vẫn chưa chuyển trang sau khi đợi thêm!")
                                                 break
-                                            elif first_row_id_after_wait:
-                                                first_row_id = first_row_id_after_wait
+                                            first_row_id = first_row_id_after_wait
                                         else:
                                             pass
                                 except Exception as verify_e:
@@ -1310,28 +1385,12 @@ class TaxCrawlerService:
                             }
                             
                             successful_downloads = []
-                            base_params = page_params
                             
-                            for idx, item in enumerate(page_items_to_download):
-                                file_num = idx + 1
-                                
+                            # Params đã lấy 1 lần cho trang này (page_params), tải song song qua httpx
+                            async for item, result in self._iter_page_downloads(
+                                session_id, frame, page_num, page_items_to_download, page_params, temp_dir
+                            ):
                                 try:
-                                    fresh_params = await self._extract_download_params(frame)
-                                    if fresh_params:
-                                        base_params = fresh_params
-                                except:
-                                    pass
-                                
-                                try:
-                                    result = await self._download_one_via_url(
-                                        session_id,
-                                        item["id"],
-                                        item,
-                                        base_params,
-                                        temp_dir,
-                                        frame=frame
-                                    )
-                                    
                                     if result and not isinstance(result, Exception):
                                         successful_downloads.append(result)
                                         
@@ -1375,8 +1434,6 @@ class TaxCrawlerService:
                                         }
                                         results.append(result_data)
                                         yield {"type": "item", "data": result_data}
-                                    
-                                    await asyncio.sleep(0.1)
                                 except Exception as e:
                                     logger.error(f"❌ Error downloading {item.get('id', 'unknown')}: {e}")
                         
@@ -1465,10 +1522,9 @@ class TaxCrawlerService:
                 
                 # Lưu download_id vào Redis
                 try:
-                    from shared.redis_client import get_redis_client
-                    redis_client = get_redis_client()
+                    from shared.redis_async import get_async_redis_client
                     redis_key = f"session:{session_id}:download_id"
-                    redis_client.setex(redis_key, 3600, download_id.encode('utf-8'))
+                    await get_async_redis_client().setex(redis_key, 3600, download_id.encode('utf-8'))
                 except Exception as redis_err:
                     logger.warning(f"⚠️ Không thể lưu download_id vào Redis: {redis_err}")
             else:
@@ -1498,11 +1554,8 @@ class TaxCrawlerService:
             logger.info(f"📊 Complete event - tokhai_downloaded: {tokhai_downloaded}, thuyet_minh_downloaded: {thuyet_minh_downloaded}, total_files_downloaded: {total_files_downloaded}, accumulated_total_so_far: {accumulated_total_so_far}")
             
             # ✅ Message hiển thị khi hoàn thành
-            completion_message = f"Hoàn thành! Đã tải {tokhai_downloaded}/{accumulated_total_so_far} tờ khai"
-            if thuyet_minh_total > 0:
-                completion_message += f" - {thuyet_minh_downloaded}/{thuyet_minh_total} tờ thuyết minh"
-            if len(all_special_items) > 0:
-                completion_message += f". Có {len(all_special_items)} tờ khai đặc biệt không tải được"
+            completion_message = self._tokhai_completion_message(
+                tokhai_downloaded, accumulated_total_so_far, thuyet_minh_downloaded, thuyet_minh_total, len(all_special_items))
             
             # Total = số file thực tế đã download (tờ khai + tờ thuyết minh) - đây là số hiển thị trên button
             # Nếu muốn biết số items đã tìm thấy, dùng actual_results_count
@@ -1529,25 +1582,8 @@ class TaxCrawlerService:
             }
             
             if download_id and zip_base64:
-                chunk_size = 5 * 1024 * 1024
-                if len(zip_base64) > chunk_size:
-                    logger.info(f"Zip base64 is large ({len(zip_base64)/1024/1024:.2f} MB), sending in chunks")
-                    for i in range(0, len(zip_base64), chunk_size):
-                        chunk = zip_base64[i:i+chunk_size]
-                        yield {
-                            "type": "zip_chunk",
-                            "download_id": download_id,
-                            "chunk_index": i // chunk_size,
-                            "chunk_data": chunk,
-                            "is_last": (i + chunk_size) >= len(zip_base64)
-                        }
-                else:
-                    yield {
-                        "type": "zip_data",
-                        "download_id": download_id,
-                        "zip_base64": zip_base64,
-                        "zip_filename": zip_filename
-            }
+                for event in self._zip_data_events(download_id, zip_base64, zip_filename):
+                    yield event
             
         except Exception as e:
             logger.error(f"Error in crawl_tokhai: {e}")
@@ -1576,6 +1612,7 @@ class TaxCrawlerService:
             except Exception as e:
                 logger.warning(f"Error checking debug files: {e}")
             shutil.rmtree(temp_dir, ignore_errors=True)
+            waits.log_wait_stats()
     
     def _remove_accents(self, text: str) -> str:
         """Remove Vietnamese accents"""
@@ -1957,11 +1994,14 @@ class TaxCrawlerService:
         item: Dict,
         base_params: Dict[str, str],
         temp_dir: str,
-        frame=None
+        frame=None,
+        raise_on_expired: bool = False
     ) -> Optional[Dict]:
         """
         Download 1 file bằng cách gọi URL trực tiếp với httpx
         ✅ FIX: Thêm frame parameter để có thể navigate về đúng trang nếu cần
+        raise_on_expired=True (tải song song, frame=None): server báo params hết hạn → raise TokhaiParamsExpired
+        để bên gọi lấy lại params 1 lần cho cả trang, thay vì retry/chụp màn hình từng file
         """
         try:
             # Build URL với params
@@ -2013,14 +2053,9 @@ class TaxCrawlerService:
                     try:
                         navigate_success = await self._navigate_to_page(frame, page_number)
                         if navigate_success:
-                            # Đợi table load sau khi navigate
-                            try:
-                                table_body = frame.locator('#allResultTableBody, table.md_list2 tbody, table#data_content_onday tbody').first
-                                await table_body.wait_for(timeout=5000)
-                                await asyncio.sleep(0.5)  # Đợi thêm một chút để đảm bảo page đã load xong
-                            except:
-                                pass
-                            
+                            # Đợi trang load xong sau khi navigate (networkidle thay cho sleep cố định)
+                            await waits.wait_for_load(frame, "download_via_url.page_networkidle", timeout=5000)
+
                             fresh_params = await self._extract_download_params(frame)
                             if fresh_params:
                                 params.update({
@@ -2043,6 +2078,9 @@ class TaxCrawlerService:
                     )
                     return None
             
+                if raise_on_expired and (response.status_code in (401, 403) or 'timeout.jsp' in str(response.url)):
+                    raise TokhaiParamsExpired(f"HTTP {response.status_code} {response.url}")
+                
                 if response.status_code != 200:
                     if retry < max_retries - 1:
                         continue
@@ -2113,6 +2151,8 @@ class TaxCrawlerService:
                     
                     content_preview = content[:500].decode('utf-8', errors='ignore')
                     logger.debug(f"[{ma_tkhai}] Content preview: {content_preview[:200]}")
+                    if raise_on_expired:
+                        raise TokhaiParamsExpired("HTML_response")
                     if retry < max_retries - 1:
                         continue
                     # ✅ Chụp màn hình khi fail sau khi retry hết
@@ -2300,6 +2340,8 @@ class TaxCrawlerService:
                 )
                 return None
                 
+        except TokhaiParamsExpired:
+            raise
         except asyncio.TimeoutError:
             logger.warning(f"⏱️ [{ma_tkhai}] Timeout")
             # ✅ Chụp màn hình khi timeout
@@ -2453,20 +2495,98 @@ class TaxCrawlerService:
             logger.warning(f"❌ Error downloading {item.get('id', 'unknown')}: {e}")
             return None
     
+    async def _iter_page_downloads(
+        self,
+        session_id: str,
+        frame,
+        page_num: int,
+        page_items: List[Dict],
+        base_params: Dict[str, str],
+        temp_dir: str,
+        concurrency: int = None
+    ) -> AsyncGenerator[tuple, None]:
+        """
+        Tải song song các tờ khai của 1 trang kết quả qua httpx client dùng chung của session
+        - Params dse_* lấy 1 lần cho cả trang (base_params), không đọc lại từ frame trước mỗi file
+        - Tối đa `concurrency` request cùng lúc (mặc định TOKHAI_DOWNLOAD_CONCURRENCY; trong crawl_batch dùng pool chung)
+        - Server báo params hết hạn (TokhaiParamsExpired) → navigate lại trang + lấy params mới
+          (1 lần cho mọi file đang lỗi cùng lúc) rồi tải lại file đó; tối đa TOKHAI_MAX_PARAMS_REFRESH lần / trang
+        
+        Yields:
+            (item, result) theo thứ tự tải xong; result = item nếu thành công, None nếu lỗi
+        """
+        if not page_items:
+            return
+        
+        # Tạo client trước khi fan-out (tránh nhiều task cùng tạo client cho 1 session)
+        await self._get_http_client(session_id)
+        semaphore = self._download_pools.get(session_id) or asyncio.Semaphore(max(1, concurrency or TOKHAI_DOWNLOAD_CONCURRENCY))
+        refresh_lock = asyncio.Lock()
+        state = {"params": base_params, "version": 0, "refreshes": 0}
+        
+        async def refresh_params(seen_version: int) -> bool:
+            async with refresh_lock:
+                if state["version"] != seen_version:
+                    return True  # Task khác vừa lấy params mới
+                if frame is None or state["refreshes"] >= TOKHAI_MAX_PARAMS_REFRESH:
+                    return False
+                state["refreshes"] += 1
+                pagination_info = await self._extract_pagination_info(frame)
+                on_page = bool(pagination_info) and pagination_info.get("current_page") == page_num
+                if not on_page and not await self._navigate_to_page(frame, page_num):
+                    return False
+                fresh_params = await self._extract_download_params(frame)
+                if not fresh_params:
+                    return False
+                state["params"] = fresh_params
+                state["version"] += 1
+                logger.info(f"🔄 Page {page_num}: refreshed download params ({state['refreshes']}/{TOKHAI_MAX_PARAMS_REFRESH})")
+                return True
+        
+        async def download(item: Dict):
+            async with semaphore:
+                while True:
+                    version = state["version"]
+                    try:
+                        result = await self._download_one_via_url(
+                            session_id,
+                            item["id"],
+                            item,
+                            state["params"],
+                            temp_dir,
+                            raise_on_expired=True
+                        )
+                        return item, result
+                    except TokhaiParamsExpired as e:
+                        logger.warning(f"⚠️ [{item['id']}] Download params expired ({e})")
+                        if not await refresh_params(version):
+                            return item, None
+                    except Exception as e:
+                        logger.error(f"❌ Error downloading {item.get('id', 'unknown')}: {e}")
+                        return item, None
+        
+        tasks = [asyncio.ensure_future(download(item)) for item in page_items]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
     async def _batch_download_optimized(
         self,
         session_id: str,
         download_queue: List[Dict],
         temp_dir: str,
         frame,
-        batch_size: int = 3,
+        batch_size: int = None,
         page_params_map: Dict[int, Dict[str, str]] = None,
         progress_callback=None  # ✅ Callback để yield progress sau mỗi file
     ) -> List[Dict]:
         """
-        Download với batching tối ưu:
-        - Dùng params tương ứng với từng trang
-        - Download theo batch (3-5 files/batch)
+        Download theo từng trang kết quả:
+        - Params dse_* lấy 1 lần mỗi trang (page_params_map / sau khi navigate), chỉ lấy lại khi hết hạn
+        - Mỗi trang tải song song tối đa batch_size file (mặc định TOKHAI_DOWNLOAD_CONCURRENCY)
         - Dùng httpx thay vì playwright navigation
         
         Returns: List các item đã download thành công
@@ -2486,15 +2606,13 @@ class TaxCrawlerService:
             logger.error("❌ No page_params_map provided, cannot download")
             return []
         
-        # Bước 2: Download từng page với params tương ứng
         total = len(download_queue)
         successful_downloads = []
+        concurrency = batch_size or TOKHAI_DOWNLOAD_CONCURRENCY
         
-        logger.info(f"📦 Starting batch download: {total} files, batch_size={batch_size}")
+        logger.info(f"📦 Starting batch download: {total} files, concurrency={concurrency}")
         
-        # Download từng page
         for page_num, page_items in sorted(items_by_page.items()):
-            # Lấy params cho page này
             base_params = page_params_map.get(page_num)
             if not base_params:
                 logger.warning(f"⚠️ No params for page {page_num}, skipping {len(page_items)} items")
@@ -2502,7 +2620,7 @@ class TaxCrawlerService:
             
             logger.info(f"📄 Downloading page {page_num}: {len(page_items)} items")
             
-            # ✅ FIX: Navigate về đúng trang trước khi download (đảm bảo params đúng)
+            # ✅ FIX: Navigate về đúng trang trước khi download (server giữ state theo trang đang mở)
             # Chỉ navigate nếu không phải trang 1 (vì đã ở trang 1 rồi)
             if page_num > 1:
                 navigate_success = await self._navigate_to_page(frame, page_num)
@@ -2510,70 +2628,31 @@ class TaxCrawlerService:
                     logger.warning(f"⚠️ Cannot navigate to page {page_num}, skipping {len(page_items)} items")
                     continue
                 
-                # Đợi table load và extract params lại (đảm bảo params mới nhất)
+                # Lấy params 1 lần cho cả trang sau khi navigate
                 try:
                     table_body = frame.locator('#allResultTableBody, table.md_list2 tbody, table#data_content_onday tbody').first
                     await table_body.wait_for(timeout=5000)
-                    await asyncio.sleep(1)
-                    
-                    # Extract params lại từ trang này (có thể đã thay đổi sau khi navigate)
                     fresh_params = await self._extract_download_params(frame)
                     if fresh_params:
                         base_params = fresh_params
                         logger.info(f"✅ Refreshed params for page {page_num}")
-                except:
+                except Exception:
                     logger.warning(f"⚠️ Cannot refresh params for page {page_num}, using cached params")
             
-            # ✅ PHƯƠNG ÁN 3: Sequential Download với Refresh Params
-            # Download tuần tự từng file, refresh params trước mỗi file để đảm bảo ổn định
-            logger.info(f"📦 Page {page_num}: Downloading {len(page_items)} files sequentially...")
-            
-            for idx, item in enumerate(page_items):
-                file_num = idx + 1
-                logger.info(f"📄 Page {page_num}, File {file_num}/{len(page_items)}: {item['id']}")
-                
-                # ✅ Refresh params trước mỗi file để đảm bảo state đúng
-                # (Tránh trường hợp params bị outdated sau khi download file trước)
-                try:
-                    fresh_params = await self._extract_download_params(frame)
-                    if fresh_params:
-                        base_params = fresh_params
-                        # logger.debug(f"✅ Refreshed params for file {file_num}")
-                except Exception as e:
-                    logger.warning(f"⚠️ Cannot refresh params for file {file_num}, using cached params: {e}")
-                
-                # Download file
-                try:
-                    result = await self._download_one_via_url(
-                        session_id,
-                        item["id"],
-                        item,
-                        base_params,
-                        temp_dir,
-                        frame=frame  # ✅ Truyền frame để có thể navigate khi retry
-                    )
+            page_done = 0
+            async for item, result in self._iter_page_downloads(
+                session_id, frame, page_num, page_items, base_params, temp_dir, concurrency
+            ):
+                page_done += 1
+                if result:
+                    successful_downloads.append(result)
+                    logger.info(f"✅ Page {page_num}, File {page_done}/{len(page_items)}: {item['id']}")
                     
-                    if result and not isinstance(result, Exception):
-                        successful_downloads.append(result)
-                        logger.info(f"✅ Page {page_num}, File {file_num}/{len(page_items)}: Success")
-                        
-                        # ✅ Yield progress sau mỗi file download xong
-                        if progress_callback:
-                            await progress_callback(result, successful_downloads, page_items)
-                    else:
-                        logger.warning(f"❌ Page {page_num}, File {file_num}/{len(page_items)}: Failed")
-                
-                except Exception as e:
-                    logger.error(f"❌ Page {page_num}, File {file_num}/{len(page_items)}: Error - {e}")
-                
-                # ✅ Delay nhỏ giữa mỗi file (0.1s) để:
-                # - Tránh spam server
-                # - Đảm bảo browser state ổn định
-                # - Vẫn tải đủ nhanh (50 files ~ 5 giây chỉ tính delay)
-                await asyncio.sleep(0.1)
-            
-            # Sequential download đã tự động tạo khoảng cách giữa các page
-            # Không cần delay thêm
+                    # ✅ Yield progress sau mỗi file download xong
+                    if progress_callback:
+                        await progress_callback(result, successful_downloads, page_items)
+                else:
+                    logger.warning(f"❌ Page {page_num}, File {page_done}/{len(page_items)}: {item['id']} failed")
         
         logger.info(f"🎉 Total downloaded: {len(successful_downloads)} / {total}")
         return successful_downloads
@@ -2605,7 +2684,6 @@ class TaxCrawlerService:
             download_queue=download_queue_filtered,
             temp_dir=temp_dir,
             frame=frame,
-            batch_size=3,  # Tối ưu: 3 files/batch
             page_params_map=page_params_map  # ✅ FIX: Truyền page_params_map
         )
     
@@ -2855,6 +2933,7 @@ class TaxCrawlerService:
                         await download_link.first.click()
                     
                     download = await download_info.value
+                    item["resolved_url"] = download.url  # _iter_direct_downloads học URL mẫu từ đây
                     save_path = os.path.join(temp_dir, file_name + ".xml" if not file_name.endswith(".xml") else file_name)
                     await download.save_as(save_path)
                     
@@ -2879,7 +2958,10 @@ class TaxCrawlerService:
         """Download XML file với tên file custom (async)"""
         try:
             response = await client.get(url)
-            if response.status_code == 200:
+            content_type = response.headers.get('content-type', '').lower()
+            # Hết phiên / sai state server trả trang HTML thay vì file → coi như lỗi
+            is_html = 'html' in content_type or b'<html' in response.content[:1000].lower()
+            if response.status_code == 200 and response.content and not is_html:
                 # Đảm bảo tên file hợp lệ
                 safe_name = file_name.replace("/", "_").replace("\\", "_").replace(":", "_")
                 if not safe_name.endswith(".xml"):
@@ -2892,12 +2974,114 @@ class TaxCrawlerService:
             logger.error(f"Error downloading {file_id}: {e}")
             return None
     
+    async def _read_download_target(self, link) -> Dict[str, Any]:
+        """
+        Đọc link "Tải về" trong bảng kết quả (không click):
+        - href là URL thật → {"download_url": URL tuyệt đối}
+        - href/onclick gọi hàm JS, vd. javascript:downloadGNT(123) → {"download_js": [tên hàm, tham số]}
+        - không đọc được → {} (chỉ tải được qua Playwright)
+        """
+        try:
+            raw_href = (await link.get_attribute('href') or '').strip()
+            onclick = (await link.get_attribute('onclick') or '').strip()
+            if raw_href and not raw_href.lower().startswith(('javascript:', '#')):
+                return {"download_url": await link.evaluate("a => a.href")}
+            match = _JS_DOWNLOAD_CALL_RE.search(onclick or raw_href)
+            if match:
+                return {"download_js": [match.group(1), match.group(2)]}
+        except Exception as e:
+            logger.debug(f"Cannot read download link: {e}")
+        return {}
+    
+    @staticmethod
+    def _resolve_download_url(item: Dict, templates: Dict[str, str]) -> Optional[str]:
+        if item.get("download_url"):
+            return item["download_url"]
+        js_call = item.get("download_js")
+        if js_call and js_call[0] in templates:
+            return templates[js_call[0]].replace(_URL_TEMPLATE_ARG, js_call[1])
+        return None
+    
+    @staticmethod
+    def _learn_download_url_template(item: Dict, templates: Dict[str, str]) -> bool:
+        """URL thật của 1 lần tải qua Playwright chứa đúng 1 lần tham số của hàm JS → URL mẫu cho các dòng khác"""
+        url, js_call = item.get("resolved_url"), item.get("download_js")
+        if not url or not js_call or len(js_call[1]) < 4 or url.count(js_call[1]) != 1:
+            return False
+        templates[js_call[0]] = url.replace(js_call[1], _URL_TEMPLATE_ARG)
+        logger.info(f"🔗 Learned download URL template for {js_call[0]}()")
+        return True
+    
+    async def _iter_direct_downloads(
+        self,
+        session: SessionData,
+        items: List[Dict],
+        temp_dir: str,
+        browser_download
+    ) -> AsyncGenerator[tuple, None]:
+        """
+        Tải file thông báo / giấy nộp tiền bằng httpx (cookie của session), tối đa DIRECT_DOWNLOAD_CONCURRENCY file cùng lúc
+        (trong crawl_batch dùng pool chung)
+        - URL lấy từ link "Tải về" (_read_download_target); link gọi hàm JS thì URL thật lấy từ 1 lần tải qua
+          Playwright (download.url) rồi thay tham số của từng dòng vào (URL mẫu giữ theo session)
+        - Dòng không ra URL hoặc httpx lỗi / trả HTML → browser_download(session, item, temp_dir) (click "Tải về"
+          như cũ, tuần tự vì dùng chung 1 page)
+        
+        Yields:
+            (item, True/False) theo thứ tự tải xong
+        """
+        templates = self._download_url_templates.setdefault(session.session_id, {})
+        pending = list(items)
+        
+        # Chưa biết URL của dòng nào → tải dòng đó qua Playwright, học URL mẫu cho các dòng cùng hàm JS
+        while True:
+            item = next((it for it in pending if not self._resolve_download_url(it, templates)), None)
+            if item is None:
+                break
+            pending.remove(item)
+            success = await browser_download(session, item, temp_dir)
+            js_call = item.get("download_js")
+            if success and js_call and not self._learn_download_url_template(item, templates):
+                # Không suy được URL mẫu → các dòng cùng hàm đi Playwright như cũ
+                for other in pending:
+                    if other.get("download_js") and other["download_js"][0] == js_call[0]:
+                        other["download_js"] = None
+            yield item, success
+        
+        if not pending:
+            return
+        client = await self._get_http_client(session.session_id)
+        semaphore = self._download_pools.get(session.session_id) or asyncio.Semaphore(max(1, DIRECT_DOWNLOAD_CONCURRENCY))
+        browser_lock = asyncio.Lock()
+        
+        async def download(item: Dict):
+            result = None
+            if client:
+                async with semaphore:
+                    result = await self._download_xml_with_name(
+                        client, self._resolve_download_url(item, templates), temp_dir, item["id"], item["file_name"]
+                    )
+            if result:
+                return item, True
+            logger.warning(f"⚠️ Direct download failed for {item['id']}, falling back to browser")
+            async with browser_lock:
+                return item, await browser_download(session, item, temp_dir)
+        
+        tasks = [asyncio.ensure_future(download(item)) for item in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
     async def crawl_thongbao(
         self,
         session_id: str,
         start_date: str,
         end_date: str,
-        job_id: Optional[str] = None
+        job_id: Optional[str] = None,
+        parallel_ranges: Optional[int] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         session = self.session_manager.get_session(session_id)
         if not session:
@@ -2908,6 +3092,13 @@ class TaxCrawlerService:
             yield {"type": "error", "error": "Chưa đăng nhập. Vui lòng đăng nhập lại.", "error_code": "NOT_LOGGED_IN"}
             return
         
+        parallel = self._resolve_parallel_ranges(parallel_ranges, start_date, end_date)
+        if parallel > 1:
+            crawl_range = lambda sid, range_start, range_end: self.crawl_thongbao(sid, range_start, range_end, job_id=job_id, parallel_ranges=1)
+            async for event in self._crawl_ranges_parallel(crawl_range, session_id, start_date, end_date, parallel):
+                yield event
+            return
+        
         page = session.page
         
         # ✅ FIX: Tạo temp directory trong source code thay vì system temp (giống tờ khai)
@@ -2953,8 +3144,6 @@ class TaxCrawlerService:
             
             # Đợi frame load và kiểm tra form thông báo
             try:
-                await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                await asyncio.sleep(1)
                 await frame.wait_for_selector('#qryFromDate', timeout=15000)
                 logger.info("Tra cuu thong bao form loaded successfully")
             except Exception as e:
@@ -3033,22 +3222,13 @@ class TaxCrawlerService:
             
             yield {"type": "info", "message": f"Bắt đầu crawl {len(date_ranges)} khoảng thời gian..."}
             
-            def check_cancelled():
+            async def check_cancelled():
                 if not job_id:
                     return False
-                try:
-                    from shared.redis_client import get_redis_client
-                    redis_client = get_redis_client()
-                    cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                    if cancelled:
-                        cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                        return cancelled == '1'
-                    return False
-                except Exception as e:
-                    return False
+                return await self._check_cancelled(job_id)
             
             for range_idx, date_range in enumerate(date_ranges):
-                if check_cancelled():
+                if await check_cancelled():
                     yield {
                         "type": "error",
                         "error": "Job đã bị hủy",
@@ -3081,33 +3261,11 @@ class TaxCrawlerService:
                     await end_input.fill(date_range[1])
                     
                     # Click tìm kiếm - button "Tra cứu"
+                    # ✅ Đợi server trả kết quả + frame networkidle (iframe có thể reload khi chuyển khoảng thời gian → frame mới)
                     search_btn = frame.locator('input[value="Tra cứu"]')
-                    await search_btn.click()
-                    
-                    await asyncio.sleep(2)
-                    
-                    logger.info(f"🔍 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Đã click search cho khoảng: {date_range[0]} - {date_range[1]}")
+                    frame = await self._submit_search(page, frame, search_btn, "thongbao")
                     
-                    # ✅ Đợi một chút để đảm bảo request đã được gửi
-                    await asyncio.sleep(1)
-                    
-                    # ✅ Tìm lại frame mới sau khi click search (iframe có thể reload khi chuyển khoảng thời gian)
-                    try:
-                        frames = page.frames
-                        for f in frames:
-                            if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
-                                frame = f  # Cập nhật frame object mới
-                                logger.info(f"🔄 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Đã tìm lại frame mới sau khi click search: {frame.url[:100]}...")
-                                break
-                    except Exception as refind_frame_e:
-                        logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể tìm lại frame mới sau khi click search: {refind_frame_e}")
-                    
-                    # ✅ Đợi frame load xong trước khi đợi table
-                    try:
-                        await frame.wait_for_load_state('networkidle', timeout=5000)
-                        logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Frame đã load xong (networkidle)")
-                    except Exception as frame_load_e:
-                        logger.debug(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể đợi frame networkidle: {frame_load_e}")
+                    logger.info(f"🔍 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Đã search khoảng: {date_range[0]} - {date_range[1]}")
                     
                     # ✅ Đợi table load xong để đảm bảo đã chuyển sang khoảng mới
                     try:
@@ -3115,10 +3273,6 @@ class TaxCrawlerService:
                         table_body_check = frame.locator('#allResultTableBody, table.result_table tbody, table#data_content_onday tbody').first
                         await table_body_check.wait_for(timeout=10000, state='visible')
                         logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Table đã load xong sau khi click search")
-                        
-                        # ✅ Đợi thêm một chút để đảm bảo dữ liệu đã được render xong
-                        await asyncio.sleep(1.5)
-                        logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Đã đợi thêm để đảm bảo dữ liệu đã render xong")
                     except Exception as wait_table_e:
                         logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể đợi table load sau khi click search: {wait_table_e}")
                         # Tiếp tục xử lý, sẽ kiểm tra "Không có dữ liệu" ở bước tiếp theo
@@ -3133,7 +3287,7 @@ class TaxCrawlerService:
                     previous_first_row_id = None  # ✅ Lưu mã giao dịch của row đầu tiên trang trước để verify table đã chuyển trang
                     while check_pages and page_num < max_pages:
                         # ✅ Check cancelled trước khi xử lý trang tiếp theo
-                        if check_cancelled():
+                        if await check_cancelled():
                             logger.info(f"[THONGBAO] Job {job_id} đã bị cancel, dừng crawl")
                             yield {
                                 "type": "error",
@@ -3166,7 +3320,6 @@ class TaxCrawlerService:
                                         # Nếu có số bản ghi nhưng không có table, có thể là lỗi load trang - RETRY
                                         logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] CÓ {range_total_records} bản ghi nhưng không tìm thấy table! Đang retry...")
                                         # Retry: đợi thêm và thử lại
-                                        await asyncio.sleep(3)
                                         try:
                                             table_body = frame.locator('#allResultTableBody, table.result_table tbody, table#data_content_onday tbody').first
                                             await table_body.wait_for(timeout=10000, state='visible')
@@ -3343,7 +3496,8 @@ class TaxCrawlerService:
                                         "file_name": file_name,
                                         "download_link": download_link_found,
                                         "cols": cols,
-                                        "col_index": download_col_index
+                                        "col_index": download_col_index,
+                                        **await self._read_download_target(download_link_found.first)
                                     })
                                 else:
                                     logger.debug(f"Không tìm thấy link download cho thông báo {ma_giao_dich}, có {col_count} cột")
@@ -3406,10 +3560,13 @@ class TaxCrawlerService:
                             
                             downloaded = 0
                             
-                            for item_idx, item in enumerate(download_queue, 1):
+                            # httpx song song theo URL của link "Tải về", Playwright chỉ cho dòng không ra URL
+                            item_idx = 0
+                            async for item, success in self._iter_direct_downloads(
+                                session, download_queue, temp_dir, self._download_single_thongbao
+                            ):
+                                item_idx += 1
                                 try:
-                                    logger.info(f"📥 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đang download file {item_idx}/{queue_total}: {item.get('id', 'N/A')}...")
-                                    success = await self._download_single_thongbao(session, item, temp_dir)
                                     if success:
                                         downloaded += 1
                                         accumulated_downloaded_so_far += 1
@@ -3521,6 +3678,7 @@ class TaxCrawlerService:
                                 # ✅ Click với timeout và logging
                                 try:
                                     logger.info(f"🖱️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đang click nút next...")
+                                    page_before = await self._extract_pagination_info(frame)
                                     await asyncio.wait_for(next_btn.click(), timeout=10.0)
                                     logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đã click nút next thành công")
                                 except asyncio.TimeoutError:
@@ -3534,10 +3692,9 @@ class TaxCrawlerService:
                                     check_pages = False
                                     continue
                                 
-                                # ✅ Đợi trang load xong trước khi tiếp tục
-                                logger.info(f"⏳ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đợi 2 giây sau khi click...")
-                                await asyncio.sleep(2)
-                                logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đã đợi xong 2 giây, bắt đầu đợi table load...")
+                                # ✅ Đợi #currAcc rời trang vừa xử lý trước khi tiếp tục
+                                if page_before and not await self._wait_for_pagination(frame, "thongbao.next_page", after_page=page_before["current_page"], timeout=15000):
+                                    logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: #currAcc vẫn báo trang {page_before['current_page']} sau khi click next")
                                 
                                 # ✅ Tìm lại frame mới sau khi click next (iframe có thể reload khi chuyển trang)
                                 try:
@@ -3584,14 +3741,7 @@ class TaxCrawlerService:
                                         logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Table đã visible, đang verify table đã chuyển trang...")
                                         
                                         # ✅ Đợi frame load xong trước khi verify table
-                                        try:
-                                            await frame.wait_for_load_state('networkidle', timeout=5000)
-                                            logger.info(f"✅ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Frame đã load xong (networkidle) sau khi click next")
-                                        except Exception as frame_load_e:
-                                            logger.debug(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể đợi frame networkidle: {frame_load_e}")
-                                        
-                                        # ✅ Đợi thêm một chút để đảm bảo table đã load xong và render đúng
-                                        await asyncio.sleep(1.5)
+                                        await waits.wait_for_load(frame, "thongbao.page_networkidle", timeout=5000)
                                         
                                         # ✅ Verify table đã thực sự chuyển trang bằng cách so sánh mã giao dịch của row đầu tiên
                                         try:
@@ -3616,19 +3766,16 @@ class TaxCrawlerService:
                                             
                                             # Nếu table vẫn có cùng số rows như trang trước, kiểm tra mã giao dịch
                                             if row_count_check == previous_row_count and previous_row_count > 0:
-                                                logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Table vẫn có {row_count_check} rows giống trang trước, đợi thêm và kiểm tra mã giao dịch...")
-                                                await asyncio.sleep(2)
+                                                logger.warning(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Table vẫn có {row_count_check} rows giống trang trước, đợi mã giao dịch đổi...")
                                                 
-                                                # Lấy lại mã giao dịch sau khi đợi
+                                                # Đợi mã giao dịch row đầu khác trang trước, hết timeout thì lấy mã hiện tại để so sánh bên dưới
                                                 first_row_id_after_wait = None
                                                 if row_count_check > 0:
                                                     try:
-                                                        first_row_after = rows_check.first
-                                                        first_cols_after = first_row_after.locator('td')
-                                                        col_count_after = await first_cols_after.count()
-                                                        if col_count_after > 2:
-                                                            first_row_id_after_wait = await first_cols_after.nth(2).text_content()
-                                                            first_row_id_after_wait = first_row_id_after_wait.strip() if first_row_id_after_wait else None
+                                                        first_row_id_after_wait = await waits.wait_until(
+                                                            lambda: self._first_row_id(rows_check, exclude=previous_first_row_id, col=2),
+                                                            "thongbao.first_row_changed", timeout=5000
+                                                        ) or await self._first_row_id(rows_check, col=2)
                                                     except Exception as get_id_e2:
                                                         logger.debug(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể lấy mã giao dịch sau khi đợi: {get_id_e2}")
                                                 
@@ -3673,7 +3820,6 @@ class TaxCrawlerService:
                                     logger.error(f"⏱️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Timeout khi đợi table load cho trang {page_num + 1} (20s)")
                                     # ✅ Retry: Đợi thêm và thử lại
                                     logger.info(f"🔄 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Retry đợi table load...")
-                                    await asyncio.sleep(3)
                                     try:
                                         table_body_check_retry = frame.locator('#allResultTableBody, table.result_table tbody, table#data_content_onday tbody').first
                                         await asyncio.wait_for(
@@ -3697,7 +3843,7 @@ class TaxCrawlerService:
                                         import traceback
                                         logger.error(f"Traceback: {traceback.format_exc()}")
                                         # Kiểm tra lại nút next sau khi đợi
-                                        await asyncio.sleep(2)
+                                        await waits.wait_for_load(frame, "thongbao.retry_networkidle", timeout=5000)
                                         try:
                                             next_btn_check = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                             next_btn_check_count = await next_btn_check.count()
@@ -3717,7 +3863,6 @@ class TaxCrawlerService:
                                     logger.error(f"Traceback: {traceback.format_exc()}")
                                     # ✅ Retry: Đợi thêm và thử lại
                                     logger.info(f"🔄 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Retry đợi table load...")
-                                    await asyncio.sleep(3)
                                     try:
                                         table_body_check_retry = frame.locator('#allResultTableBody, table.result_table tbody, table#data_content_onday tbody').first
                                         await asyncio.wait_for(
@@ -3754,7 +3899,7 @@ class TaxCrawlerService:
                                             logger.debug(f"⚠️ [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Không thể kiểm tra 'Không có dữ liệu' sau retry: {no_data_check_e3}")
                                         
                                         # Kiểm tra lại nút next sau khi đợi
-                                        await asyncio.sleep(2)
+                                        await waits.wait_for_load(frame, "thongbao.retry_networkidle", timeout=5000)
                                         try:
                                             next_btn_check = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                             next_btn_check_count = await next_btn_check.count()
@@ -3783,7 +3928,7 @@ class TaxCrawlerService:
                             logger.error(f"Traceback: {traceback.format_exc()}")
                             # ✅ Sau khi có lỗi, kiểm tra lại xem có nút next không
                             try:
-                                await asyncio.sleep(2)
+                                await waits.wait_for_load(frame, "thongbao.retry_networkidle", timeout=5000)
                                 next_btn_retry = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                 next_btn_retry_count = await next_btn_retry.count()
                                 logger.info(f"🔍 [THONGBAO] [{range_idx + 1}/{len(date_ranges)}] Sau lỗi, số lượng nút next: {next_btn_retry_count}")
@@ -3936,10 +4081,9 @@ class TaxCrawlerService:
                     
                     # Lưu download_id vào Redis (giống tờ khai)
                     try:
-                        from shared.redis_client import get_redis_client
-                        redis_client = get_redis_client()
+                        from shared.redis_async import get_async_redis_client
                         redis_key = f"session:{session_id}:download_id"
-                        redis_client.setex(redis_key, 3600, download_id.encode('utf-8'))
+                        await get_async_redis_client().setex(redis_key, 3600, download_id.encode('utf-8'))
                     except Exception as redis_err:
                         logger.warning(f"⚠️ Không thể lưu download_id vào Redis: {redis_err}")
                 else:
@@ -4049,6 +4193,7 @@ class TaxCrawlerService:
         
         finally:
             shutil.rmtree(temp_dir, ignore_errors=True)
+            waits.log_wait_stats()
     
     
     async def _download_single_giaynoptien(self, session: SessionData, item: Dict, temp_dir: str, max_retries: int = 2) -> bool:
@@ -4184,7 +4329,8 @@ class TaxCrawlerService:
         session_id: str,
         start_date: str,
         end_date: str,
-        job_id: Optional[str] = None
+        job_id: Optional[str] = None,
+        parallel_ranges: Optional[int] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         session = self.session_manager.get_session(session_id)
         if not session:
@@ -4195,6 +4341,13 @@ class TaxCrawlerService:
             yield {"type": "error", "error": "Chưa đăng nhập. Vui lòng đăng nhập lại.", "error_code": "NOT_LOGGED_IN"}
             return
         
+        parallel = self._resolve_parallel_ranges(parallel_ranges, start_date, end_date)
+        if parallel > 1:
+            crawl_range = lambda sid, range_start, range_end: self.crawl_giay_nop_tien(sid, range_start, range_end, job_id=job_id, parallel_ranges=1)
+            async for event in self._crawl_ranges_parallel(crawl_range, session_id, start_date, end_date, parallel):
+                yield event
+            return
+        
         page = session.page
         
         # ✅ FIX: Tạo temp directory trong source code thay vì system temp (giống tờ khai)
@@ -4240,31 +4393,9 @@ class TaxCrawlerService:
                 return
             
             # Tìm frame từ iframe SSO (giống tờ khai)
-            # Đợi frame xuất hiện trong page.frames (có thể mất thời gian)
-            frame = None
-            max_wait = 30  # Đợi tối đa 15 giây (30 * 0.5)
-            for i in range(max_wait):
-                try:
-                    frames = page.frames
-                    for f in frames:
-                        if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
-                            frame = f
-                            logger.info(f"Found frame for giaynoptien: {frame.url[:100]}...")
-                            # Kiểm tra xem frame đã load chưa
-                            try:
-                                await frame.wait_for_load_state('domcontentloaded', timeout=2000)
-                                break
-                            except:
-                                # Frame chưa load xong, tiếp tục đợi
-                                frame = None
-                                pass
-                    
-                    if frame:
-                        break
-                except Exception as e:
-                    logger.debug(f"Waiting for frame (attempt {i + 1}/{max_wait}): {e}")
-                
-                await asyncio.sleep(0.5)
+            frame = await waits.wait_for_frame(page, "giaynoptien.frame_lookup", ('thuedientu.gdt.gov.vn', 'etaxnnt'), timeout=15000)
+            if frame:
+                logger.info(f"Found frame for giaynoptien: {frame.url[:100]}...")
             
             if not frame:
                 yield {"type": "error", "error": "Không tìm thấy iframe sau khi navigate. Vui lòng thử lại.", "error_code": "NAVIGATION_ERROR"}
@@ -4272,8 +4403,6 @@ class TaxCrawlerService:
             
             # Đợi frame load và kiểm tra form giấy nộp tiền
             try:
-                await frame.wait_for_load_state('domcontentloaded', timeout=15000)
-                await asyncio.sleep(1)
                 await frame.wait_for_selector('input[name="ngay_lap_tu_ngay"], #ngay_lap_tu_ngay', timeout=15000)
                 logger.info("Tra cuu giay nop tien form loaded successfully")
                 
@@ -4380,33 +4509,12 @@ class TaxCrawlerService:
                     await end_input.fill(date_range[1])
                     
                     # Click tìm kiếm (dùng value hoặc onclick)
+                    # Click tìm kiếm (dùng value hoặc onclick), đợi server trả kết quả + frame networkidle
+                    # (iframe có thể reload khi chuyển khoảng thời gian → frame mới)
                     search_btn = frame.locator('input[value="Tra cứu"], input[onclick*="traCuuChungTu"]')
-                    await search_btn.click()
-                    
-                    await asyncio.sleep(2)
+                    frame = await self._submit_search(page, frame, search_btn, "giaynoptien")
                     
-                    logger.info(f"🔍 [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Đã click search cho khoảng: {date_range[0]} - {date_range[1]}")
-                    
-                    # ✅ Đợi một chút để đảm bảo request đã được gửi
-                    await asyncio.sleep(1)
-                    
-                    # ✅ Tìm lại frame mới sau khi click search (iframe có thể reload khi chuyển khoảng thời gian)
-                    try:
-                        frames = page.frames
-                        for f in frames:
-                            if 'thuedientu.gdt.gov.vn' in f.url and 'etaxnnt' in f.url:
-                                frame = f  # Cập nhật frame object mới
-                                logger.info(f"🔄 [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Đã tìm lại frame mới sau khi click search: {frame.url[:100]}...")
-                                break
-                    except Exception as refind_frame_e:
-                        logger.warning(f"⚠️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Không thể tìm lại frame mới sau khi click search: {refind_frame_e}")
-                    
-                    # ✅ Đợi frame load xong trước khi đợi table
-                    try:
-                        await frame.wait_for_load_state('networkidle', timeout=5000)
-                        logger.info(f"✅ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Frame đã load xong (networkidle)")
-                    except Exception as frame_load_e:
-                        logger.debug(f"⚠️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Không thể đợi frame networkidle: {frame_load_e}")
+                    logger.info(f"🔍 [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Đã search khoảng: {date_range[0]} - {date_range[1]}")
                     
                     # ✅ Đợi table load xong để đảm bảo đã chuyển sang khoảng mới
                     try:
@@ -4414,10 +4522,6 @@ class TaxCrawlerService:
                         table_body_check = frame.locator('table#data_content_onday tbody#allResultTableBody, #allResultTableBody').first
                         await table_body_check.wait_for(timeout=10000, state='visible')
                         logger.info(f"✅ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Table đã load xong sau khi click search")
-                        
-                        # ✅ Đợi thêm một chút để đảm bảo dữ liệu đã được render xong
-                        await asyncio.sleep(1.5)
-                        logger.info(f"✅ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Đã đợi thêm để đảm bảo dữ liệu đã render xong")
                     except Exception as wait_table_e:
                         logger.warning(f"⚠️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Không thể đợi table load sau khi click search: {wait_table_e}")
                         # Tiếp tục xử lý, sẽ kiểm tra "Không có dữ liệu" ở bước tiếp theo
@@ -4710,11 +4814,13 @@ class TaxCrawlerService:
                                             pass
                                 
                                 if download_link_found:
-                                                download_queue.append({
-                                                    "id": id_gnt,
+                                    download_queue.append({
+                                        "id": id_gnt,
+                                        "file_name": f"chungtu_{id_gnt}",
                                         "download_link": download_link_found,
                                         "cols": cols,
-                                        "col_index": download_col_index
+                                        "col_index": download_col_index,
+                                        **await self._read_download_target(download_link_found)
                                     })
                             
                             except Exception as e:
@@ -4770,10 +4876,13 @@ class TaxCrawlerService:
                             
                             downloaded = 0
                             
-                            for item_idx, item in enumerate(download_queue, 1):
+                            # httpx song song theo URL của link "Tải về", Playwright chỉ cho dòng không ra URL
+                            item_idx = 0
+                            async for item, success in self._iter_direct_downloads(
+                                session, download_queue, temp_dir, self._download_single_giaynoptien
+                            ):
+                                item_idx += 1
                                 try:
-                                    logger.info(f"📥 [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đang download file {item_idx}/{queue_total}: {item.get('id', 'N/A')}...")
-                                    success = await self._download_single_giaynoptien(session, item, temp_dir)
                                     if success:
                                         downloaded += 1
                                         accumulated_downloaded_so_far += 1
@@ -4886,6 +4995,7 @@ class TaxCrawlerService:
                                 
                                 try:
                                     logger.info(f"🖱️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đang click nút next...")
+                                    page_before = await self._extract_pagination_info(frame)
                                     await asyncio.wait_for(next_btn.click(), timeout=10.0)
                                     logger.info(f"✅ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đã click nút next thành công")
                                 except asyncio.TimeoutError:
@@ -4943,9 +5053,9 @@ class TaxCrawlerService:
                                     check_pages = False
                                     continue
                                 
-                                logger.info(f"⏳ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đợi 2 giây sau khi click...")
-                                await asyncio.sleep(2)
-                                logger.info(f"✅ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: Đã đợi xong 2 giây, bắt đầu đợi table load...")
+                                # Đợi #currAcc rời trang vừa xử lý thay cho sleep cố định
+                                if page_before and not await self._wait_for_pagination(frame, "giaynoptien.next_page", after_page=page_before["current_page"], timeout=15000):
+                                    logger.warning(f"⚠️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Trang {page_num}: #currAcc vẫn báo trang {page_before['current_page']} sau khi click next")
                                 
                                 # ✅ Kiểm tra lại xem có trang tiếp theo không (sau khi click)
                                 try:
@@ -4978,14 +5088,16 @@ class TaxCrawlerService:
                                             table_body_check.wait_for(timeout=15000, state='visible'),
                                             timeout=20.0  # Tổng timeout 20 giây
                                         )
-                                        await asyncio.sleep(1)
+                                        await waits.wait_for_load(frame, "giaynoptien.page_networkidle", timeout=5000)
                                         
                                         try:
                                             rows_check = table_body_check.locator('tr')
                                             row_count_check = await rows_check.count()
                                             
                                             if row_count_check == previous_row_count and previous_row_count > 0:
-                                                await asyncio.sleep(2)
+                                                async def row_count_changed():
+                                                    return await rows_check.count() != previous_row_count
+                                                await waits.wait_until(row_count_changed, "giaynoptien.rows_changed", timeout=2000)
                                                 row_count_check = await rows_check.count()
                                                 
                                                 if row_count_check == previous_row_count:
@@ -4998,7 +5110,6 @@ class TaxCrawlerService:
                                     except Exception as wait_table_e:
                                         raise
                                 except asyncio.TimeoutError:
-                                    await asyncio.sleep(3)
                                     try:
                                         table_body_check_retry = frame.locator('table#data_content_onday tbody#allResultTableBody, #allResultTableBody').first
                                         await asyncio.wait_for(
@@ -5025,7 +5136,7 @@ class TaxCrawlerService:
                                         except Exception as no_data_check_e3:
                                             pass
                                         
-                                        await asyncio.sleep(2)
+                                        await waits.wait_for_load(frame, "giaynoptien.retry_networkidle", timeout=5000)
                                         try:
                                             next_btn_check = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                             next_btn_check_count = await next_btn_check.count()
@@ -5103,7 +5214,6 @@ class TaxCrawlerService:
                                         logger.info(f"📸 Screenshots saved to: {screenshot_dir}")
                                     except Exception as screenshot_e:
                                         logger.error(f"❌ Error taking screenshot: {screenshot_e}")
-                                    await asyncio.sleep(3)
                                     try:
                                         table_body_check_retry = frame.locator('table#data_content_onday tbody#allResultTableBody, #allResultTableBody').first
                                         await asyncio.wait_for(
@@ -5124,7 +5234,7 @@ class TaxCrawlerService:
                                             logger.warning(f"⚠️ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Không thể tìm lại frame mới sau retry: {refind_frame_e}")
                                     except Exception as retry_e:
                                         logger.error(f"❌ [GIAYNOPTIEN] [{range_idx + 1}/{len(date_ranges)}] Retry vẫn thất bại: {retry_e}")
-                                        await asyncio.sleep(2)
+                                        await waits.wait_for_load(frame, "giaynoptien.retry_networkidle", timeout=5000)
                                         try:
                                             next_btn_check = frame.locator('img[src="/etaxnnt/static/images/pagination_right.gif"]')
                                             next_btn_check_count = await next_btn_check.count()
@@ -5329,10 +5439,9 @@ class TaxCrawlerService:
                     logger.info(f"✅ Đã tạo file ZIP: {zip_filename} (download_id: {download_id})")
                     
                     try:
-                        from shared.redis_client import get_redis_client
-                        redis_client = get_redis_client()
+                        from shared.redis_async import get_async_redis_client
                         redis_key = f"session:{session_id}:download_id"
-                        redis_client.setex(redis_key, 3600, download_id.encode('utf-8'))
+                        await get_async_redis_client().setex(redis_key, 3600, download_id.encode('utf-8'))
                     except Exception as redis_err:
                         logger.warning(f"⚠️ Không thể lưu download_id vào Redis: {redis_err}")
                 else:
@@ -5373,6 +5482,7 @@ class TaxCrawlerService:
         
         finally:
             shutil.rmtree(temp_dir, ignore_errors=True)
+            waits.log_wait_stats()
     
     _gnt_download_counter = 0
     
@@ -5620,20 +5730,29 @@ class TaxCrawlerService:
         start_date: str,
         end_date: str,
         crawl_types: List[str],
-        tokhai_type: str = "00"
+        tokhai_type: str = "00",
+        job_id: Optional[str] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Crawl nhiều loại dữ liệu đồng thời (tờ khai, thông báo, giấy nộp tiền)
         
+        Mỗi loại chạy song song trên 1 page riêng của cùng context đã đăng nhập (loại đầu dùng session.page):
+          - file của mọi loại tải qua 1 pool chung BATCH_DOWNLOAD_CONCURRENCY request (_download_pools)
+          - không chia khoảng ngày song song trong batch (GOSOFT_CRAWL_PARALLEL_RANGES không áp dụng)
+          - loại nào xong thì ZIP của loại đó chép ngay vào 1 ZIP gộp (thư mục con theo loại)
+        → thời gian cả batch gần bằng loại chậm nhất thay vì tổng các loại
+        
         Args:
             session_id: Session ID đã đăng nhập
             start_date: Ngày bắt đầu (dd/mm/yyyy)
             end_date: Ngày kết thúc (dd/mm/yyyy)
             crawl_types: Danh sách loại cần crawl ["tokhai", "thongbao", "giaynoptien"]
             tokhai_type: Loại tờ khai (chỉ áp dụng nếu crawl tokhai)
+            job_id: Job ID để các loại check cancelled
         
         Yields:
-            Dict với progress và kết quả từng loại
+            Event của từng loại (thêm crawl_type, batch_percent = % trung bình các loại), type_complete / type_error,
+            cuối cùng batch_complete (download_id của ZIP gộp)
         """
         session = self.session_manager.get_session(session_id)
         if not session:
@@ -5646,7 +5765,7 @@ class TaxCrawlerService:
         
         # Validate crawl_types
         valid_types = ["tokhai", "thongbao", "giaynoptien"]
-        crawl_types = [t for t in crawl_types if t in valid_types]
+        crawl_types = list(dict.fromkeys(t for t in crawl_types if t in valid_types))
         
         if not crawl_types:
             yield {"type": "error", "error": "Không có loại crawl hợp lệ. Chọn từ: tokhai, thongbao, giaynoptien", "error_code": "INVALID_CRAWL_TYPES"}
@@ -5660,181 +5779,174 @@ class TaxCrawlerService:
             "total_types": total_types
         }
         
+        # parallel_ranges=1: mỗi loại chỉ dùng 1 page, không mở thêm context clone (download của clone
+        # không đi qua pool chung BATCH_DOWNLOAD_CONCURRENCY)
+        crawls = {
+            "tokhai": lambda sid: self.crawl_tokhai(sid, tokhai_type, start_date, end_date, job_id=job_id, parallel_ranges=1),
+            "thongbao": lambda sid: self.crawl_thongbao(sid, start_date, end_date, job_id=job_id, parallel_ranges=1),
+            "giaynoptien": lambda sid: self.crawl_giay_nop_tien(sid, start_date, end_date, job_id=job_id, parallel_ranges=1),
+        }
+        
         # Kết quả tổng hợp
         batch_results = {
             "tokhai": None,
             "thongbao": None,
             "giaynoptien": None
         }
+        type_percents = {crawl_type: 0 for crawl_type in crawl_types}
         
-        # Xử lý từng loại tuần tự (vì cùng dùng 1 session/page)
-        for idx, crawl_type in enumerate(crawl_types):
-            yield {
-                "type": "batch_progress",
-                "current_type": crawl_type,
-                "type_index": idx + 1,
-                "total_types": total_types,
-                "message": f"Đang crawl {crawl_type} ({idx + 1}/{total_types})..."
-            }
-            
-            try:
-                if crawl_type == "tokhai":
-                    # Crawl tờ khai - thứ tự: session_id, tokhai_type, start_date, end_date
-                    async for result in self.crawl_tokhai(session_id, tokhai_type, start_date, end_date):
-                        # Forward progress events với prefix
-                        if result.get("type") == "complete":
-                            batch_results["tokhai"] = result
-                            yield {
-                                "type": "type_complete",
-                                "crawl_type": "tokhai",
-                                "result": result
-                            }
-                        elif result.get("type") == "zip_data":
-                            # Lưu zip_data vào batch_results
-                            if batch_results.get("tokhai"):
-                                batch_results["tokhai"]["zip_base64"] = result.get("zip_base64")
-                            # Forward event
-                            yield {
-                                **result,
-                                "crawl_type": "tokhai"
-                            }
-                        elif result.get("type") == "error":
-                            yield {
-                                "type": "type_error",
-                                "crawl_type": "tokhai",
-                                "error": result.get("error")
-                            }
-                        else:
-                            # Forward info/progress events
-                            yield {
-                                **result,
-                                "crawl_type": "tokhai"
-                            }
-                
-                elif crawl_type == "thongbao":
-                    # Crawl thông báo
-                    async for result in self.crawl_thongbao(session_id, start_date, end_date):
-                        if result.get("type") == "complete":
-                            batch_results["thongbao"] = result
-                            # Nếu có zip_base64 trong complete event, giữ lại
-                            yield {
-                                "type": "type_complete",
-                                "crawl_type": "thongbao",
-                                "result": result
-                            }
-                        elif result.get("type") == "zip_data":
-                            if batch_results.get("thongbao"):
-                                batch_results["thongbao"]["zip_base64"] = result.get("zip_base64")
-                            yield {
-                                **result,
-                                "crawl_type": "thongbao"
-                            }
-                        elif result.get("type") == "error":
-                            yield {
-                                "type": "type_error",
-                                "crawl_type": "thongbao",
-                                "error": result.get("error")
-                            }
-                        else:
-                            yield {
-                                **result,
-                                "crawl_type": "thongbao"
-                            }
-                
-                elif crawl_type == "giaynoptien":
-                    # Crawl giấy nộp tiền
-                    async for result in self.crawl_giay_nop_tien(session_id, start_date, end_date):
-                        if result.get("type") == "complete":
-                            batch_results["giaynoptien"] = result
-                            yield {
-                                "type": "type_complete",
-                                "crawl_type": "giaynoptien",
-                                "result": result
-                            }
-                        elif result.get("type") == "zip_data":
-                            if batch_results.get("giaynoptien"):
-                                batch_results["giaynoptien"]["zip_base64"] = result.get("zip_base64")
-                            yield {
-                                **result,
-                                "crawl_type": "giaynoptien"
-                            }
-                        elif result.get("type") == "error":
-                            yield {
-                                "type": "type_error",
-                                "crawl_type": "giaynoptien",
-                                "error": result.get("error")
-                            }
-                        else:
-                            yield {
-                                **result,
-                                "crawl_type": "giaynoptien"
-                            }
-                
-            except Exception as e:
-                logger.error(f"Error crawling {crawl_type}: {e}")
-                yield {
-                    "type": "type_error",
-                    "crawl_type": crawl_type,
-                    "error": str(e)
-                }
-        
-        # Tổng hợp kết quả cuối cùng
-        # Merge tất cả ZIP files thành 1 ZIP duy nhất
-        merged_zip_buffer = BytesIO()
-        total_files = 0
-        total_size = 0
+        download_id = str(uuid.uuid4())
+        zip_file_path = os.path.join(self.ZIP_STORAGE_DIR, f"{download_id}.zip")
+        zip_filename = f"batch_crawl_{start_date.replace('/', '')}_{end_date.replace('/', '')}.zip"
+        merged_zip = zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED)
+        merged_names = set()
+        merged_files = []
         all_results = []
         
-        with zipfile.ZipFile(merged_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as merged_zip:
-            for crawl_type, result in batch_results.items():
-                if result and result.get("zip_base64"):
+        page_session_ids = []
+        tasks = []
+        try:
+            # Loại đầu chạy trên session.page, mỗi loại sau 1 page mới cùng context; không mở được page → chạy nối tiếp trên session.page
+            assignments = {session_id: [crawl_types[0]]}
+            for crawl_type in crawl_types[1:]:
+                try:
+                    page_session_id = await self.session_manager.clone_session(session_id, share_context=True)
+                except Exception as e:
+                    logger.warning(f"⚠️ Không mở được page riêng cho {crawl_type}: {e}")
+                    page_session_id = None
+                if page_session_id:
+                    page_session_ids.append(page_session_id)
+                    assignments[page_session_id] = [crawl_type]
+                else:
+                    assignments[session_id].append(crawl_type)
+            
+            pool = asyncio.Semaphore(max(1, BATCH_DOWNLOAD_CONCURRENCY))
+            for sid in assignments:
+                self._download_pools[sid] = pool
+            
+            # (crawl_type, event); event None = loại đó đã xong
+            events: asyncio.Queue = asyncio.Queue()
+            
+            async def run_types(sid: str, types: List[str]):
+                for crawl_type in types:
+                    type_index = crawl_types.index(crawl_type) + 1
+                    await events.put((crawl_type, {
+                        "type": "batch_progress",
+                        "current_type": crawl_type,
+                        "type_index": type_index,
+                        "total_types": total_types,
+                        "message": f"Đang crawl {crawl_type} ({type_index}/{total_types})..."
+                    }))
                     try:
-                        # Decode ZIP của từng loại
-                        type_zip_bytes = base64.b64decode(result["zip_base64"])
-                        type_zip_buffer = BytesIO(type_zip_bytes)
-                        
-                        with zipfile.ZipFile(type_zip_buffer, 'r') as type_zip:
-                            for file_info in type_zip.filelist:
-                                # Thêm prefix folder theo loại
-                                new_name = f"{crawl_type}/{file_info.filename}"
-                                file_data = type_zip.read(file_info.filename)
-                                merged_zip.writestr(new_name, file_data)
-                                total_files += 1
-                                total_size += len(file_data)
-                        
-                        # Collect results
-                        if result.get("results"):
-                            for r in result["results"]:
-                                r["crawl_type"] = crawl_type
-                                all_results.append(r)
+                        async for result in crawls[crawl_type](sid):
+                            await events.put((crawl_type, result))
                     except Exception as e:
-                        logger.warning(f"Error merging ZIP for {crawl_type}: {e}")
-        
-        # Encode merged ZIP
-        merged_zip_base64 = base64.b64encode(merged_zip_buffer.getvalue()).decode('utf-8') if total_files > 0 else None
-        zip_filename = f"batch_crawl_{start_date.replace('/', '')}_{end_date.replace('/', '')}.zip"
+                        logger.error(f"Error crawling {crawl_type}: {e}")
+                        await events.put((crawl_type, {"type": "error", "error": str(e)}))
+                    await events.put((crawl_type, None))
+            
+            tasks = [asyncio.create_task(run_types(sid, types)) for sid, types in assignments.items()]
+            
+            remaining = total_types
+            while remaining:
+                crawl_type, result = await events.get()
+                if result is None:
+                    remaining -= 1
+                    type_percents[crawl_type] = 100
+                    continue
+                
+                result_type = result.get("type")
+                if "accumulated_percent" in result:
+                    type_percents[crawl_type] = result.get("accumulated_percent") or 0
+                batch_percent = int(round(sum(type_percents.values()) / total_types))
+                
+                if result_type == "complete":
+                    batch_results[crawl_type] = result
+                    if result.get("download_id"):
+                        merged_files += self._copy_zip_entries(merged_zip, result["download_id"], merged_names, prefix=f"{crawl_type}/")
+                    for r in result.get("results") or []:
+                        r["crawl_type"] = crawl_type
+                        all_results.append(r)
+                    yield {
+                        "type": "type_complete",
+                        "crawl_type": crawl_type,
+                        "result": result,
+                        "batch_percent": batch_percent
+                    }
+                elif result_type == "zip_data":
+                    # Lưu zip_data vào batch_results
+                    if batch_results.get(crawl_type):
+                        batch_results[crawl_type]["zip_base64"] = result.get("zip_base64")
+                    yield {
+                        **result,
+                        "crawl_type": crawl_type
+                    }
+                elif result_type == "error":
+                    yield {
+                        "type": "type_error",
+                        "crawl_type": crawl_type,
+                        "error": result.get("error"),
+                        "error_code": result.get("error_code")
+                    }
+                else:
+                    # Forward info/progress events
+                    yield {
+                        **result,
+                        "crawl_type": crawl_type,
+                        "batch_percent": batch_percent
+                    }
+            
+            merged_zip.close()
+            total_files = len(merged_files)
+            total_size = sum(f["size"] for f in merged_files)
+            if total_files > 0:
+                with open(zip_file_path, 'rb') as f:
+                    merged_zip_base64 = base64.b64encode(f.read()).decode('utf-8')
+            else:
+                merged_zip_base64 = None
+                download_id = None
+                os.remove(zip_file_path)
+            
+            yield {
+                "type": "batch_complete",
+                "message": f"Hoàn thành crawl {total_types} loại dữ liệu",
+                "total_files": total_files,
+                "total_size": total_size,
+                "results": all_results,
+                "batch_results": {
+                    crawl_type: {
+                        "total": result.get("total", 0) if result else 0,
+                        "files_count": result.get("files_count", 0) if result else 0,
+                        "total_size": result.get("total_size", 0) if result else 0,
+                        "download_id": result.get("download_id") if result else None,
+                        "zip_base64": result.get("zip_base64") if result else None,
+                        "zip_filename": result.get("zip_filename") if result else None,
+                        "results": result.get("results", []) if result else []
+                    }
+                    for crawl_type, result in batch_results.items()
+                    if crawl_type in crawl_types
+                },
+                "download_id": download_id,
+                "zip_base64": merged_zip_base64,
+                "zip_filename": zip_filename
+            }
         
-        yield {
-            "type": "batch_complete",
-            "message": f"Hoàn thành crawl {total_types} loại dữ liệu",
-            "total_files": total_files,
-            "total_size": total_size,
-            "results": all_results,
-            "batch_results": {
-                crawl_type: {
-                    "total": result.get("total", 0) if result else 0,
-                    "files_count": result.get("files_count", 0) if result else 0,
-                    "total_size": result.get("total_size", 0) if result else 0,
-                    "zip_base64": result.get("zip_base64") if result else None,
-                    "zip_filename": result.get("zip_filename") if result else None,
-                    "results": result.get("results", []) if result else []
-                }
-                for crawl_type, result in batch_results.items()
-                if crawl_type in crawl_types
-            },
-            "zip_base64": merged_zip_base64,
-            "zip_filename": zip_filename
-        }
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if merged_zip.fp is not None:
+                # Dừng giữa chừng → bỏ ZIP gộp dở
+                merged_zip.close()
+                try:
+                    os.remove(zip_file_path)
+                except OSError:
+                    pass
+            self._download_pools.pop(session_id, None)
+            for page_session_id in page_session_ids:
+                self._download_pools.pop(page_session_id, None)
+                await self.close_http_client(page_session_id)
+                await self.session_manager.close_session(page_session_id)
     
     async def _extract_pagination_info(self, frame) -> Optional[Dict[str, int]]:
         """
@@ -5875,6 +5987,23 @@ class TaxCrawlerService:
             logger.warning(f"Error extracting pagination info: {e}")
             return None
     
+    async def _wait_for_pagination(self, frame, label: str, page_num: Optional[int] = None,
+                                   after_page: Optional[int] = None, timeout: int = 10000) -> Optional[Dict[str, int]]:
+        """
+        Đợi #currAcc của frame báo đang ở trang page_num (hoặc đã rời trang after_page) thay cho sleep sau khi click phân trang
+        Returns: pagination info lúc đạt điều kiện, None nếu hết timeout
+        """
+        async def reached():
+            info = await self._extract_pagination_info(frame)
+            if not info:
+                return None
+            if page_num is not None and info["current_page"] != page_num:
+                return None
+            if after_page is not None and info["current_page"] == after_page:
+                return None
+            return info
+        return await waits.wait_until(reached, label, timeout=timeout, interval=0.25)
+    
     async def _navigate_to_page(self, frame, page_num: int) -> bool:
         """
         Navigate đến trang page_num của giấy nộp tiền.
@@ -5886,11 +6015,10 @@ class TaxCrawlerService:
             page_link = frame.locator(f'a[href*="pn={page_num}"]:has-text("{page_num}")')
             if await page_link.count() > 0:
                 await page_link.first.click()
-                await asyncio.sleep(1)
                 
-                # Verify navigation: check xem có đúng trang không
-                pagination_info = await self._extract_pagination_info(frame)
-                if pagination_info and pagination_info["current_page"] == page_num:
+                # Verify navigation: đợi #currAcc báo đúng trang
+                pagination_info = await self._wait_for_pagination(frame, "pagination.link", page_num=page_num)
+                if pagination_info:
                     logger.info(f"✅ Navigated to page {page_num} via link")
                     return True
                 else:
@@ -5903,17 +6031,15 @@ class TaxCrawlerService:
                 if await goto_input.count() > 0:
                     # Fill page number
                     await goto_input.fill(str(page_num))
-                    await asyncio.sleep(0.3)
                     
                     # Click nút "go" (img với src="/etaxnnt/static/images/pagination_go.gif")
                     go_btn = frame.locator('a[href*="gotoPage"] img[src*="pagination_go"], a:has(img[src*="pagination_go"])')
                     if await go_btn.count() > 0:
                         await go_btn.first.click()
-                        await asyncio.sleep(1)
                         
                         # Verify navigation
-                        pagination_info = await self._extract_pagination_info(frame)
-                        if pagination_info and pagination_info["current_page"] == page_num:
+                        pagination_info = await self._wait_for_pagination(frame, "pagination.goto", page_num=page_num)
+                        if pagination_info:
                             logger.info(f"✅ Navigated to page {page_num} via JavaScript gotoPage")
                             return True
             except Exception as js_e:
@@ -5933,10 +6059,11 @@ class TaxCrawlerService:
                 for _ in range(min(clicks_needed, 10)):  # Giới hạn tối đa 10 lần click
                     if await next_btn.count() > 0:
                         await next_btn.first.click()
-                        await asyncio.sleep(1)
                         
-                        # Check xem đã đến đúng trang chưa
-                        pagination_info = await self._extract_pagination_info(frame)
+                        # Đợi rời trang hiện tại rồi check xem đã đến đúng trang chưa
+                        pagination_info = await self._wait_for_pagination(frame, "pagination.next", after_page=current_page)
+                        if pagination_info:
+                            current_page = pagination_info["current_page"]
                         if pagination_info and pagination_info["current_page"] == page_num:
                             logger.info(f"✅ Navigated to page {page_num} via next button")
                             return True
@@ -5992,6 +6119,7 @@ class TaxCrawlerService:
                         await download_link.first.click()
                     
                     download = await download_info.value
+                    item["resolved_url"] = download.url  # _iter_direct_downloads học URL mẫu từ đây
                     save_path = os.path.join(temp_dir, file_name + ".xml" if not file_name.endswith(".xml") else file_name)
                     await download.save_as(save_path)
                     
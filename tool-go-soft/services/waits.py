@@ -0,0 +1,144 @@
+"""
+Đợi theo điều kiện thay cho asyncio.sleep cố định khi điều khiển trang thuế bằng Playwright
+
+Mỗi hàm đợi tới khi điều kiện đúng (selector hiện, frame có URL, network idle, response khớp...) hoặc hết timeout;
+hết timeout / lỗi → trả False / None, không raise, để code gọi tự quyết định retry như trước.
+Mọi lần đợi đều được đo theo nhãn (label) → xem thời gian navigation tốn ở bước nào:
+  - wait_stats(): {label: {"count", "timeouts", "total_ms", "avg_ms", "max_ms"}}, API GET /debug/wait-stats
+  - log_wait_stats(): log các nhãn tốn nhiều thời gian nhất (gọi cuối mỗi lần crawl)
+  - GOSOFT_WAIT_LOG=1: log từng lần đợi (nhãn, ms, ok / timeout)
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+WAIT_LOG_EACH = os.getenv('GOSOFT_WAIT_LOG', '0') == '1'
+# Chu kỳ kiểm tra của các hàm đợi dạng poll (wait_for_frame, wait_until)
+POLL_INTERVAL = float(os.getenv('GOSOFT_WAIT_POLL_INTERVAL', 0.1))
+
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _record(label: str, started: float, ok: bool):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stat = _stats.setdefault(label, {"count": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0})
+    stat["count"] += 1
+    stat["timeouts"] += 0 if ok else 1
+    stat["total_ms"] += elapsed_ms
+    stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+    if WAIT_LOG_EACH:
+        logger.info(f"⏱️ wait {label}: {elapsed_ms:.0f}ms {'ok' if ok else 'timeout'}")
+
+
+def wait_stats() -> Dict[str, Dict[str, float]]:
+    """Thống kê thời gian đợi theo nhãn từ lúc process chạy (hoặc từ lần reset_wait_stats gần nhất)"""
+    return {
+        label: {**stat, "avg_ms": stat["total_ms"] / stat["count"]}
+        for label, stat in sorted(_stats.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+    }
+
+
+def reset_wait_stats():
+    _stats.clear()
+
+
+def log_wait_stats(top: int = 10):
+    for label, stat in list(wait_stats().items())[:top]:
+        logger.info(f"⏱️ {label}: {stat['count']} lần, tổng {stat['total_ms']:.0f}ms, "
+                    f"TB {stat['avg_ms']:.0f}ms, max {stat['max_ms']:.0f}ms, timeout {stat['timeouts']}")
+
+
+async def wait_for_selector(target, selector: str, label: str, timeout: int = 15000, state: str = 'visible') -> bool:
+    """target: Page hoặc Frame; timeout ms"""
+    started = time.perf_counter()
+    try:
+        await target.wait_for_selector(selector, state=state, timeout=timeout)
+        ok = True
+    except Exception as e:
+        logger.debug(f"wait {label} ({selector}): {e}")
+        ok = False
+    _record(label, started, ok)
+    return ok
+
+
+async def wait_for_load(target, label: str, state: str = 'networkidle', timeout: int = 10000) -> bool:
+    """Đợi load state của Page / Frame: 'domcontentloaded', 'load' hoặc 'networkidle' (không còn request ~500ms)"""
+    started = time.perf_counter()
+    try:
+        await target.wait_for_load_state(state, timeout=timeout)
+        ok = True
+    except Exception as e:
+        logger.debug(f"wait {label} ({state}): {e}")
+        ok = False
+    _record(label, started, ok)
+    return ok
+
+
+async def wait_until(check: Callable[[], Awaitable[Any]], label: str, timeout: int = 10000,
+                     interval: float = None) -> Any:
+    """
+    Gọi check() mỗi `interval` giây tới khi trả giá trị truthy (lỗi trong check coi như chưa đạt)
+    Returns: giá trị đó, None nếu hết timeout
+    """
+    started = time.perf_counter()
+    deadline = started + timeout / 1000
+    result = None
+    while True:
+        try:
+            result = await check()
+        except Exception as e:
+            logger.debug(f"wait {label}: {e}")
+            result = None
+        remaining = deadline - time.perf_counter()
+        if result or remaining <= 0:
+            break
+        await asyncio.sleep(min(interval or POLL_INTERVAL, remaining))
+    _record(label, started, bool(result))
+    return result or None
+
+
+async def wait_for_frame(page, label: str, url_contains: Sequence[str] = ('thuedientu.gdt.gov.vn',),
+                         timeout: int = 15000):
+    """Frame đầu tiên của page có URL chứa mọi chuỗi trong url_contains, None nếu hết timeout"""
+    async def find():
+        for frame in page.frames:
+            if all(part in frame.url for part in url_contains):
+                return frame
+        return None
+    return await wait_until(find, label, timeout=timeout)
+
+
+async def wait_for_event(target, event: str, action: Callable[[], Awaitable[Any]], predicate: Callable[[Any], bool],
+                         label: str, timeout: int = 15000) -> Optional[Any]:
+    """
+    Chạy action() (click, evaluate...) và đợi event đầu tiên của target thỏa predicate
+    (vd 'framenavigated' → Frame, 'response' → Response)
+    Returns: giá trị của event, None nếu hết timeout (action vẫn đã chạy; lỗi của chính action thì raise như cũ)
+    """
+    started = time.perf_counter()
+    value = None
+    try:
+        async with target.expect_event(event, predicate=predicate, timeout=timeout) as event_info:
+            await action()
+        value = await event_info.value
+    except Exception as e:
+        if not _is_timeout(e):
+            _record(label, started, False)
+            raise
+        logger.debug(f"wait {label}: {e}")
+    _record(label, started, value is not None)
+    return value
+
+
+async def wait_for_response(page, action: Callable[[], Awaitable[Any]], predicate: Callable[[Any], bool],
+                            label: str, timeout: int = 15000) -> Optional[Any]:
+    """Chạy action() và đợi response đầu tiên (của mọi frame trong page) thỏa predicate(response)"""
+    return await wait_for_event(page, 'response', action, predicate, label, timeout=timeout)
+
+
+def _is_timeout(e: Exception) -> bool:
+    return type(e).__name__ == 'TimeoutError' or isinstance(e, asyncio.TimeoutError)
@@ -0,0 +1,256 @@
+"""
+Pool process tra cứu Go-Bot sống lâu (run_lookup_standalone.py --serve)
+
+Mỗi process load TensorFlow + 2 model captcha một lần rồi nhận job qua stdin (JSON lines),
+nên job không còn phải trả giá khởi động Python + load_model. Vẫn giữ cách ly như subprocess
+cũ (package backend_ của Go-Bot không lẫn với go-invoice trong API server).
+
+  - GOBOT_POOL_SIZE:        số process tối đa (mặc định 2), job dư sẽ chờ process rảnh
+  - GOBOT_POOL_PREWARM=1:   khởi động sẵn process khi đăng ký routes
+  - GOBOT_POOL_MAX_JOBS / GOBOT_POOL_MAX_RSS_MB: process tự thoát sau N job hoặc khi RSS vượt ngưỡng,
+    pool tạo process mới ở lần dùng kế tiếp
+
+Progress, status và result vẫn do process worker ghi thẳng vào Redis như trước.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("GOBOT_POOL_SIZE", "2"))
+POOL_PREWARM = os.getenv("GOBOT_POOL_PREWARM", "1") != "0"
+# Load TensorFlow + model lần đầu có thể chậm trên máy yếu
+POOL_READY_TIMEOUT = int(os.getenv("GOBOT_POOL_READY_TIMEOUT", "300"))
+
+_api_dir = os.path.dirname(os.path.abspath(__file__))
+_gobot_root = os.path.normpath(os.path.dirname(_api_dir))
+_gotax_root = os.path.normpath(os.path.dirname(_gobot_root))
+_RUN_LOOKUP_SCRIPT = os.path.join(_api_dir, "run_lookup_standalone.py")
+
+
+class LookupWorkerError(Exception):
+    """Process worker chết hoặc không phản hồi trong lúc chạy job"""
+    pass
+
+
+class LookupWorkerNotReady(TimeoutError):
+    """Hết thời gian của job trong khi worker vẫn đang load model (worker không hỏng, dùng lại được)"""
+    pass
+
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
+
+
+class LookupWorker:
+    """1 process run_lookup_standalone.py --serve + thread đọc stdout/stderr"""
+
+    def __init__(self):
+        env = os.environ.copy()
+        env["GOTAX_ROOT"] = _gotax_root
+        env["GOBOT_ROOT"] = _gobot_root
+        env["PYTHONIOENCODING"] = "utf-8"  # Tránh UnicodeEncodeError khi subprocess print/log emoji trên Windows
+        env["PYTHONUNBUFFERED"] = "1"
+        self.proc = subprocess.Popen(
+            [sys.executable, _RUN_LOOKUP_SCRIPT, "--serve", _gotax_root, _gobot_root],
+            cwd=_gotax_root,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.pid = self.proc.pid
+        self.ready = threading.Event()
+        self.current_job_id = None
+        self._messages = queue.Queue()
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+        logger.info(f"[Go-Bot pool] Started worker pid={self.pid}")
+
+    def _read_stdout(self):
+        try:
+            for line in iter(self.proc.stdout.readline, b""):
+                try:
+                    message = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                if message.get("type") == "ready":
+                    self.ready.set()
+                else:
+                    self._messages.put(message)
+        except Exception as e:
+            logger.debug(f"[Go-Bot pool] stdout read error (pid={self.pid}): {e}")
+        finally:
+            # EOF: process đã thoát
+            self._messages.put({"type": "exit"})
+            self.ready.set()
+
+    def _read_stderr(self):
+        try:
+            for line in iter(self.proc.stderr.readline, b""):
+                decoded = line.decode("utf-8", errors="replace").rstrip()
+                if decoded:
+                    logger.info(f"[Job {self.current_job_id or '-'}] [gobot {self.pid}] {decoded}")
+        except Exception as e:
+            logger.debug(f"[Go-Bot pool] stderr read error (pid={self.pid}): {e}")
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def run(self, params, deadline):
+        """
+        Gửi job và chờ kết quả, chờ worker sẵn sàng + chạy job không quá deadline (time.monotonic()).
+
+        Returns: message result. Raises: LookupWorkerError, LookupWorkerNotReady, TimeoutError
+        """
+        ready_timeout = min(POOL_READY_TIMEOUT, _remaining(deadline))
+        ready = self.ready.wait(ready_timeout)
+        if not self.alive() or (not ready and ready_timeout >= POOL_READY_TIMEOUT):
+            raise LookupWorkerError(f"Go-Bot worker pid={self.pid} không khởi động được")
+        if not ready:
+            raise LookupWorkerNotReady(f"Go-Bot worker pid={self.pid} chưa load xong model trước khi hết thời gian job")
+        timeout = _remaining(deadline)
+        self.current_job_id = params.get("job_id")
+        try:
+            self.proc.stdin.write((json.dumps({"type": "job", "params": params}, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise LookupWorkerError(f"Go-Bot worker pid={self.pid} đã dừng: {e}")
+        try:
+            message = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Lookup timeout: job vượt quá thời gian cho phép")
+        finally:
+            self.current_job_id = None
+        if message.get("type") != "result":
+            raise LookupWorkerError(f"Go-Bot worker pid={self.pid} thoát giữa chừng (exit code {self.proc.poll()})")
+        return message
+
+    def stop(self, timeout=5):
+        """Đóng stdin (worker thoát sau job hiện tại), kill nếu quá timeout"""
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+
+
+class LookupPool:
+    """Giữ tối đa `size` LookupWorker; mỗi worker chạy 1 job tại một thời điểm"""
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def prewarm(self):
+        """Khởi động đủ `size` worker (không chờ model load xong)"""
+        with self._lock:
+            while len(self._workers) < self.size and not self._closed:
+                worker = LookupWorker()
+                self._workers.add(worker)
+                self._idle.put(worker)
+
+    def _acquire(self, timeout):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._closed:
+                        raise LookupWorkerError("Go-Bot lookup pool đã đóng")
+                    if len(self._workers) < self.size:
+                        worker = LookupWorker()
+                        self._workers.add(worker)
+                        return worker
+                try:
+                    worker = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"Không có Go-Bot worker rảnh sau {timeout:.0f}s")
+            if worker.alive():
+                return worker
+            self._discard(worker)
+
+    def _discard(self, worker):
+        with self._lock:
+            self._workers.discard(worker)
+        if worker.alive():
+            worker.stop()
+
+    def run(self, params, timeout):
+        """
+        Chạy 1 job trên worker rảnh (block đến khi xong).
+
+        Args:
+            timeout: tổng thời gian của job (chờ worker rảnh + chờ worker load model + chạy job)
+        Returns:
+            dict {"type": "result", "code": 0|1, ...}
+        """
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(_remaining(deadline))
+        try:
+            message = worker.run(params, deadline)
+        except LookupWorkerNotReady:
+            # Worker vẫn đang load model → giữ lại cho job sau
+            self._idle.put(worker)
+            raise
+        except Exception:
+            # Worker treo/chết → bỏ, lần sau tạo process mới
+            self._discard(worker)
+            raise
+        if message.get("recycle") or self._closed:
+            logger.info(f"[Go-Bot pool] Recycling worker pid={worker.pid} "
+                        f"(jobs={message.get('jobs_done')}, rss={message.get('rss_mb')}MB)")
+            with self._lock:
+                self._workers.discard(worker)
+            # Worker tự thoát sau khi gửi result, chỉ cần reap process ở background
+            threading.Thread(target=worker.stop, daemon=True).start()
+        else:
+            self._idle.put(worker)
+        return message
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_lookup_pool():
+    """LookupPool dùng chung của process API (lazy init)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LookupPool()
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def shutdown_lookup_pool():
+    """Dừng mọi worker (gọi khi API server shutdown)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -10,7 +10,6 @@ Luồng xử lý:
 import os
 import sys
 import json
-import time
 import traceback
 import threading
 import logging
@@ -41,9 +40,13 @@ if _gotax_root not in sys.path:
 
 try:
     from shared.redis_client import get_redis_client, publish_progress
+    from shared.job_store import set_job_status
+    from shared.job_queue import enqueue_job
 except ImportError:
     get_redis_client = None
     publish_progress = None
+    set_job_status = None
+    enqueue_job = None
 
 logger = logging.getLogger(__name__)
 
@@ -117,47 +120,31 @@ def detect_id_type(value: str, provided_type: str = None) -> str:
         return "MST"
 
 
-# Go-Bot dùng subprocess (run_lookup_standalone.py) vì API server chạy nhiều tool: go-invoice và go-bot
+# Go-Bot chạy lookup trong process riêng (run_lookup_standalone.py) vì API server chạy nhiều tool: go-invoice và go-bot
 # đều có package "backend_" → nếu chạy lookup trong process như go-invoice/go-soft thì Python cache
 # backend_ từ go-invoice, Go-Bot thiếu BaseServiceCMT. Các tool kia progress trong routes vì không bị trùng package.
-_RUN_LOOKUP_SCRIPT = os.path.join(_tool_root, "api", "run_lookup_standalone.py")
+# Process được giữ sống trong LookupPool (model captcha load 1 lần) thay vì spawn mới mỗi job.
 _LOOKUP_TIMEOUT = int(os.getenv("GOBOT_LOOKUP_TIMEOUT", "900"))  # seconds (default 15 min; tang neu tra cuu cham/TensorFlow load)
 
 
 def _run_lookup_job(job_id, taxcodes, type_taxcode, id_type, proxy):
     """
-    Chạy lookup trong subprocess (run_lookup_standalone.py). Progress do script đó gửi Redis.
+    Chạy lookup trên 1 process của LookupPool (block đến khi xong). Progress do process đó gửi Redis.
+
+    Returns:
+        True nếu job bị timeout (hết thời gian chờ worker rảnh / load model / tra cứu) → route sync trả 504
     """
-    import subprocess
-    import tempfile
-    redis_client = None
-    if get_redis_client:
-        try:
-            redis_client = get_redis_client()
-        except Exception as e:
-            logger.error(f"[Job {job_id}] Redis connect error: {e}")
-    if not redis_client:
+    from toolgobot.api.lookup_pool import get_lookup_pool
+    if not get_redis_client:
         logger.error(f"[Job {job_id}] Redis client not available")
-        return
+        return False
     try:
-        redis_client.set(f"job:{job_id}:status", "processing".encode("utf-8"))
+        set_job_status(job_id, "processing")
         if publish_progress:
             publish_progress(job_id, 0, "Bắt đầu tra cứu...", data={"total": len(taxcodes), "processed": 0})
     except Exception as e:
         logger.error(f"[Job {job_id}] Redis set status error: {e}")
-        return
-
-    if not os.path.isfile(_RUN_LOOKUP_SCRIPT):
-        err = f"Go-Bot standalone script not found: {_RUN_LOOKUP_SCRIPT}"
-        logger.error(f"[Job {job_id}] {err}")
-        try:
-            redis_client.set(f"job:{job_id}:status", b"failed")
-            redis_client.set(f"job:{job_id}:error", err.encode("utf-8"))
-            if publish_progress:
-                publish_progress(job_id, 0, f"Lỗi: {err}", data={"type": "error", "error": err})
-        except Exception:
-            pass
-        return
+        return False
 
     params = {
         "job_id": job_id,
@@ -166,103 +153,27 @@ def _run_lookup_job(job_id, taxcodes, type_taxcode, id_type, proxy):
         "id_type": id_type,
         "proxy": proxy,
     }
-    gotax_root = os.path.normpath(os.path.abspath(_gotax_root))
-    gobot_root = os.path.normpath(os.path.abspath(_tool_root))
-    env = os.environ.copy()
-    env["GOTAX_ROOT"] = gotax_root
-    env["GOBOT_ROOT"] = gobot_root
-    env["PYTHONIOENCODING"] = "utf-8"  # Tránh UnicodeEncodeError khi subprocess print/log emoji trên Windows
-    env["PYTHONUNBUFFERED"] = "1"  # Subprocess print ra ngay de API server doc real-time
-    fd, temp_path = None, None
     try:
-        fd, temp_path = tempfile.mkstemp(suffix=".json", prefix="gobot_")
-        os.write(fd, json.dumps(params, ensure_ascii=False).encode("utf-8"))
-        os.close(fd)
-        fd = None
-        proc = subprocess.Popen(
-            [sys.executable, _RUN_LOOKUP_SCRIPT, temp_path, gotax_root, gobot_root],
-            cwd=gotax_root,
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        # Doc stdout/stderr real-time de biet subprocess dang o dau (tranh treo 600s khong ro ly do)
-        out_lines, err_lines = [], []
-
-        def read_stream(stream, lines_list, prefix):
-            try:
-                for line in iter(stream.readline, b""):
-                    if line:
-                        decoded = line.decode("utf-8", errors="replace").strip()
-                        lines_list.append(decoded)
-                        logger.info(f"[Job {job_id}] [{prefix}] {decoded}")
-            except Exception as e:
-                logger.debug(f"[Job {job_id}] stream read error: {e}")
-            finally:
-                try:
-                    stream.close()
-                except Exception:
-                    pass
-
-        t_out = threading.Thread(target=read_stream, args=(proc.stdout, out_lines, "out"), daemon=True)
-        t_err = threading.Thread(target=read_stream, args=(proc.stderr, err_lines, "err"), daemon=True)
-        t_out.start()
-        t_err.start()
-
-        waited = 0
-        while proc.poll() is None and waited < _LOOKUP_TIMEOUT:
-            time.sleep(10)
-            waited += 10
-            logger.info(f"[Job {job_id}] Dang xu ly... (da doi {waited}s)")
-        if proc.poll() is None:
-            proc.kill()
-            proc.wait(timeout=5)
-            raise subprocess.TimeoutExpired(proc.args, _LOOKUP_TIMEOUT)
-        t_out.join(timeout=2)
-        t_err.join(timeout=2)
-        proc_stdout = "\n".join(out_lines)
-        proc_stderr = "\n".join(err_lines)
-        if proc.returncode != 0:
-            err = (proc_stderr or "").strip() or f"Subprocess exit code {proc.returncode}"
-            logger.error(f"[Job {job_id}] Lookup subprocess failed: {err}")
-            try:
-                redis_client.set(f"job:{job_id}:status", b"failed")
-                redis_client.set(f"job:{job_id}:error", err.encode("utf-8"))
-                if publish_progress:
-                    publish_progress(job_id, 0, f"Lỗi: {err}", data={"type": "error", "error": err})
-            except Exception:
-                pass
-    except subprocess.TimeoutExpired:
-        err = f"Lookup timeout after {_LOOKUP_TIMEOUT}s"
-        logger.error(f"[Job {job_id}] {err}")
-        try:
-            redis_client.set(f"job:{job_id}:status", b"failed")
-            redis_client.set(f"job:{job_id}:error", err.encode("utf-8"))
-            if publish_progress:
-                publish_progress(job_id, 0, f"Lỗi: {err}", data={"type": "error", "error": err})
-        except Exception:
-            pass
+        result = get_lookup_pool().run(params, timeout=_LOOKUP_TIMEOUT)
+        if result.get("code") != 0:
+            # Worker đã ghi failed + error vào Redis
+            logger.error(f"[Job {job_id}] Lookup failed (code {result.get('code')})")
+        return False
+    except TimeoutError as e:
+        err_msg = str(e)
+        timed_out = True
     except Exception as e:
         err_msg = str(e)
+        timed_out = False
         logger.exception(f"[Job {job_id}] Lookup failed: {err_msg}")
-        try:
-            redis_client.set(f"job:{job_id}:status", b"failed")
-            redis_client.set(f"job:{job_id}:error", err_msg.encode("utf-8"))
-            if publish_progress:
-                publish_progress(job_id, 0, f"Lỗi: {err_msg}", data={"type": "error", "error": err_msg})
-        except Exception:
-            pass
-    finally:
-        if fd is not None:
-            try:
-                os.close(fd)
-            except Exception:
-                pass
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
+    logger.error(f"[Job {job_id}] {err_msg}")
+    try:
+        set_job_status(job_id, "failed", error=err_msg)
+        if publish_progress:
+            publish_progress(job_id, 0, f"Lỗi: {err_msg}", data={"type": "error", "error": err_msg})
+    except Exception:
+        pass
+    return timed_out
 
 
 def register_routes(app, prefix):
@@ -275,6 +186,14 @@ def register_routes(app, prefix):
     """
     # Lazy-load BackendService only when routes are registered (Windows DLL safety)
     from toolgobot.backend_.backend_service import BackendService
+    from toolgobot.api.lookup_pool import get_lookup_pool, POOL_PREWARM
+    
+    # Khởi động sẵn process tra cứu để job đầu tiên không phải chờ load TensorFlow/model
+    if POOL_PREWARM:
+        try:
+            get_lookup_pool().prewarm()
+        except Exception as e:
+            logger.warning(f"Go-Bot lookup pool prewarm failed: {e}")
     
     @app.route(f'{prefix}/health', methods=['GET'])
     def go_bot_health_check():
@@ -371,56 +290,21 @@ def register_routes(app, prefix):
                     "message": f"For individual (cn), ID type must be CMT, CCCD or MST, but got {detected_id_type}"
                 }), 400
             
-            # Sync lookup: chạy subprocess (cùng script queue) rồi đọc result từ Redis
-            import subprocess
-            import tempfile
+            # Sync lookup: chạy trên LookupPool (cùng đường với queue) rồi đọc result từ Redis
             import uuid
+            from shared.job_store import get_job_state
             sync_job_id = str(uuid.uuid4())
-            params = {"job_id": sync_job_id, "taxcodes": taxcodes, "type_taxcode": type_taxcode, "id_type": id_type, "proxy": proxy}
-            gotax_root = os.path.normpath(os.path.abspath(_gotax_root))
-            gobot_root = os.path.normpath(os.path.abspath(_tool_root))
-            sync_env = os.environ.copy()
-            sync_env["GOTAX_ROOT"] = gotax_root
-            sync_env["GOBOT_ROOT"] = gobot_root
-            sync_env["PYTHONIOENCODING"] = "utf-8"
-            if not os.path.isfile(_RUN_LOOKUP_SCRIPT):
-                return jsonify({"status": "error", "message": "Go-Bot standalone script not found"}), 500
-            fd, temp_path = None, None
-            try:
-                fd, temp_path = tempfile.mkstemp(suffix=".json", prefix="gobot_sync_")
-                os.write(fd, json.dumps(params, ensure_ascii=False).encode("utf-8"))
-                os.close(fd)
-                fd = None
-                proc = subprocess.run(
-                    [sys.executable, _RUN_LOOKUP_SCRIPT, temp_path, gotax_root, gobot_root],
-                    cwd=gotax_root,
-                    timeout=_LOOKUP_TIMEOUT,
-                    env=sync_env,
-                    capture_output=True,
-                )
-                if get_redis_client:
-                    rc = get_redis_client()
-                    status = (rc.get(f"job:{sync_job_id}:status") or b"").decode("utf-8")
-                    if status == "completed":
-                        raw = rc.get(f"job:{sync_job_id}:result")
-                        result = json.loads((raw or b"{}").decode("utf-8")) if raw else {}
-                        return jsonify({"status": "success", "data": result}), 200
-                    err = (rc.get(f"job:{sync_job_id}:error") or b"").decode("utf-8") or (proc.stderr or b"").decode("utf-8", errors="replace")
-                    return jsonify({"status": "error", "message": err or f"Subprocess exit {proc.returncode}"}), 500
+            if not get_redis_client:
                 return jsonify({"status": "error", "message": "Redis not available"}), 500
-            except subprocess.TimeoutExpired:
-                return jsonify({"status": "error", "message": f"Lookup timeout after {_LOOKUP_TIMEOUT}s"}), 504
-            finally:
-                if fd is not None:
-                    try:
-                        os.close(fd)
-                    except Exception:
-                        pass
-                if temp_path and os.path.exists(temp_path):
-                    try:
-                        os.remove(temp_path)
-                    except Exception:
-                        pass
+            timed_out = _run_lookup_job(sync_job_id, taxcodes, type_taxcode, id_type, proxy)
+            state = get_job_state(sync_job_id)
+            if state.get("status") == "completed":
+                result = json.loads(state.get("result") or "{}")
+                return jsonify({"status": "success", "data": result}), 200
+            err = state.get("error") or "Lookup failed"
+            if timed_out:
+                return jsonify({"status": "error", "message": err}), 504
+            return jsonify({"status": "error", "message": err}), 500
             
         except Exception as e:
             return jsonify({
@@ -500,8 +384,7 @@ def register_routes(app, prefix):
                 "job_id": job_id,
                 "params": {"taxcodes": taxcodes, "type_taxcode": type_taxcode, "id_type": id_type, "proxy": proxy},
             }
-            redis_client = get_redis_client()
-            redis_client.lpush("go-bot:jobs", json.dumps(job_data, ensure_ascii=False))
+            enqueue_job("go-bot:jobs", job_data)
             return _json_response({"status": "accepted", "job_id": job_id, "total": len(taxcodes)}, 202)
         except Exception as e:
             logger.exception("go_bot_lookup_upload error")
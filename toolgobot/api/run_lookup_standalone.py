@@ -27,102 +27,129 @@ sys.path[:] = [_gotax_root, _gobot_root] + _rest
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-_shutdown_requested = False
-
-
-def main():
-    global _shutdown_requested
+# Chế độ --serve (process trong LookupPool): tự recycle sau N job hoặc khi RSS vượt ngưỡng
+POOL_MAX_JOBS = int(os.getenv("GOBOT_POOL_MAX_JOBS", "50"))
+POOL_MAX_RSS_MB = int(os.getenv("GOBOT_POOL_MAX_RSS_MB", "3072"))
+_LOOKUP_THREAD_NAME = "gobot-lookup"
 
-    if len(sys.argv) < 2:
-        logger.error("Usage: python run_lookup_standalone.py <params.json> [GOTAX_ROOT] [GOBOT_ROOT]")
-        sys.exit(1)
-    params_path = os.path.abspath(sys.argv[1])
-    if not os.path.exists(params_path):
-        logger.error("Params file not found: %s", params_path)
-        sys.exit(1)
+_shutdown_requested = False
+_current_job_id = None
 
-    with open(params_path, "r", encoding="utf-8") as f:
-        params = json.load(f)
+# Được gán trong _load_deps()
+get_redis_client = publish_progress = cancel_job = None
+set_job_status = set_job_state = read_cancelled_status = None
+get_cancellation_token = release_cancellation_token = None
+BackendService = None
 
-    job_id = params.get("job_id")
-    taxcodes = params.get("taxcodes")
-    type_taxcode = params.get("type_taxcode")
-    id_type = params.get("id_type")
-    proxy = params.get("proxy")
 
-    if not job_id or not taxcodes or type_taxcode not in ("cn", "dn"):
-        logger.error("Invalid params: job_id, taxcodes (list), type_taxcode (cn|dn) required")
-        sys.exit(1)
+def _load_deps():
+    """Import shared/ của GOTAX_ROOT + BackendService. False nếu thiếu."""
+    global get_redis_client, publish_progress, cancel_job, set_job_status, set_job_state, read_cancelled_status
+    global get_cancellation_token, release_cancellation_token, BackendService
 
     _redis_client_path = os.path.join(_gotax_root, "shared", "redis_client.py")
     if not os.path.isfile(_redis_client_path):
         logger.error("shared/redis_client.py not found at %s (GOTAX_ROOT=%s)", _redis_client_path, _gotax_root)
-        sys.exit(1)
+        return False
     try:
-        import importlib.util
-        _spec = importlib.util.spec_from_file_location("redis_client", _redis_client_path)
-        _redis_mod = importlib.util.module_from_spec(_spec)
-        _spec.loader.exec_module(_redis_mod)
-        get_redis_client = _redis_mod.get_redis_client
-        publish_progress = _redis_mod.publish_progress
+        # toolgobot/shared (có __init__.py) che mất shared/ của GOTAX_ROOT → gộp 2 thư mục vào 1 package
+        import types
+        _shared_pkg = types.ModuleType("shared")
+        _shared_pkg.__path__ = [os.path.join(_gotax_root, "shared"), os.path.join(_gobot_root, "shared")]
+        sys.modules["shared"] = _shared_pkg
+        from shared.redis_client import get_redis_client, publish_progress, cancel_job
+        from shared.job_store import set_job_status, set_job_state, read_cancelled_status
+        from shared.cancellation import get_cancellation_token, release_cancellation_token
     except Exception as e:
         logger.error("Cannot load shared.redis_client: %s", e)
-        sys.exit(1)
+        return False
 
     try:
         from toolgobot.backend_.backend_service import BackendService
     except ImportError as e:
         logger.error("Cannot import BackendService: %s", e)
-        sys.exit(1)
+        return False
+    return True
 
-    redis_client = None
+
+def _signal_handler(sig, frame):
+    global _shutdown_requested
+    if _shutdown_requested:
+        return
+    _shutdown_requested = True
+    job_id = _current_job_id
+    logger.info("⏹️ [Job %s] Signal %s received, cancelling...", job_id, sig)
+    if not job_id:
+        return
     try:
-        redis_client = get_redis_client()
+        publish_progress(job_id, 0, "Yêu cầu đã bị hủy (tool dừng)", data={"type": "error", "error": "Job cancelled"})
+        cancel_job(job_id)
     except Exception as e:
-        logger.error("Redis connect error: %s", e)
-        sys.exit(1)
+        logger.warning("Error setting cancelled flag: %s", e)
 
-    def _signal_handler(sig, frame):
-        global _shutdown_requested
-        if _shutdown_requested:
-            return
-        _shutdown_requested = True
-        logger.info("⏹️ [Job %s] Signal %s received, cancelling...", job_id, sig)
-        try:
-            redis_client.set(f"job:{job_id}:cancelled", "1")
-            redis_client.set(f"job:{job_id}:status", "cancelled")
-            publish_progress(job_id, 0, "Yêu cầu đã bị hủy (tool dừng)", data={"type": "error", "error": "Job cancelled"})
-        except Exception as e:
-            logger.warning("Error setting cancelled flag: %s", e)
 
+def _install_signal_handlers():
     signal.signal(signal.SIGINT, _signal_handler)
     if sys.platform != "win32":
         signal.signal(signal.SIGTERM, _signal_handler)
 
+
+def run_job(params):
+    """
+    Chạy 1 lookup job, progress/result/status ghi vào Redis.
+
+    Returns:
+        0 nếu completed hoặc cancelled, 1 nếu failed
+    """
+    global _current_job_id
+
+    job_id = params.get("job_id")
+    taxcodes = params.get("taxcodes")
+    type_taxcode = params.get("type_taxcode")
+    id_type = params.get("id_type")
+    proxy = params.get("proxy")
+
+    if not job_id or not taxcodes or type_taxcode not in ("cn", "dn"):
+        logger.error("Invalid params: job_id, taxcodes (list), type_taxcode (cn|dn) required")
+        return 1
+
+    redis_client = None
+    try:
+        redis_client = get_redis_client()
+    except Exception as e:
+        logger.error("Redis connect error: %s", e)
+        return 1
+
+    _current_job_id = job_id
+    cancel_token = get_cancellation_token(job_id)
+
     def _is_cancelled():
         if _shutdown_requested:
             return True
+        return cancel_token.is_set() or _redis_cancelled()
+
+    def _redis_cancelled():
+        # Fallback cho message pub/sub bị lỡ: cancelled flag hoặc status (HASH job:{id} + key cũ)
         try:
-            cancelled = redis_client.get(f"job:{job_id}:cancelled")
+            cancelled, status = read_cancelled_status(job_id, client=redis_client)
             if cancelled:
                 c = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
                 if c == '1':
+                    cancel_token.set()
                     return True
-            status = redis_client.get(f"job:{job_id}:status")
             if status:
                 s = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
                 if s == 'cancelled':
+                    cancel_token.set()
                     return True
         except Exception:
             pass
         return False
 
-    import time as _time_module
-    job_start_time = int(_time_module.time())
-    redis_client.set(f"job:{job_id}:status", b"processing")
-    redis_client.set(f"job:{job_id}:start_time", str(job_start_time).encode("utf-8"))
+    job_start_time = int(time.time())
+    set_job_state(job_id, status="processing", start_time=job_start_time)
     publish_progress(job_id, 0, "Bắt đầu tra cứu...", data={"total": len(taxcodes), "processed": 0})
-    logger.info("Standalone script started for job %s, taxcodes=%s", job_id, len(taxcodes))
+    logger.info("Lookup started for job %s, taxcodes=%s", job_id, len(taxcodes))
     sys.stdout.flush()
     sys.stderr.flush()
 
@@ -138,6 +165,7 @@ def main():
             backend = BackendService(proxy_url=proxy)
             backend._job_id = job_id
             backend._redis_client = redis_client
+            backend._cancel_token = cancel_token
             logger.info("Calling handle_request...")
             sys.stdout.flush()
             sys.stderr.flush()
@@ -149,59 +177,160 @@ def main():
         except Exception as e:
             error_holder.append(e)
 
-    if is_batch:
-        worker = threading.Thread(target=do_lookup, daemon=True)
-        worker.start()
-        step = 0
-        while worker.is_alive():
-            time.sleep(5)
-            step += 1
-            if _is_cancelled():
-                logger.info("[Job %s] Job đã bị cancel, dừng poll", job_id)
-                sys.exit(0)
-            publish_progress(job_id, min(step * 2, 90), "Đang tra cứu...", data={"total": len(taxcodes), "processed": 0})
-        worker.join(timeout=5)
-    else:
-        do_lookup()
+    try:
+        if is_batch:
+            worker = threading.Thread(target=do_lookup, name=_LOOKUP_THREAD_NAME, daemon=True)
+            worker.start()
+            step = 0
+            while worker.is_alive():
+                # Chờ 5s nhưng thức dậy ngay khi nhận tín hiệu hủy
+                cancel_token.wait(5)
+                step += 1
+                if _is_cancelled():
+                    logger.info("[Job %s] Job đã bị cancel, dừng poll", job_id)
+                    # BackendService tự dừng ở lần _check_cancelled kế tiếp (token đã set)
+                    worker.join(timeout=30)
+                    return 0
+                publish_progress(job_id, min(step * 2, 90), "Đang tra cứu...", data={"total": len(taxcodes), "processed": 0})
+            worker.join(timeout=5)
+        else:
+            do_lookup()
+
+        if _is_cancelled():
+            logger.info("[Job %s] Job đã bị cancel sau khi lookup xong", job_id)
+            return 0
+
+        try:
+            if error_holder:
+                raise error_holder[0]
+            if not result_holder:
+                raise RuntimeError("Lookup did not return result")
+            result = result_holder[0]
+            if isinstance(result, dict) and result.get("status") == "error":
+                err_msg = result.get("message", "Unknown error")
+                logger.error("Job %s failed (backend): %s", job_id, err_msg)
+                publish_progress(job_id, 0, err_msg, data={"type": "error", "error": err_msg})
+                set_job_status(job_id, "failed", error=err_msg)
+                return 1
+            looked = result.get("looked_info") if isinstance(result, dict) else None
+            if isinstance(result, dict) and result.get("status") == "success" and (not looked or len(looked) == 0):
+                err_msg = "Khong co du lieu tra cuu (co the loi giai captcha hoac template thieu file)"
+                logger.error("Job %s: %s", job_id, err_msg)
+                publish_progress(job_id, 0, err_msg, data={"type": "error", "error": err_msg})
+                set_job_status(job_id, "failed", error=err_msg)
+                return 1
+            result_json = json.dumps(result, ensure_ascii=False)
+            publish_progress(job_id, 100, "Hoan thanh", data={"total": len(taxcodes), "processed": len(taxcodes)})
+            set_job_status(job_id, "completed", result=result_json)
+            logger.info("Job %s completed", job_id)
+            return 0
+        except Exception as e:
+            err_msg = str(e)
+            logger.exception("Job %s failed: %s", job_id, err_msg)
+            publish_progress(job_id, 0, f"Lỗi: {err_msg}", data={"type": "error", "error": err_msg})
+            set_job_status(job_id, "failed", error=err_msg)
+            return 1
+    finally:
+        _current_job_id = None
+        release_cancellation_token(job_id)
+
+
+def main():
+    """Chạy 1 job từ file params rồi thoát (one-shot)"""
+    if len(sys.argv) < 2:
+        logger.error("Usage: python run_lookup_standalone.py <params.json>|--serve [GOTAX_ROOT] [GOBOT_ROOT]")
+        sys.exit(1)
+    params_path = os.path.abspath(sys.argv[1])
+    if not os.path.exists(params_path):
+        logger.error("Params file not found: %s", params_path)
+        sys.exit(1)
+
+    with open(params_path, "r", encoding="utf-8") as f:
+        params = json.load(f)
+
+    if not _load_deps():
+        sys.exit(1)
+    _install_signal_handlers()
+    sys.exit(run_job(params))
+
+
+def _rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return 0
 
-    if _is_cancelled():
-        logger.info("[Job %s] Job đã bị cancel sau khi lookup xong", job_id)
-        sys.exit(0)
 
+def _warm_up():
+    """Load 2 model captcha (TensorFlow) trước job đầu tiên"""
+    from toolgobot.backend_.base_service import get_solver, get_solver_cmt
+    started = time.perf_counter()
+    get_solver()
     try:
-        if error_holder:
-            raise error_holder[0]
-        if not result_holder:
-            raise RuntimeError("Lookup did not return result")
-        result = result_holder[0]
-        if isinstance(result, dict) and result.get("status") == "error":
-            err_msg = result.get("message", "Unknown error")
-            logger.error("Job %s failed (backend): %s", job_id, err_msg)
-            redis_client.set(f"job:{job_id}:status", b"failed")
-            redis_client.set(f"job:{job_id}:error", err_msg.encode("utf-8"))
-            publish_progress(job_id, 0, err_msg, data={"type": "error", "error": err_msg})
-            sys.exit(1)
-        looked = result.get("looked_info") if isinstance(result, dict) else None
-        if isinstance(result, dict) and result.get("status") == "success" and (not looked or len(looked) == 0):
-            err_msg = "Khong co du lieu tra cuu (co the loi giai captcha hoac template thieu file)"
-            logger.error("Job %s: %s", job_id, err_msg)
-            redis_client.set(f"job:{job_id}:status", b"failed")
-            redis_client.set(f"job:{job_id}:error", err_msg.encode("utf-8"))
-            publish_progress(job_id, 0, err_msg, data={"type": "error", "error": err_msg})
-            sys.exit(1)
-        result_json = json.dumps(result, ensure_ascii=False)
-        redis_client.set(f"job:{job_id}:result", result_json.encode("utf-8"))
-        redis_client.set(f"job:{job_id}:status", b"completed")
-        publish_progress(job_id, 100, "Hoan thanh", data={"total": len(taxcodes), "processed": len(taxcodes)})
-        logger.info("Job %s completed", job_id)
+        get_solver_cmt()
     except Exception as e:
-        err_msg = str(e)
-        logger.exception("Job %s failed: %s", job_id, err_msg)
-        redis_client.set(f"job:{job_id}:status", b"failed")
-        redis_client.set(f"job:{job_id}:error", err_msg.encode("utf-8"))
-        publish_progress(job_id, 0, f"Lỗi: {err_msg}", data={"type": "error", "error": err_msg})
+        logger.error("Error loading model captcha solver (CMT): %s", e)
+    logger.info("Captcha models loaded in %.1fs", time.perf_counter() - started)
+
+
+def serve():
+    """
+    Process sống lâu trong LookupPool (toolgobot/api/lookup_pool.py).
+
+    Protocol (JSON lines): stdin nhận {"type": "job", "params": {...}}, stdout trả
+    {"type": "ready"} một lần rồi {"type": "result", ...} sau mỗi job. EOF trên stdin = dừng.
+    Log và print của backend đi ra stderr để không lẫn vào protocol.
+    """
+    proto_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    def send(message):
+        proto_out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        proto_out.flush()
+
+    if not _load_deps():
         sys.exit(1)
+    _install_signal_handlers()
+    _warm_up()
+    send({"type": "ready", "pid": os.getpid()})
+
+    jobs_done = 0
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            logger.error("Invalid message from pool: %s", line[:200])
+            continue
+        if message.get("type") != "job":
+            continue
+
+        params = message.get("params") or {}
+        try:
+            code = run_job(params)
+        except Exception as e:
+            logger.exception("Unhandled error in job %s: %s", params.get("job_id"), e)
+            code = 1
+        jobs_done += 1
+
+        # Lookup thread còn chạy (cancel giữa chừng) hoặc process đã "già" → thoát để pool thay process mới
+        stuck = any(t.name == _LOOKUP_THREAD_NAME and t.is_alive() for t in threading.enumerate())
+        rss = _rss_mb()
+        recycle = (_shutdown_requested or stuck or jobs_done >= POOL_MAX_JOBS
+                   or (POOL_MAX_RSS_MB > 0 and rss > POOL_MAX_RSS_MB))
+        send({"type": "result", "job_id": params.get("job_id"), "code": code,
+              "recycle": recycle, "jobs_done": jobs_done, "rss_mb": round(rss)})
+        if recycle:
+            logger.info("Worker %s recycling (jobs=%s, rss=%.0fMB, stuck=%s)", os.getpid(), jobs_done, rss, stuck)
+            break
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--serve":
+        serve()
+    else:
+        main()
@@ -52,33 +52,51 @@ class BackendService(BaseService):
         self.current_mst = None  # ✅ MST hiện tại đang cào
         self._job_id = None  # ✅ Set từ run_lookup_standalone để check cancelled
         self._redis_client = None  # ✅ Redis client từ run_lookup_standalone
+        self._cancel_token = None  # ✅ CancellationToken (pub/sub job:{id}:cancel) từ run_lookup_standalone
+
+    def _mark_cancelled(self):
+        """Cancel job qua shared cancel_job: ghi HASH job:{id} (+ key cũ), push job:{id}:done, publish job:{id}:cancel"""
+        from shared.redis_client import cancel_job
+        cancel_job(self._job_id)
+        if self._cancel_token is not None:
+            self._cancel_token.set()
 
     def _check_cancelled(self):
         """Check if job is cancelled from Redis. Raise JobCancelledException if cancelled."""
         if not self._job_id or not self._redis_client:
             return False
+        token = self._cancel_token
+        # ✅ Fast path: flag local do subscriber set, chỉ đọc Redis mỗi CANCEL_POLL_INTERVAL giây
+        if token is not None:
+            if token.is_set():
+                raise JobCancelledException(f"Job {self._job_id} đã bị hủy")
+            if not token.should_poll():
+                return False
         try:
-            cancelled = self._redis_client.get(f"job:{self._job_id}:cancelled")
+            from shared.job_store import read_cancelled_status, get_job_state
+            # HASH job:{id} + key cũ (Laravel ghi cancelled flag), 1 round trip
+            cancelled, status = read_cancelled_status(self._job_id, client=self._redis_client)
             if cancelled:
                 c = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
                 if c == '1':
                     logger.info("[Job %s] Job đã bị cancel (detected in BackendService)", self._job_id)
+                    if token is not None:
+                        token.set()
                     raise JobCancelledException(f"Job {self._job_id} đã bị hủy")
-            status = self._redis_client.get(f"job:{self._job_id}:status")
             s = ""
             if status:
                 s = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
                 if s == 'cancelled':
                     logger.info("[Job %s] Job status=cancelled (detected in BackendService)", self._job_id)
+                    if token is not None:
+                        token.set()
                     raise JobCancelledException(f"Job {self._job_id} đã bị hủy")
             if s == 'processing':
                 import time as _time
                 current = int(_time.time())
                 last_poll_time = self._redis_client.get(f"job:{self._job_id}:last_poll_time")
-                start_time_str = self._redis_client.get(f"job:{self._job_id}:start_time")
-                start_time = None
-                if start_time_str is not None:
-                    start_time = int(start_time_str) if isinstance(start_time_str, bytes) else int(start_time_str)
+                start_time_str = get_job_state(self._job_id).get('start_time')
+                start_time = int(start_time_str) if start_time_str else None
                 
                 if last_poll_time is not None:
                     last_poll = int(last_poll_time) if isinstance(last_poll_time, bytes) else int(last_poll_time)
@@ -86,21 +104,18 @@ class BackendService(BaseService):
                         elapsed = current - start_time
                         if elapsed > 15:
                             logger.info("[Job %s] Client disconnect detected (no poll after job start, elapsed %ds)", self._job_id, elapsed)
-                            self._redis_client.set(f"job:{self._job_id}:cancelled", "1")
-                            self._redis_client.set(f"job:{self._job_id}:status", "cancelled")
+                            self._mark_cancelled()
                             raise JobCancelledException(f"Job {self._job_id} đã bị hủy (client disconnect - no poll)")
                     if current - last_poll > 12:
                         logger.info("[Job %s] Client disconnect detected (no poll in %ds)", self._job_id, current - last_poll)
-                        self._redis_client.set(f"job:{self._job_id}:cancelled", "1")
-                        self._redis_client.set(f"job:{self._job_id}:status", "cancelled")
+                        self._mark_cancelled()
                         raise JobCancelledException(f"Job {self._job_id} đã bị hủy (client disconnect)")
                 else:
                     if start_time:
                         elapsed = current - start_time
                         if elapsed > 15:
                             logger.info("[Job %s] Client disconnect detected (no poll after %ds, job started %ds ago)", self._job_id, elapsed, elapsed)
-                            self._redis_client.set(f"job:{self._job_id}:cancelled", "1")
-                            self._redis_client.set(f"job:{self._job_id}:status", "cancelled")
+                            self._mark_cancelled()
                             raise JobCancelledException(f"Job {self._job_id} đã bị hủy (client disconnect - no poll)")
         except JobCancelledException:
             raise
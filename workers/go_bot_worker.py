@@ -3,11 +3,10 @@
 Go-Bot Worker
 Consume jobs from Redis queue, call API server /api/go-bot/lookup/queue,
 API server chạy lookup trong background và ghi progress/result vào Redis.
-Worker chỉ gọi API rồi poll Redis chờ hoàn thành (giống Go Invoice).
+Worker chỉ gọi API rồi chờ job:{id}:done trên Redis (giống Go Invoice).
 """
 import sys
 import os
-import json
 import asyncio
 import logging
 import httpx
@@ -15,7 +14,10 @@ import httpx
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
-from shared.redis_client import get_redis_client, publish_progress
+from shared.redis_client import get_redis_client, publish_progress, cancel_job
+from shared.redis_async import await_job_done, aget_job_status
+from shared.job_queue import JobQueue, resume_job
+from shared.job_store import set_job_status, set_job_state, get_job_state, processing_job_ids
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,18 +29,15 @@ API_SERVER_URL = os.getenv('GO_BOT_API_URL', 'http://127.0.0.1:5000/api/go-bot')
 async def process_go_bot_job(job_data):
     """
     Gửi job tới API /lookup/queue, API chạy lookup trong background và ghi Redis.
-    Worker poll Redis cho tới khi completed/failed/cancelled.
+    Worker chờ (BLPOP) cho tới khi completed/failed/cancelled.
     """
     job_id = job_data.get('job_id')
     params = job_data.get('params', {})
 
-    redis_client = get_redis_client()
-
     try:
         import time as _time_module
         job_start_time = int(_time_module.time())
-        redis_client.set(f"job:{job_id}:status", "processing".encode('utf-8'))
-        redis_client.set(f"job:{job_id}:start_time", str(job_start_time).encode('utf-8'))
+        set_job_state(job_id, status="processing", start_time=job_start_time)
 
         taxcodes = params.get('taxcodes')
         type_taxcode = params.get('type_taxcode')
@@ -48,17 +47,15 @@ async def process_go_bot_job(job_data):
         if not taxcodes or not isinstance(taxcodes, list) or len(taxcodes) == 0:
             error_msg = "Missing or invalid 'taxcodes' (non-empty list required)"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed", error=error_msg)
             return
 
         if type_taxcode not in ['cn', 'dn']:
             error_msg = "'type_taxcode' must be 'cn' or 'dn'"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed", error=error_msg)
             return
 
         request_data = {
@@ -84,16 +81,14 @@ async def process_go_bot_job(job_data):
             except httpx.TimeoutException:
                 error_msg = "Timeout khi gọi API server"
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed", error=error_msg)
                 return
             except Exception as e:
                 error_msg = f"Lỗi kết nối API: {e}"
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed", error=error_msg)
                 return
 
             if response.status_code != 202:
@@ -103,71 +98,49 @@ async def process_go_bot_job(job_data):
                 except Exception:
                     error_msg = f"API trả về {response.status_code}"
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed", error=error_msg)
                 return
 
             resp_data = response.json()
             if resp_data.get('status') != 'accepted':
                 error_msg = resp_data.get('message', 'API không chấp nhận request')
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed", error=error_msg)
                 return
 
         logger.info(f"[Job {job_id}] API đã chấp nhận, đang đợi Redis completed...")
 
         max_wait_time = 7200
-        poll_interval = 2
-        waited_time = 0
-        last_log_time = 0
-
-        while waited_time < max_wait_time:
-            await asyncio.sleep(poll_interval)
-            waited_time += poll_interval
-
-            if waited_time - last_log_time >= 10:
-                logger.info(f"[Job {job_id}] Đang xử lý... (đã đợi {waited_time}s)")
-                last_log_time = waited_time
-
-            cancelled = redis_client.get(f"job:{job_id}:cancelled")
-            if cancelled:
-                c = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                if c == '1':
-                    logger.info(f"[Job {job_id}] Job đã bị cancel")
-                    redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                    publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
-                    return
+        # BLPOP job:{id}:done thay vì poll status mỗi 2s
+        status = await await_job_done(job_id, timeout=max_wait_time)
 
-            status = redis_client.get(f"job:{job_id}:status")
-            if status:
-                status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                if status == 'completed':
-                    logger.info(f"[Job {job_id}] Job hoàn thành")
-                    return
-                if status == 'failed':
-                    err = redis_client.get(f"job:{job_id}:error")
-                    if err:
-                        err = err.decode('utf-8') if isinstance(err, bytes) else str(err)
-                    logger.error(f"[Job {job_id}] Job failed: {err}")
-                    return
-                if status == 'cancelled':
-                    logger.info(f"[Job {job_id}] Job đã bị cancel")
-                    return
+        if status == 'completed':
+            logger.info(f"[Job {job_id}] Job hoàn thành")
+            return
+        if status == 'failed':
+            err = get_job_state(job_id).get('error')
+            if err:
+                err = err.decode('utf-8') if isinstance(err, bytes) else str(err)
+            logger.error(f"[Job {job_id}] Job failed: {err}")
+            return
+        if status == 'cancelled':
+            logger.info(f"[Job {job_id}] Job đã bị cancel")
+            # Laravel chỉ set cancelled flag → đồng bộ status
+            publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
+            set_job_status(job_id, "cancelled")
+            return
 
         logger.warning(f"[Job {job_id}] Timeout sau {max_wait_time}s")
-        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-        redis_client.set(f"job:{job_id}:error", "Timeout chờ kết quả".encode('utf-8'))
         publish_progress(job_id, 0, "Timeout chờ kết quả")
+        set_job_status(job_id, "failed", error="Timeout chờ kết quả")
 
     except asyncio.CancelledError:
         logger.info(f"[Job {job_id}] Task bị cancel (Ctrl+C)")
         try:
-            redis_client.set(f"job:{job_id}:cancelled", "1".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
             publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
+            cancel_job(job_id)
         except Exception:
             pass
         return
@@ -175,13 +148,14 @@ async def process_go_bot_job(job_data):
     except Exception as e:
         error_msg = str(e)
         logger.error(f"[Job {job_id}] Exception: {error_msg}", exc_info=True)
-        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-        redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
         publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+        set_job_status(job_id, "failed", error=error_msg)
 
 
 async def worker_loop(redis_client, semaphore, max_concurrent=3):
     active_tasks = set()
+    queue = JobQueue(QUEUE_GO_BOT)
+    await queue.setup()
     while True:
         try:
             completed = [t for t in active_tasks if t.done()]
@@ -193,44 +167,35 @@ async def worker_loop(redis_client, semaphore, max_concurrent=3):
                     logger.error(f"Task error: {e}", exc_info=True)
 
             if len(active_tasks) < max_concurrent:
-                result = await asyncio.to_thread(redis_client.blpop, [QUEUE_GO_BOT], timeout=1)
-                if result:
-                    queue_name, job_data_json = result
-                    if isinstance(job_data_json, bytes):
-                        job_data_json = job_data_json.decode('utf-8')
-                    try:
-                        job_data = json.loads(job_data_json)
-                        job_id = job_data.get('job_id')
-                        logger.info(f"Received job: {job_id}")
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Parse job error: {e}")
-                        continue
-                    async def run_job():
+                # XREADGROUP (block tối đa 1s) - job chỉ bị xóa khỏi stream sau khi ack
+                messages = await queue.read(count=max_concurrent - len(active_tasks), block_ms=1000)
+                for message in messages:
+                    job_data = message.data
+                    job_id = message.job_id
+                    logger.info(f"Received job: {job_id} ({message.lane})")
+                    # Worker trước chết khi API đang chạy job → chỉ chờ kết quả, không gọi lại API
+                    resume = message.redelivered and await aget_job_status(job_id) == 'processing'
+                    if message.redelivered:
+                        logger.warning(f"[Job {job_id}] Job được giao lại (lần {message.deliveries}), resume={resume}")
+                    async def run_job(job_data=job_data, job_id=job_id, message=message, resume=resume):
                         async with semaphore:
-                            await process_go_bot_job(job_data)
+                            if resume:
+                                await resume_job(job_id)
+                            else:
+                                await process_go_bot_job(job_data)
+                        await queue.ack(message)
                     task = asyncio.create_task(run_job())
                     active_tasks.add(task)
-                else:
-                    await asyncio.sleep(0.5)
             else:
                 await asyncio.sleep(0.5)
         except KeyboardInterrupt:
             logger.info("⏹️ Worker dừng bởi người dùng (Ctrl+C)")
 
             try:
-                keys = redis_client.keys("job:*:status")
-                for key in keys:
-                    if isinstance(key, bytes):
-                        key = key.decode('utf-8')
-                    status = redis_client.get(key)
-                    if status:
-                        status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                        if status == 'processing':
-                            job_id = key.split(':')[1]
-                            logger.info(f"⏹️ Setting cancelled flag for job {job_id}")
-                            redis_client.set(f"job:{job_id}:cancelled", "1")
-                            redis_client.set(f"job:{job_id}:status", "cancelled")
-                            publish_progress(job_id, 0, "Yêu cầu đã bị hủy (worker dừng)")
+                for job_id in processing_job_ids(redis_client):
+                    logger.info(f"⏹️ Setting cancelled flag for job {job_id}")
+                    publish_progress(job_id, 0, "Yêu cầu đã bị hủy (worker dừng)")
+                    cancel_job(job_id)
             except Exception as e:
                 logger.warning(f"Error setting cancelled flags: {e}")
 
@@ -6,7 +6,6 @@ API server sẽ publish events vào Redis, worker lắng nghe từ Redis
 """
 import sys
 import os
-import json
 import asyncio
 import logging
 import httpx
@@ -16,7 +15,10 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
 # Import shared modules
-from shared.redis_client import get_redis_client, publish_progress
+from shared.redis_client import get_redis_client, publish_progress, cancel_job
+from shared.redis_async import await_job_done, aget_job_status
+from shared.job_queue import JobQueue, resume_job
+from shared.job_store import set_job_status, get_job_state, processing_job_ids
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,11 +39,9 @@ async def process_go_invoice_job(job_data):
     action = job_data.get('action', 'tongquat')
     params = job_data.get('params', {})
     
-    redis_client = get_redis_client()
-    
     try:
         # Update status: processing
-        redis_client.set(f"job:{job_id}:status", "processing".encode('utf-8'))
+        set_job_status(job_id, "processing")
         
         # Extract params
         token = params.get('token')
@@ -53,17 +53,15 @@ async def process_go_invoice_job(job_data):
         if not token:
             error_msg = "Missing token"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, error_msg, {'type': 'error', 'error': error_msg, 'error_code': 'MISSING_TOKEN'})
+            set_job_status(job_id, "failed", error=error_msg)
             return
         
         if not all([start_date, end_date]):
             error_msg = "Missing start_date or end_date"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed", error=error_msg)
             return
         
         if action == 'tongquat':
@@ -131,14 +129,13 @@ async def process_go_invoice_job(job_data):
         else:
             error_msg = f"Action không hợp lệ: {action}"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed", error=error_msg)
             return
         
         # ✅ Gọi API server với timeout ngắn (10s) - API sẽ trả về "accepted" ngay
         # API xử lý trong background và ghi progress vào Redis
-        # Worker sẽ poll Redis để đợi kết quả (giống Go Soft)
+        # Worker chờ job:{id}:done trên Redis để biết kết quả (giống Go Soft)
         async with httpx.AsyncClient(timeout=10.0) as client:
             logger.info(f"[Job {job_id}] Gọi API server: {API_SERVER_URL}{endpoint}")
             
@@ -169,17 +166,15 @@ async def process_go_invoice_job(job_data):
                         'error': error_msg,
                         'error_code': error_code
                     })
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                    set_job_status(job_id, "failed", error=error_msg)
                     return
                 
                 response_data = response.json()
                 if response_data.get('status') != 'accepted':
                     error_msg = response_data.get('message', 'API server từ chối request')
                     logger.error(f"[Job {job_id}] {error_msg}")
-                    redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                     publish_progress(job_id, 0, error_msg)
+                    set_job_status(job_id, "failed", error=error_msg)
                     return
                 
                 logger.info(f"[Job {job_id}] API server đã chấp nhận request, đang đợi API hoàn thành...")
@@ -187,79 +182,62 @@ async def process_go_invoice_job(job_data):
             except httpx.TimeoutException:
                 error_msg = "Timeout khi gọi API server (không thể kết nối)"
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed", error=error_msg)
                 return
         
-        # ✅ Poll status trong Redis để đợi job hoàn thành (tối đa 2 giờ - giống Go Soft)
+        # ✅ Đợi job hoàn thành (tối đa 2 giờ - giống Go Soft): BLPOP job:{id}:done, không poll status
         # API server sẽ tự publish events vào Redis, Laravel frontend sẽ tự lắng nghe qua SSE/polling
         max_wait_time = 7200  # 2 hours
-        poll_interval = 2
-        waited_time = 0
-        
-        # Flag để check cancellation từ bên ngoài (Ctrl+C)
-        should_stop = False
         
-        while waited_time < max_wait_time and not should_stop:
+        try:
+            status = await await_job_done(job_id, timeout=max_wait_time)
+        except asyncio.CancelledError:
+            logger.info(f"[Job {job_id}] Task bị cancel (Ctrl+C)")
+            # Set cancelled flag in Redis
             try:
-                await asyncio.sleep(poll_interval)
-                waited_time += poll_interval
-                
-                # Check cancelled flag
-                cancelled = redis_client.get(f"job:{job_id}:cancelled")
-                if cancelled:
-                    cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                    if cancelled == '1':
-                        logger.info(f"[Job {job_id}] Job đã bị cancel")
-                        redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                        # ✅ Client message: thân thiện với người dùng
-                        publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
-                        return
-                
-                # Check job status
-                status = redis_client.get(f"job:{job_id}:status")
-                if status:
-                    status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                    
-                    if status == 'completed':
-                        logger.info(f"[Job {job_id}] Job hoàn thành")
-                        return
-                    elif status == 'failed':
-                        error = redis_client.get(f"job:{job_id}:error")
-                        if error:
-                            error = error.decode('utf-8') if isinstance(error, bytes) else str(error)
-                        logger.error(f"[Job {job_id}] Job failed: {error}")
-                        return
-                    elif status == 'cancelled':
-                        logger.info(f"[Job {job_id}] Job đã bị cancel")
-                        return
-            except asyncio.CancelledError:
-                logger.info(f"[Job {job_id}] Task bị cancel (Ctrl+C)")
-                should_stop = True
-                # Set cancelled flag in Redis
-                try:
-                    redis_client.set(f"job:{job_id}:cancelled", "1".encode('utf-8'))
-                    redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                    # ✅ Client message: thân thiện với người dùng
-                    publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
-                except:
-                    pass
-                return
+                cancel_job(job_id)
+                # ✅ Client message: thân thiện với người dùng
+                publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
+            except:
+                pass
+            return
         
+        if status == 'completed':
+            logger.info(f"[Job {job_id}] Job hoàn thành")
+            return
+        elif status == 'failed':
+            error = get_job_state(job_id).get('error')
+            if error:
+                error = error.decode('utf-8') if isinstance(error, bytes) else str(error)
+            logger.error(f"[Job {job_id}] Job failed: {error}")
+            return
+        elif status == 'cancelled':
+            logger.info(f"[Job {job_id}] Job đã bị cancel")
+            # ✅ Client message: thân thiện với người dùng
+            publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
+            # Laravel chỉ set cancelled flag → đồng bộ status
+            set_job_status(job_id, "cancelled")
+            return
+        
+        # API không set status cuối trong max_wait_time → đánh dấu failed, không để job 'processing' mãi
         logger.warning(f"[Job {job_id}] Timeout: Job chưa hoàn thành sau {max_wait_time} giây")
+        error_msg = f"Timeout chờ kết quả sau {max_wait_time} giây"
+        publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
+        set_job_status(job_id, "failed", error=error_msg)
         
     except Exception as e:
         error_msg = str(e)
         logger.error(f"[Job {job_id}] Exception: {error_msg}", exc_info=True)
-        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-        redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
         publish_progress(job_id, 0, f"Đã xảy ra lỗi: {error_msg}")
+        set_job_status(job_id, "failed", error=error_msg)
 
 
 async def worker_loop(redis_client, semaphore, max_concurrent=5):
     """Async worker loop that processes jobs concurrently"""
     active_tasks = set()
+    queue = JobQueue(QUEUE_GO_INVOICE)
+    await queue.setup()
     
     while True:
         try:
@@ -272,36 +250,34 @@ async def worker_loop(redis_client, semaphore, max_concurrent=5):
                 except Exception as e:
                     logger.error(f"Task completed with error: {e}", exc_info=True)
             
-            # Only pop new job if we have capacity
+            # Only read new jobs if we have capacity
             if len(active_tasks) < max_concurrent:
                 try:
-                    result = await asyncio.to_thread(redis_client.blpop, [QUEUE_GO_INVOICE], timeout=1)
+                    # XREADGROUP (block tối đa 1s) - job chỉ bị xóa khỏi stream sau khi ack
+                    messages = await queue.read(count=max_concurrent - len(active_tasks), block_ms=1000)
                     
-                    if result:
-                        queue_name, job_data_json = result
-                        
-                        if isinstance(job_data_json, bytes):
-                            job_data_json = job_data_json.decode('utf-8')
-                        
-                        try:
-                            job_data = json.loads(job_data_json)
-                            job_id = job_data.get('job_id')
-                            logger.info(f"Received job: {job_id}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Error parsing job data: {e}")
-                            continue
+                    for message in messages:
+                        job_data = message.data
+                        job_id = message.job_id
+                        logger.info(f"Received job: {job_id} ({message.lane})")
+                        # Worker trước chết khi API đang chạy job → chỉ chờ kết quả, không gọi lại API
+                        resume = message.redelivered and await aget_job_status(job_id) == 'processing'
+                        if message.redelivered:
+                            logger.warning(f"[Job {job_id}] Job được giao lại (lần {message.deliveries}), resume={resume}")
                         
                         # Create async task
-                        async def process_with_semaphore():
+                        async def process_with_semaphore(job_data=job_data, job_id=job_id, message=message, resume=resume):
                             async with semaphore:
                                 try:
-                                    await process_go_invoice_job(job_data)
+                                    if resume:
+                                        await resume_job(job_id)
+                                    else:
+                                        await process_go_invoice_job(job_data)
                                 except asyncio.CancelledError:
                                     logger.info(f"[Job {job_id}] Task cancelled")
                                     # ✅ Set cancelled flag ngay lập tức để API server biết dừng
                                     try:
-                                        redis_client.set(f"job:{job_id}:cancelled", "1")
-                                        redis_client.set(f"job:{job_id}:status", "cancelled")
+                                        cancel_job(job_id)
                                         # ✅ Client message: thân thiện với người dùng
                                         publish_progress(job_id, 0, "Yêu cầu đã bị hủy")
                                     except:
@@ -309,11 +285,10 @@ async def worker_loop(redis_client, semaphore, max_concurrent=5):
                                     raise  # Re-raise để worker loop biết
                                 except Exception as e:
                                     logger.error(f"Error processing job {job_id}: {e}", exc_info=True)
+                                await queue.ack(message)
                         
                         task = asyncio.create_task(process_with_semaphore())
                         active_tasks.add(task)
-                    else:
-                        await asyncio.sleep(0.5)
                 except Exception as e:
                     logger.error(f"Error checking queue: {e}", exc_info=True)
                     await asyncio.sleep(1)
@@ -327,18 +302,9 @@ async def worker_loop(redis_client, semaphore, max_concurrent=5):
             # Điều này quan trọng để API server biết dừng ngay
             try:
                 # Lấy tất cả job IDs đang processing
-                keys = redis_client.keys("job:*:status")
-                for key in keys:
-                    if isinstance(key, bytes):
-                        key = key.decode('utf-8')
-                    status = redis_client.get(key)
-                    if status:
-                        status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                        if status == 'processing':
-                            job_id = key.split(':')[1]
-                            logger.info(f"⏹️ Setting cancelled flag for job {job_id}")
-                            redis_client.set(f"job:{job_id}:cancelled", "1")
-                            redis_client.set(f"job:{job_id}:status", "cancelled")
+                for job_id in processing_job_ids(redis_client):
+                    logger.info(f"⏹️ Setting cancelled flag for job {job_id}")
+                    cancel_job(job_id)
             except Exception as e:
                 logger.warning(f"Error setting cancelled flags: {e}")
             
@@ -11,7 +11,9 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
 # Import shared modules
-from shared.redis_client import get_redis_client, publish_progress, is_job_cancelled
+from shared.redis_client import publish_progress, is_job_cancelled
+from shared.job_queue import JobQueue
+from shared.job_store import set_job_status, set_job_state
 
 # Import tool-go-quick modules
 tool_go_quick_path = os.path.join(project_root, 'tool-go-quick')
@@ -26,6 +28,11 @@ logger = logging.getLogger(__name__)
 # Redis queues
 QUEUE_GO_QUICK = 'go-quick:jobs'
 
+# 1 = 1 process load model rồi fork GOQUICK_WORKER_PROCS worker con (Linux/macOS), các con dùng chung
+# trang nhớ của model (copy-on-write) thay vì mỗi worker tự load; Windows không có fork → chạy 1 worker như cũ
+WORKER_FORK = os.getenv('GOQUICK_WORKER_FORK', '0') == '1'
+WORKER_PROCS = int(os.getenv('GOQUICK_WORKER_PROCS', 10))
+
 async def process_go_quick_job(job_data):
     job_id = job_data.get('job_id')
     action = job_data.get('action', 'process-pdf')
@@ -33,17 +40,15 @@ async def process_go_quick_job(job_data):
     
     logger.info(f"[Job {job_id}] ⚡ Bắt đầu xử lý job, action={action}")
     
-    redis_client = get_redis_client()
-    
     try:
         if is_job_cancelled(job_id):
             logger.info(f"[Job {job_id}] Job đã bị cancel trước khi xử lý")
-            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
             publish_progress(job_id, 0, "Job đã bị hủy")
+            set_job_status(job_id, "cancelled")
             return
         
         # Update status: processing
-        redis_client.set(f"job:{job_id}:status", "processing".encode('utf-8'))
+        set_job_status(job_id, "processing")
         
         # Extract params
         file_path = params.get('file_path')
@@ -52,18 +57,22 @@ async def process_go_quick_job(job_data):
         if not file_path:
             error_msg = "Thiếu thông tin: file_path"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed")
             return
         
         # Xác định func_type dựa trên action
         total_cccd = 0  # Sẽ được set sau khi có kết quả
         if action == 'process-pdf':
-            func_type = 2  # PDF
+            # PDF đưa thẳng vào DetectWorker (func_type=1): trang được render ra numpy và đi vào
+            # pipeline detect/OCR luôn, không qua bước PDF → ZIP PNG base64 (func_type=2) rồi giải nén lại
+            func_type = 1
             logger.info(f"[Job {job_id}] Bắt đầu xử lý PDF")
             publish_progress(job_id, 0, "Bắt đầu xử lý PDF...")
         elif action == 'process-excel':
-            func_type = 3  # Excel
+            # Excel cũng đưa thẳng vào DetectWorker (func_type=1): ảnh Drive được tải song song và đi vào
+            # pipeline ngay khi tải xong, không đợi tải hết rồi đóng ZIP base64 (func_type=3)
+            func_type = 1
             logger.info(f"[Job {job_id}] Bắt đầu xử lý Excel")
             publish_progress(job_id, 0, "Bắt đầu xử lý Excel...")
         elif action == 'process-cccd':
@@ -73,16 +82,16 @@ async def process_go_quick_job(job_data):
         else:
             error_msg = f"Action không hợp lệ: {action}"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed")
             return
         
         # Read file content
         if not os.path.exists(file_path):
             error_msg = f"File không tồn tại: {file_path}"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed")
             return
         
         # Get file name from path
@@ -94,7 +103,8 @@ async def process_go_quick_job(job_data):
         
         logger.info(f"[Job {job_id}] Đọc file: {file_name} ({len(file_content)} bytes)")
         
-        # Load model cache (nếu chưa load)
+        # Load model cache (nếu chưa load; GOQUICK_PRELOAD=1 thì đã load + warm-up lúc worker start)
+        from api.routes import get_model_cache, get_cccd_extractor_streaming
         logger.info(f"[Job {job_id}] Đang load model cache...")
         model_cache = get_model_cache()
         logger.info(f"[Job {job_id}] Models đã sẵn sàng")
@@ -117,8 +127,8 @@ async def process_go_quick_job(job_data):
         # Check cancellation trước khi xử lý
         if is_job_cancelled(job_id):
             logger.info(f"[Job {job_id}] Job đã bị cancel trước khi xử lý")
-            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
             publish_progress(job_id, 0, "Job đã bị hủy")
+            set_job_status(job_id, "cancelled")
             return
         
         # Gọi trực tiếp handle_task (không qua HTTP)
@@ -134,8 +144,8 @@ async def process_go_quick_job(job_data):
             # Nếu exception là do cancellation, handle riêng
             if "đã bị hủy" in str(e) or "Job đã bị hủy" in str(e):
                 logger.info(f"[Job {job_id}] Job đã bị hủy trong quá trình xử lý: {e}")
-                redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
                 publish_progress(job_id, 0, "Job đã bị hủy")
+                set_job_status(job_id, "cancelled")
                 return
             # Nếu là exception khác, re-raise để được handle ở ngoài
             raise
@@ -143,8 +153,8 @@ async def process_go_quick_job(job_data):
         # Check cancellation sau khi xử lý
         if is_job_cancelled(job_id):
             logger.info(f"[Job {job_id}] Job đã bị cancel sau khi xử lý")
-            redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
             publish_progress(job_id, 0, "Job đã bị hủy")
+            set_job_status(job_id, "cancelled")
             return
         
         logger.info(f"[Job {job_id}] Đã xử lý xong")
@@ -166,7 +176,7 @@ async def process_go_quick_job(job_data):
             
             if total_cccd > 0:
                 # Lưu total_cccd vào Redis để frontend có thể hiển thị
-                redis_client.set(f"job:{job_id}:total_cccd", str(total_cccd))
+                set_job_state(job_id, total_cccd=total_cccd)
                 # Publish progress với format 0/total_cccd và 0% - GỬI total_cccd trong message
                 publish_progress(job_id, 0, f"Bắt đầu xử lý... (0/{total_cccd} CCCD - 0%)", total_cccd=total_cccd, processed_cccd=0)
                 logger.info(f"[Job {job_id}] ✅ Tổng số CCCD: {total_cccd}")
@@ -204,8 +214,8 @@ async def process_go_quick_job(job_data):
                 # Nếu exception là do cancellation, handle riêng
                 if "đã bị hủy" in str(e) or "Job đã bị hủy" in str(e):
                     logger.info(f"[Job {job_id}] Job đã bị hủy trong quá trình OCR: {e}")
-                    redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
                     publish_progress(job_id, 0, "Job đã bị hủy")
+                    set_job_status(job_id, "cancelled")
                     return
                 # Nếu là exception khác, re-raise để được handle ở ngoài
                 raise
@@ -214,7 +224,7 @@ async def process_go_quick_job(job_data):
             if isinstance(result, dict) and result.get("status") == "success" and total_cccd == 0:
                 total_cccd = result.get("total_cccd", 0)
                 if total_cccd > 0:
-                    redis_client.set(f"job:{job_id}:total_cccd", str(total_cccd))
+                    set_job_state(job_id, total_cccd=total_cccd)
                     # Publish lại progress với total_cccd
                     publish_progress(job_id, 20, f"Đang xử lý OCR... (0/{total_cccd} CCCD - 20%)", total_cccd=total_cccd, processed_cccd=0)
                     logger.info(f"[Job {job_id}] ✅ Tổng số CCCD (từ OCR): {total_cccd}")
@@ -227,9 +237,6 @@ async def process_go_quick_job(job_data):
             'data': result
         }
         
-        redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-        redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
-        
         # Publish final progress
         customer_count = 0
         if isinstance(result, dict) and 'customer' in result:
@@ -242,9 +249,12 @@ async def process_go_quick_job(job_data):
                 # Fallback: dùng customer_count nếu không có total_cccd
                 total_cccd = customer_count
             if total_cccd > 0:
-                redis_client.set(f"job:{job_id}:total_cccd", str(total_cccd))
                 logger.info(f"[Job {job_id}] ✅ Lấy total_cccd từ result cuối: {total_cccd}")
         
+        # result + total_cccd + status ghi cùng 1 lần; status cuối → progress list được compact
+        set_job_state(job_id, result=json.dumps(result_data, ensure_ascii=False),
+                      total_cccd=total_cccd or None, status="completed")
+        
         # Publish progress với format cuối cùng
         if total_cccd > 0:
             publish_progress(job_id, 100, f"Hoàn thành! Đã xử lý {customer_count}/{total_cccd} CCCD (100%)", total_cccd=total_cccd, processed_cccd=customer_count)
@@ -256,17 +266,11 @@ async def process_go_quick_job(job_data):
     except Exception as e:
         error_msg = f"Lỗi xử lý job: {str(e)}"
         logger.error(f"[Job {job_id}] {error_msg}", exc_info=True)
-        redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-        redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
         publish_progress(job_id, 0, error_msg)
+        set_job_status(job_id, "failed", error=error_msg)
     finally:
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"[Job {job_id}] Đã xóa temp file: {file_path}")
-        except Exception as e:
-            logger.warning(f"[Job {job_id}] Không thể xóa temp file: {e}")
-        
+        # File input chỉ xóa sau khi ack (process_job_wrapper): task bị cancel lúc worker dừng thì
+        # message còn pending, worker khác reclaim vẫn cần đọc lại file
         try:
             import gc
             gc.collect()
@@ -279,8 +283,8 @@ async def process_go_quick_job(job_data):
         except:
             pass
 
-async def process_job_wrapper(job_data):
-    """Wrapper để xử lý job trong background task"""
+async def process_job_wrapper(job_data, queue, message):
+    """Wrapper để xử lý job trong background task (ack message khi xử lý xong)"""
     job_id = job_data.get('job_id', 'unknown')
     logger.info(f"[Job {job_id}] 🔄 process_job_wrapper được gọi")
     try:
@@ -288,13 +292,33 @@ async def process_job_wrapper(job_data):
         logger.info(f"[Job {job_id}] ✅ process_job_wrapper hoàn thành")
     except Exception as e:
         logger.error(f"❌ Error processing job {job_id}: {e}", exc_info=True)
+    # Không ack khi task bị cancel (worker dừng) → worker khác reclaim sau visibility timeout
+    await queue.ack(message)
+    remove_input_file(job_id, job_data.get('params', {}).get('file_path'))
+
+def remove_input_file(job_id, file_path):
+    """Xóa file input của job (gọi sau khi job đã có status cuối và message đã được ack)"""
+    if not file_path:
+        return
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info(f"[Job {job_id}] Đã xóa temp file: {file_path}")
+    except Exception as e:
+        logger.warning(f"[Job {job_id}] Không thể xóa temp file: {e}")
 
 async def main():
     """Main worker loop - xử lý nhiều jobs parallel"""
     # Lazy-load model cache here to prevent torch DLL loading at module import time (Windows DLL safety)
-    from api.routes import get_model_cache, get_cccd_extractor_streaming
+    from api.routes import PRELOAD_ENABLED, warm_up_models
     
-    redis_client = get_redis_client()
+    if PRELOAD_ENABLED:
+        # Load + warm-up model trước khi nhận job → job đầu tiên không phải chờ load
+        logger.info("🔄 Đang preload + warm-up Go-Quick models...")
+        await asyncio.get_event_loop().run_in_executor(None, warm_up_models)
+    
+    queue = JobQueue(QUEUE_GO_QUICK)
+    await queue.setup()
     logger.info("Go-Quick Worker ready | queue: %s" % QUEUE_GO_QUICK)
     
     # Set để track các tasks đang chạy
@@ -305,26 +329,23 @@ async def main():
         try:
             # Chỉ lấy job mới nếu chưa đạt max concurrent
             if len(running_tasks) < max_concurrent_jobs:
-                # Blocking pop from queue (wait up to 1 second)
-                # Chạy blpop trong thread pool để không block event loop
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(None, lambda: redis_client.blpop([QUEUE_GO_QUICK], timeout=1))
+                # XREADGROUP (block tối đa 1 giây), không block event loop
+                # Job chỉ bị xóa khỏi stream sau khi ack → worker chết thì job được giao cho worker khác
+                messages = await queue.read(count=max_concurrent_jobs - len(running_tasks), block_ms=1000)
                 
-                if result:
-                    queue_name, job_data_json = result
-                    job_data = json.loads(job_data_json.decode('utf-8'))
-                    
-                    job_id = job_data.get('job_id')
-                    logger.info(f"📥 Received job: {job_id} (Running: {len(running_tasks)}/{max_concurrent_jobs})")
+                for message in messages:
+                    job_data = message.data
+                    job_id = message.job_id
+                    logger.info(f"📥 Received job: {job_id} ({message.lane}, lần giao {message.deliveries}) (Running: {len(running_tasks)}/{max_concurrent_jobs})")
                     
                     # Tạo task để xử lý job trong background
                     logger.info(f"[Job {job_id}] 🔄 Tạo asyncio task để xử lý...")
-                    task = asyncio.create_task(process_job_wrapper(job_data))
+                    task = asyncio.create_task(process_job_wrapper(job_data, queue, message))
                     running_tasks.add(task)
                     logger.info(f"[Job {job_id}] ✅ Task đã được tạo và thêm vào running_tasks (Total running: {len(running_tasks)})")
                     
                     # Xóa task khỏi set khi hoàn thành
-                    def remove_task(task):
+                    def remove_task(task, job_id=job_id):
                         running_tasks.discard(task)
                         logger.debug(f"[Job {job_id}] 🗑️ Task đã hoàn thành, đã xóa khỏi running_tasks")
                     
@@ -359,7 +380,7 @@ async def main():
             logger.error(f"❌ Error in worker loop: {e}", exc_info=True)
             await asyncio.sleep(5)  # Wait before retry
 
-if __name__ == '__main__':
+def run_worker():
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -369,3 +390,52 @@ if __name__ == '__main__':
         # Chỉ log các exception thực sự, không phải CancelledError
         if not isinstance(e, (asyncio.CancelledError, KeyboardInterrupt)):
             logger.error(f"❌ Fatal error: {e}", exc_info=True)
+
+def run_forked(procs):
+    """
+    Load model 1 lần rồi fork procs worker con; process cha chỉ chờ con và chuyển tiếp SIGTERM/SIGINT.
+
+    Warm-up (inference giả) chạy trong từng con sau khi fork: thread pool OpenMP/torch đã khởi tạo
+    ở process cha không dùng được sau fork, còn weight (phần chiếm RAM) vẫn dùng chung copy-on-write.
+    """
+    import signal
+    from api.routes import preload_models
+
+    logger.info(f"🔄 Đang load Go-Quick models trước khi fork {procs} worker...")
+    preload_models()
+
+    children = []
+    for _ in range(procs):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    logger.info(f"✅ Đã fork {len(children)} Go-Quick worker: {children}")
+
+    def forward(sig, frame):
+        for pid in children:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+
+if __name__ == '__main__':
+    if WORKER_FORK and hasattr(os, 'fork'):
+        run_forked(max(1, WORKER_PROCS))
+    else:
+        run_worker()
@@ -17,6 +17,9 @@ sys.path.insert(0, project_root)
 
 # Import shared modules
 from shared.redis_client import get_redis_client, publish_progress
+from shared.job_store import set_job_status, get_job_state
+from shared.redis_async import await_job_done, aget_job_status
+from shared.job_queue import JobQueue, resume_job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -47,7 +50,7 @@ async def process_go_soft_job(job_data):
     
     try:
         # Update status: processing
-        redis_client.set(f"job:{job_id}:status", "processing".encode('utf-8'))
+        set_job_status(job_id, "processing")
         
         # Extract params
         session_id = params.get('session_id')
@@ -57,10 +60,13 @@ async def process_go_soft_job(job_data):
         if not all([session_id, start_date, end_date]):
             error_msg = "Thiếu thông tin: session_id, start_date, end_date"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed")
             return
         
+        # Số khoảng thời gian crawl song song (tùy chọn theo job, không có → mặc định của API server)
+        parallel_ranges = params.get('parallel_ranges')
+        
         # API Server URL
         API_SERVER_URL = os.getenv('GO_SOFT_API_URL', 'http://127.0.0.1:5000/api/go-soft')
         
@@ -75,7 +81,8 @@ async def process_go_soft_job(job_data):
                 'session_id': session_id,
                 'tokhai_type': tokhai_type,
                 'start_date': start_date,
-                'end_date': end_date
+                'end_date': end_date,
+                'parallel_ranges': parallel_ranges
             }
             logger.info(f"[Job {job_id}] Bắt đầu crawl tờ khai: {tokhai_type} từ {start_date} đến {end_date}")
             publish_progress(job_id, 0, "Bắt đầu crawl tờ khai...")
@@ -85,7 +92,8 @@ async def process_go_soft_job(job_data):
                 'job_id': job_id,
                 'session_id': session_id,
                 'start_date': start_date,
-                'end_date': end_date
+                'end_date': end_date,
+                'parallel_ranges': parallel_ranges
             }
             logger.info(f"[Job {job_id}] Bắt đầu crawl thông báo từ {start_date} đến {end_date}")
             publish_progress(job_id, 0, "Bắt đầu crawl thông báo...")
@@ -95,7 +103,8 @@ async def process_go_soft_job(job_data):
                 'job_id': job_id,
                 'session_id': session_id,
                 'start_date': start_date,
-                'end_date': end_date
+                'end_date': end_date,
+                'parallel_ranges': parallel_ranges
             }
             logger.info(f"[Job {job_id}] Bắt đầu crawl giấy nộp tiền từ {start_date} đến {end_date}")
             publish_progress(job_id, 0, "Bắt đầu crawl giấy nộp tiền...")
@@ -120,8 +129,8 @@ async def process_go_soft_job(job_data):
         else:
             error_msg = f"Action không hợp lệ: {action}"
             logger.error(f"[Job {job_id}] {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
             publish_progress(job_id, 0, error_msg)
+            set_job_status(job_id, "failed")
             return
         
         # Gọi API server (POST request, không cần SSE)
@@ -158,109 +167,88 @@ async def process_go_soft_job(job_data):
                     'error_code': error_code
                 }
                 publish_progress(job_id, 0, error_msg, error_event)
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
+                set_job_status(job_id, "failed", error=error_msg)
                 return
             
             response_data = response.json()
             if response_data.get('status') != 'accepted':
                 error_msg = response_data.get('message', 'API server từ chối request')
                 logger.error(f"[Job {job_id}] {error_msg}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
                 publish_progress(job_id, 0, error_msg)
+                set_job_status(job_id, "failed")
                 return
             
             logger.info(f"[Job {job_id}] API server đã chấp nhận request, đang đợi API hoàn thành...")
         
         # Worker không cần lắng nghe events từ Redis
         # API server sẽ tự publish events vào Redis, Laravel frontend sẽ tự lắng nghe qua SSE
-        # Worker chỉ cần poll status để biết khi nào job hoàn thành (hoặc đợi một chút rồi check result)
-        
-        # Poll status trong Redis (tối đa 2 giờ = 7200 giây)
+        # Worker chỉ cần biết khi nào job kết thúc: BLPOP job:{id}:done (API push khi set status cuối)
         max_wait_time = 7200  # 2 hours
-        poll_interval = 2  # Check mỗi 2 giây
-        waited_time = 0
+        status = await await_job_done(job_id, timeout=max_wait_time)
         
-        while waited_time < max_wait_time:
-            await asyncio.sleep(poll_interval)
-            waited_time += poll_interval
-            
-            # ✅ Check cancelled flag trước
-            cancelled = redis_client.get(f"job:{job_id}:cancelled")
-            if cancelled:
-                cancelled = cancelled.decode('utf-8') if isinstance(cancelled, bytes) else str(cancelled).strip()
-                if cancelled == '1':
-                    logger.info(f"[Job {job_id}] Job đã bị cancel, dừng worker")
-                    redis_client.set(f"job:{job_id}:status", "cancelled".encode('utf-8'))
-                    publish_progress(job_id, 0, "Job đã bị hủy")
-                    return
-            
-            # Check job status
-            status = redis_client.get(f"job:{job_id}:status")
-            if status:
-                status = status.decode('utf-8') if isinstance(status, bytes) else str(status).strip()
-                
-                if status == 'cancelled':
-                    logger.info(f"[Job {job_id}] Job đã bị cancel")
-                    publish_progress(job_id, 0, "Job đã bị hủy")
-                    return
-                
-                if status == 'completed':
-                    # Lấy result từ Redis (API đã lưu)
-                    result_json = redis_client.get(f"job:{job_id}:result")
-                    if result_json:
-                        try:
-                            result_data = json.loads(result_json.decode('utf-8') if isinstance(result_json, bytes) else result_json)
-                            
-                            # ✅ Kiểm tra nếu là batch crawl (có batch_results)
-                            if 'batch_results' in result_data:
-                                # Batch crawl result
-                                batch_results = result_data.get('batch_results', {})
-                                total_files = result_data.get('total_files', 0)
-                                
-                                # Log thông tin từng loại crawl trong batch
-                                for crawl_type, batch_result in batch_results.items():
-                                    type_total = batch_result.get('total', 0)
-                                    type_download_id = batch_result.get('download_id')
-                                    type_zip_filename = batch_result.get('zip_filename')
-                                    logger.info(f"[Job {job_id}] Batch crawl - {crawl_type}: {type_total} file, download_id: {type_download_id}")
-                                
-                                job_completed = True
-                                logger.info(f"[Job {job_id}] Batch crawl hoàn thành: {total_files} file tổng cộng")
-                            else:
-                                # Single crawl result
-                                total_count = result_data.get('total', 0)
-                                download_id = result_data.get('download_id')
-                                zip_filename = result_data.get('zip_filename')
-                                job_completed = True
-                                logger.info(f"[Job {job_id}] Job hoàn thành: {total_count} file, download_id: {download_id}")
-                            break
-                        except Exception as e:
-                            logger.warning(f"[Job {job_id}] Lỗi khi parse result từ Redis: {e}")
+        if status == 'cancelled':
+            logger.info(f"[Job {job_id}] Job đã bị cancel, dừng worker")
+            # Laravel chỉ set cancelled flag → đồng bộ status
+            publish_progress(job_id, 0, "Job đã bị hủy")
+            set_job_status(job_id, "cancelled")
+            return
+        
+        if status == 'completed':
+            # Lấy result từ Redis (API đã lưu cùng transaction với status)
+            result_json = get_job_state(job_id).get('result')
+            if result_json:
+                try:
+                    result_data = json.loads(result_json.decode('utf-8') if isinstance(result_json, bytes) else result_json)
+                    
+                    # ✅ Kiểm tra nếu là batch crawl (có batch_results)
+                    if 'batch_results' in result_data:
+                        # Batch crawl result
+                        batch_results = result_data.get('batch_results', {})
+                        total_files = result_data.get('total_files', 0)
+                        
+                        # Log thông tin từng loại crawl trong batch
+                        for crawl_type, batch_result in batch_results.items():
+                            type_total = batch_result.get('total', 0)
+                            type_download_id = batch_result.get('download_id')
+                            logger.info(f"[Job {job_id}] Batch crawl - {crawl_type}: {type_total} file, download_id: {type_download_id}")
+                        
+                        logger.info(f"[Job {job_id}] Batch crawl hoàn thành: {total_files} file tổng cộng")
                     else:
-                        logger.warning(f"[Job {job_id}] Status completed nhưng chưa có result trong Redis")
-                        break
-                
-                elif status == 'failed':
-                    error_json = redis_client.get(f"job:{job_id}:error")
-                    error_msg = "Lỗi không xác định"
-                    if error_json:
-                        try:
-                            error_msg = error_json.decode('utf-8') if isinstance(error_json, bytes) else str(error_json)
-                        except:
-                            pass
-                    logger.error(f"[Job {job_id}] Job failed: {error_msg}")
-                    raise Exception(error_msg)
+                        # Single crawl result
+                        total_count = result_data.get('total', 0)
+                        download_id = result_data.get('download_id')
+                        zip_filename = result_data.get('zip_filename')
+                        logger.info(f"[Job {job_id}] Job hoàn thành: {total_count} file, download_id: {download_id}")
+                except Exception as e:
+                    logger.warning(f"[Job {job_id}] Lỗi khi parse result từ Redis: {e}")
+            else:
+                logger.warning(f"[Job {job_id}] Status completed nhưng chưa có result trong Redis")
+            job_completed = True
+        
+        elif status == 'failed':
+            error_json = get_job_state(job_id).get('error')
+            error_msg = "Lỗi không xác định"
+            if error_json:
+                try:
+                    error_msg = error_json.decode('utf-8') if isinstance(error_json, bytes) else str(error_json)
+                except:
+                    pass
+            logger.error(f"[Job {job_id}] Job failed: {error_msg}")
+            raise Exception(error_msg)
         
         if not job_completed:
+            # API không set status cuối trong max_wait_time → đánh dấu failed, không để job 'processing' mãi
             logger.warning(f"[Job {job_id}] Timeout: Job chưa hoàn thành sau {max_wait_time} giây")
+            error_msg = f"Timeout chờ kết quả sau {max_wait_time} giây"
+            publish_progress(job_id, 0, error_msg, {'type': 'error', 'error': error_msg})
+            set_job_status(job_id, "failed", error=error_msg)
                 
     except Exception as e:
         error_msg = str(e)
         error_type = type(e).__name__
         
         # Kiểm tra Redis status trước
-        current_status = redis_client.get(f"job:{job_id}:status")
+        current_status = get_job_state(job_id).get('status')
         if current_status:
             current_status = current_status.decode('utf-8') if isinstance(current_status, bytes) else str(current_status).strip()
         
@@ -270,12 +258,12 @@ async def process_go_soft_job(job_data):
             return
         
         # Kiểm tra result trong Redis
-        result_json = redis_client.get(f"job:{job_id}:result")
+        result_json = get_job_state(job_id).get('result')
         if result_json:
             try:
                 result_data = json.loads(result_json.decode('utf-8') if isinstance(result_json, bytes) else result_json)
                 if result_data.get('total', 0) > 0:
-                    redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+                    set_job_status(job_id, "completed")
                     logger.info(f"[Job {job_id}] Đã đánh dấu completed dựa trên result trong Redis")
                     return
             except:
@@ -293,14 +281,12 @@ async def process_go_soft_job(job_data):
                 logger.info(f"[Job {job_id}] Đã lưu kết quả sau lỗi")
             except Exception as save_err:
                 logger.error(f"[Job {job_id}] Lỗi khi lưu kết quả: {save_err}")
-                redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-                redis_client.set(f"job:{job_id}:error", f"{error_msg} (save failed: {save_err})".encode('utf-8'))
                 publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+                set_job_status(job_id, "failed", error=f"{error_msg} (save failed: {save_err})")
         else:
             logger.error(f"[Job {job_id}] Lỗi: {error_msg}")
-            redis_client.set(f"job:{job_id}:status", "failed".encode('utf-8'))
-            redis_client.set(f"job:{job_id}:error", error_msg.encode('utf-8'))
             publish_progress(job_id, 0, f"Lỗi: {error_msg}")
+            set_job_status(job_id, "failed", error=error_msg)
 
 
 async def save_job_result(redis_client, job_id, total_count, results, zip_base64, zip_filename, download_id=None):
@@ -317,20 +303,21 @@ async def save_job_result(redis_client, job_id, total_count, results, zip_base64
         if download_id:
             result_data['download_id'] = download_id
         
-        redis_client.set(f"job:{job_id}:result", json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
-        redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
         publish_progress(job_id, 100, "Hoàn thành!")
+        set_job_status(job_id, "completed", result=json.dumps(result_data, ensure_ascii=False))
         logger.info(f"[Job {job_id}] Đã lưu kết quả: {total_count} file")
     except Exception as e:
         logger.error(f"[Job {job_id}] Lỗi khi lưu kết quả: {e}")
         try:
-            redis_client.set(f"job:{job_id}:status", "completed".encode('utf-8'))
+            set_job_status(job_id, "completed")
         except:
             pass
 
 async def worker_loop(redis_client, semaphore, max_concurrent=3):
     """Async worker loop that processes jobs concurrently"""
     active_tasks = set()
+    queue = JobQueue(QUEUE_GO_SOFT)
+    await queue.setup()
     
     while True:
         try:
@@ -343,54 +330,41 @@ async def worker_loop(redis_client, semaphore, max_concurrent=3):
                 except Exception as e:
                     logger.error(f"Task completed with error: {e}", exc_info=True)
             
-            # Only pop new job if we have capacity
+            # Only read new jobs if we have capacity
             if len(active_tasks) < max_concurrent:
-                # Non-blocking check for jobs (use lpop instead of blpop in async context)
-                # We'll use a small timeout to avoid blocking the event loop
                 try:
-                    # Use asyncio.to_thread to run blocking Redis operation
-                    result = await asyncio.to_thread(redis_client.blpop, [QUEUE_GO_SOFT], timeout=1)
+                    # XREADGROUP (block tối đa 1s) - job chỉ bị xóa khỏi stream sau khi ack
+                    messages = await queue.read(count=max_concurrent - len(active_tasks), block_ms=1000)
                     
-                    if result:
-                        queue_name, job_data_json = result
-                        logger.info(f"Received job from queue: {queue_name}")
-                        
-                        # Decode bytes to string if needed
-                        if isinstance(job_data_json, bytes):
-                            job_data_json = job_data_json.decode('utf-8')
-                        
-                        logger.info(f"Job data (raw): {job_data_json[:200]}...")  # Log first 200 chars
-                        
-                        try:
-                            job_data = json.loads(job_data_json)
-                            job_id = job_data.get('job_id')
-                            logger.info(f"Job data parsed successfully. Job ID: {job_id}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Error parsing job data as JSON: {e}")
-                            logger.error(f"Job data: {job_data_json}")
-                            continue
-                        
-                        logger.info(f"Processing job: {job_id}")
+                    for message in messages:
+                        job_data = message.data
+                        job_id = message.job_id
+                        logger.info(f"Received job from queue: {QUEUE_GO_SOFT} ({message.lane}). Job ID: {job_id}")
+                        # Worker trước chết khi API đang chạy job → chỉ chờ kết quả, không gọi lại API
+                        resume = message.redelivered and await aget_job_status(job_id) == 'processing'
+                        if message.redelivered:
+                            logger.warning(f"[Job {job_id}] Job được giao lại (lần {message.deliveries}), resume={resume}")
                         
                         # Create async task for this job (runs concurrently)
-                        async def process_with_semaphore():
+                        async def process_with_semaphore(job_data=job_data, job_id=job_id, message=message, resume=resume):
                             async with semaphore:  # Limit concurrent jobs
                                 try:
                                     logger.info(f"Starting async processing for job: {job_id}")
-                                    await process_go_soft_job(job_data)
+                                    if resume:
+                                        await resume_job(job_id)
+                                    else:
+                                        await process_go_soft_job(job_data)
                                     logger.info(f"Completed async processing for job: {job_id}")
                                 except Exception as e:
                                     logger.error(f"Error in async processing for job {job_id}: {e}", exc_info=True)
                                     # Update job status to failed
-                                    await asyncio.to_thread(redis_client.set, f"job:{job_id}:status", "failed".encode('utf-8'))
-                                    await asyncio.to_thread(redis_client.set, f"job:{job_id}:error", str(e).encode('utf-8'))
+                                    await asyncio.to_thread(set_job_status, job_id, "failed", error=str(e))
                                     publish_progress(job_id, 0, f"Lỗi: {str(e)}")
+                                # Không ack khi task bị cancel (worker dừng) → worker khác reclaim sau visibility timeout
+                                await queue.ack(message)
                         
                         task = asyncio.create_task(process_with_semaphore())
                         active_tasks.add(task)
-                    else:
-                        # No job received, wait a bit before checking again
-                        await asyncio.sleep(0.5)
                 except Exception as e:
                     logger.error(f"Error checking queue: {e}", exc_info=True)
                     await asyncio.sleep(1)